@@ -3,7 +3,8 @@ Analysis API endpoints for image and PDF processing
 """
 import os
 import logging
-from typing import List
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 import uuid
@@ -16,12 +17,141 @@ from app.core.config import settings
 from app.core.database import get_database
 from app.services.image_analysis import image_analysis_service
 from app.services.pdf_analysis import pdf_analysis_service
-from app.services.archive_extractor import archive_extractor
+from app.services.archive_extractor import archive_extractor, ArchiveLimitError
+from app.services.upload_retention import upload_store
 from app.utils.file_handler import file_handler
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+BlockingRunner = Callable[..., Awaitable[Any]]
+
+async def _run_inline(function: Callable[..., Any], *args: Any) -> Any:
+    return function(*args)
+
+def validate_upload(file: UploadFile, allowed_extensions: List[str], max_size: int):
+    """Reject an upload by extension (400) or declared size (413)"""
+    if not file.filename.lower().endswith(tuple(allowed_extensions)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file type. Allowed: {allowed_extensions}"
+        )
+    if file.size and file.size > max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large. Max size: {max_size} bytes"
+        )
+
+async def store_upload(file: UploadFile, current_user: User) -> Tuple[str, int]:
+    """Stream an upload into upload storage under a unique name; returns (stored filename, size)"""
+    unique_filename = f"{uuid.uuid4()}{os.path.splitext(file.filename)[1]}"
+    # Retained for the user's plan TTL
+    with upload_store.writer(unique_filename, plan=current_user.plan) as writer:
+        size, _ = await file_handler.copy_to_storage(file, writer)
+    return unique_filename, size
+
+async def analyze_stored_image(
+    stored_filename: str,
+    original_name: str,
+    current_user: User,
+    endpoint: str,
+    run_blocking: BlockingRunner = _run_inline,
+    **options: Any
+) -> Dict[str, Any]:
+    """
+    Analyze a retained upload, store its ImageAnalysis and log API usage
+    Shared by the synchronous endpoints and background jobs, which pass
+    their own run_blocking and analyze_image options (progress, TTA).
+    """
+    file_path = upload_store.resolve(stored_filename)
+    if file_path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found or expired"
+        )
+    
+    file_hash = await run_blocking(image_analysis_service.get_file_hash, file_path)
+    exif_data = await run_blocking(image_analysis_service.extract_exif_data, file_path)
+    analysis_result = await run_blocking(partial(
+        image_analysis_service.analyze_image, file_path, original_name, user_id=current_user.id, **options
+    ))
+    file_size = os.path.getsize(file_path)
+    
+    analysis = ImageAnalysis(
+        user_id=current_user.id,
+        filename=original_name,
+        file_size=file_size,
+        file_hash=file_hash,
+        result=analysis_result,
+        exif_data=exif_data,
+        stored_filename=stored_filename
+    )
+    db = get_database()
+    result = await db.image_analyses.insert_one(analysis.dict(by_alias=True))
+    await db.api_logs.insert_one({
+        "user_id": current_user.id,
+        "endpoint": endpoint,
+        "filename": original_name,
+        "file_size": file_size,
+        "result": analysis_result.prediction,
+        "confidence": analysis_result.confidence_score,
+        "timestamp": analysis.created_at
+    })
+    
+    return {
+        "analysis_id": str(result.inserted_id),
+        "prediction": analysis_result.prediction,
+        "confidence_score": analysis_result.confidence_score,
+        "processing_time": analysis_result.processing_time,
+        "metadata": analysis_result.metadata,
+        "exif_data": exif_data
+    }
+
+async def analyze_pdf_file(
+    file_path: str,
+    filename: str,
+    current_user: User,
+    endpoint: str,
+    run_blocking: BlockingRunner = _run_inline,
+    progress: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, Any]:
+    """Analyze a PDF, store its PDFAnalysis and log API usage; the caller removes the file"""
+    file_size = file_handler.get_file_size(file_path)
+    file_hash = await run_blocking(pdf_analysis_service.get_file_hash, file_path)
+    content = await run_blocking(pdf_analysis_service.extract_text_and_metadata, file_path, progress)
+    analysis_result = await run_blocking(pdf_analysis_service.analyze_pdf, file_path, filename, content)
+    
+    analysis = PDFAnalysis(
+        user_id=current_user.id,
+        filename=filename,
+        file_size=file_size,
+        file_hash=file_hash,
+        page_count=content['page_count'],
+        result=analysis_result,
+        extracted_text=content['text'][:5000],  # Store first 5000 chars
+        metadata=content['metadata']
+    )
+    db = get_database()
+    result = await db.pdf_analyses.insert_one(analysis.dict(by_alias=True))
+    await db.api_logs.insert_one({
+        "user_id": current_user.id,
+        "endpoint": endpoint,
+        "filename": filename,
+        "file_size": file_size,
+        "ai_probability": analysis_result.ai_generated_probability,
+        "timestamp": analysis.created_at
+    })
+    
+    return {
+        "analysis_id": str(result.inserted_id),
+        "ai_generated_probability": analysis_result.ai_generated_probability,
+        "metadata_inconsistencies": analysis_result.metadata_inconsistencies,
+        "suspicious_patterns": analysis_result.suspicious_patterns,
+        "processing_time": analysis_result.processing_time,
+        "page_count": content['page_count'],
+        "text_analysis": analysis_result.text_analysis
+    }
+
 @router.post("/upload")
 async def upload_file(
     image: UploadFile = File(...),
@@ -29,44 +159,17 @@ async def upload_file(
 ):
     """Upload file endpoint that frontend expects"""
     
-    # Validate file type
-    if not image.filename.lower().endswith(tuple(settings.ALLOWED_IMAGE_EXTENSIONS)):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid file type. Allowed: {settings.ALLOWED_IMAGE_EXTENSIONS}"
-        )
-    
-    # Validate file size
-    if image.size and image.size > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File too large. Max size: {settings.MAX_FILE_SIZE} bytes"
-        )
+    validate_upload(image, settings.ALLOWED_IMAGE_EXTENSIONS, settings.MAX_FILE_SIZE)
     
     try:
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(image.filename)[1]
-        unique_filename = f"{file_id}{file_extension}"
-        
-        # Save uploaded file
-        temp_path = await file_handler.save_upload_file(image)
-        
-        # Move to uploads directory with unique name
-        uploads_dir = "uploads"
-        os.makedirs(uploads_dir, exist_ok=True)
-        final_path = os.path.join(uploads_dir, unique_filename)
-        
-        # Move file to final location
-        import shutil
-        shutil.move(temp_path, final_path)
+        unique_filename, size = await store_upload(image, current_user)
         
         return {
             "filename": unique_filename,
             "original_name": image.filename,
-            "size": image.size,
+            "size": size,
             "mimetype": image.content_type,
-            "upload_id": file_id
+            "upload_id": os.path.splitext(unique_filename)[0]
         }
         
     except Exception as e:
@@ -85,61 +188,12 @@ async def analyze_uploaded_file(
     """Analyze uploaded file"""
     
     try:
-        # Check if file exists
-        file_path = os.path.join("uploads", filename)
-        if not os.path.exists(file_path):
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="File not found"
-            )
-        
-        # Get file hash
-        file_hash = image_analysis_service.get_file_hash(file_path)
-        
-        # Extract EXIF data
-        exif_data = image_analysis_service.extract_exif_data(file_path)
-        
-        # Perform analysis
-        analysis_result = image_analysis_service.analyze_image(file_path, original_name)
-        
-        # Get file size
-        file_size = os.path.getsize(file_path)
-        
-        # Create analysis record
-        analysis = ImageAnalysis(
-            user_id=current_user.id,
-            filename=original_name,
-            file_size=file_size,
-            file_hash=file_hash,
-            result=analysis_result,
-            exif_data=exif_data
-        )
-        
-        # Save to database
-        db = get_database()
-        result = await db.image_analyses.insert_one(analysis.dict(by_alias=True))
-        
-        # Log API usage
-        await db.api_logs.insert_one({
-            "user_id": current_user.id,
-            "endpoint": "/api/analyze/analyze",
-            "filename": original_name,
-            "file_size": file_size,
-            "result": analysis_result.prediction,
-            "confidence": analysis_result.confidence_score,
-            "timestamp": analysis.created_at
-        })
-        
-        return {
-            "analysis_id": str(result.inserted_id),
-            "prediction": analysis_result.prediction,
-            "confidence_score": analysis_result.confidence_score,
-            "processing_time": analysis_result.processing_time,
-            "metadata": analysis_result.metadata,
-            "exif_data": exif_data,
-            "status": "completed"
-        }
+        response = await analyze_stored_image(filename, original_name, current_user, "/api/analyze/analyze")
+        response["status"] = "completed"
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing file: {e}")
         raise HTTPException(
@@ -154,76 +208,17 @@ async def analyze_image(
 ):
     """Analyze uploaded image for AI generation detection"""
     
-    # Validate file type
-    if not file.filename.lower().endswith(tuple(settings.ALLOWED_IMAGE_EXTENSIONS)):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid file type. Allowed: {settings.ALLOWED_IMAGE_EXTENSIONS}"
-        )
-    
-    # Validate file size
-    if file.size > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File too large. Max size: {settings.MAX_FILE_SIZE} bytes"
-        )
+    validate_upload(file, settings.ALLOWED_IMAGE_EXTENSIONS, settings.MAX_FILE_SIZE)
     
     try:
-        # Save uploaded file temporarily
-        temp_path = await file_handler.save_upload_file(file)
-        
-        # Get file hash
-        file_hash = image_analysis_service.get_file_hash(temp_path)
-        
-        # Extract EXIF data
-        exif_data = image_analysis_service.extract_exif_data(temp_path)
-        
-        # Perform analysis
-        analysis_result = image_analysis_service.analyze_image(temp_path, file.filename)
-        
-        # Create analysis record
-        analysis = ImageAnalysis(
-            user_id=current_user.id,
-            filename=file.filename,
-            file_size=file.size,
-            file_hash=file_hash,
-            result=analysis_result,
-            exif_data=exif_data
-        )
-        
-        # Save to database
-        db = get_database()
-        result = await db.image_analyses.insert_one(analysis.dict(by_alias=True))
-        
-        # Clean up temp file
-        file_handler.cleanup_file(temp_path)
-        
-        # Log API usage
-        await db.api_logs.insert_one({
-            "user_id": current_user.id,
-            "endpoint": "/analyze/image",
-            "filename": file.filename,
-            "file_size": file.size,
-            "result": analysis_result.prediction,
-            "confidence": analysis_result.confidence_score,
-            "timestamp": analysis.created_at
-        })
-        
-        return {
-            "analysis_id": str(result.inserted_id),
-            "prediction": analysis_result.prediction,
-            "confidence_score": analysis_result.confidence_score,
-            "processing_time": analysis_result.processing_time,
-            "metadata": analysis_result.metadata,
-            "exif_data": exif_data
-        }
+        # Retained like two-step uploads, so the record keeps its stored_filename
+        stored_filename, _ = await store_upload(file, current_user)
+        return await analyze_stored_image(stored_filename, file.filename, current_user, "/analyze/image")
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing image: {e}")
-        # Clean up temp file if it exists
-        if 'temp_path' in locals():
-            file_handler.cleanup_file(temp_path)
-        
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Analysis failed: {str(e)}"
@@ -236,78 +231,18 @@ async def analyze_pdf(
 ):
     """Analyze uploaded PDF for AI-generated content"""
     
-    # Validate file type
-    if not file.filename.lower().endswith(tuple(settings.ALLOWED_PDF_EXTENSIONS)):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid file type. Allowed: {settings.ALLOWED_PDF_EXTENSIONS}"
-        )
-    
-    # Validate file size
-    if file.size > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File too large. Max size: {settings.MAX_FILE_SIZE} bytes"
-        )
+    validate_upload(file, settings.ALLOWED_PDF_EXTENSIONS, settings.MAX_FILE_SIZE)
     
     try:
         # Save uploaded file temporarily
         temp_path = await file_handler.save_upload_file(file)
-        
-        # Get file hash
-        file_hash = pdf_analysis_service.get_file_hash(temp_path)
-        
-        # Extract content
-        content = pdf_analysis_service.extract_text_and_metadata(temp_path)
-        
-        # Perform analysis
-        analysis_result = pdf_analysis_service.analyze_pdf(temp_path, file.filename)
-        
-        # Create analysis record
-        analysis = PDFAnalysis(
-            user_id=current_user.id,
-            filename=file.filename,
-            file_size=file.size,
-            file_hash=file_hash,
-            page_count=content['page_count'],
-            result=analysis_result,
-            extracted_text=content['text'][:5000],  # Store first 5000 chars
-            metadata=content['metadata']
-        )
-        
-        # Save to database
-        db = get_database()
-        result = await db.pdf_analyses.insert_one(analysis.dict(by_alias=True))
-        
-        # Clean up temp file
-        file_handler.cleanup_file(temp_path)
-        
-        # Log API usage
-        await db.api_logs.insert_one({
-            "user_id": current_user.id,
-            "endpoint": "/analyze/pdf",
-            "filename": file.filename,
-            "file_size": file.size,
-            "ai_probability": analysis_result.ai_generated_probability,
-            "timestamp": analysis.created_at
-        })
-        
-        return {
-            "analysis_id": str(result.inserted_id),
-            "ai_generated_probability": analysis_result.ai_generated_probability,
-            "metadata_inconsistencies": analysis_result.metadata_inconsistencies,
-            "suspicious_patterns": analysis_result.suspicious_patterns,
-            "processing_time": analysis_result.processing_time,
-            "page_count": content['page_count'],
-            "text_analysis": analysis_result.text_analysis
-        }
+        try:
+            return await analyze_pdf_file(temp_path, file.filename, current_user, "/analyze/pdf")
+        finally:
+            file_handler.cleanup_file(temp_path)
         
     except Exception as e:
         logger.error(f"Error analyzing PDF: {e}")
-        # Clean up temp file if it exists
-        if 'temp_path' in locals():
-            file_handler.cleanup_file(temp_path)
-        
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Analysis failed: {str(e)}"
@@ -348,11 +283,24 @@ async def upload_training_dataset(
         temp_path = await file_handler.save_upload_file(file)
         
         # Extract archive
-        success, extract_path, category_counts = archive_extractor.extract_archive(
-            temp_path, name
-        )
+        try:
+            success, extract_path, category_counts = archive_extractor.extract_archive(
+                temp_path, name
+            )
+        except ArchiveLimitError as e:
+            # Extractor already removed any partially written files
+            file_handler.cleanup_file(temp_path)
+            raise HTTPException(
+                status_code=(
+                    status.HTTP_400_BAD_REQUEST
+                    if e.code in ("unsafe_path", "nesting_too_deep")
+                    else status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                ),
+                detail=e.to_dict()
+            )
         
         if not success:
+            file_handler.cleanup_file(temp_path)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to extract archive"
@@ -387,6 +335,8 @@ async def upload_training_dataset(
             "message": "Dataset uploaded and extracted successfully"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading dataset: {e}")
         # Clean up files if they exist
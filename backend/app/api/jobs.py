@@ -0,0 +1,207 @@
+"""
+Background analysis job endpoints with server-sent progress events
+
+POST endpoints accept the upload, start the job and return 202 with its id
+straight away; progress is streamed from GET /{job_id}/events as SSE. Image
+jobs report the analyze_image timing points (exif, metadata, quality,
+forensic, ela, preprocess, inference), PDF jobs one 'page' event per
+extracted page and dataset jobs the archive ingestion counters. Every job
+starts with 'upload_received', reports 'persisted' once its record is
+stored and ends with 'completed' (carrying the result) or 'failed'.
+
+Image and PDF jobs validate, analyze and persist through the same helpers
+as the synchronous /api/analyze endpoints (retained upload, analysis record,
+api_logs usage entry); only the progress reporting differs.
+"""
+import logging
+from typing import Optional
+from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form, Header
+from fastapi.responses import StreamingResponse
+
+from app.models.user import User
+from app.models.analysis import TrainingDataset
+from app.api.auth import get_current_user
+from app.api.analysis import analyze_pdf_file, analyze_stored_image, store_upload, validate_upload
+from app.core.config import settings
+from app.core.database import get_database
+from app.services.archive_extractor import archive_extractor
+from app.services.jobs import Job, job_manager, sse_message
+from app.utils.file_handler import file_handler
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+def _accepted(job: Job) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "events_url": f"/api/jobs/{job.id}/events"
+    }
+
+@router.post("/image", status_code=status.HTTP_202_ACCEPTED)
+async def start_image_job(
+    file: UploadFile = File(...),
+    tta: bool = Form(False),  # Premium: batched test-time augmentation
+    current_user: User = Depends(get_current_user)
+):
+    """Analyze an image in the background"""
+    
+    validate_upload(file, settings.ALLOWED_IMAGE_EXTENSIONS, settings.MAX_FILE_SIZE)
+    if tta and current_user.plan == "free":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Premium subscription required for test-time augmentation"
+        )
+    
+    stored_filename, file_size = await store_upload(file, current_user)
+    
+    async def work(job: Job) -> dict:
+        result = await analyze_stored_image(
+            stored_filename, file.filename, current_user, "/api/jobs/image",
+            run_blocking=job_manager.run_blocking,
+            tta_budget_ms=settings.TTA_LATENCY_BUDGET_MS if tta else None,
+            progress=lambda stage, seconds: job.emit(stage, seconds=round(seconds, 4))
+        )
+        job.emit('persisted', analysis_id=result["analysis_id"])
+        if result["prediction"] == "error":
+            raise RuntimeError(result["metadata"].get('error', 'Analysis failed'))
+        return result
+    
+    job = job_manager.submit("image", work, owner=str(current_user.id))
+    job.emit('upload_received', filename=file.filename, size=file_size)
+    return _accepted(job)
+
+@router.post("/pdf", status_code=status.HTTP_202_ACCEPTED)
+async def start_pdf_job(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Analyze a PDF in the background, reporting extraction page by page"""
+    
+    validate_upload(file, settings.ALLOWED_PDF_EXTENSIONS, settings.MAX_FILE_SIZE)
+    
+    temp_path = await file_handler.save_upload_file(file)
+    file_size = file_handler.get_file_size(temp_path)
+    
+    async def work(job: Job) -> dict:
+        try:
+            result = await analyze_pdf_file(
+                temp_path, file.filename, current_user, "/api/jobs/pdf",
+                run_blocking=job_manager.run_blocking,
+                progress=lambda page, pages: job.emit('page', page=page, pages=pages)
+            )
+            job.emit('persisted', analysis_id=result["analysis_id"])
+            return result
+        finally:
+            file_handler.cleanup_file(temp_path)
+    
+    job = job_manager.submit("pdf", work, owner=str(current_user.id))
+    job.emit('upload_received', filename=file.filename, size=file_size)
+    return _accepted(job)
+
+@router.post("/dataset", status_code=status.HTTP_202_ACCEPTED)
+async def start_dataset_job(
+    file: UploadFile = File(...),
+    name: str = Form(...),
+    description: str = Form(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Ingest a training dataset archive in the background"""
+    
+    if current_user.role != "pro":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Pro subscription required for dataset uploads"
+        )
+    if not any(file.filename.lower().endswith(ext) for ext in settings.ALLOWED_ARCHIVE_EXTENSIONS):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid archive type. Allowed: {settings.ALLOWED_ARCHIVE_EXTENSIONS}"
+        )
+    if file.size and file.size > settings.MAX_FILE_SIZE * 5:  # Allow larger archives
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Archive too large. Max size: {settings.MAX_FILE_SIZE * 5} bytes"
+        )
+    
+    temp_path = await file_handler.save_upload_file(file)
+    file_size = file_handler.get_file_size(temp_path)
+    
+    async def work(job: Job) -> dict:
+        try:
+            # ArchiveLimitError fails the job with its limit details
+            success, extract_path, category_counts = await job_manager.run_blocking(
+                archive_extractor.extract_archive, temp_path, name,
+                lambda progress: job.emit('archive', **progress)
+            )
+            if not success:
+                raise RuntimeError("Failed to extract archive")
+            
+            dataset = TrainingDataset(
+                name=name,
+                description=description,
+                archive_filename=file.filename,
+                extracted_path=extract_path,
+                total_images=sum(category_counts.values()),
+                categories=category_counts,
+                status="ready"
+            )
+            inserted = await get_database().training_datasets.insert_one(dataset.dict(by_alias=True))
+            job.emit('persisted', dataset_id=str(inserted.inserted_id))
+            
+            return {
+                "dataset_id": str(inserted.inserted_id),
+                "name": name,
+                "total_images": dataset.total_images,
+                "categories": category_counts,
+                "status": "ready"
+            }
+        finally:
+            file_handler.cleanup_file(temp_path)
+    
+    job = job_manager.submit("dataset", work, owner=str(current_user.id))
+    job.emit('upload_received', filename=file.filename, size=file_size)
+    return _accepted(job)
+
+def _get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found or expired"
+        )
+    return job
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Current stage and, once completed, the result of a job (owner only)"""
+    job = _get_job(job_id)
+    if job.owner != str(current_user.id):
+        # Same answer as an unknown id, so other users' jobs are not disclosed
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found or expired"
+        )
+    return job.snapshot()
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-sent progress events of a job
+    Job ids are unguessable and EventSource cannot send an Authorization
+    header, so on this endpoint only the id itself grants access (the
+    snapshot endpoint checks the owner). Reconnecting clients resume
+    after Last-Event-ID; disconnecting never cancels the job.
+    """
+    job = _get_job(job_id)
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    
+    async def stream():
+        async for event in job.subscribe(after, keepalive=settings.JOB_KEEPALIVE_SECONDS):
+            yield sse_message(event)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
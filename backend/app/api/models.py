@@ -0,0 +1,109 @@
+"""
+Model registry API endpoints
+"""
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, status, Depends
+from pydantic import BaseModel, Field
+from app.core.config import settings
+from app.models.user import User
+from app.api.auth import get_current_user
+from ml.model import model_manager
+from ml.shadow import shadow_evaluator
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+def require_admin(current_user: User = Depends(get_current_user)) -> User:
+    """Only admin users may change the serving model"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin role required"
+        )
+    return current_user
+
+class ShadowRequest(BaseModel):
+    version: str
+    sample_rate: float = Field(default=0.1, ge=0.0, le=1.0)
+    canary_percent: float = Field(default=0.0, ge=0.0, le=100.0)
+
+@router.get("")
+async def list_models(current_user: User = Depends(get_current_user)):
+    """Registered model versions, the serving version and the last swap status"""
+    return {
+        "serving_version": model_manager.model_version,
+        "versions": model_manager.registry.list_versions(),
+        "swap_status": model_manager.swap_status
+    }
+
+@router.post("/{version}/activate", status_code=status.HTTP_202_ACCEPTED)
+async def activate_model(version: str, current_user: User = Depends(require_admin)):
+    """Start a background hot swap to a registered version; poll GET /api/models for progress"""
+    if model_manager.registry.get(version) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown model version {version}"
+        )
+    if model_manager.swap_lock.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another model swap is in progress"
+        )
+    
+    def swap():
+        try:
+            model_manager.activate_version(version)
+        except Exception as e:
+            logger.error(f"Background swap to {version} failed: {e}")
+    
+    # Loading and warm-up run in a worker thread; requests keep using the old model
+    asyncio.get_running_loop().run_in_executor(None, swap)
+    logger.info(f"Model swap to {version} requested by {current_user.email}")
+    return {
+        "version": version,
+        "status": "loading",
+        "message": "Model swap started"
+    }
+
+@router.get("/shadow")
+async def shadow_report(current_user: User = Depends(get_current_user)):
+    """Agreement rate, confidence deltas and latency of the live and candidate models"""
+    return shadow_evaluator.summary()
+
+@router.post("/shadow")
+async def start_shadow(request: ShadowRequest, current_user: User = Depends(require_admin)):
+    """Start shadow (or, with canary_percent > 0, canary) evaluation of a registered version"""
+    if model_manager.registry.get(request.version) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown model version {request.version}"
+        )
+    
+    def start():
+        return shadow_evaluator.start(
+            request.version,
+            sample_rate=request.sample_rate,
+            canary_percent=request.canary_percent,
+            workers=settings.SHADOW_WORKERS,
+            max_pending=settings.SHADOW_MAX_PENDING
+        )
+    
+    try:
+        # Candidate load and warm-up stay off the event loop
+        report = await asyncio.get_running_loop().run_in_executor(None, start)
+    except Exception as e:
+        logger.error(f"Shadow evaluation of {request.version} failed to start: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Shadow evaluation failed to start: {str(e)}"
+        )
+    logger.info(f"{report['mode'].capitalize()} evaluation of {request.version} started by {current_user.email}")
+    return report
+
+@router.delete("/shadow")
+async def stop_shadow(current_user: User = Depends(require_admin)):
+    """Stop shadow/canary evaluation; returns the final report"""
+    report = shadow_evaluator.summary()
+    shadow_evaluator.stop()
+    return report
@@ -2,7 +2,7 @@
 Configuration settings for the AI Authenticity Verification Platform
 """
 import os
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -27,14 +27,68 @@ class Settings(BaseSettings):
     # File upload settings
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
     UPLOAD_DIR: str = "uploads"
+    UPLOAD_INDEX_PATH: str = os.getenv("UPLOAD_INDEX_PATH", "upload_index.sqlite3")  # Local storage only, outside the served UPLOAD_DIR
+    UPLOAD_TTL_HOURS: Dict[str, float] = {"free": 24, "premium": 24 * 30, "pro": 24 * 90}  # Retention per plan
+    UPLOAD_SWEEP_INTERVAL_SECONDS: int = int(os.getenv("UPLOAD_SWEEP_INTERVAL_SECONDS", "300"))
+    UPLOAD_SWEEP_BATCH: int = 500  # Expired uploads deleted per index query
+    UPLOAD_DISK_HIGH_WATERMARK: float = float(os.getenv("UPLOAD_DISK_HIGH_WATERMARK", "0.90"))  # Starts eviction
+    UPLOAD_DISK_LOW_WATERMARK: float = float(os.getenv("UPLOAD_DISK_LOW_WATERMARK", "0.80"))  # Eviction target
+    UPLOAD_EVICTION_MIN_AGE_SECONDS: int = 600  # Uploads still being analyzed are never evicted
     ALLOWED_IMAGE_EXTENSIONS: List[str] = [".jpg", ".jpeg", ".png", ".bmp", ".tiff"]
     ALLOWED_PDF_EXTENSIONS: List[str] = [".pdf"]
     ALLOWED_ARCHIVE_EXTENSIONS: List[str] = [".zip", ".rar", ".7z", ".tar", ".tar.gz"]
     
+    # Upload and dataset blob storage: "local" (UPLOAD_DIR / DATASET_PATH) or "s3"
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local")
+    S3_BUCKET: str = os.getenv("S3_BUCKET", "")
+    S3_PREFIX: str = os.getenv("S3_PREFIX", "")  # Objects go under <prefix>uploads/ and <prefix>datasets/
+    S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL", "")  # MinIO or other S3-compatible APIs
+    S3_REGION: str = os.getenv("S3_REGION", "")
+    S3_PART_SIZE_MB: int = int(os.getenv("S3_PART_SIZE_MB", "8"))  # Multipart upload part size (S3 minimum is 5)
+    STORAGE_CACHE_DIR: str = os.getenv("STORAGE_CACHE_DIR", "storage_cache")  # Local copies of S3 objects
+    STORAGE_CACHE_MAX_MB: int = int(os.getenv("STORAGE_CACHE_MAX_MB", "2048"))
+    
+    # Archive ingestion settings
+    ARCHIVE_MAX_MEMBER_SIZE: int = 50 * 1024 * 1024  # 50MB per extracted image
+    ARCHIVE_VALIDATION_WORKERS: int = os.cpu_count() or 1
+    ARCHIVE_PROGRESS_INTERVAL: int = 100  # Report progress every N members
+    ARCHIVE_MAX_TOTAL_SIZE: int = 5 * 1024 * 1024 * 1024  # 5GB uncompressed per archive
+    ARCHIVE_MAX_COMPRESSION_RATIO: float = 100.0
+    ARCHIVE_MAX_MEMBERS: int = 200000
+    ARCHIVE_MAX_NESTING_DEPTH: int = 8
+    ARCHIVE_TIME_BUDGET_SECONDS: float = 600.0
+    
+    # Background jobs with progress events
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))  # Threads running blocking job stages
+    JOB_RETENTION_SECONDS: int = 900  # Finished jobs stay available to (re)subscribers
+    JOB_KEEPALIVE_SECONDS: float = 15.0  # Comment sent on idle event streams
+    
     # ML Model settings
     MODEL_PATH: str = "ml/models"
     IMAGE_SIZE: tuple = (224, 224)
     BATCH_SIZE: int = 32
+    INFERENCE_PRECISION: str = os.getenv("INFERENCE_PRECISION", "fp32")  # fp32 or bf16
+    INFERENCE_CHANNELS_LAST: bool = os.getenv("INFERENCE_CHANNELS_LAST", "False").lower() == "true"
+    INFERENCE_PARITY_DATASET: str = os.getenv("INFERENCE_PARITY_DATASET", "")  # Test split checked against fp32
+    INFERENCE_CASCADE: bool = os.getenv("INFERENCE_CASCADE", "False").lower() == "true"  # Needs ml/models/cascade.json
+    SHADOW_MODEL_VERSION: str = os.getenv("SHADOW_MODEL_VERSION", "")  # Registry candidate evaluated on live traffic
+    SHADOW_SAMPLE_RATE: float = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+    SHADOW_CANARY_PERCENT: float = float(os.getenv("SHADOW_CANARY_PERCENT", "0"))  # Users served by the candidate
+    SHADOW_WORKERS: int = 1
+    SHADOW_MAX_PENDING: int = 8  # Sampled requests beyond this backlog are dropped
+    MODEL_REGISTRY_POLL_SECONDS: float = float(os.getenv("MODEL_REGISTRY_POLL_SECONDS", "5"))  # 0 disables following activations
+    TTA_LATENCY_BUDGET_MS: float = float(os.getenv("TTA_LATENCY_BUDGET_MS", "150"))  # Premium TTA forward budget
+    TILED_ANALYSIS_MIN_PIXELS: int = int(os.getenv("TILED_ANALYSIS_MIN_PIXELS", str(24 * 1000 * 1000)))
+    TILE_SIZE: int = 512  # Tile edge in decoded pixels
+    TILE_BATCH_SIZE: int = 16
+    TILE_POOLING: str = os.getenv("TILE_POOLING", "max")  # max (most suspicious tile) or mean
+    ANALYSIS_MEMORY_CEILING_MB: int = int(os.getenv("ANALYSIS_MEMORY_CEILING_MB", "512"))  # Per tiled request
+    ELA_QUALITY: int = 90  # JPEG quality for Error Level Analysis re-encoding
+    ELA_MAX_PIXELS: int = int(os.getenv("ELA_MAX_PIXELS", str(1024 * 1024)))  # Larger decodes are windowed
+    METADATA_RULES_PATH: str = os.getenv(
+        "METADATA_RULES_PATH", os.path.join(os.path.dirname(__file__), "metadata_rules.json")
+    )  # Versioned software signatures, generator sizes and weights
+    ELA_HEATMAP: bool = os.getenv("ELA_HEATMAP", "False").lower() == "true"  # 64 px heatmap in results
     
     # Training dataset paths
     DATASET_PATH: str = "datasets"
@@ -0,0 +1,17 @@
+"""
+Service errors with a machine-readable code
+"""
+from typing import Any, Dict
+
+
+class ServiceError(Exception):
+    """Base of service errors reported to clients as {code, message, details}"""
+    
+    def __init__(self, code: str, message: str, **details: Any):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.details = details
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {'code': self.code, 'message': self.message, 'details': self.details}
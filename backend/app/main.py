@@ -16,6 +16,10 @@ from app.core.database import connect_to_mongo, close_mongo_connection
 from app.api.auth import router as auth_router
 from app.api.analysis import router as analysis_router
 from app.api.history import router as history_router
+from app.api.models import router as models_router
+from app.api.jobs import router as jobs_router
+from app.services.jobs import job_manager
+from app.services.upload_retention import retention_sweeper
 from app.static_files import setup_static_files
 
 # Configure logging
@@ -31,9 +35,12 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting AI Authenticity Verification Platform...")
     await connect_to_mongo()
+    retention_sweeper.start()
     yield
     # Shutdown
     logger.info("Shutting down...")
+    await retention_sweeper.stop()
+    await job_manager.shutdown()
     await close_mongo_connection()
 
 # Initialize FastAPI app
@@ -60,6 +67,8 @@ security = HTTPBearer()
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(analysis_router, prefix="/api/analyze", tags=["Analysis"])
 app.include_router(history_router, prefix="/api/history", tags=["History"])
+app.include_router(models_router, prefix="/api/models", tags=["Models"])
+app.include_router(jobs_router, prefix="/api/jobs", tags=["Jobs"])
 
 # Setup static file serving for frontend
 setup_static_files(app)
@@ -14,6 +14,49 @@ class ImageAnalysisResult(BaseModel):
     processing_time: float
     metadata: Dict[str, Any] = {}
 
+class C2PAManifest(BaseModel):
+    present: bool = False
+    manifest_labels: List[str] = []
+    claim_generator: Optional[str] = None
+    ai_generated: bool = False  # digitalSourceType trainedAlgorithmicMedia in an assertion
+
+class ImageMetadata(BaseModel):
+    """Normalized metadata read from file headers without decoding pixels"""
+    format: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    mode: Optional[str] = None
+    has_transparency: bool = False
+    exif: Dict[str, Any] = {}
+    xmp: Dict[str, str] = {}  # "prefix:Property" -> value
+    iptc: Dict[str, Any] = {}
+    text_chunks: Dict[str, str] = {}  # PNG tEXt/zTXt/iTXt
+    generation_parameters: Optional[str] = None  # Stable Diffusion/ComfyUI/InvokeAI settings
+    c2pa: C2PAManifest = Field(default_factory=C2PAManifest)
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def as_exif_dict(self) -> Dict[str, Any]:
+        """Flat EXIF-style dict returned by the API as exif_data"""
+        data = dict(self.exif)
+        data.update({
+            'format': self.format,
+            'mode': self.mode,
+            'size': self.size,
+            'has_transparency': self.has_transparency
+        })
+        if self.xmp:
+            data['XMP'] = self.xmp
+        if self.iptc:
+            data['IPTC'] = self.iptc
+        if self.generation_parameters:
+            data['GenerationParameters'] = self.generation_parameters
+        if self.c2pa.present:
+            data['C2PA'] = self.c2pa.dict()
+        return data
+
 class ImageAnalysis(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     user_id: PyObjectId
@@ -22,6 +65,7 @@ class ImageAnalysis(BaseModel):
     file_hash: str
     result: ImageAnalysisResult
     exif_data: Dict[str, Any] = {}
+    stored_filename: Optional[str] = None  # Name in UPLOAD_DIR while the upload is retained
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     class Config:
@@ -12,7 +12,7 @@ class PyObjectId(ObjectId):
         yield cls.validate
 
     @classmethod
-    def validate(cls, v):
+    def validate(cls, v, _info=None):  # pydantic 2 also passes validation info
         if not ObjectId.is_valid(v):
             raise ValueError("Invalid objectid")
         return ObjectId(v)
@@ -38,7 +38,7 @@ class UserInDB(UserBase):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     hashed_password: str
     is_active: bool = True
-    role: str = "free"  # free, pro
+    role: str = "free"  # free, pro, admin
     plan: str = "free"  # Added for frontend compatibility
     analysis_count: int = 0  # Number of analyses used this month
     monthly_analysis_limit: int = 10  # Monthly limit based on plan
@@ -1,32 +1,163 @@
 """
 Archive extraction service for training datasets
 Supports ZIP, RAR, 7Z, TAR formats
+
+Archives are ingested as a stream of members: each member is filtered by
+extension and size before it is read, validated as an image in a worker
+pool and only stored once it has been accepted. Accepted images go into the
+content-addressed blob store under DATASET_PATH/blobs (in the dataset
+storage backend, so S3 when STORAGE_BACKEND=s3) and the dataset itself is a
+manifest at DATASET_PATH/<name>/manifest.json.
+
+Every extraction runs under an ExtractionBudget which bounds the total
+uncompressed bytes, compression ratio, member count, path nesting and
+wall-clock time. Exceeding any limit raises ArchiveLimitError and removes
+whatever was already written for the dataset.
 """
+import io
 import os
+import time
 import logging
+import posixpath
 import zipfile
 import tarfile
 import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import hashlib
 from PIL import Image
 import rarfile
 
 from app.core.config import settings
+from app.core.errors import ServiceError
 from app.models.analysis import TrainingDataset
+from app.services.storage import dataset_storage
+from ml.dataset_store import BLOB_DIR, BlobStore, DatasetManifest, has_manifest, referenced_hashes
 
 logger = logging.getLogger(__name__)
 
+# (member name, uncompressed size, compressed size if known) -> should the member be read
+MemberFilter = Callable[[str, int, Optional[int]], bool]
+ProgressCallback = Callable[[Dict[str, int]], None]
+
+
+def _blob_storage():
+    """Shared dataset storage when it is remote; locally blobs stay under DATASET_PATH/blobs"""
+    return None if dataset_storage.is_local else dataset_storage
+
+
+class ArchiveLimitError(ServiceError):
+    """Raised when an archive violates an extraction limit"""
+
+
+class ExtractionBudget:
+    """Tracks resource usage of a single extraction against configured limits"""
+    
+    def __init__(self, archive_size: int):
+        self.archive_size = max(archive_size, 1)
+        self.max_total_bytes = settings.ARCHIVE_MAX_TOTAL_SIZE
+        self.max_ratio = settings.ARCHIVE_MAX_COMPRESSION_RATIO
+        self.max_members = settings.ARCHIVE_MAX_MEMBERS
+        self.max_depth = settings.ARCHIVE_MAX_NESTING_DEPTH
+        self.time_budget = settings.ARCHIVE_TIME_BUDGET_SECONDS
+        self.started = time.monotonic()
+        self.members = 0
+        self.total_bytes = 0
+    
+    def check_time(self):
+        elapsed = time.monotonic() - self.started
+        if elapsed > self.time_budget:
+            raise ArchiveLimitError(
+                'time_budget_exceeded', 'Archive extraction took too long',
+                elapsed_seconds=round(elapsed, 2), limit_seconds=self.time_budget
+            )
+    
+    def check_member(self, name: str, size: int, compressed_size: Optional[int]) -> str:
+        """Account for a member entry and return its normalized path"""
+        self.check_time()
+        
+        self.members += 1
+        if self.members > self.max_members:
+            raise ArchiveLimitError(
+                'too_many_members', 'Archive contains too many entries',
+                limit=self.max_members
+            )
+        
+        path = safe_member_path(name)
+        depth = path.count('/') + 1
+        if depth > self.max_depth:
+            raise ArchiveLimitError(
+                'nesting_too_deep', 'Archive entry is nested too deeply',
+                member=name, depth=depth, limit=self.max_depth
+            )
+        
+        if compressed_size and size / compressed_size > self.max_ratio:
+            raise ArchiveLimitError(
+                'compression_ratio_exceeded', 'Archive entry has a suspicious compression ratio',
+                member=name, ratio=round(size / compressed_size, 1), limit=self.max_ratio
+            )
+        return path
+    
+    def consume(self, name: str, nbytes: int):
+        """Account for bytes actually decompressed from a member"""
+        self.total_bytes += nbytes
+        if self.total_bytes > self.max_total_bytes:
+            raise ArchiveLimitError(
+                'uncompressed_size_exceeded', 'Archive expands beyond the allowed size',
+                member=name, limit_bytes=self.max_total_bytes
+            )
+        # Archive-wide ratio also catches formats without per-member sizes (TAR, solid 7z)
+        ratio = self.total_bytes / self.archive_size
+        if self.total_bytes > settings.ARCHIVE_MAX_MEMBER_SIZE and ratio > self.max_ratio:
+            raise ArchiveLimitError(
+                'compression_ratio_exceeded', 'Archive has a suspicious compression ratio',
+                ratio=round(ratio, 1), limit=self.max_ratio
+            )
+
+
+def safe_member_path(name: str) -> str:
+    """Normalize an archive member name, rejecting absolute and traversing paths"""
+    normalized = name.replace('\\', '/')
+    if normalized.startswith('/') or (len(normalized) > 1 and normalized[1] == ':'):
+        raise ArchiveLimitError('unsafe_path', 'Archive entry has an absolute path', member=name)
+    normalized = posixpath.normpath(normalized)
+    if normalized == '..' or normalized.startswith('../') or '\x00' in normalized:
+        raise ArchiveLimitError('unsafe_path', 'Archive entry escapes the extraction directory', member=name)
+    return normalized
+
+
+def _read_capped(stream, declared_size: int, name: str) -> bytes:
+    """Read a member stream, refusing to decompress past its declared size"""
+    data = stream.read(declared_size + 1)
+    if len(data) > declared_size:
+        raise ArchiveLimitError(
+            'size_mismatch', 'Archive entry is larger than its declared size',
+            member=name, declared_bytes=declared_size
+        )
+    return data
+
+
+def _is_valid_image_bytes(data: bytes) -> bool:
+    """Check if an in-memory buffer is a valid image (runs in worker processes)"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+
+
 class ArchiveExtractor:
     def __init__(self):
         self.supported_formats = {
-            '.zip': self._extract_zip,
-            '.rar': self._extract_rar,
-            '.7z': self._extract_7z,
-            '.tar': self._extract_tar,
-            '.tar.gz': self._extract_tar,
-            '.tgz': self._extract_tar
+            '.zip': self._iter_zip,
+            '.rar': self._iter_rar,
+            '.7z': self._iter_7z,
+            '.tar': self._iter_tar,
+            '.tar.gz': self._iter_tar,
+            '.tgz': self._iter_tar
         }
         
         # Ensure dataset directory exists
@@ -49,51 +180,74 @@ class ArchiveExtractor:
         except Exception:
             return False
 
-    def _extract_zip(self, archive_path: str, extract_to: str) -> bool:
-        """Extract ZIP archive"""
-        try:
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_to)
-            return True
-        except Exception as e:
-            logger.error(f"Error extracting ZIP: {e}")
-            return False
-
-    def _extract_rar(self, archive_path: str, extract_to: str) -> bool:
-        """Extract RAR archive"""
-        try:
-            with rarfile.RarFile(archive_path, 'r') as rar_ref:
-                rar_ref.extractall(extract_to)
-            return True
-        except Exception as e:
-            logger.error(f"Error extracting RAR: {e}")
-            return False
-
-    def _extract_7z(self, archive_path: str, extract_to: str) -> bool:
-        """Extract 7Z archive using py7zr"""
-        try:
-            import py7zr
-            with py7zr.SevenZipFile(archive_path, mode='r') as z:
-                z.extractall(extract_to)
-            return True
-        except Exception as e:
-            logger.error(f"Error extracting 7Z: {e}")
-            return False
+    def _iter_zip(self, archive_path: str, accept: MemberFilter) -> Iterator[Tuple[str, bytes]]:
+        """Yield accepted ZIP members"""
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir() or not accept(info.filename, info.file_size, info.compress_size):
+                    continue
+                with zip_ref.open(info) as member:
+                    yield info.filename, _read_capped(member, info.file_size, info.filename)
 
-    def _extract_tar(self, archive_path: str, extract_to: str) -> bool:
-        """Extract TAR archive"""
-        try:
-            with tarfile.open(archive_path, 'r:*') as tar_ref:
-                tar_ref.extractall(extract_to)
-            return True
-        except Exception as e:
-            logger.error(f"Error extracting TAR: {e}")
-            return False
+    def _iter_rar(self, archive_path: str, accept: MemberFilter) -> Iterator[Tuple[str, bytes]]:
+        """Yield accepted RAR members"""
+        with rarfile.RarFile(archive_path, 'r') as rar_ref:
+            for info in rar_ref.infolist():
+                if info.is_dir() or not accept(info.filename, info.file_size, info.compress_size):
+                    continue
+                with rar_ref.open(info) as member:
+                    yield info.filename, _read_capped(member, info.file_size, info.filename)
 
-    def extract_archive(self, archive_path: str, dataset_name: str) -> Tuple[bool, str, Dict[str, int]]:
+    def _iter_7z(self, archive_path: str, accept: MemberFilter) -> Iterator[Tuple[str, bytes]]:
+        """Yield accepted 7Z members using py7zr
+        
+        Solid 7z archives can only be decompressed from the start, so all
+        accepted members are extracted in a single pass into a scratch
+        directory (bounded by the extraction budget) and read back from there.
+        """
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, mode='r') as z:
+            sizes: Dict[str, int] = {}
+            for info in z.list():
+                if info.is_directory or not accept(info.filename, info.uncompressed, info.compressed):
+                    continue
+                sizes[info.filename] = info.uncompressed
+            if not sizes:
+                return
+            with tempfile.TemporaryDirectory(dir=settings.DATASET_PATH, prefix=".7z-") as scratch:
+                z.extract(path=scratch, targets=list(sizes))
+                for name, size in sizes.items():
+                    with open(os.path.join(scratch, safe_member_path(name)), 'rb') as member:
+                        yield name, _read_capped(member, size, name)
+    
+    def _iter_tar(self, archive_path: str, accept: MemberFilter) -> Iterator[Tuple[str, bytes]]:
+        """Yield accepted TAR members
+        
+        Links, devices and other special entries are never accepted.
+        """
+        with tarfile.open(archive_path, 'r:*') as tar_ref:
+            for member in tar_ref:
+                if not member.isfile() or not accept(member.name, member.size, None):
+                    continue
+                extracted = tar_ref.extractfile(member)
+                if extracted is None:
+                    continue
+                yield member.name, _read_capped(extracted, member.size, member.name)
+    
+    def _member_category(self, member_name: str) -> Optional[str]:
+        """Category of a member is the name of its parent folder"""
+        parts = [p for p in member_name.replace('\\', '/').split('/') if p]
+        if len(parts) < 2:
+            return None
+        return parts[-2]
+    
+    def extract_archive(self, archive_path: str, dataset_name: str,
+                        progress_callback: Optional[ProgressCallback] = None
+                        ) -> Tuple[bool, str, Dict[str, int]]:
         """
         Extract archive and organize images by category
         Returns: (success, extract_path, category_counts)
+        Raises: ArchiveLimitError if the archive violates an extraction limit
         """
         # Determine file extension
         file_ext = None
@@ -106,69 +260,141 @@ class ArchiveExtractor:
             logger.error(f"Unsupported archive format: {archive_path}")
             return False, "", {}
 
+        # Dataset names become directory names and must not escape DATASET_PATH
+        try:
+            safe_name = safe_member_path(dataset_name)
+        except ArchiveLimitError:
+            logger.error(f"Invalid dataset name: {dataset_name}")
+            return False, "", {}
+        if '/' in safe_name or safe_name in ('', '.', BLOB_DIR):
+            logger.error(f"Invalid dataset name: {dataset_name}")
+            return False, "", {}
+        
         # Create extraction directory
-        extract_path = os.path.join(settings.DATASET_PATH, dataset_name)
+        extract_path = os.path.join(settings.DATASET_PATH, safe_name)
         os.makedirs(extract_path, exist_ok=True)
 
-        # Extract archive
-        success = self.supported_formats[file_ext](archive_path, extract_path)
-        if not success:
+        budget = ExtractionBudget(os.path.getsize(archive_path))
+        
+        def accept(name: str, size: int, compressed_size: Optional[int]) -> bool:
+            path = budget.check_member(name, size, compressed_size)
+            if not self._accept_member(path, size):
+                return False
+            budget.consume(name, size)
+            return True
+        
+        manifest = DatasetManifest(safe_name, os.path.join(settings.DATASET_PATH, BLOB_DIR), _blob_storage())
+        created_blobs: List[str] = []
+        
+        # Stream members through filtering, validation and storing
+        try:
+            self._ingest_members(
+                self.supported_formats[file_ext](archive_path, accept),
+                manifest,
+                created_blobs,
+                progress_callback,
+                budget
+            )
+            manifest.save(extract_path)
+        except ArchiveLimitError as e:
+            logger.warning(f"Archive rejected ({e.code}): {e.message} {e.details}")
+            self._discard(extract_path, manifest.store, created_blobs)
+            raise
+        except Exception as e:
+            logger.error(f"Error extracting {file_ext.upper().lstrip('.')}: {e}")
+            self._discard(extract_path, manifest.store, created_blobs)
             return False, "", {}
 
-        # Organize and count images by category
-        category_counts = self._organize_images(extract_path)
-        
+        category_counts = manifest.category_counts()
+        logger.info(f"Organized dataset: {category_counts}")
         return True, extract_path, category_counts
 
-    def _organize_images(self, extract_path: str) -> Dict[str, int]:
+    def _discard(self, extract_path: str, store: BlobStore, created_blobs: List[str]):
+        """
+        Remove the partial dataset and the blobs it first stored
+        Blobs a saved manifest references are kept: a concurrent import of
+        the same content may already have completed against them.
+        """
+        self.cleanup_dataset(extract_path)
+        referenced = referenced_hashes(settings.DATASET_PATH) if os.path.isdir(settings.DATASET_PATH) else set()
+        for digest in created_blobs:
+            if digest not in referenced:
+                store.remove(digest)
+    
+    def _accept_member(self, member_name: str, member_size: int) -> bool:
+        """Filter members by category, extension and size before they are read"""
+        if self._member_category(member_name) is None:
+            return False
+        file_ext = os.path.splitext(member_name)[1].lower()
+        if file_ext not in settings.ALLOWED_IMAGE_EXTENSIONS:
+            return False
+        return 0 < member_size <= settings.ARCHIVE_MAX_MEMBER_SIZE
+    
+    def _ingest_members(self, members: Iterator[Tuple[str, bytes]], manifest: DatasetManifest,
+                        created_blobs: List[str],
+                        progress_callback: Optional[ProgressCallback] = None,
+                        budget: Optional[ExtractionBudget] = None):
         """
-        Organize extracted images into categories and count them
-        Expected structure: dataset/category/images
+        Validate members in a process pool and store accepted images
+        Each image is labelled with its parent folder: dataset/category/images
         """
-        category_counts = {}
-        
-        # Walk through extracted directory
-        for root, dirs, files in os.walk(extract_path):
-            # Skip root directory
-            if root == extract_path:
-                continue
-                
-            # Get category name (folder name)
-            category = os.path.basename(root)
-            if category not in category_counts:
-                category_counts[category] = 0
-            
-            # Count valid images in this category
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_ext = os.path.splitext(file)[1].lower()
-                
-                if file_ext in settings.ALLOWED_IMAGE_EXTENSIONS:
-                    if self.is_valid_image(file_path):
-                        category_counts[category] += 1
-                    else:
-                        # Remove invalid image
-                        os.remove(file_path)
-                        logger.warning(f"Removed invalid image: {file_path}")
+        store = manifest.store
+        progress = {'processed': 0, 'accepted': 0, 'rejected': 0, 'duplicates': 0, 'bytes_written': 0}
+        
+        workers = max(1, settings.ARCHIVE_VALIDATION_WORKERS)
+        max_in_flight = workers * 2  # Bounds the member bytes held in memory
+
+        def report():
+            if progress_callback:
+                progress_callback(dict(progress))
+
+        def write_member(name: str, data: bytes):
+            digest, created = store.put_bytes(data)
+            if created:
+                created_blobs.append(digest)
+                progress['bytes_written'] += len(data)
+            if manifest.add(digest, self._member_category(name), os.path.basename(name)):
+                progress['accepted'] += 1
+            else:
+                progress['duplicates'] += 1
+
+        def collect(done):
+            for future in done:
+                name, data = pending.pop(future)
+                if future.result():
+                    write_member(name, data)
                 else:
-                    # Remove non-image files
-                    os.remove(file_path)
+                    progress['rejected'] += 1
+                    logger.warning(f"Skipped invalid image: {name}")
+                progress['processed'] += 1
+                if progress['processed'] % settings.ARCHIVE_PROGRESS_INTERVAL == 0:
+                    report()
         
-        # Remove empty categories
-        empty_categories = [cat for cat, count in category_counts.items() if count == 0]
-        for cat in empty_categories:
-            cat_path = os.path.join(extract_path, cat)
-            if os.path.exists(cat_path):
-                shutil.rmtree(cat_path)
-            del category_counts[cat]
+        pending = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for name, data in members:
+                if budget:
+                    budget.check_time()
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[pool.submit(_is_valid_image_bytes, data)] = (name, data)
         
-        logger.info(f"Organized dataset: {category_counts}")
-        return category_counts
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        
+        report()
 
     def get_dataset_structure(self, dataset_path: str) -> Dict[str, List[str]]:
         """Get the structure of an extracted dataset"""
         structure = {}
         
+        if has_manifest(dataset_path):
+            for path, label in DatasetManifest.load(dataset_path, _blob_storage()).select():
+                structure.setdefault(label, []).append(path)
+            return structure
+        
         for category in os.listdir(dataset_path):
             category_path = os.path.join(dataset_path, category)
             if os.path.isdir(category_path):
@@ -193,4 +419,4 @@ class ArchiveExtractor:
             logger.error(f"Error cleaning up dataset: {e}")
 
 # Global extractor instance
-archive_extractor = ArchiveExtractor()
\ No newline at end of file
+archive_extractor = ArchiveExtractor()
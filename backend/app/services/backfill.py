@@ -0,0 +1,333 @@
+"""
+Re-scoring backfill over stored image analyses
+
+Streams image_analyses documents by _id cursor in batches and recomputes
+their verdicts with the current model and metadata rules:
+- documents whose upload is still retained (UploadStore) are reloaded;
+  workers read metadata and preprocess in a thread pool, then the batch is
+  classified with one forward pass per BATCH_SIZE images
+- documents whose upload is gone are re-scored from the stored exif_data,
+  anomalies and quality metrics (the stored model output is kept)
+Updates go back with one unordered bulk_write per batch. Reads and writes
+share a token-bucket ops/sec budget, and the resume token (last _id) is
+checkpointed after every batch so an interrupted run continues where it
+stopped. Dry runs write neither updates nor the checkpoint.
+
+Both document shapes are handled: app API documents keep the verdict under
+'result', production_server documents at the top level.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+import torch
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import CursorNotFound
+
+from app.core.config import settings
+from ml.model import model_manager
+from app.services.image_analysis import image_analysis_service
+from app.services.metadata_rules import metadata_rules
+from app.services.tiled_analysis import needs_tiling
+from app.services.upload_retention import upload_store
+
+logger = logging.getLogger(__name__)
+
+# _id types in BSON sort order: production_server stores uuid strings, the app API ObjectIds
+ID_PHASES = ('string', 'objectId')
+PROJECTION = {
+    'result': 1, 'prediction': 1, 'confidence_score': 1, 'model_version': 1, 'metadata': 1,
+    'exif_data': 1, 'filename': 1, 'stored_filename': 1
+}
+COUNTERS = ('read', 'updated', 'from_file', 'from_stored', 'skipped', 'missing_files', 'failed')
+
+
+class OpsThrottle:
+    """Token bucket limiting database operations per second (0 disables it)"""
+    
+    def __init__(self, ops_per_sec: float, burst: Optional[float] = None):
+        self.rate = ops_per_sec
+        self.capacity = burst or max(ops_per_sec, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self, ops: int) -> float:
+        """Take ops tokens, sleeping off any debt; returns the seconds slept"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= ops
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+            self.waited += wait
+        return wait
+
+
+class BackfillCheckpoint:
+    """Resume token (_id phase and last _id) and counters, rewritten atomically"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.state = self._read()
+    
+    def _read(self) -> Dict[str, Any]:
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                return json.load(f)
+        return {
+            'phase': 0,
+            'last_id': None,
+            'counters': {name: 0 for name in COUNTERS},
+            'started_at': datetime.utcnow().isoformat()
+        }
+    
+    @property
+    def phase(self) -> int:
+        return self.state['phase']
+    
+    @property
+    def last_id(self) -> Any:
+        last_id = self.state['last_id']
+        if last_id is not None and ID_PHASES[self.phase] == 'objectId':
+            return ObjectId(last_id)
+        return last_id
+    
+    @property
+    def counters(self) -> Dict[str, int]:
+        return self.state['counters']
+    
+    @property
+    def done(self) -> bool:
+        return self.phase >= len(ID_PHASES)
+    
+    def advance(self, phase: int, last_id: Any, persist: bool = True):
+        """Move the resume token; persist=False keeps it in memory only (dry runs)"""
+        self.state.update({
+            'phase': phase,
+            'last_id': str(last_id) if last_id is not None else None,
+            'rules_version': metadata_rules.version,
+            'model_version': model_manager.model_version,
+            'updated_at': datetime.utcnow().isoformat()
+        })
+        if not persist:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def document_view(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Verdict fields of either document shape and the update path prefix"""
+    nested = 'result' in doc
+    verdict = doc['result'] if nested else doc
+    return {
+        'prefix': 'result.' if nested else '',
+        'prediction': verdict.get('prediction'),
+        'confidence_score': verdict.get('confidence_score', 0.0),
+        'model_version': verdict.get('model_version'),
+        'metadata': verdict.get('metadata') or {},
+        'exif_data': doc.get('exif_data') or {},
+        # production_server documents store the upload name as filename
+        'upload': doc.get('stored_filename') if nested else doc.get('filename')
+    }
+
+
+class AnalysisBackfill:
+    """Batched re-scoring of image_analyses documents"""
+    
+    def __init__(self, collection, checkpoint: BackfillCheckpoint, throttle: OpsThrottle,
+                 batch_size: int = 64, workers: int = 4, rules_only: bool = False,
+                 force: bool = False, dry_run: bool = False, reader=None):
+        self.collection = collection
+        self.reader = reader if reader is not None else collection
+        self.checkpoint = checkpoint
+        self.throttle = throttle
+        self.batch_size = batch_size
+        self.workers = workers
+        self.rules_only = rules_only
+        self.force = force
+        self.dry_run = dry_run
+    
+    def _batches(self, phase: int, last_id: Any) -> Iterator[List[Dict[str, Any]]]:
+        """Documents of one _id type after last_id, reopening the cursor if the server dropped it"""
+        while True:
+            query: Dict[str, Any] = {'$type': ID_PHASES[phase]}
+            if last_id is not None:
+                query['$gt'] = last_id
+            cursor = self.reader.find({'_id': query}, PROJECTION, sort=[('_id', 1)], batch_size=self.batch_size)
+            batch = []
+            try:
+                for doc in cursor:
+                    batch.append(doc)
+                    if len(batch) == self.batch_size:
+                        yield batch
+                        last_id, batch = batch[-1]['_id'], []
+                if batch:
+                    yield batch
+                return
+            except CursorNotFound:
+                logger.warning(f"Backfill cursor expired after {last_id}, reopening")
+                if batch:
+                    yield batch
+                    last_id = batch[-1]['_id']
+            finally:
+                cursor.close()
+    
+    def _current(self, view: Dict[str, Any]) -> bool:
+        return (view['metadata'].get('metadata_rules_version') == metadata_rules.version
+                and view['model_version'] == model_manager.model_version)
+    
+    def _prepare(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Worker: reload the retained upload (metadata, quality, model tensor) when there is one"""
+        view = document_view(doc)
+        item = {'doc': doc, 'view': view, 'source': 'stored', 'exif_data': view['exif_data'],
+                'quality': view['metadata'].get('quality_metrics')}
+        path = None if self.rules_only else upload_store.resolve(view['upload'])
+        if path is None:
+            item['missing_file'] = bool(view['upload']) and not self.rules_only
+            return item
+        
+        try:
+            metadata = image_analysis_service.read_metadata(path)
+            if needs_tiling(metadata.size):
+                # Very large images go through the bounded-memory tiled path
+                item['analysis'] = image_analysis_service.analyze_image(path, os.path.basename(path))
+            else:
+                item['tensor'] = image_analysis_service.preprocess_image_for_model(path)
+                item['quality'] = item['quality'] or image_analysis_service.analyze_image_quality(path)
+            item['exif_data'] = metadata.as_exif_dict()
+            item['source'] = 'file'
+        except Exception as e:
+            logger.error(f"Backfill could not reload {path}: {e}")
+            item['error'] = str(e)
+        return item
+    
+    def _infer(self, items: List[Dict[str, Any]]):
+        pending = [item for item in items if 'tensor' in item]
+        for start in range(0, len(pending), settings.BATCH_SIZE):
+            chunk = pending[start:start + settings.BATCH_SIZE]
+            predictions = model_manager.predict_batch(torch.stack([item.pop('tensor') for item in chunk]))
+            for item, prediction in zip(chunk, predictions):
+                item['prediction'] = prediction
+    
+    def _updates(self, items: List[Dict[str, Any]]) -> List[UpdateOne]:
+        counters = self.checkpoint.counters
+        scored = []
+        for item in items:
+            if 'error' in item or item.get('prediction', {}).get('prediction') == 'error':
+                counters['failed'] += 1
+            elif 'analysis' in item and item['analysis'].prediction == 'error':
+                counters['failed'] += 1
+            else:
+                scored.append(item)
+        
+        anomalies = [
+            metadata_rules.detect(item['exif_data']) if item['exif_data']
+            else item['view']['metadata'].get('exif_anomalies', {})
+            for item in scored
+        ]
+        scores = metadata_rules.weigh_batch(anomalies, [item['quality'] for item in scored])
+        
+        operations = []
+        now = datetime.utcnow()
+        for item, item_anomalies, score in zip(scored, anomalies, scores):
+            view = item['view']
+            prefix = view['prefix']
+            backfill = {'source': item['source'], 'rules_version': metadata_rules.version, 'at': now}
+            fields: Dict[str, Any] = {}
+            if 'analysis' in item:
+                result = item['analysis']
+                backfill['model_version'] = result.model_version
+                fields.update({
+                    'prediction': result.prediction,
+                    'confidence_score': result.confidence_score,
+                    'model_version': result.model_version,
+                    'metadata': {**result.metadata, 'backfill': backfill}
+                })
+            else:
+                if 'prediction' in item:
+                    prediction = item['prediction']
+                    original = prediction['confidence']
+                    fields.update({
+                        'prediction': prediction['prediction'],
+                        'model_version': prediction['model_version'],
+                        'metadata.ml_probabilities': prediction['probabilities'],
+                        'metadata.original_confidence': original
+                    })
+                else:
+                    prediction = {'model_version': view['model_version']}
+                    original = view['metadata'].get('original_confidence', view['confidence_score'])
+                backfill['model_version'] = prediction['model_version']
+                fields.update({
+                    'confidence_score': image_analysis_service._adjust_confidence_with_metadata(original, float(score)),
+                    'metadata.exif_anomalies': item_anomalies,
+                    'metadata.metadata_suspicion_score': float(score),
+                    'metadata.metadata_rules_version': metadata_rules.version,
+                    'metadata.backfill': backfill
+                })
+            update = {prefix + name: value for name, value in fields.items()}
+            if item['source'] == 'file' and prefix:
+                update['exif_data'] = item['exif_data']  # Only app API documents store exif_data
+            operations.append(UpdateOne({'_id': item['doc']['_id']}, {'$set': update}))
+            counters['from_' + item['source']] += 1
+        return operations
+    
+    def run(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Process documents from the checkpoint on; returns the counters"""
+        counters = self.checkpoint.counters
+        read_this_run = 0
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not self.checkpoint.done:
+                phase = self.checkpoint.phase
+                for docs in self._batches(phase, self.checkpoint.last_id):
+                    self.throttle.acquire(len(docs))
+                    counters['read'] += len(docs)
+                    read_this_run += len(docs)
+                    
+                    todo = []
+                    for doc in docs:
+                        if not self.force and self._current(document_view(doc)):
+                            counters['skipped'] += 1
+                        else:
+                            todo.append(doc)
+                    items = list(pool.map(self._prepare, todo))
+                    counters['missing_files'] += sum(1 for item in items if item.get('missing_file'))
+                    self._infer(items)
+                    operations = self._updates(items)
+                    
+                    if operations and not self.dry_run:
+                        self.throttle.acquire(len(operations))
+                        result = self.collection.bulk_write(operations, ordered=False)
+                        counters['updated'] += result.modified_count
+                    self.checkpoint.advance(phase, docs[-1]['_id'], persist=not self.dry_run)
+                    logger.info(f"Backfill {ID_PHASES[phase]} ids up to {docs[-1]['_id']}: {counters}")
+                    
+                    if limit is not None and read_this_run >= limit:
+                        return self._report(started)
+                self.checkpoint.advance(phase + 1, None, persist=not self.dry_run)
+        return self._report(started)
+    
+    def _report(self, started: float) -> Dict[str, Any]:
+        return {
+            **self.checkpoint.counters,
+            'done': self.checkpoint.done,
+            'elapsed_seconds': time.time() - started,
+            'throttled_seconds': self.throttle.waited,
+            'rules_version': metadata_rules.version,
+            'model_version': model_manager.model_version
+        }
@@ -0,0 +1,109 @@
+"""
+Error Level Analysis (ELA)
+
+The analysis decode is re-encoded as JPEG in memory (cv2.imencode, no temp
+files) and compared with itself: regions whose compression history differs
+from the rest of the image (pasted or retouched areas) re-compress with a
+different error level. Only meaningful for JPEG sources.
+
+ELA works on the luma of the shared analysis decode and never decodes the
+file again. Its cost is bounded by ELA_MAX_PIXELS: larger images are cut
+into an evenly spread mosaic of 8-pixel aligned windows, which keep the
+JPEG block grid and full detail of the decode they come from. The decode is
+only full resolution when it was not DCT-reduced; a reduced decode averages
+each 8x8 block and washes out the differences ELA looks for, so callers
+report the reduction next to the features. BGR images are still accepted
+(max error over channels).
+"""
+import time
+from typing import Any, Dict, Optional, Tuple
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+ELA_BLOCK = 32  # Block size for regional error statistics
+HEATMAP_SIZE = 64  # Longest side of the optional heatmap
+OUTLIER_MADS = 3.0
+ELA_WINDOW = 256  # Window edge when the image exceeds the pixel budget
+
+
+def ela_windows(image: np.ndarray, max_pixels: int) -> Tuple[np.ndarray, int]:
+    """Mosaic of evenly spread windows holding at most max_pixels, plus the window count
+    
+    Images within the budget are returned unchanged with a count of 0.
+    """
+    height, width = image.shape[:2]
+    if height * width <= max_pixels:
+        return image, 0
+    edge = ELA_WINDOW
+    if min(height, width) < edge:
+        # Thin strip: keep the short side and crop the long one to the budget
+        if height < width:
+            return image[:, :max(8, max_pixels // height // 8 * 8)], 1
+        return image[:max(8, max_pixels // width // 8 * 8)], 1
+    count = max(1, max_pixels // (edge * edge))
+    rows = min(height // edge, max(1, round(np.sqrt(count * height / width))))
+    cols = min(width // edge, max(1, count // rows))
+    tops = np.linspace(0, height - edge, rows).astype(int) // 8 * 8
+    lefts = np.linspace(0, width - edge, cols).astype(int) // 8 * 8
+    mosaic = np.vstack([
+        np.hstack([image[top:top + edge, left:left + edge] for left in lefts])
+        for top in tops
+    ])
+    return mosaic, rows * cols
+
+
+def error_level_analysis(image: np.ndarray, quality: Optional[int] = None,
+                         heatmap: bool = False,
+                         max_pixels: Optional[int] = None) -> Tuple[Dict[str, Any], float]:
+    """ELA features (and heatmap) for a luma or BGR image, plus the seconds it took
+    
+    Images above max_pixels (default ELA_MAX_PIXELS) are analysed on windows;
+    'windows' reports how many, and the heatmap is only produced for whole images.
+    """
+    started = time.perf_counter()
+    quality = settings.ELA_QUALITY if quality is None else quality
+    max_pixels = settings.ELA_MAX_PIXELS if max_pixels is None else max_pixels
+    image, windows = ela_windows(image, max_pixels)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG re-encoding failed")
+    error = cv2.absdiff(image, cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED))
+    if error.ndim == 3:
+        blue, green, red = cv2.split(error)
+        error = cv2.max(cv2.max(blue, green), red)  # Per-pixel max over channels
+    
+    # Errors are uint8, so global statistics come from one 256-bin histogram
+    histogram = np.bincount(error.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    total = histogram.sum()
+    mean = float(histogram @ levels / total)
+    
+    # Block means via area resampling (exact for whole blocks)
+    rows, cols = error.shape[0] // ELA_BLOCK, error.shape[1] // ELA_BLOCK
+    if rows and cols:
+        block_error = cv2.resize(error[:rows * ELA_BLOCK, :cols * ELA_BLOCK].astype(np.float32),
+                                 (cols, rows), interpolation=cv2.INTER_AREA)
+        median = float(np.median(block_error))
+        mad = float(np.median(np.abs(block_error - median))) or 1e-6
+        outliers = float((block_error > median + OUTLIER_MADS * mad).mean())
+        block_cv = float(block_error.std() / block_error.mean()) if block_error.mean() > 0 else 0.0
+    else:
+        outliers, block_cv = 0.0, 0.0
+    
+    features: Dict[str, Any] = {
+        'quality': quality,
+        'ela_mean': mean,
+        'ela_std': float(np.sqrt(histogram @ (levels - mean) ** 2 / total)),
+        'ela_p99': int(np.searchsorted(np.cumsum(histogram), 0.99 * total)),
+        'ela_max': int(np.flatnonzero(histogram)[-1]),
+        'ela_block_cv': block_cv,
+        'ela_outlier_block_fraction': outliers,
+        'windows': windows
+    }
+    if heatmap and not windows:
+        scale = HEATMAP_SIZE / max(error.shape)
+        size = (max(1, round(error.shape[1] * scale)), max(1, round(error.shape[0] * scale)))
+        features['heatmap'] = cv2.resize(error, size, interpolation=cv2.INTER_AREA).tolist()
+    return features, time.perf_counter() - started
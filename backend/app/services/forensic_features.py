@@ -0,0 +1,136 @@
+"""
+Frequency-domain and residual forensic features
+
+All features are computed with whole-array NumPy/OpenCV operations on the
+image already decoded for quality analysis:
+- spectrum: azimuthally averaged FFT power spectrum of the downscaled
+  grayscale, its log-log slope, high-frequency energy and the strongest
+  high-frequency peak above the fitted slope (upsampling artifacts)
+- blockiness: JPEG 8x8 grid discontinuity on the (DCT-reduced) decode
+- noise residual: statistics of grayscale minus its 3x3 median
+- color correlation: correlation of per-channel high-pass residuals
+"""
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+import cv2
+import numpy as np
+
+SPECTRUM_BINS = 32
+JPEG_BLOCK = 8
+NOISE_BLOCK = 16  # Block size for residual variance uniformity
+
+
+@lru_cache(maxsize=8)
+def _radial_bins(height: int, width: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Radial bin of every FFT coefficient (fftshifted), bin counts and a 2D Hann window"""
+    fy = np.fft.fftshift(np.fft.fftfreq(height))[:, None]
+    fx = np.fft.fftshift(np.fft.fftfreq(width))[None, :]
+    radius = np.sqrt(fx ** 2 + fy ** 2) / 0.5  # 1.0 at Nyquist along an axis
+    index = np.minimum((radius * SPECTRUM_BINS).astype(np.int64), SPECTRUM_BINS).ravel()
+    counts = np.bincount(index, minlength=SPECTRUM_BINS + 1)[:SPECTRUM_BINS]
+    window = np.outer(np.hanning(height), np.hanning(width)).astype(np.float32)
+    return index, counts, window
+
+
+def spectrum_features(gray: np.ndarray) -> Dict[str, Any]:
+    index, counts, window = _radial_bins(*gray.shape)
+    centered = gray.astype(np.float32) - gray.mean()
+    power = np.abs(np.fft.fftshift(np.fft.fft2(centered * window))) ** 2
+    # Coefficients beyond Nyquist (corners) fall in the overflow bin and are dropped
+    radial = np.bincount(index, weights=power.ravel(), minlength=SPECTRUM_BINS + 1)[:SPECTRUM_BINS]
+    radial = radial / np.maximum(counts, 1)
+    log_power = np.log10(radial + 1e-12)
+    
+    frequencies = np.log10((np.arange(1, SPECTRUM_BINS) + 0.5) / SPECTRUM_BINS)
+    slope, intercept = np.polyfit(frequencies, log_power[1:], 1)
+    excess = log_power[1:] - (slope * frequencies + intercept)
+    high = SPECTRUM_BINS // 2
+    return {
+        'azimuthal_spectrum': np.round(log_power - log_power[1:].max(), 4).tolist(),
+        'spectral_slope': float(slope),
+        'high_freq_energy_ratio': float(radial[high:].sum() / max(radial[1:].sum(), 1e-12)),
+        'spectral_peak_score': float(excess[high - 1:].max())
+    }
+
+
+def blockiness(gray: np.ndarray, period: int) -> Optional[float]:
+    """Mean gradient across block boundaries over mean gradient elsewhere (1.0 = no grid)"""
+    if period < 2 or min(gray.shape) < 2 * period:
+        return None
+    values = gray.astype(np.float32)
+    ratios = []
+    for axis in (0, 1):
+        gradient = np.abs(np.diff(values, axis=axis)).mean(axis=1 - axis)
+        boundary = (np.arange(1, len(gradient) + 1) % period) == 0
+        inside = gradient[~boundary].mean()
+        ratios.append(gradient[boundary].mean() / inside if inside > 0 else 1.0)
+    return float(np.mean(ratios))
+
+
+def noise_residual_features(gray: np.ndarray) -> Dict[str, float]:
+    residual = gray.astype(np.float32) - cv2.medianBlur(gray, 3).astype(np.float32)
+    std = float(residual.std())
+    centered = residual - residual.mean()
+    skewness = float((centered ** 3).mean() / std ** 3) if std > 0 else 0.0
+    kurtosis = float((centered ** 4).mean() / std ** 4 - 3.0) if std > 0 else 0.0
+    
+    rows = gray.shape[0] // NOISE_BLOCK * NOISE_BLOCK
+    cols = gray.shape[1] // NOISE_BLOCK * NOISE_BLOCK
+    block_variance = residual[:rows, :cols].reshape(
+        rows // NOISE_BLOCK, NOISE_BLOCK, cols // NOISE_BLOCK, NOISE_BLOCK
+    ).var(axis=(1, 3))
+    mean_variance = block_variance.mean() if block_variance.size else 0.0
+    return {
+        'residual_std': std,
+        'residual_skewness': skewness,
+        'residual_kurtosis': kurtosis,
+        # Spread of local noise levels; spliced or generated regions tend to differ
+        'residual_variance_cv': float(block_variance.std() / mean_variance) if mean_variance > 0 else 0.0
+    }
+
+
+def color_correlation_features(image: np.ndarray) -> Dict[str, float]:
+    channels = image.astype(np.float32)
+    residual = (channels - cv2.blur(channels, (3, 3))).reshape(-1, 3).T  # B, G, R rows
+    if residual.std(axis=1).min() == 0:
+        return {'residual_corr_rg': 1.0, 'residual_corr_rb': 1.0, 'residual_corr_gb': 1.0, 'residual_corr_mean': 1.0}
+    corr = np.corrcoef(residual)
+    values = {
+        'residual_corr_rg': float(corr[2, 1]),
+        'residual_corr_rb': float(corr[2, 0]),
+        'residual_corr_gb': float(corr[1, 0])
+    }
+    values['residual_corr_mean'] = float(np.mean(list(values.values())))
+    return values
+
+
+def extract_forensic_features(image: np.ndarray, gray: np.ndarray,
+                              decoded_gray: np.ndarray, reduction: int) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Features and per-feature timings (seconds)
+    image/gray are the downscaled BGR and grayscale analysis images;
+    decoded_gray is the grayscale decode before downscaling, whose JPEG grid
+    period is 8 / reduction when it was decoded at a reduced DCT scale.
+    """
+    features: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    
+    started = time.perf_counter()
+    features.update(spectrum_features(gray))
+    timings['spectrum'] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    features['jpeg_blockiness'] = blockiness(decoded_gray, JPEG_BLOCK // reduction)
+    timings['blockiness'] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    features.update(noise_residual_features(gray))
+    timings['noise_residual'] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    features.update(color_correlation_features(image))
+    timings['color_correlation'] = time.perf_counter() - started
+    
+    timings['total'] = sum(timings.values())
+    return features, timings
@@ -5,24 +5,72 @@ import os
 import logging
 import hashlib
 import time
-from typing import Dict, Any, Optional
-from PIL import Image, ExifTags
-from PIL.ExifTags import TAGS
+from typing import BinaryIO, Callable, Dict, Any, Optional, Tuple, Union
+from PIL import Image
 import torch
 import cv2
 import numpy as np
 
 from app.core.config import settings
 from ml.model import model_manager, ImagePreprocessor
-from app.models.analysis import ImageAnalysisResult
+from ml.shadow import shadow_evaluator
+from app.services.forensic_features import extract_forensic_features
+from app.services.ela import error_level_analysis
+from app.services.metadata_reader import read_image_metadata, open_image_header
+from app.services.metadata_rules import metadata_rules
+from app.services.tiled_analysis import TiledAnalyzer, MemoryCeilingError, needs_tiling
+from app.models.analysis import ImageAnalysisResult, ImageMetadata
 
 logger = logging.getLogger(__name__)
 
+# A file path, or a seekable in-memory/spooled buffer (e.g. UploadFile.file)
+ImageSource = Union[str, BinaryIO]
+
+def _rewound(source: ImageSource) -> ImageSource:
+    """Paths are reopened by every stage; buffers are shared, so rewind them first"""
+    if not isinstance(source, str):
+        source.seek(0)
+    return source
+
 class ImageAnalysisService:
     def __init__(self):
         self.preprocessor = ImagePreprocessor()
+        self.tiled_analyzer = TiledAnalyzer(self.preprocessor)
         # Load model on initialization
         model_manager.load_model()
+        if settings.INFERENCE_CASCADE:
+            model_manager.enable_cascade()
+        if settings.INFERENCE_PRECISION != "fp32" or settings.INFERENCE_CHANNELS_LAST:
+            model_manager.configure_precision(
+                settings.INFERENCE_PRECISION,
+                settings.INFERENCE_CHANNELS_LAST,
+                parity_loader=self._parity_loader()
+            )
+        if settings.MODEL_REGISTRY_POLL_SECONDS > 0:
+            # Follow activations made by other workers, pods or the registry CLI
+            model_manager.watch_registry(settings.MODEL_REGISTRY_POLL_SECONDS)
+        if settings.SHADOW_MODEL_VERSION:
+            try:
+                shadow_evaluator.start(
+                    settings.SHADOW_MODEL_VERSION,
+                    sample_rate=settings.SHADOW_SAMPLE_RATE,
+                    canary_percent=settings.SHADOW_CANARY_PERCENT,
+                    workers=settings.SHADOW_WORKERS,
+                    max_pending=settings.SHADOW_MAX_PENDING
+                )
+            except Exception as e:
+                logger.error(f"Shadow evaluation of {settings.SHADOW_MODEL_VERSION} not started: {e}")
+    
+    def _parity_loader(self):
+        """Test split used to check a reduced-precision mode against fp32"""
+        if not settings.INFERENCE_PARITY_DATASET:
+            return None
+        from torch.utils.data import DataLoader
+        from ml.train import Trainer
+        
+        trainer = Trainer(os.path.join(settings.DATASET_PATH, settings.INFERENCE_PARITY_DATASET))
+        dataset = trainer._make_dataset('test', self.preprocessor.get_val_transform())
+        return DataLoader(dataset, batch_size=settings.BATCH_SIZE, shuffle=False)
     
     def get_file_hash(self, file_path: str) -> str:
         """Generate SHA256 hash of file"""
@@ -32,97 +80,62 @@ class ImageAnalysisService:
                 hash_sha256.update(chunk)
         return hash_sha256.hexdigest()
     
-    def extract_exif_data(self, image_path: str) -> Dict[str, Any]:
-        """Extract EXIF metadata from image"""
-        exif_data = {}
-        
+    def read_metadata(self, image_path: ImageSource) -> ImageMetadata:
+        """Header-only EXIF/XMP/IPTC/C2PA/PNG text metadata (pixels are not decoded)"""
         try:
-            with Image.open(image_path) as image:
-                # Get EXIF data
-                exif = image.getexif()
-                
-                if exif is not None:
-                    for tag_id, value in exif.items():
-                        tag = TAGS.get(tag_id, tag_id)
-                        
-                        # Convert bytes to string if needed
-                        if isinstance(value, bytes):
-                            try:
-                                value = value.decode('utf-8')
-                            except UnicodeDecodeError:
-                                value = str(value)
-                        
-                        exif_data[tag] = value
-                
-                # Additional image info
-                exif_data.update({
-                    'format': image.format,
-                    'mode': image.mode,
-                    'size': image.size,
-                    'has_transparency': image.mode in ('RGBA', 'LA') or 'transparency' in image.info
-                })
-                
+            return read_image_metadata(image_path)
         except Exception as e:
-            logger.error(f"Error extracting EXIF data: {e}")
-        
-        return exif_data
+            logger.error(f"Error reading image metadata: {e}")
+            return ImageMetadata()
     
-    def detect_metadata_anomalies(self, exif_data: Dict[str, Any]) -> Dict[str, Any]:
+    def extract_exif_data(self, image_path: str) -> Dict[str, Any]:
+        """Extract EXIF metadata from image"""
+        return self.read_metadata(image_path).as_exif_dict()
+    
+    def detect_metadata_anomalies(self, metadata: ImageMetadata) -> Dict[str, Any]:
         """Detect suspicious metadata patterns"""
-        anomalies = {
-            'missing_camera_info': False,
-            'suspicious_software': False,
-            'missing_timestamp': False,
-            'unusual_dimensions': False,
-            'missing_exif': False
-        }
-        
-        # Check for missing EXIF data
-        if not exif_data or len(exif_data) < 5:
-            anomalies['missing_exif'] = True
-        
-        # Check for missing camera information
-        camera_tags = ['Make', 'Model', 'LensModel']
-        if not any(tag in exif_data for tag in camera_tags):
-            anomalies['missing_camera_info'] = True
-        
-        # Check for suspicious software signatures
-        software = exif_data.get('Software', '').lower()
-        suspicious_software = ['photoshop', 'gimp', 'midjourney', 'dalle', 'stable diffusion']
-        if any(sus in software for sus in suspicious_software):
-            anomalies['suspicious_software'] = True
-        
-        # Check for missing timestamp
-        timestamp_tags = ['DateTime', 'DateTimeOriginal', 'DateTimeDigitized']
-        if not any(tag in exif_data for tag in timestamp_tags):
-            anomalies['missing_timestamp'] = True
-        
-        # Check for unusual dimensions (common AI generation sizes)
-        size = exif_data.get('size', (0, 0))
-        ai_common_sizes = [(512, 512), (1024, 1024), (768, 768), (256, 256)]
-        if size in ai_common_sizes:
-            anomalies['unusual_dimensions'] = True
+        return metadata_rules.detect(metadata.as_exif_dict())
+    
+    def load_analysis_image(self, image_path: ImageSource) -> Tuple[Optional[np.ndarray], int]:
+        """Decode once for quality and forensic analysis: (BGR image or None, DCT reduction)
         
-        return anomalies
+        JPEGs are decoded directly at 1/2 or 1/4 scale when still >= 512 px.
+        Stopping at 1/4 keeps the 8x8 JPEG grid visible (period 2) for the
+        blockiness feature.
+        """
+        with open_image_header(_rewound(image_path)) as probe:
+            longest = max(probe.size)
+        reduction, flags = 1, cv2.IMREAD_COLOR
+        for factor, reduced_flags in ((4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if longest // factor >= 512:
+                reduction, flags = factor, reduced_flags
+                break
+        if isinstance(image_path, str):
+            return cv2.imread(image_path, flags), reduction
+        return cv2.imdecode(np.frombuffer(_rewound(image_path).read(), dtype=np.uint8), flags), reduction
+    
+    def downscale_for_analysis(self, img: np.ndarray) -> np.ndarray:
+        """Resize image to max 512x512 for faster processing"""
+        height, width = img.shape[:2]
+        if max(height, width) > 512:
+            scale = 512 / max(height, width)
+            new_width = int(width * scale)
+            new_height = int(height * scale)
+            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        return img
     
-    def analyze_image_quality(self, image_path: str) -> Dict[str, float]:
-        """Analyze image quality metrics - OPTIMIZED for speed"""
+    def analyze_image_quality(self, image_path: ImageSource, gray: np.ndarray = None) -> Dict[str, float]:
+        """Analyze image quality metrics - OPTIMIZED for speed
+        
+        gray is the shared downscaled grayscale; without it the image is decoded here.
+        """
         try:
-            # Load image with OpenCV at reduced resolution for speed
-            img = cv2.imread(image_path)
-            if img is None:
-                return {}
-            
-            # Resize image to max 512x512 for faster processing
-            height, width = img.shape[:2]
-            if max(height, width) > 512:
-                scale = 512 / max(height, width)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            
-            # Convert to grayscale
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            if gray is None:
+                # Load image with OpenCV at reduced resolution for speed
+                img, _ = self.load_analysis_image(image_path)
+                if img is None:
+                    return {}
+                gray = cv2.cvtColor(self.downscale_for_analysis(img), cv2.COLOR_BGR2GRAY)
             
             # Calculate essential metrics only (reduced computation)
             metrics = {}
@@ -144,10 +157,10 @@ class ImageAnalysisService:
             logger.error(f"Error analyzing image quality: {e}")
             return {}
     
-    def preprocess_image_for_model(self, image_path: str) -> torch.Tensor:
+    def preprocess_image_for_model(self, image_path: ImageSource) -> torch.Tensor:
         """Preprocess image for model inference"""
         try:
-            image = Image.open(image_path).convert('RGB')
+            image = Image.open(_rewound(image_path)).convert('RGB')
             transform = self.preprocessor.get_val_transform()
             tensor = transform(image)
             return tensor
@@ -155,45 +168,127 @@ class ImageAnalysisService:
             logger.error(f"Error preprocessing image: {e}")
             raise
     
-    def analyze_image(self, image_path: str, filename: str) -> ImageAnalysisResult:
-        """Complete image analysis pipeline - OPTIMIZED for speed"""
+    def analyze_image(self, image_path: ImageSource, filename: str, user_id: Optional[str] = None,
+                      tta_budget_ms: Optional[float] = None,
+                      progress: Optional[Callable[[str, float], None]] = None) -> ImageAnalysisResult:
+        """Complete image analysis pipeline - OPTIMIZED for speed
+        
+        user_id places the request in a canary bucket when a canary is running.
+        tta_budget_ms switches to batched test-time augmentation with as many
+        views as fit the budget (premium analysis). Images of at least
+        TILED_ANALYSIS_MIN_PIXELS are analyzed tile by tile under the memory
+        ceiling instead. image_path may also be a seekable buffer, so uploads
+        can be analyzed without being written to storage first. progress is
+        called with (stage, seconds) at each performance_breakdown timing point.
+        """
         start_time = time.time()
         
+        def report(stage: str, seconds: float):
+            if progress is not None:
+                try:
+                    progress(stage, seconds)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed at {stage}: {e}")
+        
         try:
             logger.info(f"🚀 Starting FAST analysis: {filename}")
             
-            # Step 1: Quick EXIF extraction (usually fast)
+            # Step 1: Header-only metadata extraction (no pixel decode)
             exif_start = time.time()
-            exif_data = self.extract_exif_data(image_path)
+            image_metadata = self.read_metadata(image_path)
             exif_time = time.time() - exif_start
             logger.info(f"   EXIF extraction: {exif_time:.3f}s")
+            report('exif', exif_time)
             
             # Step 2: Quick metadata anomaly detection
             metadata_start = time.time()
-            metadata_anomalies = self.detect_metadata_anomalies(exif_data)
+            metadata_anomalies = self.detect_metadata_anomalies(image_metadata)
             metadata_time = time.time() - metadata_start
             logger.info(f"   Metadata analysis: {metadata_time:.3f}s")
+            report('metadata', metadata_time)
             
-            # Step 3: Optimized quality analysis
+            # Step 3: Optimized quality analysis (tiles also get their predictions here)
             quality_start = time.time()
-            quality_metrics = self.analyze_image_quality(image_path)
+            tiled_result = None
+            decoded = None
+            if needs_tiling(image_metadata.size):
+                tiled_result = self.tiled_analyzer.analyze(_rewound(image_path))
+                quality_metrics = tiled_result['quality_metrics']
+            else:
+                # One decode and one downscaled grayscale shared with the forensic features
+                decoded, reduction = self.load_analysis_image(image_path)
+                if decoded is not None:
+                    small = self.downscale_for_analysis(decoded)
+                    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+                    quality_metrics = self.analyze_image_quality(image_path, gray=gray)
+                else:
+                    quality_metrics = {}
             quality_time = time.time() - quality_start
             logger.info(f"   Quality analysis: {quality_time:.3f}s")
+            report('quality', quality_time)
+            
+            # Step 3b: Forensic features (vectorized, on the shared decode)
+            forensic_features, forensic_times = None, {}
+            if decoded is not None:
+                try:
+                    forensic_features, forensic_times = extract_forensic_features(
+                        small, gray,
+                        cv2.cvtColor(decoded, cv2.COLOR_BGR2GRAY) if small is not decoded else gray,
+                        reduction
+                    )
+                except Exception as e:
+                    logger.error(f"Error extracting forensic features: {e}")
+            logger.info(f"   Forensic features: {forensic_times.get('total', 0.0):.3f}s")
+            report('forensic', forensic_times.get('total', 0.0))
+            
+            # Step 3c: Error Level Analysis (JPEG sources only, luma of the shared decode, windowed to ELA_MAX_PIXELS)
+            ela, ela_time = None, 0.0
+            if decoded is not None:
+                if image_metadata.format != 'JPEG':
+                    ela = {'skipped': 'non_jpeg_source'}
+                else:
+                    ela_start = time.time()
+                    try:
+                        # No second decode: a DCT-reduced decode is reported so scores can be weighed
+                        luma = cv2.cvtColor(decoded, cv2.COLOR_BGR2GRAY)
+                        ela, _ = error_level_analysis(luma, quality=settings.ELA_QUALITY, heatmap=settings.ELA_HEATMAP)
+                        ela['decode_reduction'] = reduction
+                        del luma
+                    except Exception as e:
+                        logger.error(f"Error in error level analysis: {e}")
+                    ela_time = time.time() - ela_start
+                del decoded  # Release the full decode before inference
+            logger.info(f"   Error level analysis: {ela_time:.3f}s")
+            report('ela', ela_time)
             
             # Step 4: Fast image preprocessing
             preprocess_start = time.time()
-            image_tensor = self.preprocess_image_for_model(image_path)
+            if tiled_result is not None:
+                pass  # Tiles were preprocessed in batches in step 3
+            elif tta_budget_ms:
+                image = Image.open(_rewound(image_path)).convert('RGB')  # Views are cut at inference
+            else:
+                image_tensor = self.preprocess_image_for_model(image_path)
             preprocess_time = time.time() - preprocess_start
             logger.info(f"   Image preprocessing: {preprocess_time:.3f}s")
+            report('preprocess', preprocess_time)
             
-            # Step 5: ML model inference (usually the slowest part)
+            # Step 5: Quick metadata scoring (lets the cascade escalate on disagreement)
+            metadata_score = self._calculate_metadata_suspicion_score(metadata_anomalies, quality_metrics)
+            
+            # Step 6: ML model inference (usually the slowest part)
             ml_start = time.time()
-            prediction_result = model_manager.predict_image(image_tensor)
+            if tiled_result is not None:
+                prediction_result = tiled_result
+            elif tta_budget_ms:
+                prediction_result = model_manager.predict_tta(image, tta_budget_ms)
+            else:
+                prediction_result = shadow_evaluator.predict_image(
+                    image_tensor, user_id=user_id, metadata_suspicion=metadata_score
+                )
             ml_time = time.time() - ml_start
             logger.info(f"   ML inference: {ml_time:.3f}s")
-            
-            # Step 6: Quick metadata scoring
-            metadata_score = self._calculate_metadata_suspicion_score(metadata_anomalies, quality_metrics)
+            report('inference', ml_time)
             
             # Step 7: Adjust confidence (fast)
             adjusted_confidence = self._adjust_confidence_with_metadata(
@@ -204,16 +299,29 @@ class ImageAnalysisService:
             # Calculate total processing time
             processing_time = time.time() - start_time
             
+            metadata = {}
+            if 'cascade' in prediction_result:
+                metadata['cascade'] = prediction_result['cascade']
+            if prediction_result.get('served_by') == 'candidate':
+                metadata['canary'] = True
+            if 'tta' in prediction_result:
+                metadata['tta'] = prediction_result['tta']
+            if 'tiling' in prediction_result:
+                metadata['tiling'] = prediction_result['tiling']
+            if image_metadata.c2pa.present:
+                metadata['c2pa'] = image_metadata.c2pa.dict()
+            
             # Create result
             result = ImageAnalysisResult(
                 prediction=prediction_result['prediction'],
                 confidence_score=adjusted_confidence,
-                model_version="2.1.0-optimized",
+                model_version=prediction_result.get('model_version', model_manager.model_version),
                 processing_time=processing_time,
                 metadata={
                     'exif_anomalies': metadata_anomalies,
                     'quality_metrics': quality_metrics,
                     'metadata_suspicion_score': metadata_score,
+                    'metadata_rules_version': metadata_rules.version,
                     'ml_probabilities': prediction_result.get('probabilities', {}),
                     'original_confidence': prediction_result['confidence'],
                     'performance_breakdown': {
@@ -222,8 +330,14 @@ class ImageAnalysisService:
                         'quality_time': quality_time,
                         'preprocess_time': preprocess_time,
                         'ml_time': ml_time,
+                        'forensic_time': forensic_times.get('total', 0.0),
+                        'ela_time': ela_time,
                         'total_time': processing_time
-                    }
+                    },
+                    'forensic_features': forensic_features,
+                    'forensic_breakdown': forensic_times,
+                    'ela': ela,
+                    **metadata
                 }
             )
             
@@ -237,43 +351,18 @@ class ImageAnalysisService:
             return ImageAnalysisResult(
                 prediction="error",
                 confidence_score=0.0,
-                model_version="2.1.0-optimized",
+                model_version=model_manager.model_version,
                 processing_time=processing_time,
-                metadata={'error': str(e)}
+                metadata={
+                    'error': str(e),
+                    **({'limit': e.to_dict()} if isinstance(e, MemoryCeilingError) else {})
+                }
             )
     
     def _calculate_metadata_suspicion_score(self, anomalies: Dict[str, bool], 
                                           quality_metrics: Dict[str, float]) -> float:
         """Calculate suspicion score based on metadata analysis"""
-        score = 0.0
-        
-        # Anomaly weights
-        anomaly_weights = {
-            'missing_exif': 0.3,
-            'missing_camera_info': 0.2,
-            'suspicious_software': 0.4,
-            'missing_timestamp': 0.1,
-            'unusual_dimensions': 0.2
-        }
-        
-        # Add anomaly scores
-        for anomaly, present in anomalies.items():
-            if present:
-                score += anomaly_weights.get(anomaly, 0.1)
-        
-        # Quality metric analysis
-        if quality_metrics:
-            # Very high sharpness might indicate AI generation
-            sharpness = quality_metrics.get('sharpness', 0)
-            if sharpness > 1000:  # Threshold for unusually sharp images
-                score += 0.1
-            
-            # Very low noise might indicate AI generation
-            noise = quality_metrics.get('noise_level', 50)
-            if noise < 10:  # Threshold for unusually clean images
-                score += 0.1
-        
-        return min(score, 1.0)  # Cap at 1.0
+        return metadata_rules.score(anomalies, quality_metrics)
     
     def _adjust_confidence_with_metadata(self, ml_confidence: float, 
                                        metadata_score: float) -> float:
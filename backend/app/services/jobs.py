@@ -0,0 +1,174 @@
+"""
+Background analysis jobs with stage-level progress events
+
+Long analyses (big PDFs, archive ingestion, premium image analyses) run as
+jobs that are detached from the request that started them: the work is an
+asyncio task owned by the JobManager, so a client that disconnects from the
+event stream (or never connects) does not cancel it. Blocking stages run in
+the manager's thread pool and report progress from there.
+
+Every job keeps its ordered event log until JOB_RETENTION_SECONDS after it
+finished. Subscribers get the events after a given id and then new ones as
+they are emitted, which lets a reconnecting EventSource resume from its
+Last-Event-ID. A job ends with exactly one 'completed' or 'failed' event.
+"""
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.errors import ServiceError
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STAGES = ('completed', 'failed')
+
+
+class Job:
+    """Event log and outcome of one background job"""
+    
+    def __init__(self, kind: str, owner: Optional[str] = None):
+        self.id = uuid.uuid4().hex  # Unguessable: EventSource cannot send an Authorization header
+        self.kind = kind
+        self.owner = owner
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.status = 'running'
+        self.result: Any = None
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._subscribers: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+    
+    def emit(self, stage: str, **data: Any) -> Dict[str, Any]:
+        """Append an event; safe to call from worker threads"""
+        with self._lock:
+            event = {
+                'id': len(self.events) + 1,
+                'stage': stage,
+                'elapsed': round(time.time() - self.created_at, 4),
+                **data
+            }
+            self.events.append(event)
+            subscribers = list(self._subscribers)
+        for loop, wake in subscribers:
+            loop.call_soon_threadsafe(wake.set)
+        return event
+    
+    def complete(self, result: Any):
+        self.result = result
+        self.status = 'completed'
+        self.finished_at = time.time()
+        self.emit('completed', result=result)
+    
+    def fail(self, error: str, **details: Any):
+        self.status = 'failed'
+        self.finished_at = time.time()
+        self.emit('failed', error=error, **details)
+    
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STAGES
+    
+    async def subscribe(self, after: int = 0, keepalive: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Events with id > after, then live ones until the job ends; None marks a keepalive"""
+        wake = asyncio.Event()
+        subscriber = (asyncio.get_running_loop(), wake)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            position = max(after, 0)
+            while True:
+                wake.clear()
+                with self._lock:
+                    pending = self.events[position:]
+                position += len(pending)
+                for event in pending:
+                    yield event
+                if pending and pending[-1]['stage'] in TERMINAL_STAGES:
+                    return
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.events[-1]['stage'] if self.events else None,
+            'events': len(self.events),
+            'result': self.result
+        }
+
+
+def sse_message(event: Optional[Dict[str, Any]]) -> str:
+    """Server-sent events wire format (a comment line for keepalives)"""
+    if event is None:
+        return ": keepalive\n\n"
+    return f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+class JobManager:
+    """Runs jobs detached from requests and keeps recent ones for subscribers"""
+    
+    def __init__(self, workers: int, retention_seconds: float):
+        self.retention_seconds = retention_seconds
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: Set[asyncio.Task] = set()
+    
+    def submit(self, kind: str, work: Callable[[Job], Awaitable[Any]], owner: Optional[str] = None) -> Job:
+        """Start work(job) in the background; its return value completes the job"""
+        self._prune()
+        job = Job(kind, owner)
+        self.jobs[job.id] = job
+        task = asyncio.get_running_loop().create_task(self._run(job, work))
+        # Held here, not by the request: disconnecting clients cannot cancel it
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+    
+    async def _run(self, job: Job, work: Callable[[Job], Awaitable[Any]]):
+        try:
+            job.complete(await work(job))
+        except asyncio.CancelledError:
+            job.fail('Job cancelled')
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.fail(str(e), **({'limit': e.to_dict()} if isinstance(e, ServiceError) else {}))
+    
+    async def run_blocking(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking stage in the job thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+    
+    def _prune(self):
+        expired = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done and job.finished_at < expired]:
+            del self.jobs[job_id]
+    
+    async def wait(self):
+        """Wait for the running jobs (tests, graceful shutdown)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+    
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await self.wait()
+        self.executor.shutdown(wait=False)
+
+
+job_manager = JobManager(settings.JOB_WORKERS, settings.JOB_RETENTION_SECONDS)
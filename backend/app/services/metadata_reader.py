@@ -0,0 +1,392 @@
+"""
+Header-only image metadata reader
+
+JPEG files are read marker by marker up to the start of scan (SOS) and PNG
+files chunk by chunk (skipping IDAT payloads with seek), so no pixel data is
+read or decoded. Extracted:
+- EXIF (APP1 / eXIf): IFD0, Exif and GPS IFDs with PIL tag names
+- XMP (APP1 / iTXt XML:com.adobe.xmp): simple properties such as
+  xmp:CreatorTool and Iptc4xmpExt:DigitalSourceType
+- IPTC-IIM (APP13 Photoshop 8BIM resource 0x0404)
+- C2PA / JUMBF provenance (APP11 / caBX): manifest labels, claim generator
+  and whether an assertion declares trainedAlgorithmicMedia
+- PNG text chunks, including Stable Diffusion "parameters" and ComfyUI
+  "prompt" generation settings; compressed chunks are inflated only up to
+  MAX_TEXT_BYTES
+
+A malformed segment or chunk is skipped with a warning; fields read from
+the others are kept.
+
+Other formats fall back to a lazy PIL open (header parse only). Header opens
+skip Pillow's decompression bomb check: it rejects large scans on their
+dimensions alone, while analysis bounds the actual decode itself.
+"""
+import io
+import re
+import codecs
+import zlib
+import struct
+import logging
+from contextlib import nullcontext
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+from PIL import Image
+from PIL.ExifTags import TAGS, GPSTAGS
+
+from app.models.analysis import C2PAManifest, ImageMetadata
+
+logger = logging.getLogger(__name__)
+
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01}
+JPEG_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+PHOTOSHOP_HEADER = b"Photoshop 3.0\x00"
+GENERATION_KEYS = ("parameters", "prompt", "invokeai_metadata", "sd-metadata", "Dream", "workflow")
+MAX_TEXT_CHARS = 4096  # Stored length of each PNG text chunk
+MAX_GENERATION_CHARS = 64 * 1024  # Stored length of the generation settings (ComfyUI workflows are long)
+MAX_TEXT_BYTES = 1024 * 1024  # Inflated size cap of a zTXt/iTXt chunk, as PIL's MAX_TEXT_CHUNK
+MAX_BINARY_TAG_BYTES = 64  # Longer undefined EXIF values (MakerNote, ...) are summarized
+AI_SOURCE_TYPE = b"trainedAlgorithmicMedia"
+
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+# TIFF type -> (struct format, size)
+TIFF_TYPES = {
+    1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("L", 4), 5: ("LL", 8), 6: ("b", 1),
+    7: ("s", 1), 8: ("h", 2), 9: ("l", 4), 10: ("ll", 8), 11: ("f", 4), 12: ("d", 8)
+}
+IPTC_DATASETS = {
+    5: "ObjectName", 25: "Keywords", 55: "DateCreated", 65: "OriginatingProgram",
+    80: "By-line", 110: "Credit", 115: "Source", 116: "CopyrightNotice", 120: "Caption-Abstract"
+}
+XMP_PROPERTY = re.compile(r'([A-Za-z][\w.-]*):([A-Za-z][\w.-]*)="([^"]*)"|<([A-Za-z][\w.-]*):([A-Za-z][\w.-]*)>([^<]+)</')
+CBOR_TEXT_AFTER = re.compile(rb"claim_generator(?!_)([\x60-\x7b])")
+
+
+def _decode_text(value: bytes) -> str:
+    return value.rstrip(b"\x00").decode("utf-8", errors="replace").strip()
+
+
+def _exif_value(tag: int, type_id: int, raw: bytes, count: int, order: str) -> Any:
+    fmt, size = TIFF_TYPES[type_id]
+    if type_id == 2:
+        return _decode_text(raw)
+    if tag == 0x9286 and type_id in (1, 7) and len(raw) >= 8:  # UserComment: 8-byte charset prefix
+        charset, text = raw[:8], raw[8:]
+        return text.decode("utf-16" if charset.startswith(b"UNICODE") else "latin-1", errors="replace").strip("\x00 ")
+    if type_id == 7:
+        if len(raw) > MAX_BINARY_TAG_BYTES:
+            return f"<{len(raw)} bytes>"
+        return _decode_text(raw) if raw.isascii() else raw.hex()
+    values = struct.unpack(f"{order}{fmt * count}", raw[:size * count])
+    if type_id in (5, 10):
+        values = tuple(num / den if den else 0.0 for num, den in zip(values[::2], values[1::2]))
+    return values[0] if len(values) == 1 else list(values)
+
+
+def parse_tiff_exif(data: bytes) -> Dict[str, Any]:
+    """EXIF from a TIFF structure; tags use PIL's names, GPS tags go under GPSInfo"""
+    if len(data) < 8 or data[:2] not in (b"II", b"MM"):
+        return {}
+    order = "<" if data[:2] == b"II" else ">"
+    
+    def read_ifd(offset: int, names: Dict[int, str], visited: set) -> Tuple[Dict[str, Any], Dict[int, int]]:
+        entries, pointers = {}, {}
+        if offset in visited or offset + 2 > len(data):
+            return entries, pointers
+        visited.add(offset)
+        (count,) = struct.unpack_from(f"{order}H", data, offset)
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            if entry + 12 > len(data):
+                break
+            tag, type_id, value_count = struct.unpack_from(f"{order}HHL", data, entry)
+            if type_id not in TIFF_TYPES:
+                continue
+            length = TIFF_TYPES[type_id][1] * value_count
+            if length <= 4:
+                raw = data[entry + 8:entry + 8 + length]
+            else:
+                (value_offset,) = struct.unpack_from(f"{order}L", data, entry + 8)
+                raw = data[value_offset:value_offset + length]
+                if len(raw) < length:
+                    continue
+            if tag in (EXIF_IFD_POINTER, GPS_IFD_POINTER):
+                pointers[tag] = struct.unpack(f"{order}L", raw[:4])[0]
+                continue
+            try:
+                entries[names.get(tag, tag)] = _exif_value(tag, type_id, raw, value_count, order)
+            except struct.error:
+                continue
+        return entries, pointers
+    
+    visited: set = set()
+    (ifd0,) = struct.unpack_from(f"{order}L", data, 4)
+    exif, pointers = read_ifd(ifd0, TAGS, visited)
+    if EXIF_IFD_POINTER in pointers:
+        exif.update(read_ifd(pointers[EXIF_IFD_POINTER], TAGS, visited)[0])
+    if GPS_IFD_POINTER in pointers:
+        gps = read_ifd(pointers[GPS_IFD_POINTER], GPSTAGS, visited)[0]
+        if gps:
+            exif["GPSInfo"] = gps
+    return exif
+
+
+def parse_xmp(packet: bytes) -> Dict[str, str]:
+    """Simple (attribute or single-text element) XMP properties"""
+    properties = {}
+    for match in XMP_PROPERTY.finditer(packet.decode("utf-8", errors="replace")):
+        prefix, name, value = (match.group(1), match.group(2), match.group(3)) if match.group(1) \
+            else (match.group(4), match.group(5), match.group(6))
+        if prefix not in ("xmlns", "xml", "rdf", "x"):
+            properties.setdefault(f"{prefix}:{name}", value.strip())
+    return properties
+
+
+def parse_photoshop_iptc(data: bytes) -> Dict[str, Any]:
+    """IPTC-IIM records from the 8BIM resource 0x0404 of a Photoshop APP13 block"""
+    position, iptc = 0, {}
+    while position + 12 <= len(data) and data[position:position + 4] == b"8BIM":
+        (resource_id,) = struct.unpack_from(">H", data, position + 4)
+        name_length = data[position + 6]
+        position += 7 + name_length + ((name_length + 1) % 2)  # Pascal name padded to even
+        (size,) = struct.unpack_from(">L", data, position)
+        block = data[position + 4:position + 4 + size]
+        position += 4 + size + (size % 2)
+        if resource_id != 0x0404:
+            continue
+        offset = 0
+        while offset + 5 <= len(block) and block[offset] == 0x1C:
+            record, dataset = block[offset + 1], block[offset + 2]
+            (length,) = struct.unpack_from(">H", block, offset + 3)
+            value = _decode_text(block[offset + 5:offset + 5 + length])
+            offset += 5 + length
+            if record == 2 and dataset in IPTC_DATASETS:
+                name = IPTC_DATASETS[dataset]
+                if name == "Keywords":
+                    iptc.setdefault(name, []).append(value)
+                else:
+                    iptc[name] = value
+    return iptc
+
+
+def scan_c2pa(jumbf: bytes) -> C2PAManifest:
+    """Lightweight scan of a JUMBF/C2PA payload (labels and markers, no CBOR decoding)"""
+    if b"c2pa" not in jumbf:
+        return C2PAManifest()
+    labels = sorted({
+        label.decode("ascii", errors="replace")
+        for label in re.findall(rb"(urn:(?:uuid|c2pa):[0-9A-Za-z:._-]+)", jumbf)
+    })
+    claim_generator = None
+    match = CBOR_TEXT_AFTER.search(jumbf)
+    if match:
+        header = match.group(1)[0]
+        start = match.end()
+        if header < 0x78:
+            length = header - 0x60
+        else:  # 0x78: one-byte length, 0x79: two-byte, 0x7a: four-byte, 0x7b: eight-byte
+            width = 1 << (header - 0x78)
+            length = int.from_bytes(jumbf[start:start + width], "big")
+            start += width
+        claim_generator = jumbf[start:start + length].decode("utf-8", errors="replace")
+    return C2PAManifest(
+        present=True,
+        manifest_labels=labels,
+        claim_generator=claim_generator,
+        ai_generated=AI_SOURCE_TYPE in jumbf
+    )
+
+
+def _read_jpeg(f: BinaryIO, metadata: ImageMetadata):
+    jumbf_segments: Dict[bytes, List[bytes]] = {}
+    xmp_packets = []
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            break
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":  # Fill bytes
+            marker = f.read(1)
+        if not marker:
+            break
+        code = marker[0]
+        if code in JPEG_STANDALONE_MARKERS or code == 0x00:
+            continue
+        if code in (0xD9, 0xDA):  # EOI or start of scan: pixel data follows
+            break
+        header = f.read(2)
+        if len(header) < 2:
+            break
+        (length,) = struct.unpack(">H", header)
+        if code not in JPEG_SOF_MARKERS and code not in (0xE1, 0xED, 0xEB):
+            f.seek(length - 2, io.SEEK_CUR)
+            continue
+        segment = f.read(length - 2)
+        try:
+            if code in JPEG_SOF_MARKERS:
+                _, height, width, components = struct.unpack_from(">BHHB", segment)
+                metadata.width, metadata.height = width, height
+                metadata.mode = JPEG_MODES.get(components)
+            elif code == 0xE1:
+                if segment.startswith(EXIF_HEADER):
+                    metadata.exif.update(parse_tiff_exif(segment[len(EXIF_HEADER):]))
+                elif segment.startswith(XMP_HEADER):
+                    xmp_packets.append(segment[len(XMP_HEADER):])
+            elif code == 0xED:
+                if segment.startswith(PHOTOSHOP_HEADER):
+                    metadata.iptc.update(parse_photoshop_iptc(segment[len(PHOTOSHOP_HEADER):]))
+            elif code == 0xEB:
+                # JPEG XT box: "JP", box instance (2), sequence (4), then the JUMBF box;
+                # continuation segments repeat the 8-byte box header
+                if segment[:2] == b"JP" and len(segment) > 16:
+                    instance, sequence = segment[2:4], struct.unpack_from(">L", segment, 4)[0]
+                    jumbf_segments.setdefault(instance, []).append(segment[8:] if sequence <= 1 else segment[16:])
+        except (struct.error, IndexError) as e:
+            # A malformed segment loses only its own fields
+            logger.warning(f"Unreadable JPEG segment 0x{code:02X}: {e}")
+    for packet in xmp_packets:
+        metadata.xmp.update(parse_xmp(packet))
+    for segments in jumbf_segments.values():
+        manifest = scan_c2pa(b"".join(segments))
+        if manifest.present:
+            metadata.c2pa = manifest
+            break
+
+
+def _read_png(f: BinaryIO, metadata: ImageMetadata):
+    f.seek(len(PNG_SIGNATURE))
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">L4s", header)
+        if chunk_type == b"IEND":
+            break
+        if chunk_type not in (b"IHDR", b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"caBX", b"tRNS"):
+            f.seek(length + 4, io.SEEK_CUR)  # Skip payload (IDAT included) and CRC
+            continue
+        data = f.read(length)
+        f.seek(4, io.SEEK_CUR)
+        try:
+            if chunk_type == b"IHDR":
+                width, height, _, color_type = struct.unpack_from(">LLBB", data)
+                metadata.width, metadata.height = width, height
+                metadata.mode = PNG_MODES.get(color_type)
+                metadata.has_transparency = color_type in (4, 6)
+            elif chunk_type == b"tRNS":
+                metadata.has_transparency = True
+            elif chunk_type == b"eXIf":
+                metadata.exif.update(parse_tiff_exif(data))
+            elif chunk_type == b"caBX":
+                metadata.c2pa = scan_c2pa(data)
+            else:
+                key, value = _png_text(chunk_type, data)
+                if key == "XML:com.adobe.xmp":
+                    metadata.xmp.update(parse_xmp(value.encode("utf-8")))
+                elif key:
+                    if key in GENERATION_KEYS and metadata.generation_parameters is None:
+                        metadata.generation_parameters = value[:MAX_GENERATION_CHARS]
+                    metadata.text_chunks[key] = value[:MAX_TEXT_CHARS]
+        except (struct.error, IndexError) as e:
+            logger.warning(f"Unreadable PNG {chunk_type.decode('latin-1')} chunk: {e}")
+
+
+def _inflate_text(data: bytes) -> bytes:
+    """Compressed text, inflated to at most MAX_TEXT_BYTES (a few KB can inflate to GBs)"""
+    return zlib.decompressobj().decompress(data, MAX_TEXT_BYTES)
+
+
+def _png_text(chunk_type: bytes, data: bytes) -> Tuple[Optional[str], str]:
+    key, _, rest = data.partition(b"\x00")
+    try:
+        if chunk_type == b"tEXt":
+            return key.decode("latin-1"), rest.decode("latin-1")
+        if chunk_type == b"zTXt":
+            return key.decode("latin-1"), _inflate_text(rest[1:]).decode("latin-1")
+        compressed = rest[0] == 1
+        _language, _, rest = rest[2:].partition(b"\x00")
+        _translated, _, text = rest.partition(b"\x00")
+        if compressed:
+            # Not final: a character split by the MAX_TEXT_BYTES cut is dropped, not an error
+            return key.decode("latin-1"), codecs.getincrementaldecoder("utf-8")().decode(_inflate_text(text))
+        return key.decode("latin-1"), text.decode("utf-8")
+    except (zlib.error, UnicodeDecodeError, IndexError) as e:
+        logger.warning(f"Unreadable PNG {chunk_type.decode()} chunk: {e}")
+        return None, ""
+
+
+def open_image_header(source: Union[str, BinaryIO]) -> Image.Image:
+    """Lazy PIL open of any size; the caller bounds what it decodes
+    
+    Image.open rejects images above twice MAX_IMAGE_PIXELS once their header
+    is parsed. Those are opened through the format plugins directly, the way
+    Image.open probes them, so the process-wide limit stays in force for
+    every other caller.
+    """
+    start = None if isinstance(source, str) else source.tell()
+    try:
+        return Image.open(source)
+    except Image.DecompressionBombError:
+        pass
+    if start is None:
+        with open(source, "rb") as f:
+            prefix = f.read(16)
+    else:
+        source.seek(start)
+        prefix = source.read(16)
+    for format_id in Image.ID:
+        factory, accept = Image.OPEN[format_id]
+        accepted = accept(prefix) if accept else True
+        if not accepted or isinstance(accepted, str):
+            continue
+        if start is not None:
+            source.seek(start)
+        try:
+            return factory(source)  # A path is opened (and closed) by the image itself
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+    raise Image.UnidentifiedImageError(f"Cannot identify image file {source!r}")
+
+
+def _read_with_pil(f: BinaryIO, metadata: ImageMetadata):
+    with open_image_header(f) as image:
+        metadata.format = image.format
+        metadata.width, metadata.height = image.size
+        metadata.mode = image.mode
+        metadata.has_transparency = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        exif = image.getexif()
+        for tag_id, value in exif.items():
+            metadata.exif[TAGS.get(tag_id, tag_id)] = value.decode("utf-8", errors="replace") \
+                if isinstance(value, bytes) else value
+        for tag_id, value in exif.get_ifd(EXIF_IFD_POINTER).items():
+            metadata.exif[TAGS.get(tag_id, tag_id)] = value.decode("utf-8", errors="replace") \
+                if isinstance(value, bytes) else value
+        xmp = image.info.get("xmp")
+        if xmp:
+            metadata.xmp.update(parse_xmp(xmp if isinstance(xmp, bytes) else xmp.encode("utf-8")))
+
+
+def read_image_metadata(image: Union[str, BinaryIO]) -> ImageMetadata:
+    """Metadata of an image file path or seekable buffer without decoding its pixels"""
+    metadata = ImageMetadata()
+    with open(image, "rb") if isinstance(image, str) else nullcontext(image) as f:
+        f.seek(0)
+        signature = f.read(8)
+        if signature[:2] == b"\xff\xd8":
+            metadata.format = "JPEG"
+            _read_jpeg(f, metadata)
+            return metadata
+        if signature == PNG_SIGNATURE:
+            metadata.format = "PNG"
+            _read_png(f, metadata)
+            return metadata
+        f.seek(0)
+        _read_with_pil(f, metadata)
+    return metadata
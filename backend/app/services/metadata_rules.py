@@ -0,0 +1,189 @@
+"""
+Metadata anomaly rules engine
+
+Software signatures, generator dimension tables, weights and quality
+thresholds come from a versioned JSON rules file (METADATA_RULES_PATH) and
+are compiled once at load time:
+- software signatures: one case-insensitive regex alternation, so a
+  Software/CreatorTool value is scanned in a single pass
+- generator dimensions: a set of (width, height) pairs
+- generator aspect ratios: a set of reduced (width, height) ratios, matched
+  only when both sides are multiples of the generator latent grid
+
+Rules operate on the flat exif_data dict (ImageMetadata.as_exif_dict()),
+which is also what image_analyses documents store, so stored analyses can be
+re-scored in bulk with score_batch() without re-reading the images.
+"""
+import json
+import logging
+import re
+from math import gcd
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+from app.core.config import settings
+from app.core.errors import ServiceError
+
+logger = logging.getLogger(__name__)
+
+ANOMALIES = (
+    'missing_camera_info',
+    'suspicious_software',
+    'missing_timestamp',
+    'unusual_dimensions',
+    'missing_exif',
+    'ai_provenance'
+)
+QUALITY_RULES = ('high_sharpness', 'low_noise')
+
+# Keys as_exif_dict() adds next to the EXIF tags
+NON_EXIF_KEYS = frozenset({
+    'format', 'mode', 'size', 'has_transparency', 'XMP', 'IPTC', 'GenerationParameters', 'C2PA'
+})
+
+
+class RulesConfigError(ServiceError):
+    """Raised when a metadata rules file is missing or invalid"""
+
+
+def _reduced(width: int, height: int) -> Tuple[int, int]:
+    divisor = gcd(width, height) or 1
+    return width // divisor, height // divisor
+
+
+class MetadataRules:
+    """Compiled metadata rules of one rules file version"""
+    
+    def __init__(self, rules: Dict[str, Any]):
+        try:
+            self.version = str(rules['version'])
+            weights = rules['weights']
+            thresholds = rules['thresholds']
+            signatures = rules['software_signatures']
+        except KeyError as e:
+            raise RulesConfigError('invalid_rules', f"Metadata rules are missing {e}", missing=str(e).strip("'"))
+        
+        self.max_score = float(rules.get('max_score', 1.0))
+        default_weight = float(rules.get('default_weight', 0.1))
+        self.anomaly_weights = np.array([weights.get(name, default_weight) for name in ANOMALIES], dtype=np.float64)
+        self.quality_weights = np.array([weights.get(name, default_weight) for name in QUALITY_RULES], dtype=np.float64)
+        self.sharpness_above = float(thresholds['sharpness_above'])
+        self.noise_below = float(thresholds['noise_below'])
+        
+        self.camera_tags = tuple(rules.get('camera_tags', ()))
+        self.timestamp_tags = tuple(rules.get('timestamp_tags', ()))
+        self.software_tags = tuple(rules.get('software_tags', ()))
+        self.xmp_software_tags = tuple(rules.get('xmp_software_tags', ()))
+        self.ai_source_types = frozenset(rules.get('ai_source_types', ()))
+        
+        self.signature_category = {
+            signature.lower(): category
+            for category, names in signatures.items() for signature in names
+        }
+        # Longest signatures first so "dall-e" is reported rather than a shorter prefix
+        alternation = '|'.join(re.escape(name) for name in sorted(self.signature_category, key=len, reverse=True))
+        self.software_pattern = re.compile(alternation, re.IGNORECASE) if alternation else None
+        
+        self.generator_dimensions = frozenset(tuple(size) for size in rules.get('generator_dimensions', ()))
+        aspect = rules.get('generator_aspect_ratios', {})
+        self.aspect_multiple = int(aspect.get('multiple_of', 0))
+        self.aspect_ratios = frozenset(_reduced(*ratio) for ratio in aspect.get('ratios', ()))
+    
+    @classmethod
+    def load(cls, path: str) -> 'MetadataRules':
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                rules = json.load(f)
+        except (OSError, ValueError) as e:
+            raise RulesConfigError('rules_unreadable', f"Cannot load metadata rules from {path}: {e}", path=path)
+        engine = cls(rules)
+        logger.info(f"Loaded metadata rules {engine.version} from {path}")
+        return engine
+    
+    def match_software(self, exif_data: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        """(signature, category) of the first known signature in the software fields"""
+        if self.software_pattern is None:
+            return None
+        xmp = exif_data.get('XMP') or {}
+        values = [exif_data.get(tag) for tag in self.software_tags]
+        values += [xmp.get(tag) for tag in self.xmp_software_tags]
+        match = self.software_pattern.search(' '.join(str(value) for value in values if value))
+        if match is None:
+            return None
+        signature = match.group(0).lower()
+        return signature, self.signature_category[signature]
+    
+    def generator_sized(self, size: Optional[Sequence[int]]) -> bool:
+        if not size or len(size) != 2:
+            return False
+        width, height = int(size[0]), int(size[1])
+        if (width, height) in self.generator_dimensions:
+            return True
+        if not self.aspect_multiple or width % self.aspect_multiple or height % self.aspect_multiple:
+            return False
+        return _reduced(width, height) in self.aspect_ratios
+    
+    def detect(self, exif_data: Dict[str, Any]) -> Dict[str, bool]:
+        """Anomaly flags for one flat exif_data dict"""
+        has_exif = any(key not in NON_EXIF_KEYS for key in exif_data)
+        source_type = str((exif_data.get('XMP') or {}).get('Iptc4xmpExt:DigitalSourceType', ''))
+        c2pa = exif_data.get('C2PA') or {}
+        return {
+            'missing_camera_info': not any(tag in exif_data for tag in self.camera_tags),
+            'suspicious_software': self.match_software(exif_data) is not None,
+            'missing_timestamp': not any(tag in exif_data for tag in self.timestamp_tags),
+            'unusual_dimensions': self.generator_sized(exif_data.get('size')),
+            'missing_exif': not has_exif,
+            # Provenance declaring generation: C2PA assertion, IPTC digital source
+            # type or generator settings embedded by Stable Diffusion front ends
+            'ai_provenance': bool(
+                c2pa.get('ai_generated') or exif_data.get('GenerationParameters')
+                or source_type.rsplit('/', 1)[-1] in self.ai_source_types
+            )
+        }
+    
+    def score(self, anomalies: Dict[str, bool], quality_metrics: Optional[Dict[str, float]]) -> float:
+        """Suspicion score of one record (score_batch() for many)"""
+        score = sum(weight for name, weight in zip(ANOMALIES, self.anomaly_weights) if anomalies.get(name))
+        if quality_metrics:
+            flags = (quality_metrics.get('sharpness', 0) > self.sharpness_above,
+                     quality_metrics.get('noise_level', 50) < self.noise_below)
+            score += sum(weight for flag, weight in zip(flags, self.quality_weights) if flag)
+        return min(float(score), self.max_score)
+    
+    def _quality_flags(self, sharpness: np.ndarray, noise: np.ndarray) -> np.ndarray:
+        # Very sharp or very clean images are typical of generators
+        return np.stack([sharpness > self.sharpness_above, noise < self.noise_below], axis=1)
+    
+    def score_batch(self, exif_records: Iterable[Dict[str, Any]],
+                    quality_records: Iterable[Optional[Dict[str, float]]]) -> Tuple[List[Dict[str, bool]], np.ndarray]:
+        """Anomalies and suspicion scores for many records at once"""
+        anomalies = [self.detect(exif_data) for exif_data in exif_records]
+        return anomalies, self.weigh_batch(anomalies, quality_records)
+    
+    def weigh_batch(self, anomalies: Sequence[Dict[str, bool]],
+                    quality_records: Iterable[Optional[Dict[str, float]]]) -> np.ndarray:
+        """
+        Suspicion scores for already detected anomalies
+        Flags are collected into an (N, rules) matrix and scored with one
+        matrix-vector product; records without quality metrics get no
+        quality contribution, as in score().
+        """
+        quality = list(quality_records)
+        if len(quality) != len(anomalies):
+            raise ValueError(f"Got {len(anomalies)} metadata records but {len(quality)} quality records")
+        if not anomalies:
+            return np.zeros(0)
+        
+        flags = np.array([[bool(record.get(name)) for name in ANOMALIES] for record in anomalies], dtype=np.float64)
+        scores = flags @ self.anomaly_weights
+        
+        has_quality = np.array([bool(metrics) for metrics in quality])
+        sharpness = np.array([(metrics or {}).get('sharpness', 0) for metrics in quality], dtype=np.float64)
+        noise = np.array([(metrics or {}).get('noise_level', 50) for metrics in quality], dtype=np.float64)
+        quality_scores = self._quality_flags(sharpness, noise).astype(np.float64) @ self.quality_weights
+        scores = scores + np.where(has_quality, quality_scores, 0.0)
+        return np.minimum(scores, self.max_score)
+
+
+metadata_rules = MetadataRules.load(settings.METADATA_RULES_PATH)
@@ -6,7 +6,7 @@ import logging
 import hashlib
 import time
 import re
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, List, Optional
 import fitz  # PyMuPDF
 from textstat import flesch_reading_ease, flesch_kincaid_grade
 import nltk
@@ -48,8 +48,9 @@ class PDFAnalysisService:
                 hash_sha256.update(chunk)
         return hash_sha256.hexdigest()
     
-    def extract_text_and_metadata(self, pdf_path: str) -> Dict[str, Any]:
-        """Extract text and metadata from PDF"""
+    def extract_text_and_metadata(self, pdf_path: str,
+                                  progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        """Extract text and metadata from PDF; progress is called with (page, page_count) per page"""
         try:
             doc = fitz.open(pdf_path)
             
@@ -58,16 +59,19 @@ class PDFAnalysisService:
             
             # Extract text from all pages
             text_content = ""
-            for page_num in range(len(doc)):
+            page_count = len(doc)
+            for page_num in range(page_count):
                 page = doc.load_page(page_num)
                 text_content += page.get_text()
+                if progress is not None:
+                    progress(page_num + 1, page_count)
             
             doc.close()
             
             return {
                 'text': text_content,
                 'metadata': metadata,
-                'page_count': len(doc)
+                'page_count': page_count
             }
             
         except Exception as e:
@@ -216,13 +220,14 @@ class PDFAnalysisService:
         
         return patterns
     
-    def analyze_pdf(self, pdf_path: str, filename: str) -> PDFAnalysisResult:
-        """Complete PDF analysis pipeline"""
+    def analyze_pdf(self, pdf_path: str, filename: str,
+                    content: Optional[Dict[str, Any]] = None) -> PDFAnalysisResult:
+        """Complete PDF analysis pipeline; content is an already extracted extract_text_and_metadata()"""
         start_time = time.time()
         
         try:
             # Extract content
-            content = self.extract_text_and_metadata(pdf_path)
+            content = content or self.extract_text_and_metadata(pdf_path)
             text = content['text']
             metadata = content['metadata']
             page_count = content['page_count']
@@ -0,0 +1,473 @@
+"""
+Pluggable blob storage for uploads and dataset blobs
+
+Objects are addressed by '/'-separated keys relative to a namespace:
+- LocalStorage keeps them under a directory (the previous layout)
+- S3Storage keeps them in a bucket under S3_PREFIX<namespace>/, through any
+  S3-compatible API (AWS, MinIO; S3_ENDPOINT_URL)
+Writes stream through writer(key): local writes go to a temp file that is
+renamed on success, S3 writes are buffered into S3_PART_SIZE_MB multipart
+parts (a single PUT when the object is smaller than one part). A failed
+write never leaves a partial object. read_range() serves byte ranges
+without reading whole objects.
+
+Consumers that need a filesystem path (OpenCV, Pillow, py7zr) call
+local_path(): S3 objects are downloaded once into a size-bounded
+ReadThroughCache and served from disk afterwards. Upload and blob names are
+never rewritten with different content, so cached copies need no
+invalidation beyond delete().
+"""
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB  # S3 minimum for every part but the last
+CACHE_MIN_AGE_SECONDS = 60  # Entries just handed out are not evicted under their reader
+
+
+class StorageWriter(ABC):
+    """Streaming object writer; commits on a clean context exit and aborts on an exception"""
+    
+    size = 0
+    
+    @abstractmethod
+    def write(self, data: bytes):
+        ...
+    
+    @abstractmethod
+    def commit(self):
+        ...
+    
+    @abstractmethod
+    def abort(self):
+        ...
+    
+    def __enter__(self) -> "StorageWriter":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class StorageBackend(ABC):
+    """Key/value object storage interface"""
+    
+    is_local = False
+    
+    @abstractmethod
+    def writer(self, key: str) -> StorageWriter:
+        ...
+    
+    def put_bytes(self, key: str, data: bytes):
+        with self.writer(key) as writer:
+            writer.write(data)
+    
+    def put_file(self, key: str, file_path: str, move: bool = False):
+        with self.writer(key) as writer, open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(MB), b""):
+                writer.write(chunk)
+        if move:
+            os.remove(file_path)
+    
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+    
+    @abstractmethod
+    def size(self, key: str) -> Optional[int]:
+        """Object size in bytes, or None when it does not exist"""
+    
+    @abstractmethod
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        ...
+    
+    @abstractmethod
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path with the object's content, or None when it does not exist"""
+    
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        ...
+    
+    @abstractmethod
+    def list(self, prefix: str = "") -> Iterator[str]:
+        ...
+    
+    def url(self, key: str) -> Optional[str]:
+        """URL clients can fetch the object from, if the backend has one"""
+        return None
+
+
+class _LocalWriter(StorageWriter):
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+    
+    def write(self, data: bytes):
+        self._file.write(data)
+        self.size += len(data)
+    
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+    
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class LocalStorage(StorageBackend):
+    """Objects as files under root; url_prefix is where root is served statically"""
+    
+    is_local = True
+    
+    def __init__(self, root: str, url_prefix: Optional[str] = None):
+        self.root = root
+        self.url_prefix = url_prefix
+        os.makedirs(root, exist_ok=True)
+    
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+    
+    def writer(self, key: str) -> StorageWriter:
+        return _LocalWriter(self.path(key))
+    
+    def put_file(self, key: str, file_path: str, move: bool = False):
+        """Move, or hard-link when possible, instead of copying"""
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if move:
+            shutil.move(file_path, dest)
+            return
+        try:
+            os.link(file_path, dest)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Different filesystem or links unsupported
+            super().put_file(key, file_path)
+    
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+    
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            return f.read(length)
+    
+    def local_path(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+    
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def list(self, prefix: str = "") -> Iterator[str]:
+        for directory, _, files in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root)
+            for name in files:
+                key = name if relative == "." else "/".join(relative.split(os.sep) + [name])
+                if key.startswith(prefix) and not name.endswith((".part", ".tmp")):
+                    yield key
+    
+    def url(self, key: str) -> Optional[str]:
+        return f"{self.url_prefix}/{key}" if self.url_prefix else None
+
+
+class ReadThroughCache:
+    """Local copies of remote objects, evicted least recently used past max_bytes"""
+    
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._fetching: Dict[str, threading.Lock] = {}
+        os.makedirs(root, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+    
+    def _entries(self) -> Iterator[str]:
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".part"):
+                    yield os.path.join(directory, name)
+    
+    def path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+    
+    def lookup(self, key: str) -> Optional[str]:
+        """Cached path, refreshed as most recently used, or None"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+    
+    def get(self, key: str, fetch) -> str:
+        """Cached path of key, calling fetch(tmp_path) to download it on a miss"""
+        path = self.lookup(key)
+        if path is not None:
+            return path
+        with self._lock:
+            key_lock = self._fetching.setdefault(key, threading.Lock())
+        with key_lock:
+            # A concurrent reader may have fetched it while we waited
+            path = self.lookup(key)
+            if path is not None:
+                return path
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            os.close(fd)
+            try:
+                fetch(tmp_path)
+                os.replace(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            finally:
+                with self._lock:
+                    self._fetching.pop(key, None)
+            with self._lock:
+                self.misses += 1
+                self.size += os.path.getsize(path)
+        self._evict()
+        return path
+    
+    def discard(self, key: str):
+        path = self.path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.size -= size
+    
+    def _evict(self):
+        if self.size <= self.max_bytes:
+            return
+        with self._lock:
+            entries = []
+            for path in self._entries():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            newest = max((entry[0] for entry in entries), default=0) - CACHE_MIN_AGE_SECONDS
+            for mtime, size, path in entries:
+                if self.size <= self.max_bytes or mtime > newest:
+                    break
+                try:
+                    os.remove(path)
+                    self.size -= size
+                except FileNotFoundError:
+                    pass
+    
+    def stats(self) -> Dict[str, Any]:
+        return {'bytes': self.size, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+class _S3Writer(StorageWriter):
+    """Buffers into part_size multipart parts; objects smaller than one part are a single PUT"""
+    
+    def __init__(self, client, bucket: str, key: str, part_size: int):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id: Optional[str] = None
+        self.parts = []
+        self._buffer = bytearray()
+    
+    def write(self, data: bytes):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(self.part_size)
+    
+    def _upload_part(self, length: int):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        body = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=body
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': number})
+    
+    def commit(self):
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            return
+        if self._buffer:
+            self._upload_part(len(self._buffer))
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+        )
+    
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self._buffer.clear()
+
+
+class S3Storage(StorageBackend):
+    """Objects in an S3-compatible bucket under prefix, read through a local cache"""
+    
+    def __init__(self, bucket: str, prefix: str, cache: ReadThroughCache, client=None,
+                 part_size: int = 8 * MB, url_expiry_seconds: int = 3600):
+        if client is None:
+            import boto3  # Only needed with STORAGE_BACKEND=s3
+            client = boto3.client(
+                "s3",
+                endpoint_url=settings.S3_ENDPOINT_URL or None,
+                region_name=settings.S3_REGION or None
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache = cache
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.url_expiry_seconds = url_expiry_seconds
+    
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+    
+    def writer(self, key: str) -> StorageWriter:
+        return _S3Writer(self.client, self.bucket, self._key(key), self.part_size)
+    
+    def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))['ContentLength']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+    
+    def tags(self, key: str) -> Optional[Dict[str, str]]:
+        """Object tags, or None when the object does not exist"""
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.get_object_tagging(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {tag['Key']: tag['Value'] for tag in response['TagSet']}
+    
+    def put_tags(self, key: str, tags: Dict[str, str]):
+        self.client.put_object_tagging(
+            Bucket=self.bucket, Key=self._key(key),
+            Tagging={'TagSet': [{'Key': name, 'Value': value} for name, value in tags.items()]}
+        )
+    
+    def set_expiration_rules(self, rules: Dict[str, Tuple[Optional[Dict[str, str]], int]]):
+        """Install bucket lifecycle rules {id: (tags or None, days)} expiring objects under the prefix
+        
+        Rules with other ids (other namespaces or tools sharing the bucket) are kept.
+        """
+        from botocore.exceptions import ClientError
+        try:
+            existing = self.client.get_bucket_lifecycle_configuration(Bucket=self.bucket)['Rules']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchLifecycleConfiguration':
+                raise
+            existing = []
+        merged = [rule for rule in existing if rule.get('ID') not in rules]
+        for rule_id, (tags, days) in rules.items():
+            if tags:
+                tag_set = [{'Key': name, 'Value': value} for name, value in tags.items()]
+                rule_filter = {'And': {'Prefix': self.prefix, 'Tags': tag_set}}
+            else:
+                rule_filter = {'Prefix': self.prefix}
+            merged.append({'ID': rule_id, 'Filter': rule_filter, 'Status': 'Enabled', 'Expiration': {'Days': days}})
+        self.client.put_bucket_lifecycle_configuration(Bucket=self.bucket, LifecycleConfiguration={'Rules': merged})
+    
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            with open(cached, "rb") as f:
+                f.seek(start)
+                return f.read(length)
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{start + length - 1}"
+        )
+        return response['Body'].read()
+    
+    def local_path(self, key: str) -> Optional[str]:
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            return cached
+        if not self.exists(key):
+            return None
+        return self.cache.get(key, lambda tmp_path: self.client.download_file(self.bucket, self._key(key), tmp_path))
+    
+    def delete(self, key: str) -> bool:
+        self.cache.discard(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+    
+    def list(self, prefix: str = "") -> Iterator[str]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for entry in page.get('Contents', []):
+                yield entry['Key'][len(self.prefix):]
+    
+    def url(self, key: str) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object", Params={'Bucket': self.bucket, 'Key': self._key(key)}, ExpiresIn=self.url_expiry_seconds
+        )
+
+
+def create_storage(namespace: str, local_root: str, url_prefix: Optional[str] = None) -> StorageBackend:
+    """Backend selected by STORAGE_BACKEND for one namespace (uploads, datasets)"""
+    if settings.STORAGE_BACKEND == "local":
+        return LocalStorage(local_root, url_prefix)
+    if settings.STORAGE_BACKEND == "s3":
+        if not settings.S3_BUCKET:
+            raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        return S3Storage(
+            settings.S3_BUCKET,
+            f"{settings.S3_PREFIX}{namespace}/",
+            ReadThroughCache(os.path.join(settings.STORAGE_CACHE_DIR, namespace), settings.STORAGE_CACHE_MAX_MB * MB),
+            part_size=settings.S3_PART_SIZE_MB * MB
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND '{settings.STORAGE_BACKEND}', expected local or s3")
+
+
+upload_storage = create_storage("uploads", settings.UPLOAD_DIR, url_prefix="/uploads")
+dataset_storage = create_storage("datasets", settings.DATASET_PATH)
@@ -0,0 +1,276 @@
+"""
+Tiled analysis for very large images (panoramas, gigapixel scans, large TIFFs)
+
+The image is opened lazily and decoded once under a per-request memory
+ceiling. JPEGs are decoded directly at a reduced DCT scale (1/2, 1/4, 1/8)
+when full resolution would not fit. Striped and tiled TIFFs that do not fit
+are decoded one band of tile rows at a time instead: the strips (or TIFF
+tiles) covering the band are copied into a small standalone TIFF, so any
+compression libtiff supports decodes without the rest of the image. Other
+formats that do not fit are rejected with MemoryCeilingError instead of
+being decoded. The decoded image (or band) is cut into tiles that are
+converted, scored for quality and classified in fixed-size batches, so at
+most one batch of tile tensors is alive at a time.
+
+Tile results are pooled into one prediction ("max" lets the most suspicious
+tile decide, "mean" averages tile probabilities) and the most suspicious
+tiles are reported with their boxes in original image coordinates.
+"""
+import io
+import math
+import struct
+import logging
+from itertools import accumulate, groupby
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple, Union
+import cv2
+import numpy as np
+import torch
+from PIL import Image, TiffImagePlugin, TiffTags
+
+from app.core.config import settings
+from app.core.errors import ServiceError
+from app.services.metadata_reader import open_image_header
+from ml.model import model_manager, ImagePreprocessor
+
+logger = logging.getLogger(__name__)
+
+POOLING_MODES = ("max", "mean")
+JPEG_SCALES = (1, 2, 4, 8)  # Scale factors libjpeg can decode at directly
+BYTES_PER_PIXEL = 4  # Pillow stores RGB/RGBA images with 4 bytes per pixel
+TOP_REGIONS = 5
+# Sub-IFD pointers would dangle in a band TIFF (EXIF, GPS, interoperability, SubIFDs)
+TIFF_IFD_POINTERS = (TiffImagePlugin.SUBIFD, TiffImagePlugin.EXIFIFD, 0x8825, 0xA005)
+
+
+class MemoryCeilingError(ServiceError):
+    """Raised when an image cannot be analyzed within the memory ceiling"""
+
+
+def _release(image: Image.Image, source: Union[str, BinaryIO]):
+    """Close images opened from a path; close() would also close a caller's buffer"""
+    if isinstance(source, str):
+        image.close()
+
+
+def tiff_band_rows(image: Image.Image) -> int:
+    """Rows per strip (or TIFF tile) of an image decodable band by band; 0 if it is not"""
+    tags = getattr(image, 'tag_v2', None)
+    if image.format != "TIFF" or tags is None or tags.get(TiffImagePlugin.PLANAR_CONFIGURATION, 1) != 1:
+        return 0
+    if TiffImagePlugin.TILEOFFSETS in tags:
+        rows = tags.get(TiffImagePlugin.TILELENGTH, 0)
+    elif TiffImagePlugin.STRIPOFFSETS in tags:
+        rows = tags.get(TiffImagePlugin.ROWSPERSTRIP, image.size[1])
+    else:
+        return 0
+    return rows if 0 < rows < image.size[1] else 0
+
+
+def decode_tiff_rows(image: Image.Image, top: int, bottom: int) -> Tuple[Image.Image, int]:
+    """Decode the strips covering rows [top, bottom); returns the band and its first row"""
+    tags = image.tag_v2
+    width, height = image.size
+    rows = tiff_band_rows(image)
+    if TiffImagePlugin.TILEOFFSETS in tags:
+        offsets_tag, counts_tag = TiffImagePlugin.TILEOFFSETS, TiffImagePlugin.TILEBYTECOUNTS
+        per_row = math.ceil(width / tags[TiffImagePlugin.TILEWIDTH])
+    else:
+        offsets_tag, counts_tag = TiffImagePlugin.STRIPOFFSETS, TiffImagePlugin.STRIPBYTECOUNTS
+        per_row = 1
+    first, last = top // rows, math.ceil(bottom / rows)
+    offsets = tags[offsets_tag][first * per_row:last * per_row]
+    counts = tags[counts_tag][first * per_row:last * per_row]
+    
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=b"II")
+    for tag, value in tags.items():
+        if tag not in TIFF_IFD_POINTERS:
+            ifd[tag] = value
+            ifd.tagtype[tag] = tags.tagtype[tag]
+    ifd[TiffImagePlugin.IMAGELENGTH] = min(height, last * rows) - first * rows
+    ifd.tagtype[offsets_tag] = ifd.tagtype[counts_tag] = TiffTags.LONG
+    ifd[counts_tag] = tuple(counts)
+    ifd[offsets_tag] = (0,) * len(counts)
+    data_start = 8 + len(ifd.tobytes(8))
+    # tobytes() rebases strip offsets onto the end of the IFD itself, tile offsets are absolute
+    base = 0 if offsets_tag == TiffImagePlugin.STRIPOFFSETS else data_start
+    ifd[offsets_tag] = tuple(base + position for position in accumulate(counts[:-1], initial=0))
+    
+    band = io.BytesIO()
+    band.write(b"II*\x00" + struct.pack("<L", 8) + ifd.tobytes(8))
+    for offset, count in zip(offsets, counts):
+        image.fp.seek(offset)
+        band.write(image.fp.read(count))
+    band.seek(0)
+    decoded = open_image_header(band)
+    decoded.load()
+    return decoded, first * rows
+
+
+def needs_tiling(size: Tuple[int, int]) -> bool:
+    width, height = size
+    return width * height >= settings.TILED_ANALYSIS_MIN_PIXELS
+
+
+def tile_boxes(width: int, height: int, tile_size: int) -> List[Tuple[int, int, int, int]]:
+    """Grid of (left, top, right, bottom) tiles; edge tiles are shifted inward to stay full size"""
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size + 1, tile_size))
+        if positions[-1] + tile_size < length:
+            positions.append(length - tile_size)
+        return positions
+    
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in starts(height) for left in starts(width)
+    ]
+
+
+class TiledAnalyzer:
+    """Bounded-memory tile-by-tile quality metrics and predictions"""
+    
+    def __init__(self, preprocessor: ImagePreprocessor = None):
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self.tile_size = settings.TILE_SIZE
+        self.batch_size = settings.TILE_BATCH_SIZE
+        self.memory_ceiling = settings.ANALYSIS_MEMORY_CEILING_MB * 1024 * 1024
+        self.pooling = settings.TILE_POOLING
+        if self.pooling not in POOLING_MODES:
+            raise ValueError(f"Unknown tile pooling '{self.pooling}', expected one of {POOLING_MODES}")
+    
+    def _batch_bytes(self) -> int:
+        """Tile crops plus the normalized float tensor batch"""
+        crops = self.batch_size * self.tile_size * self.tile_size * BYTES_PER_PIXEL
+        height, width = self.preprocessor.image_size
+        return crops + self.batch_size * 3 * height * width * 4
+    
+    def _band_bytes(self, width: int, band_rows: int) -> int:
+        """A band of tile rows widened to whole strips at both ends"""
+        return width * (self.tile_size + 2 * band_rows) * BYTES_PER_PIXEL
+    
+    def open_bounded(self, image_path: Union[str, BinaryIO]) -> Tuple[Image.Image, float]:
+        """Open and decode within the ceiling; returns the image and its downscale factor
+        
+        A TIFF decoded band by band is returned still undecoded (image.tile is
+        not empty) and is read through decode_tiff_rows by _tile_batches.
+        """
+        image = open_image_header(image_path)
+        width, height = image.size
+        budget = self.memory_ceiling - self._batch_bytes()
+        
+        scales = JPEG_SCALES if image.format == "JPEG" else (1,)
+        for scale in scales:
+            decoded = math.ceil(width / scale) * math.ceil(height / scale) * BYTES_PER_PIXEL
+            if decoded <= budget:
+                break
+        else:
+            band_rows = tiff_band_rows(image)
+            if band_rows and self._band_bytes(width, band_rows) <= budget:
+                return image, 1.0
+            _release(image, image_path)
+            raise MemoryCeilingError(
+                'memory_ceiling_exceeded',
+                f"{width}x{height} {image.format} image cannot be decoded within the memory ceiling",
+                width=width, height=height, format=image.format,
+                decoded_bytes=decoded, ceiling_bytes=self.memory_ceiling
+            )
+        
+        if scale > 1:
+            # DCT-domain downscale: the full-resolution image is never materialized
+            image.draft("RGB", (math.ceil(width / scale), math.ceil(height / scale)))
+        image.load()
+        return image, width / image.size[0]
+    
+    def _tile_batches(self, image: Image.Image) -> Iterator[Tuple[List[Tuple[int, int, int, int]], List[Image.Image]]]:
+        boxes = tile_boxes(image.size[0], image.size[1], self.tile_size)
+        if not image.tile:
+            for start in range(0, len(boxes), self.batch_size):
+                batch_boxes = boxes[start:start + self.batch_size]
+                yield batch_boxes, [image.crop(box).convert("RGB") for box in batch_boxes]
+            return
+        
+        # Undecoded TIFF: one band of strips per row of tiles
+        for top, row in groupby(boxes, key=lambda box: box[1]):
+            row = list(row)
+            band, first_row = decode_tiff_rows(image, top, row[0][3])
+            try:
+                for start in range(0, len(row), self.batch_size):
+                    batch_boxes = row[start:start + self.batch_size]
+                    yield batch_boxes, [
+                        band.crop((left, upper - first_row, right, lower - first_row)).convert("RGB")
+                        for left, upper, right, lower in batch_boxes
+                    ]
+            finally:
+                band.close()
+    
+    def _tile_quality(self, tile: Image.Image) -> Dict[str, float]:
+        gray = np.asarray(tile.convert("L"))
+        mean = float(gray.mean())
+        return {
+            'sharpness': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+            'noise_level': float(gray.std()),
+            'brightness': mean / 255.0,
+            'contrast': float(gray.std()) / mean if mean > 0 else 0.0
+        }
+    
+    def analyze(self, image_path: Union[str, BinaryIO]) -> Dict[str, Any]:
+        """Prediction, pooled quality metrics and localization for a large image"""
+        image, scale = self.open_bounded(image_path)
+        tile_transform = self.preprocessor.get_tile_transform()
+        tiles = []
+        model_version = None
+        try:
+            for boxes, crops in self._tile_batches(image):
+                batch = torch.stack([tile_transform(crop) for crop in crops])
+                predictions = model_manager.predict_batch(batch)
+                for box, crop, prediction in zip(boxes, crops, predictions):
+                    model_version = prediction.get('model_version', model_version)
+                    tiles.append({
+                        'box': [round(coord * scale) for coord in box],
+                        'quality': self._tile_quality(crop),
+                        'prediction': prediction['prediction'],
+                        'probabilities': prediction['probabilities'],
+                        'suspicion': 1.0 - prediction['probabilities'].get('authentic', 0.0)
+                    })
+            decoded_size = image.size
+        finally:
+            _release(image, image_path)
+        
+        valid = [tile for tile in tiles if tile['probabilities']]
+        if not valid:
+            raise RuntimeError("Model inference failed for every tile")
+        
+        if self.pooling == "max":
+            probabilities = max(valid, key=lambda tile: tile['suspicion'])['probabilities']
+        else:
+            probabilities = {
+                name: float(np.mean([tile['probabilities'][name] for tile in valid]))
+                for name in valid[0]['probabilities']
+            }
+        prediction = max(probabilities, key=probabilities.get)
+        
+        quality_metrics = {
+            name: float(np.mean([tile['quality'][name] for tile in tiles]))
+            for name in ('sharpness', 'noise_level', 'brightness', 'contrast')
+        }
+        regions = sorted(valid, key=lambda tile: tile['suspicion'], reverse=True)[:TOP_REGIONS]
+        
+        return {
+            'prediction': prediction,
+            'confidence': probabilities[prediction],
+            'probabilities': probabilities,
+            'model_version': model_version,
+            'quality_metrics': quality_metrics,
+            'tiling': {
+                'tiles': len(tiles),
+                'tile_size': round(self.tile_size * scale),
+                'decode_scale': scale,
+                'decoded_size': list(decoded_size),
+                'pooling': self.pooling,
+                'suspicious_regions': [
+                    {'box': tile['box'], 'prediction': tile['prediction'], 'suspicion': tile['suspicion']}
+                    for tile in regions
+                ]
+            }
+        }
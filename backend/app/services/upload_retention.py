@@ -0,0 +1,374 @@
+"""
+Upload retention: sharded upload storage, TTL index and background sweeper
+
+Uploads keep their flat UUID names in the API but are stored under two-level
+hash fan-out directories (uploads/ab/cd/<name>) so no directory grows past a
+few hundred entries. Every stored upload is recorded in a SQLite index with
+an expiry from its plan's TTL (UPLOAD_TTL_HOURS); the index lives outside
+UPLOAD_DIR because that directory is served statically.
+
+The sweeper deletes expired uploads in batches of UPLOAD_SWEEP_BATCH. When
+disk usage passes UPLOAD_DISK_HIGH_WATERMARK it evicts the uploads closest to
+expiry (free tier first, as its TTL is shortest) until usage is back under
+UPLOAD_DISK_LOW_WATERMARK; uploads younger than
+UPLOAD_EVICTION_MIN_AGE_SECONDS are spared so analyses in flight keep their
+files. Pre-sharding uploads in the top level of UPLOAD_DIR are adopted into
+the index once.
+
+Files live in the upload storage backend (app.services.storage). The SQLite
+index is private to one host, so UploadStore only runs on local storage.
+With STORAGE_BACKEND=s3 ObjectUploadStore keeps retention in the bucket
+itself: every upload is tagged with its plan and bucket lifecycle rules
+expire each plan's uploads after its TTL (rounded up to whole days, the
+lifecycle granularity). Every pod then shares the uploads and their
+retention, S3 does the sweeping, and there is no disk to watermark.
+"""
+import os
+import math
+import time
+import shutil
+import sqlite3
+import asyncio
+import hashlib
+import logging
+from contextlib import closing, contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.storage import MB, S3Storage, StorageBackend, StorageWriter, upload_storage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS uploads ("
+    "name TEXT PRIMARY KEY, path TEXT NOT NULL, plan TEXT NOT NULL, size INTEGER NOT NULL, "
+    "created_at REAL NOT NULL, expires_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS uploads_expires_at ON uploads (expires_at)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+)
+DEFAULT_PLAN = "free"
+RETENTION_TAG = "retention"  # Object tag holding the plan of an S3 upload
+
+
+class UploadStore:
+    """Sharded upload directory with a per-plan TTL index"""
+    
+    def __init__(self, backend: StorageBackend, index_path: str):
+        if not backend.is_local:
+            raise ValueError("The SQLite upload index is local to one host; use ObjectUploadStore for object storage")
+        self.backend = backend
+        self.index_path = index_path
+        self.on_pressure: Optional[Callable[[], None]] = None  # Set by the sweeper
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers are not blocked by the sweeper
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+    
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call: endpoints and the sweeper thread share the index
+        return sqlite3.connect(self.index_path, timeout=30)
+    
+    def key(self, name: str) -> str:
+        """Storage key of an upload: ab/cd/<name>"""
+        name = os.path.basename(name)
+        digest = hashlib.sha256(name.encode('utf-8')).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}/{name}"
+    
+    def _stored_key(self, name: Optional[str]) -> Optional[str]:
+        if not name:
+            return None
+        # Pre-sharding uploads sit at the top level of local storage
+        for key in (self.key(name), os.path.basename(name)):
+            if self.backend.exists(key):
+                return key
+        return None
+    
+    def url(self, name: Optional[str]) -> Optional[str]:
+        """URL of a retained upload (/uploads static mount, or a presigned URL)"""
+        key = self._stored_key(name)
+        return self.backend.url(key) if key else None
+    
+    def size(self, name: Optional[str]) -> Optional[int]:
+        """Size of a retained upload without fetching it, or None"""
+        key = self._stored_key(name)
+        return self.backend.size(key) if key else None
+    
+    def resolve(self, name: Optional[str]) -> Optional[str]:
+        """Local path of a retained upload, or None once it expired or was evicted"""
+        key = self._stored_key(name)
+        return self.backend.local_path(key) if key else None
+    
+    def ttl_seconds(self, plan: str) -> float:
+        hours = settings.UPLOAD_TTL_HOURS
+        return hours.get(plan, hours[DEFAULT_PLAN]) * 3600
+    
+    def retains(self, plan: str) -> bool:
+        """Whether uploads of this plan are kept at all (a zero TTL disables retention)"""
+        return self.ttl_seconds(plan) > 0
+    
+    def _register(self, name: str, plan: str, size: int, created_at: Optional[float] = None):
+        created_at = created_at or time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (name, self.key(name), plan, size, created_at, created_at + self.ttl_seconds(plan))
+            )
+            conn.commit()
+        if self.on_pressure is not None and self.bytes_over_watermark() > 0:
+            self.on_pressure()
+    
+    @contextmanager
+    def writer(self, name: str, plan: str = DEFAULT_PLAN) -> Iterator[StorageWriter]:
+        """Stream an upload into storage; it is indexed once the write committed"""
+        name = os.path.basename(name)
+        with self.backend.writer(self.key(name)) as writer:
+            yield writer
+        self._register(name, plan, writer.size)
+    
+    def save(self, name: str, content: bytes, plan: str = DEFAULT_PLAN) -> str:
+        """Store an upload from memory; returns its key"""
+        with self.writer(name, plan) as writer:
+            writer.write(content)
+        return self.key(name)
+    
+    def save_stream(self, name: str, f: BinaryIO, plan: str = DEFAULT_PLAN) -> str:
+        """Store an upload from a file object (e.g. a spooled request body); returns its key"""
+        f.seek(0)
+        with self.writer(name, plan) as writer:
+            for chunk in iter(lambda: f.read(MB), b""):
+                writer.write(chunk)
+        return self.key(name)
+    
+    def store_file(self, source_path: str, name: str, plan: str = DEFAULT_PLAN) -> str:
+        """Move an already written file (e.g. a temp upload) into storage; returns its key"""
+        name = os.path.basename(name)
+        size = os.path.getsize(source_path)
+        self.backend.put_file(self.key(name), source_path, move=True)
+        self._register(name, plan, size)
+        return self.key(name)
+    
+    def retain(self, name: str, plan: str) -> bool:
+        """Extend an upload to a longer plan TTL (never shortens it); False when nothing changed"""
+        name = os.path.basename(name)
+        with closing(self._connect()) as conn:
+            updated = conn.execute(
+                "UPDATE uploads SET plan = ?, expires_at = created_at + ? WHERE name = ? AND expires_at < created_at + ?",
+                (plan, self.ttl_seconds(plan), name, self.ttl_seconds(plan))
+            ).rowcount
+            indexed = updated or conn.execute("SELECT 1 FROM uploads WHERE name = ?", (name,)).fetchone()
+            conn.commit()
+        if not indexed:
+            logger.warning(f"Cannot retain upload {name}: it is not in the retention index")
+        return bool(updated)
+    
+    def _delete(self, rows: List[Tuple[str, str, int]]) -> int:
+        """Delete files (already missing ones are fine) and drop their index rows; returns bytes freed"""
+        freed = 0
+        for name, key, size in rows:
+            try:
+                if self.backend.delete(key.replace(os.sep, "/")):
+                    freed += size
+            except Exception as e:
+                logger.error(f"Could not delete upload {name}: {e}")
+        with closing(self._connect()) as conn:
+            conn.executemany("DELETE FROM uploads WHERE name = ?", [(row[0],) for row in rows])
+            conn.commit()
+        return freed
+    
+    def sweep_expired(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Delete every expired upload in batches; returns (uploads, bytes)"""
+        now = now or time.time()
+        deleted, freed = 0, 0
+        while True:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    "SELECT name, path, size FROM uploads WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                    (now, settings.UPLOAD_SWEEP_BATCH)
+                ).fetchall()
+            if not rows:
+                return deleted, freed
+            freed += self._delete(rows)
+            deleted += len(rows)
+    
+    def bytes_over_watermark(self) -> int:
+        """Bytes to free to get back under the low watermark, or 0 below the high watermark"""
+        if not self.backend.is_local:
+            return 0  # Object storage is not bounded by this disk
+        usage = shutil.disk_usage(self.backend.root)
+        if usage.used < settings.UPLOAD_DISK_HIGH_WATERMARK * usage.total:
+            return 0
+        return int(usage.used - settings.UPLOAD_DISK_LOW_WATERMARK * usage.total)
+    
+    def evict(self, bytes_to_free: int, now: Optional[float] = None) -> Tuple[int, int]:
+        """Emergency eviction of the uploads closest to expiry; returns (uploads, bytes)"""
+        newest = (now or time.time()) - settings.UPLOAD_EVICTION_MIN_AGE_SECONDS
+        evicted, freed = 0, 0
+        while freed < bytes_to_free:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    "SELECT name, path, size FROM uploads WHERE created_at <= ? ORDER BY expires_at LIMIT ?",
+                    (newest, settings.UPLOAD_SWEEP_BATCH)
+                ).fetchall()
+            if not rows:
+                break
+            # Stop inside the batch once enough is freed
+            needed, batch = bytes_to_free - freed, []
+            for row in rows:
+                batch.append(row)
+                needed -= row[2]
+                if needed <= 0:
+                    break
+            freed += self._delete(batch)
+            evicted += len(batch)
+        return evicted, freed
+    
+    def adopt_legacy(self) -> int:
+        """Index top-level (pre-sharding) local uploads once, with the free TTL from their mtime"""
+        if not self.backend.is_local:
+            return 0
+        with closing(self._connect()) as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_adopted'").fetchone():
+                return 0
+            rows = []
+            with os.scandir(self.backend.root) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.endswith(".part"):
+                        stat = entry.stat()
+                        rows.append((entry.name, entry.name, DEFAULT_PLAN, stat.st_size,
+                                     stat.st_mtime, stat.st_mtime + self.ttl_seconds(DEFAULT_PLAN)))
+            conn.executemany("INSERT OR IGNORE INTO uploads VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO meta VALUES ('legacy_adopted', ?)", (str(time.time()),))
+            conn.commit()
+        if rows:
+            logger.info(f"Adopted {len(rows)} legacy uploads into the retention index")
+        return len(rows)
+    
+    def sweep(self) -> Dict[str, Any]:
+        """One sweeper pass: legacy adoption, expired uploads, watermark eviction"""
+        adopted = self.adopt_legacy()
+        expired, expired_bytes = self.sweep_expired()
+        evicted, evicted_bytes = 0, 0
+        over = self.bytes_over_watermark()
+        if over > 0:
+            evicted, evicted_bytes = self.evict(over)
+            logger.warning(f"Disk above {settings.UPLOAD_DISK_HIGH_WATERMARK:.0%}: evicted {evicted} uploads ({evicted_bytes} bytes)")
+        return {
+            'adopted': adopted,
+            'expired': expired,
+            'expired_bytes': expired_bytes,
+            'evicted': evicted,
+            'evicted_bytes': evicted_bytes
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        with closing(self._connect()) as conn:
+            by_plan = conn.execute("SELECT plan, COUNT(*), COALESCE(SUM(size), 0) FROM uploads GROUP BY plan").fetchall()
+        stats: Dict[str, Any] = {'plans': {plan: {'uploads': count, 'bytes': size} for plan, count, size in by_plan}}
+        if self.backend.is_local:
+            usage = shutil.disk_usage(self.backend.root)
+            stats['disk_used_fraction'] = usage.used / usage.total
+        return stats
+
+
+class ObjectUploadStore(UploadStore):
+    """Uploads in S3, retained by a plan tag and bucket lifecycle rules that every pod shares"""
+    
+    def __init__(self, backend: S3Storage):
+        self.backend = backend
+        self.on_pressure: Optional[Callable[[], None]] = None  # Object storage never reports pressure
+        self.lifecycle_days = {plan: self.ttl_days(plan) for plan in settings.UPLOAD_TTL_HOURS}
+        rules = {
+            f"{backend.prefix}{RETENTION_TAG}-{plan}": ({RETENTION_TAG: plan}, days)
+            for plan, days in self.lifecycle_days.items()
+        }
+        # Uploads whose tagging failed still expire, after the longest TTL
+        rules[f"{backend.prefix}{RETENTION_TAG}-untagged"] = (None, max(self.lifecycle_days.values()))
+        backend.set_expiration_rules(rules)
+    
+    def ttl_days(self, plan: str) -> int:
+        return max(1, math.ceil(self.ttl_seconds(plan) / 86400))
+    
+    def _register(self, name: str, plan: str, size: int, created_at: Optional[float] = None):
+        self.backend.put_tags(self.key(name), {RETENTION_TAG: plan})
+    
+    def retain(self, name: str, plan: str) -> bool:
+        """Retag an upload with a longer plan TTL (never shortens it); False when nothing changed"""
+        key = self._stored_key(name)
+        tags = self.backend.tags(key) if key else None
+        if tags is None:
+            logger.warning(f"Cannot retain upload {os.path.basename(name)}: it is not in storage")
+            return False
+        current = tags.get(RETENTION_TAG)
+        if current is None or self.ttl_days(plan) <= self.ttl_days(current):
+            return False  # Untagged uploads already live for the longest TTL
+        self.backend.put_tags(key, {**tags, RETENTION_TAG: plan})
+        return True
+    
+    def sweep_expired(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Lifecycle rules expire uploads inside S3; nothing to do here"""
+        return 0, 0
+    
+    def evict(self, bytes_to_free: int, now: Optional[float] = None) -> Tuple[int, int]:
+        return 0, 0
+    
+    def adopt_legacy(self) -> int:
+        return 0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {'lifecycle_days': dict(self.lifecycle_days)}
+
+
+def create_upload_store(backend: StorageBackend, index_path: str) -> UploadStore:
+    """SQLite-indexed store for local storage, tag and lifecycle retention for S3"""
+    if isinstance(backend, S3Storage):
+        return ObjectUploadStore(backend)
+    return UploadStore(backend, index_path)
+
+
+class RetentionSweeper:
+    """Runs UploadStore.sweep() off the event loop every interval, or at once under disk pressure"""
+    
+    def __init__(self, store: UploadStore, interval: float):
+        self.store = store
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+    
+    def start(self):
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self.store.on_pressure = lambda: loop.call_soon_threadsafe(self._wake.set)
+        self._task = loop.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        self.store.on_pressure = None
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                result = await loop.run_in_executor(None, self.store.sweep)
+                if result['expired'] or result['evicted']:
+                    logger.info(f"Upload sweep: {result}")
+            except Exception as e:
+                logger.error(f"Upload sweep failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+upload_store = create_upload_store(upload_storage, settings.UPLOAD_INDEX_PATH)
+retention_sweeper = RetentionSweeper(upload_store, settings.UPLOAD_SWEEP_INTERVAL_SECONDS)
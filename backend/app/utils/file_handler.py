@@ -3,14 +3,19 @@ File handling utilities for uploads and temporary files
 """
 import os
 import logging
+import hashlib
 import tempfile
 import shutil
-from typing import Optional
+from typing import Optional, Tuple
 from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
 from app.core.config import settings
+from app.services.storage import StorageWriter
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 class FileHandler:
     def __init__(self):
         # Ensure upload directory exists
@@ -39,6 +44,34 @@ class FileHandler:
             logger.error(f"Error saving upload file: {e}")
             raise
     
+    async def copy_to_storage(self, upload_file: UploadFile, writer: StorageWriter) -> Tuple[int, str]:
+        """Stream an upload into a storage writer chunk by chunk; returns (size, sha256)"""
+        digest = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            # Storage writes may block on the network (S3 multipart parts)
+            await run_in_threadpool(writer.write, chunk)
+        return size, digest.hexdigest()
+    
+    async def hash_upload(self, upload_file: UploadFile) -> Tuple[int, str]:
+        """Size and sha256 of an upload, read chunk by chunk from its spooled buffer; rewinds it"""
+        digest = hashlib.sha256()
+        size = 0
+        await upload_file.seek(0)
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+        await upload_file.seek(0)
+        return size, digest.hexdigest()
+    
     def cleanup_file(self, file_path: str):
         """Remove temporary file"""
         try:
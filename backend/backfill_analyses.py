@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Re-score stored image analyses with the current model and metadata rules
+
+Run after shipping a new model or rules file. The run is checkpointed after
+every batch; rerunning with the same --checkpoint resumes, --reset starts
+over. Keep --ops-per-sec well below what live traffic leaves free.
+
+    python backfill_analyses.py --ops-per-sec 300 --workers 4
+"""
+import os
+import sys
+import json
+import argparse
+import logging
+from pymongo import MongoClient, ReadPreference
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.config import settings
+from app.services.backfill import AnalysisBackfill, BackfillCheckpoint, OpsThrottle
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-score stored image analyses')
+    parser.add_argument('--checkpoint', type=str, default='backfill_checkpoint.json', help='Resume token file')
+    parser.add_argument('--reset', action='store_true', help='Ignore an existing checkpoint')
+    parser.add_argument('--batch-size', type=int, default=64, help='Documents per cursor batch and bulk_write')
+    parser.add_argument('--workers', type=int, default=4, help='Threads reloading retained uploads')
+    parser.add_argument('--ops-per-sec', type=float, default=200, help='Database reads + writes per second (0 = unthrottled)')
+    parser.add_argument('--limit', type=int, help='Stop after this many documents (resume later)')
+    parser.add_argument('--rules-only', action='store_true', help='Do not reload uploads or run the model')
+    parser.add_argument('--force', action='store_true', help='Also re-score documents already on the current versions')
+    parser.add_argument('--read-secondary', action='store_true', help='Read from secondaries when available')
+    parser.add_argument('--dry-run', action='store_true', help='Compute updates without writing them or the checkpoint')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.reset and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    
+    client = MongoClient(settings.MONGODB_URL)
+    collection = client[settings.DATABASE_NAME].image_analyses
+    reader = collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED) if args.read_secondary else collection
+    
+    backfill = AnalysisBackfill(
+        collection,
+        BackfillCheckpoint(args.checkpoint),
+        OpsThrottle(args.ops_per_sec),
+        batch_size=args.batch_size,
+        workers=args.workers,
+        rules_only=args.rules_only,
+        force=args.force,
+        dry_run=args.dry_run,
+        reader=reader
+    )
+    try:
+        print(json.dumps(backfill.run(limit=args.limit), indent=2, default=str))
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
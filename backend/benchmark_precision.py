@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark CPU precision modes (fp32/bf16, with and without channels_last)
+for inference and training steps, with an optional fp32 parity check on a
+dataset's test split
+"""
+import os
+import sys
+import time
+import argparse
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ml.model import AIDetectionCNN, ModelManager, SimpleAIDetectionCNN
+from ml import precision as precision_modes
+
+MODES = [("fp32", False), ("fp32", True), ("bf16", False), ("bf16", True)]
+
+def measure_training(model: nn.Module, precision: str, channels_last: bool, batch_size: int,
+                     iterations: int, device: torch.device) -> float:
+    """Training steps/sec expressed as samples/sec on random input"""
+    model.train()
+    module = precision_modes.conv_module(model)
+    module.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+    optimizer = torch.optim.SGD([p for p in model.parameters() if p.requires_grad], lr=1e-4)
+    criterion = nn.CrossEntropyLoss()
+    data = precision_modes.prepare_input(torch.randn(batch_size, 3, 224, 224, device=device), channels_last)
+    target = torch.randint(0, model.num_classes, (batch_size,), device=device)
+
+    start = None
+    for step in range(iterations + 1):
+        if step == 1:
+            start = time.perf_counter()  # First step is warmup
+        optimizer.zero_grad()
+        with precision_modes.autocast(precision, device):
+            output = model(data)
+        criterion(output.float(), target).backward()
+        optimizer.step()
+    return batch_size * iterations / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU precision modes')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--dataset', type=str, help='Dataset path for the fp32 parity check')
+    parser.add_argument('--model_file', type=str, default='simple_ai_detection_model.pth',
+                        help='Checkpoint in ml/models used for the parity check')
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    print("⚡ Precision Mode Benchmark")
+    print("=" * 50)
+    print(f"Native bf16 support: {precision_modes.bf16_supported()}")
+
+    models = {
+        'ResNet50': AIDetectionCNN(pretrained=False),
+        'SimpleCNN': SimpleAIDetectionCNN()
+    }
+    for name, model in models.items():
+        print(f"\n📊 {name} (batch {args.batch_size}):")
+        baseline_infer = baseline_train = None
+        for precision, channels_last in MODES:
+            mode = precision_modes.mode_name(precision, channels_last)
+            infer = precision_modes.benchmark_throughput(
+                model, precision, channels_last, device, args.batch_size, args.iterations
+            )
+            train = measure_training(model, precision, channels_last, args.batch_size,
+                                     args.iterations, device)
+            baseline_infer = baseline_infer or infer
+            baseline_train = baseline_train or train
+            print(f"   {mode:8s} inference {infer:8.1f} img/s ({infer / baseline_infer:.2f}x)  "
+                  f"training {train:8.1f} img/s ({train / baseline_train:.2f}x)")
+
+    if args.dataset:
+        from ml.train import Trainer
+        manager = ModelManager()
+        manager.load_model(args.model_file)
+        trainer = Trainer(args.dataset)
+        test_dataset = trainer._make_dataset('test', manager.preprocessor.get_val_transform())
+        loader = DataLoader(test_dataset, batch_size=args.batch_size, shuffle=False)
+        print(f"\n🎯 Parity on test split ({len(test_dataset)} samples):")
+        for precision, channels_last in MODES[1:]:
+            report = precision_modes.parity_check(manager.model, loader, precision, channels_last, device)
+            status = "✅" if report['passed'] else "❌"
+            print(f"   {status} {report['mode']:8s} accuracy {report['mode_accuracy']:.4f} "
+                  f"(fp32 {report['fp32_accuracy']:.4f}, agreement {report['prediction_agreement']:.4f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Two-stage cascade calibration
+A cheap first-stage model (usually a distilled SimpleAIDetectionCNN) answers
+when its max softmax probability clears a threshold; everything else is
+escalated to the full ResNet50. The threshold is calibrated on the val split
+as the lowest value whose cascade accuracy still meets a target.
+
+Usage: python -m ml.cascade --dataset <name> --fast distilled_<name>.pth --full ai_detection_model_<name>.pth
+"""
+import os
+import json
+import logging
+import argparse
+from datetime import datetime
+from typing import Dict, Optional
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from ml.model import ModelManager
+
+logger = logging.getLogger(__name__)
+
+CASCADE_CONFIG_FILE = "cascade.json"
+DEFAULT_TARGET_ACCURACY = 0.95
+METADATA_DISAGREEMENT_SCORE = 0.5  # Suspicion score that contradicts an "authentic" call
+
+def config_path(model_path: str) -> str:
+    return os.path.join(model_path, CASCADE_CONFIG_FILE)
+
+def load_cascade_config(model_path: str) -> Optional[Dict]:
+    path = config_path(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def calibrate_threshold(fast_confidence: np.ndarray, fast_predictions: np.ndarray,
+                        full_predictions: np.ndarray, targets: np.ndarray,
+                        target_accuracy: float) -> Dict[str, float]:
+    """
+    Lowest confidence threshold whose cascade accuracy meets target_accuracy
+    If even full escalation misses the target, the threshold with the best
+    accuracy is returned instead.
+    """
+    fast_correct = fast_predictions == targets
+    full_correct = full_predictions == targets
+    total = max(len(targets), 1)
+
+    # Candidates: each observed confidence (samples at or above it stay on stage 1)
+    # plus "escalate everything"
+    candidates = np.concatenate([np.unique(fast_confidence), [np.inf]])
+    best = None
+    for threshold in candidates:
+        keep = fast_confidence >= threshold
+        accuracy = (np.sum(fast_correct & keep) + np.sum(full_correct & ~keep)) / total
+        escalation_rate = float(np.mean(~keep)) if len(targets) else 0.0
+        result = {'threshold': float(threshold), 'accuracy': float(accuracy),
+                  'escalation_rate': escalation_rate}
+        if accuracy >= target_accuracy:
+            return result
+        if best is None or accuracy > best['accuracy']:
+            best = result
+    logger.warning(f"Cascade cannot reach accuracy {target_accuracy:.4f}; best is {best['accuracy']:.4f}")
+    return best
+
+def _collect(manager: ModelManager, loader: DataLoader) -> tuple:
+    """(max probability, predicted index, target) arrays for a loader"""
+    manager.model.eval()
+    confidence, predictions, targets = [], [], []
+    with torch.inference_mode():
+        for data, target in loader:
+            probabilities = manager.model.predict_proba(data.to(manager.device))
+            top, index = probabilities.max(dim=1)
+            confidence.append(top.cpu().numpy())
+            predictions.append(index.cpu().numpy())
+            targets.append(target.numpy())
+    return np.concatenate(confidence), np.concatenate(predictions), np.concatenate(targets)
+
+def calibrate(dataset_path: str, fast_file: str, full_file: str,
+              target_accuracy: float = DEFAULT_TARGET_ACCURACY,
+              model_path: str = "ml/models", batch_size: int = 32) -> Dict:
+    """Calibrate on the val split and write cascade.json next to the models"""
+    from ml.train import Trainer
+
+    fast, full = ModelManager(model_path), ModelManager(model_path)
+    if not fast.load_model(fast_file) or not full.load_model(full_file):
+        raise ValueError("Both cascade stages must be trained checkpoints")
+
+    trainer = Trainer(dataset_path, model_path)
+    val_dataset = trainer._make_dataset('val', fast.preprocessor.get_val_transform())
+    loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+
+    fast_confidence, fast_predictions, targets = _collect(fast, loader)
+    _, full_predictions, _ = _collect(full, loader)
+    result = calibrate_threshold(fast_confidence, fast_predictions, full_predictions,
+                                 targets, target_accuracy)
+
+    config = {
+        'fast_model': fast_file,
+        'full_model': full_file,
+        'threshold': result['threshold'],
+        'target_accuracy': target_accuracy,
+        'val_accuracy': result['accuracy'],
+        'val_escalation_rate': result['escalation_rate'],
+        'val_fast_accuracy': float(np.mean(fast_predictions == targets)) if len(targets) else 0.0,
+        'val_full_accuracy': float(np.mean(full_predictions == targets)) if len(targets) else 0.0,
+        'metadata_disagreement_score': METADATA_DISAGREEMENT_SCORE,
+        'calibrated_at': datetime.utcnow().isoformat()
+    }
+    with open(config_path(model_path), "w") as f:
+        json.dump(config, f, indent=2)
+    logger.info(f"Cascade calibrated: {config}")
+    return config
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Calibrate the two-stage inference cascade')
+    parser.add_argument('--dataset', type=str, required=True, help='Dataset name')
+    parser.add_argument('--fast', type=str, required=True, help='First-stage checkpoint in ml/models')
+    parser.add_argument('--full', type=str, required=True, help='Second-stage checkpoint in ml/models')
+    parser.add_argument('--target-accuracy', type=float, default=DEFAULT_TARGET_ACCURACY,
+                        help='Val accuracy the cascade must reach')
+    args = parser.parse_args()
+
+    from ml.train import settings
+    calibrate(os.path.join(settings.DATASET_PATH, args.dataset), args.fast, args.full,
+              args.target_accuracy)
+
+if __name__ == "__main__":
+    main()
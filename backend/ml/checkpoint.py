@@ -0,0 +1,103 @@
+"""
+Full training checkpoints for resumable training
+A checkpoint holds everything needed to continue a run exactly where it
+stopped: model, optimizer, scheduler, RNG states, early-stopping counters
+and metric history. Writes are atomic (temp file + rename).
+"""
+import os
+import time
+import random
+import logging
+import tempfile
+from typing import Any, Dict, Optional
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+def atomic_save(obj: Any, path: str):
+    """torch.save to a temp file in the same directory, then rename over path"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:  # Also an interrupted write
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def capture_rng_state() -> Dict[str, Any]:
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def restore_rng_state(state: Dict[str, Any]):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+class TrainingCheckpointer:
+    """Periodic full-state checkpoints for one training run"""
+    
+    def __init__(self, checkpoint_dir: str, run_name: str, every: int = 1):
+        self.path = os.path.join(checkpoint_dir, f"{run_name}_last.pth")
+        self.every = max(1, every)
+        self.write_times = []
+    
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+    
+    def save(self, epoch: int, model, optimizer, scheduler, tracking: Dict[str, Any],
+             force: bool = False) -> Optional[float]:
+        """Checkpoint after `epoch` (0-based) if due. Returns write time in seconds"""
+        if not force and (epoch + 1) % self.every != 0:
+            return None
+        start = time.time()
+        atomic_save({
+            'epoch': epoch,
+            'model_state_dict': model.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'scheduler_state_dict': scheduler.state_dict(),
+            'rng_state': capture_rng_state(),
+            'tracking': tracking,
+            'num_classes': model.num_classes,
+            'class_names': model.class_names
+        }, self.path)
+        write_time = time.time() - start
+        self.write_times.append(write_time)
+        logger.info(f"Checkpoint saved to {self.path} in {write_time:.3f}s")
+        return write_time
+    
+    def load(self, model, optimizer, scheduler, device) -> Dict[str, Any]:
+        """Restore state in place; returns tracking dict with 'start_epoch'"""
+        # Our own file; the numpy RNG state needs full unpickling
+        checkpoint = torch.load(self.path, map_location=device, weights_only=False)
+        model.load_state_dict(checkpoint['model_state_dict'])
+        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+        restore_rng_state(checkpoint['rng_state'])
+        tracking = dict(checkpoint['tracking'])
+        tracking['start_epoch'] = checkpoint['epoch'] + 1
+        logger.info(f"Resumed from {self.path} at epoch {tracking['start_epoch'] + 1}")
+        return tracking
+    
+    def summary(self) -> Dict[str, float]:
+        if not self.write_times:
+            return {'checkpoint_count': 0, 'checkpoint_time_avg': 0.0, 'checkpoint_time_total': 0.0}
+        return {
+            'checkpoint_count': len(self.write_times),
+            'checkpoint_time_avg': sum(self.write_times) / len(self.write_times),
+            'checkpoint_time_total': sum(self.write_times)
+        }
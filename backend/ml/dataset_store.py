@@ -0,0 +1,268 @@
+"""
+Content-addressed dataset storage
+Images are stored once in a blob store keyed by SHA256; datasets and their
+train/val/test splits are JSON manifests that reference blobs by hash.
+A BlobStore can also sit on a storage backend (app.services.storage) whose
+root is the datasets directory, e.g. S3 shared by several pods; blobs then
+keep the same blobs/ab/cd/<hash> layout as keys.
+"""
+import os
+import json
+import random
+import shutil
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+BLOB_DIR = "blobs"
+SPLITS = ("train", "val", "test")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+
+class BlobStore:
+    """SHA256-addressed file store with two-level fan-out directories"""
+    
+    def __init__(self, root: str, storage=None):
+        self.root = root
+        self.storage = storage
+        if storage is None:
+            os.makedirs(root, exist_ok=True)
+    
+    def key(self, digest: str) -> str:
+        """Storage key of a blob, relative to the datasets root"""
+        return f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}"
+    
+    def path(self, digest: str) -> str:
+        """Filesystem path of a blob (fetched into the local cache for remote storage)"""
+        if self.storage is not None:
+            return self.storage.local_path(self.key(digest))
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+    
+    def exists(self, digest: str) -> bool:
+        if self.storage is not None:
+            return self.storage.exists(self.key(digest))
+        return os.path.exists(self.path(digest))
+    
+    def put_bytes(self, data: bytes) -> Tuple[str, bool]:
+        """Store a buffer. Returns (digest, created)"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest, False
+        if self.storage is not None:
+            self.storage.put_bytes(self.key(digest), data)
+            return digest, True
+        
+        dest = self.path(digest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, dest)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, True
+    
+    def put_file(self, file_path: str) -> Tuple[str, bool]:
+        """Store an existing file, hard-linking when possible. Returns (digest, created)"""
+        hash_sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hash_sha256.update(chunk)
+        digest = hash_sha256.hexdigest()
+        if self.exists(digest):
+            return digest, False
+        if self.storage is not None:
+            self.storage.put_file(self.key(digest), file_path)
+            return digest, True
+        
+        dest = self.path(digest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.link(file_path, dest)
+        except OSError:
+            # Different filesystem or links unsupported
+            tmp_path = dest + ".tmp"
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, dest)
+        return digest, True
+    
+    def remove(self, digest: str):
+        """Delete a blob if present"""
+        if self.storage is not None:
+            self.storage.delete(self.key(digest))
+            return
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+    
+    def garbage_collect(self, referenced: Iterable[str]) -> int:
+        """Delete blobs not in the referenced set. Returns number removed"""
+        keep = set(referenced)
+        removed = 0
+        if self.storage is not None:
+            for key in list(self.storage.list(BLOB_DIR + "/")):
+                if key.rsplit("/", 1)[-1] not in keep:
+                    self.storage.delete(key)
+                    removed += 1
+            return removed
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if name not in keep and not name.endswith(".tmp"):
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+        return removed
+
+class DatasetManifest:
+    """Dataset as a list of (hash, label, split) records over a BlobStore"""
+    
+    def __init__(self, name: str, blob_root: str, storage=None):
+        self.name = name
+        self.blob_root = blob_root
+        self.storage = storage
+        self.samples: List[Dict[str, Optional[str]]] = []
+        self._hashes = set()
+    
+    @property
+    def store(self) -> BlobStore:
+        return BlobStore(self.blob_root, self.storage)
+    
+    @property
+    def classes(self) -> List[str]:
+        return sorted({s["label"] for s in self.samples})
+    
+    @property
+    def class_to_idx(self) -> Dict[str, int]:
+        return {cls: idx for idx, cls in enumerate(self.classes)}
+    
+    def add(self, digest: str, label: str, name: str = None, split: str = None) -> bool:
+        """Add a sample; duplicates of an already listed blob are ignored"""
+        if digest in self._hashes:
+            return False
+        self._hashes.add(digest)
+        self.samples.append({"hash": digest, "label": label, "name": name, "split": split})
+        return True
+    
+    def select(self, split: str = None) -> List[Tuple[str, str]]:
+        """(blob path, label) pairs, optionally restricted to one split"""
+        store = self.store
+        return [
+            (store.path(s["hash"]), s["label"])
+            for s in self.samples
+            if split is None or s["split"] == split
+        ]
+    
+    def category_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for sample in self.samples:
+            counts[sample["label"]] = counts.get(sample["label"], 0) + 1
+        return counts
+    
+    def assign_splits(self, train_ratio: float, val_ratio: float, seed: int = None):
+        """Stratified train/val/test assignment - metadata only, no file copies"""
+        rng = random.Random(seed)
+        by_label: Dict[str, List[Dict]] = {}
+        for sample in self.samples:
+            by_label.setdefault(sample["label"], []).append(sample)
+        
+        for label, samples in sorted(by_label.items()):
+            rng.shuffle(samples)
+            total = len(samples)
+            train_size = int(total * train_ratio)
+            val_size = int(total * val_ratio)
+            for i, sample in enumerate(samples):
+                if i < train_size:
+                    sample["split"] = "train"
+                elif i < train_size + val_size:
+                    sample["split"] = "val"
+                else:
+                    sample["split"] = "test"
+            logger.info(f"Split {label}: {train_size} train, {val_size} val, "
+                        f"{total - train_size - val_size} test")
+    
+    def save(self, dataset_path: str):
+        """Atomically write the manifest into the dataset directory"""
+        os.makedirs(dataset_path, exist_ok=True)
+        payload = {
+            "version": MANIFEST_VERSION,
+            "name": self.name,
+            "blob_store": os.path.relpath(self.blob_root, dataset_path),
+            "samples": self.samples
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=dataset_path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, manifest_path(dataset_path))
+    
+    @classmethod
+    def load(cls, dataset_path: str, storage=None) -> "DatasetManifest":
+        with open(manifest_path(dataset_path)) as f:
+            payload = json.load(f)
+        manifest = cls(
+            payload["name"],
+            os.path.normpath(os.path.join(dataset_path, payload["blob_store"])),
+            storage
+        )
+        for sample in payload["samples"]:
+            manifest.add(sample["hash"], sample["label"], sample.get("name"), sample.get("split"))
+        return manifest
+
+def manifest_path(dataset_path: str) -> str:
+    return os.path.join(dataset_path, MANIFEST_FILE)
+
+def has_manifest(dataset_path: str) -> bool:
+    return os.path.exists(manifest_path(dataset_path))
+
+def default_blob_root(dataset_path: str) -> str:
+    """Blob store shared by all datasets living next to dataset_path"""
+    return os.path.join(os.path.dirname(os.path.abspath(dataset_path)), BLOB_DIR)
+
+def import_directory(dataset_path: str, blob_root: str = None) -> DatasetManifest:
+    """Build a manifest for a legacy dataset/category/images directory tree"""
+    blob_root = blob_root or default_blob_root(dataset_path)
+    store = BlobStore(blob_root)
+    manifest = DatasetManifest(os.path.basename(os.path.normpath(dataset_path)), blob_root)
+    
+    categories = sorted(d for d in os.listdir(dataset_path)
+                        if os.path.isdir(os.path.join(dataset_path, d)) and d not in SPLITS)
+    for category in categories:
+        category_path = os.path.join(dataset_path, category)
+        for img_name in sorted(os.listdir(category_path)):
+            img_path = os.path.join(category_path, img_name)
+            if os.path.isfile(img_path) and img_name.lower().endswith(IMAGE_EXTENSIONS):
+                digest, _ = store.put_file(img_path)
+                manifest.add(digest, category, img_name)
+    
+    manifest.save(dataset_path)
+    logger.info(f"Imported {len(manifest.samples)} images from {dataset_path} into {blob_root}")
+    return manifest
+
+def load_or_import(dataset_path: str) -> DatasetManifest:
+    """Manifest for a dataset, importing a legacy directory tree on first use"""
+    if has_manifest(dataset_path):
+        return DatasetManifest.load(dataset_path)
+    return import_directory(dataset_path)
+
+def split_dataset(dataset_path: str, train_ratio: float = 0.8, val_ratio: float = 0.1,
+                  seed: int = None) -> DatasetManifest:
+    """Assign train/val/test splits in the dataset manifest"""
+    manifest = load_or_import(dataset_path)
+    manifest.assign_splits(train_ratio, val_ratio, seed)
+    manifest.save(dataset_path)
+    return manifest
+
+def referenced_hashes(datasets_root: str) -> set:
+    """All blob hashes referenced by manifests under datasets_root"""
+    hashes = set()
+    for entry in os.listdir(datasets_root):
+        dataset_path = os.path.join(datasets_root, entry)
+        if os.path.isdir(dataset_path) and has_manifest(dataset_path):
+            hashes.update(s["hash"] for s in DatasetManifest.load(dataset_path).samples)
+    return hashes
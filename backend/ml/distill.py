@@ -0,0 +1,272 @@
+"""
+Knowledge distillation from the ResNet50 AIDetectionCNN into SimpleAIDetectionCNN
+The teacher labels each split once and its logits are cached in a
+memory-mapped array; the student then trains on a blend of the softened
+teacher distribution and the hard labels.
+
+Usage: python -m ml.distill --dataset <name> --teacher ai_detection_model_<name>.pth
+"""
+import os
+import glob
+import time
+import hashlib
+import logging
+import argparse
+from typing import Dict
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset
+
+from ml.model import ModelManager, SimpleAIDetectionCNN
+from ml.shards import has_shards, ShardedImageDataset
+from ml.tensor_cache import dataset_fingerprint
+from ml.train import Trainer, settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "teacher_logits"
+
+def model_fingerprint(model: nn.Module) -> str:
+    """Hash of all weights of a model"""
+    hash_sha256 = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        hash_sha256.update(name.encode())
+        hash_sha256.update(tensor.detach().cpu().numpy().tobytes())
+    return hash_sha256.hexdigest()
+
+class IndexedDataset(Dataset):
+    """Yields (image, label, index) so cached teacher logits can be looked up"""
+    
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.class_to_idx = dataset.class_to_idx
+    
+    def __len__(self):
+        return len(self.dataset)
+    
+    def __getitem__(self, idx):
+        image, label = self.dataset[idx]
+        return image, label, idx
+
+def cached_teacher_logits(teacher: nn.Module, dataset, cache_root: str, split: str,
+                          batch_size: int = 64, num_workers: int = 4,
+                          device: torch.device = torch.device("cpu")) -> np.ndarray:
+    """
+    Teacher logits for every sample of a dataset, computed once per teacher
+    Returns a read-only (N, num_classes) float32 memmap in dataset order
+    """
+    key = hashlib.sha256(
+        f"{dataset_fingerprint(dataset)}|{repr(dataset.transform)}|{model_fingerprint(teacher)}".encode()
+    ).hexdigest()[:16]
+    cache_dir = os.path.join(cache_root, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    logits_path = os.path.join(cache_dir, f"{split}-{key}.f32.npy")
+    
+    if not os.path.exists(logits_path):
+        for stale in glob.glob(os.path.join(cache_dir, f"{split}-*.npy")):
+            os.remove(stale)
+        tmp_path = logits_path + ".tmp"
+        logits = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                           shape=(len(dataset), teacher.num_classes))
+        teacher.eval()
+        offset = 0
+        with torch.inference_mode():
+            loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+            for data, _ in loader:
+                output = teacher(data.to(device)).float().cpu().numpy()
+                logits[offset:offset + len(output)] = output
+                offset += len(output)
+        logits.flush()
+        del logits
+        os.replace(tmp_path, logits_path)
+        logger.info(f"Cached {offset} {split} teacher logits to {logits_path}")
+    
+    return np.load(logits_path, mmap_mode="r")
+
+def distillation_loss(student_logits: torch.Tensor, teacher_logits: torch.Tensor,
+                      targets: torch.Tensor, temperature: float, alpha: float) -> torch.Tensor:
+    """alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE(student, labels)"""
+    soft = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean"
+    ) * (temperature ** 2)
+    hard = F.cross_entropy(student_logits, targets)
+    return alpha * soft + (1 - alpha) * hard
+
+def measure_latency(model: nn.Module, device: torch.device, iterations: int = 20) -> float:
+    """Mean single-image inference latency in milliseconds"""
+    model.eval()
+    data = torch.randn(1, 3, 224, 224, device=device)
+    with torch.inference_mode():
+        for _ in range(3):
+            model(data)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(data)
+    return (time.perf_counter() - start) / iterations * 1000
+
+class DistillationTrainer:
+    """Trains SimpleAIDetectionCNN against cached ResNet50 teacher logits"""
+    
+    def __init__(self, dataset_path: str, model_save_path: str = "ml/models"):
+        self.dataset_path = dataset_path
+        self.model_save_path = model_save_path
+        self.trainer = Trainer(dataset_path, model_save_path)
+        self.device = self.trainer.device
+        self.preprocessor = self.trainer.preprocessor
+        
+        # Training parameters
+        self.batch_size = settings.BATCH_SIZE
+        self.learning_rate = 0.001
+        self.num_epochs = 30
+        self.patience = 8
+        self.temperature = 4.0
+        self.alpha = 0.7  # Weight of the soft-target term
+    
+    def _make_dataset(self, split: str, transform) -> Dataset:
+        """Map-style dataset for a split (logits are looked up by index)"""
+        if has_shards(self.dataset_path):
+            return ShardedImageDataset(self.dataset_path, transform=transform, split=split)
+        return self.trainer._make_dataset(split, transform)
+    
+    def _load_teacher(self, teacher_file: str) -> nn.Module:
+        manager = ModelManager(self.model_save_path)
+        if not manager.load_model(teacher_file) or manager.model.architecture != "resnet50":
+            raise ValueError(f"Teacher checkpoint {teacher_file} is not a trained AIDetectionCNN")
+        return manager.model
+    
+    def _predict(self, model: nn.Module, loader: DataLoader) -> tuple:
+        """(predictions, targets) over a loader yielding (image, label, index)"""
+        model.eval()
+        predictions, targets = [], []
+        with torch.no_grad():
+            for data, target, _ in loader:
+                predictions.append(model(data.to(self.device)).argmax(dim=1).cpu())
+                targets.append(target)
+        if not predictions:
+            return torch.zeros(0, dtype=torch.long), torch.zeros(0, dtype=torch.long)
+        return torch.cat(predictions), torch.cat(targets)
+    
+    def _accuracy(self, model: nn.Module, loader: DataLoader) -> float:
+        predictions, targets = self._predict(model, loader)
+        return (predictions == targets).sum().item() / max(len(targets), 1)
+    
+    def distill(self, dataset_name: str, teacher_file: str) -> Dict[str, float]:
+        """Run distillation and save the student as distilled_<dataset>.pth"""
+        logger.info(f"Distilling {teacher_file} into SimpleAIDetectionCNN for dataset: {dataset_name}")
+        teacher = self._load_teacher(teacher_file)
+        
+        # The teacher labels deterministic crops; the student sees augmented ones
+        val_transform = self.preprocessor.get_val_transform()
+        labelled = {split: self._make_dataset(split, val_transform) for split in ('train', 'val', 'test')}
+        teacher_logits = {
+            split: cached_teacher_logits(teacher, dataset, self.dataset_path, split,
+                                         batch_size=self.batch_size, device=self.device)
+            for split, dataset in labelled.items()
+        }
+        
+        train_dataset = IndexedDataset(self._make_dataset('train', self.preprocessor.get_train_transform()))
+        train_loader = DataLoader(train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=4)
+        val_loader = DataLoader(IndexedDataset(labelled['val']), batch_size=self.batch_size, num_workers=4)
+        test_loader = DataLoader(IndexedDataset(labelled['test']), batch_size=self.batch_size, num_workers=4)
+        
+        student = SimpleAIDetectionCNN(num_classes=teacher.num_classes)
+        student.class_names = teacher.class_names
+        student.to(self.device)
+        optimizer = optim.Adam(student.parameters(), lr=self.learning_rate, weight_decay=1e-4)
+        scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'max', patience=3)
+        
+        best_val_accuracy = 0.0
+        patience_counter = 0
+        best_state = None
+        epoch = 0
+        
+        for epoch in range(self.num_epochs):
+            student.train()
+            total_loss = 0.0
+            for data, target, index in train_loader:
+                data, target = data.to(self.device), target.to(self.device)
+                soft_targets = torch.from_numpy(teacher_logits['train'][index.numpy()]).to(self.device)
+                
+                optimizer.zero_grad()
+                loss = distillation_loss(student(data), soft_targets, target, self.temperature, self.alpha)
+                loss.backward()
+                optimizer.step()
+                total_loss += loss.item()
+            
+            val_accuracy = self._accuracy(student, val_loader)
+            scheduler.step(val_accuracy)
+            logger.info(f"Distill epoch {epoch+1}/{self.num_epochs}: "
+                        f"Loss: {total_loss / max(len(train_loader), 1):.4f}, Val Acc: {val_accuracy:.4f}")
+            
+            if val_accuracy > best_val_accuracy:
+                best_val_accuracy = val_accuracy
+                best_state = {k: v.detach().clone() for k, v in student.state_dict().items()}
+                patience_counter = 0
+            else:
+                patience_counter += 1
+                if patience_counter >= self.patience:
+                    logger.info(f"Early stopping distillation at epoch {epoch+1}")
+                    break
+        
+        if best_state is not None:
+            student.load_state_dict(best_state)
+        
+        # Student vs teacher on the test split (teacher predictions come from the cache)
+        student_predictions, test_targets = self._predict(student, test_loader)
+        teacher_predictions = torch.from_numpy(np.asarray(teacher_logits['test'])).argmax(dim=1)
+        total = max(len(test_targets), 1)
+        student_accuracy = (student_predictions == test_targets).sum().item() / total
+        teacher_accuracy = (teacher_predictions == test_targets).sum().item() / total
+        agreement = (teacher_predictions == student_predictions).sum().item() / total
+        
+        teacher_latency = measure_latency(teacher, self.device)
+        student_latency = measure_latency(student, self.device)
+        
+        report = {
+            'best_val_accuracy': best_val_accuracy,
+            'student_test_accuracy': student_accuracy,
+            'teacher_test_accuracy': teacher_accuracy,
+            'accuracy_gap': teacher_accuracy - student_accuracy,
+            'teacher_agreement': agreement,
+            'teacher_latency_ms': teacher_latency,
+            'student_latency_ms': student_latency,
+            'latency_speedup': teacher_latency / max(student_latency, 1e-9)
+        }
+        
+        ModelManager(self.model_save_path).save_model(
+            student, optimizer, epoch, 0.0, best_val_accuracy,
+            f"distilled_{dataset_name}.pth",
+            extra={'teacher': teacher_file, 'distillation': report}
+        )
+        logger.info(f"Distillation report: {report}")
+        return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill AIDetectionCNN into SimpleAIDetectionCNN')
+    parser.add_argument('--dataset', type=str, required=True, help='Dataset name')
+    parser.add_argument('--teacher', type=str, required=True, help='Teacher checkpoint in ml/models')
+    parser.add_argument('--epochs', type=int, default=30, help='Number of epochs')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    parser.add_argument('--lr', type=float, default=0.001, help='Learning rate')
+    parser.add_argument('--temperature', type=float, default=4.0, help='Softmax temperature')
+    parser.add_argument('--alpha', type=float, default=0.7, help='Weight of the soft-target loss')
+    args = parser.parse_args()
+    
+    distiller = DistillationTrainer(os.path.join(settings.DATASET_PATH, args.dataset))
+    distiller.num_epochs = args.epochs
+    distiller.batch_size = args.batch_size
+    distiller.learning_rate = args.lr
+    distiller.temperature = args.temperature
+    distiller.alpha = args.alpha
+    
+    results = distiller.distill(args.dataset, args.teacher)
+    logger.info("Distillation completed!")
+    logger.info(f"Results: {results}")
+
+if __name__ == "__main__":
+    main()
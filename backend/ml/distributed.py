@@ -0,0 +1,124 @@
+"""
+Multi-process CPU data-parallel training with torch.distributed (gloo)
+
+Rendezvous is configured through environment variables:
+    MASTER_ADDR, MASTER_PORT  - address of the rank 0 node (default 127.0.0.1:29500)
+    NNODES, NODE_RANK         - number of machines and this machine's index (default 1, 0)
+Processes started by torchrun (RANK/WORLD_SIZE already set) are used as-is.
+Multi-machine runs expect the dataset and checkpoint directories on shared storage.
+"""
+import os
+import logging
+from datetime import timedelta
+from typing import Callable, Tuple
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import Dataset, Subset
+
+logger = logging.getLogger(__name__)
+
+BACKEND = "gloo"
+# Collectives wait this long, e.g. while rank 0 builds evaluation caches
+TIMEOUT_MINUTES = int(os.environ.get("DIST_TIMEOUT_MINUTES", "60"))
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+def init_distributed() -> Tuple[int, int]:
+    """Join the process group described by the environment. Returns (rank, world_size)"""
+    if is_distributed():
+        return get_rank(), get_world_size()
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return 0, 1
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", "29500")
+    dist.init_process_group(backend=BACKEND, init_method="env://",
+                            timeout=timedelta(minutes=TIMEOUT_MINUTES))
+    # Split cores between the processes sharing this machine
+    local_world = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world))
+    logger.info(f"Joined {BACKEND} process group: rank {get_rank()}/{world_size}")
+    return get_rank(), world_size
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+def all_reduce_sum(values) -> list:
+    """Sum a list of numbers across ranks (no-op when not distributed)"""
+    if not is_distributed():
+        return list(values)
+    tensor = torch.tensor(list(values), dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+def shared_seed() -> int:
+    """A seed that is identical on every rank (rank 0 draws it)"""
+    seed = torch.initial_seed() % (2 ** 31)
+    if not is_distributed():
+        return seed
+    tensor = torch.tensor([seed], dtype=torch.int64)
+    dist.broadcast(tensor, src=0)
+    return int(tensor.item())
+
+def eval_shard(dataset: Dataset) -> Dataset:
+    """
+    This rank's strided slice of an evaluation dataset
+    Unlike DistributedSampler nothing is padded, so summed metrics are exact
+    """
+    if not is_distributed():
+        return dataset
+    shard = Subset(dataset, range(get_rank(), len(dataset), get_world_size()))
+    shard.class_to_idx = dataset.class_to_idx
+    return shard
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+def launch_requested(nproc_per_node: int) -> bool:
+    """True when the command line or environment asks for more than one process"""
+    return (nproc_per_node > 1 or int(os.environ.get("NNODES", "1")) > 1
+            or "RANK" in os.environ)
+
+def _worker(local_rank: int, nproc_per_node: int, fn: Callable, args: tuple):
+    nnodes = int(os.environ.get("NNODES", "1"))
+    node_rank = int(os.environ.get("NODE_RANK", "0"))
+    os.environ["LOCAL_RANK"] = str(local_rank)
+    os.environ["LOCAL_WORLD_SIZE"] = str(nproc_per_node)
+    os.environ["RANK"] = str(node_rank * nproc_per_node + local_rank)
+    os.environ["WORLD_SIZE"] = str(nnodes * nproc_per_node)
+    init_distributed()
+    try:
+        fn(*args)
+    finally:
+        cleanup_distributed()
+
+def launch(fn: Callable, nproc_per_node: int, args: tuple = ()):
+    """
+    Run fn(*args) in nproc_per_node processes on this machine
+    For several machines, run the same command on each with NNODES/NODE_RANK
+    and a shared MASTER_ADDR/MASTER_PORT
+    """
+    if "RANK" in os.environ and "WORLD_SIZE" in os.environ:
+        # Already started by torchrun or another launcher
+        init_distributed()
+        try:
+            fn(*args)
+        finally:
+            cleanup_distributed()
+        return
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", "29500")
+    mp.spawn(_worker, args=(nproc_per_node, fn, args), nprocs=nproc_per_node, join=True)
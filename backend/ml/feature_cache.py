@@ -0,0 +1,155 @@
+"""
+Frozen-backbone feature caching for fast head training
+AIDetectionCNN keeps almost all of its ResNet50 backbone frozen, so the
+2048-d backbone embeddings of a dataset can be computed once, stored in a
+memory-mapped array and reused to train only the classifier head
+"""
+import os
+import glob
+import hashlib
+import logging
+from typing import Tuple
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset
+
+from ml.tensor_cache import dataset_fingerprint
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "feature_cache"
+
+def backbone_fingerprint(model: nn.Module) -> str:
+    """Hash of the backbone weights the features were computed with"""
+    hash_sha256 = hashlib.sha256()
+    for name, tensor in model.backbone.state_dict().items():
+        hash_sha256.update(name.encode())
+        hash_sha256.update(tensor.detach().cpu().numpy().tobytes())
+    return hash_sha256.hexdigest()
+
+class FeatureDataset(Dataset):
+    """Backbone embeddings read from a memory-mapped float32 array"""
+    
+    def __init__(self, features_path: str, labels_path: str):
+        self.features = np.load(features_path, mmap_mode="r")
+        self.labels = np.load(labels_path)
+    
+    def __len__(self):
+        return len(self.labels)
+    
+    def __getitem__(self, idx):
+        return torch.from_numpy(np.array(self.features[idx])), int(self.labels[idx])
+
+def cached_features(model: nn.Module, dataset, cache_root: str, split: str,
+                    views: int = 1, batch_size: int = 64, num_workers: int = 4,
+                    device: torch.device = torch.device("cpu")) -> FeatureDataset:
+    """
+    Compute (or reuse) backbone embeddings for a dataset
+    views > 1 stores that many passes over the dataset, which gives a fixed
+    number of augmented views when the dataset uses a random transform
+    """
+    key = hashlib.sha256(
+        f"{dataset_fingerprint(dataset)}|{repr(dataset.transform)}|{views}|"
+        f"{backbone_fingerprint(model)}".encode()
+    ).hexdigest()[:16]
+    cache_dir = os.path.join(cache_root, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    features_path = os.path.join(cache_dir, f"{split}-{key}.f32.npy")
+    labels_path = os.path.join(cache_dir, f"{split}-{key}.labels.npy")
+    
+    if not (os.path.exists(features_path) and os.path.exists(labels_path)):
+        for stale in glob.glob(os.path.join(cache_dir, f"{split}-*.npy")):
+            os.remove(stale)
+        _extract(model, dataset, features_path, labels_path, views, batch_size, num_workers, device)
+    
+    return FeatureDataset(features_path, labels_path)
+
+def _extract(model: nn.Module, dataset, features_path: str, labels_path: str, views: int,
+             batch_size: int, num_workers: int, device: torch.device):
+    """Run the backbone once per view and write embeddings to a memmap"""
+    total = len(dataset) * views
+    num_features = model.classifier[1].in_features
+    
+    tmp_features = features_path + ".tmp"
+    features = np.lib.format.open_memmap(tmp_features, mode="w+", dtype=np.float32,
+                                         shape=(total, num_features))
+    labels = np.zeros(total, dtype=np.int64)
+    
+    model.eval()
+    offset = 0
+    with torch.inference_mode():
+        for view in range(views):
+            loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+            for data, target in loader:
+                embeddings = model.backbone(data.to(device)).cpu().numpy()
+                features[offset:offset + len(embeddings)] = embeddings
+                labels[offset:offset + len(embeddings)] = target.numpy()
+                offset += len(embeddings)
+            logger.info(f"Extracted view {view + 1}/{views}: {offset}/{total} embeddings")
+    
+    features.flush()
+    del features
+    os.replace(tmp_features, features_path)
+    tmp_labels = labels_path + ".tmp"
+    with open(tmp_labels, "wb") as f:
+        np.save(f, labels)
+    os.replace(tmp_labels, labels_path)
+
+def train_head(model: nn.Module, train_features: FeatureDataset, val_features: FeatureDataset,
+               epochs: int = 50, learning_rate: float = 0.001, batch_size: int = 256,
+               patience: int = 10) -> Tuple[float, dict]:
+    """
+    Train only model.classifier on cached embeddings
+    Returns (best validation accuracy, best classifier state dict)
+    """
+    device = next(model.classifier.parameters()).device
+    head = model.classifier
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(head.parameters(), lr=learning_rate, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=5)
+    
+    train_loader = DataLoader(train_features, batch_size=batch_size, shuffle=True)
+    val_loader = DataLoader(val_features, batch_size=batch_size, shuffle=False)
+    
+    best_accuracy = 0.0
+    best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+    patience_counter = 0
+    
+    for epoch in range(epochs):
+        head.train()
+        train_loss = 0.0
+        for data, target in train_loader:
+            data, target = data.to(device), target.to(device)
+            optimizer.zero_grad()
+            loss = criterion(head(data), target)
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item()
+        
+        head.eval()
+        val_loss, correct = 0.0, 0
+        with torch.no_grad():
+            for data, target in val_loader:
+                data, target = data.to(device), target.to(device)
+                output = head(data)
+                val_loss += criterion(output, target).item()
+                correct += (output.argmax(dim=1) == target).sum().item()
+        val_loss /= max(len(val_loader), 1)
+        val_accuracy = correct / max(len(val_features), 1)
+        scheduler.step(val_loss)
+        
+        logger.info(f"Head epoch {epoch+1}/{epochs}: Train Loss: {train_loss / max(len(train_loader), 1):.4f}, "
+                    f"Val Loss: {val_loss:.4f}, Val Acc: {val_accuracy:.4f}")
+        
+        if val_accuracy > best_accuracy:
+            best_accuracy = val_accuracy
+            best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+            patience_counter = 0
+        else:
+            patience_counter += 1
+            if patience_counter >= patience:
+                logger.info(f"Early stopping head training at epoch {epoch+1}")
+                break
+    
+    return best_accuracy, best_state
@@ -7,17 +7,56 @@ import torch.nn.functional as F
 import torchvision.transforms as transforms
 from torchvision.models import resnet50, ResNet50_Weights
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import os
+import time
+import threading
+
+from ml.checkpoint import atomic_save
+from ml import precision as precision_modes
+from ml.registry import ModelRegistry, REGISTRY_DIR
 
 logger = logging.getLogger(__name__)
 
-class AIDetectionCNN(nn.Module):
+class DetectionModel(nn.Module):
+    """Shared prediction helpers for the detection architectures"""
+    
+    architecture = None
+    
+    def predict_proba(self, x):
+        """Get prediction probabilities"""
+        with torch.no_grad():
+            logits = self.forward(x)
+            probabilities = F.softmax(logits.float(), dim=1)
+        return probabilities
+    
+    def predict(self, x):
+        """Get predictions with confidence scores"""
+        probabilities = self.predict_proba(x)
+        predicted_classes = torch.argmax(probabilities, dim=1)
+        confidence_scores = torch.max(probabilities, dim=1)[0]
+        
+        results = []
+        for i in range(len(predicted_classes)):
+            results.append({
+                'prediction': self.class_names[predicted_classes[i]],
+                'confidence': confidence_scores[i].item(),
+                'probabilities': {
+                    name: prob.item() 
+                    for name, prob in zip(self.class_names, probabilities[i])
+                }
+            })
+        
+        return results
+
+class AIDetectionCNN(DetectionModel):
     """
     CNN model for detecting AI-generated images
     Based on ResNet50 with custom classification head
     """
     
+    architecture = "resnet50"
+    
     def __init__(self, num_classes: int = 3, pretrained: bool = True):
         super(AIDetectionCNN, self).__init__()
         
@@ -54,32 +93,83 @@ class AIDetectionCNN(nn.Module):
         features = self.backbone(x)
         output = self.classifier(features)
         return output
+
+class SimpleAIDetectionCNN(DetectionModel):
+    """Simplified CNN for AI detection"""
     
-    def predict_proba(self, x):
-        """Get prediction probabilities"""
-        with torch.no_grad():
-            logits = self.forward(x)
-            probabilities = F.softmax(logits, dim=1)
-        return probabilities
+    architecture = "simple"
     
-    def predict(self, x):
-        """Get predictions with confidence scores"""
-        probabilities = self.predict_proba(x)
-        predicted_classes = torch.argmax(probabilities, dim=1)
-        confidence_scores = torch.max(probabilities, dim=1)[0]
+    def __init__(self, num_classes=3):
+        super(SimpleAIDetectionCNN, self).__init__()
         
-        results = []
-        for i in range(len(predicted_classes)):
-            results.append({
-                'prediction': self.class_names[predicted_classes[i]],
-                'confidence': confidence_scores[i].item(),
-                'probabilities': {
-                    name: prob.item() 
-                    for name, prob in zip(self.class_names, probabilities[i])
-                }
-            })
+        self.features = nn.Sequential(
+            # First conv block
+            nn.Conv2d(3, 32, kernel_size=3, padding=1),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(kernel_size=2, stride=2),
+            
+            # Second conv block
+            nn.Conv2d(32, 64, kernel_size=3, padding=1),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(kernel_size=2, stride=2),
+            
+            # Third conv block
+            nn.Conv2d(64, 128, kernel_size=3, padding=1),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(kernel_size=2, stride=2),
+            
+            # Fourth conv block
+            nn.Conv2d(128, 256, kernel_size=3, padding=1),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(kernel_size=2, stride=2),
+        )
         
-        return results
+        self.classifier = nn.Sequential(
+            nn.Dropout(0.5),
+            nn.Linear(256 * 14 * 14, 512),
+            nn.ReLU(inplace=True),
+            nn.Dropout(0.3),
+            nn.Linear(512, 128),
+            nn.ReLU(inplace=True),
+            nn.Linear(128, num_classes)
+        )
+        
+        self.num_classes = num_classes
+        self.class_names = ["authentic", "ai_generated", "manipulated"]
+    
+    def forward(self, x):
+        x = self.features(x)
+        x = torch.flatten(x, 1)  # Also valid for channels_last activations
+        x = self.classifier(x)
+        return x
+
+ARCHITECTURES = {
+    AIDetectionCNN.architecture: AIDetectionCNN,
+    SimpleAIDetectionCNN.architecture: SimpleAIDetectionCNN
+}
+
+def checkpoint_architecture(checkpoint: Dict[str, Any]) -> str:
+    """Architecture of a checkpoint; older files are recognised by their weights"""
+    if 'architecture' in checkpoint:
+        return checkpoint['architecture']
+    state_dict = checkpoint['model_state_dict']
+    if any(key.startswith('backbone.') for key in state_dict):
+        return AIDetectionCNN.architecture
+    return SimpleAIDetectionCNN.architecture
+
+def build_model(architecture: str, num_classes: int = 3,
+                channel_config: Dict[str, Any] = None) -> DetectionModel:
+    """Untrained model of an architecture, shaped to take a checkpoint's weights"""
+    from ml.prune import PRUNED_ARCHITECTURE, apply_channel_config
+    
+    if architecture == PRUNED_ARCHITECTURE:
+        return apply_channel_config(AIDetectionCNN(num_classes=num_classes, pretrained=False), channel_config)
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unknown model architecture '{architecture}'")
+    if architecture == AIDetectionCNN.architecture:
+        return AIDetectionCNN(num_classes=num_classes, pretrained=False)
+    return ARCHITECTURES[architecture](num_classes=num_classes)
+
 
 class ImagePreprocessor:
     """Image preprocessing for the AI detection model"""
@@ -105,29 +195,78 @@ class ImagePreprocessor:
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
         ])
+        
+        # Test-time augmentation: views are cropped from this resized tensor
+        self.tta_transform = transforms.Compose([
+            transforms.Resize((256, 256)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        ])
+        
+        # Tiled analysis: the whole tile is resized so every pixel is covered
+        self.tile_transform = transforms.Compose([
+            transforms.Resize(image_size),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        ])
     
     def get_train_transform(self):
         return self.train_transform
     
     def get_val_transform(self):
         return self.val_transform
+    
+    def get_tta_transform(self):
+        return self.tta_transform
+    
+    def get_tile_transform(self):
+        return self.tile_transform
 
 class ModelManager:
     """Manages model loading, saving, and inference"""
     
+    MODEL_VERSION = "2.1.0-optimized"  # Reported for models not loaded from the registry
+    DEFAULT_MODEL_FILE = "simple_ai_detection_model.pth"
+    WARMUP_ITERATIONS = 3
+    
     def __init__(self, model_path: str = "ml/models"):
         self.model_path = model_path
-        self.model = None
+        self.model = None  # Serving reference; replaced atomically on hot swap
+        self.registry = ModelRegistry(os.path.join(model_path, REGISTRY_DIR))
+        self.swap_lock = threading.Lock()
+        self.swap_status = {'state': 'idle'}
+        self._registry_stamp = None  # Index state last followed by sync_active_version
+        self._watch_stop: Optional[threading.Event] = None
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.preprocessor = ImagePreprocessor()
+        self.precision = "fp32"
+        self.channels_last = False
+        self.parity_report = None
+        self.fast_stage = None  # First-stage ModelManager when cascade mode is on
+        self.cascade_config = None
         
         # Ensure model directory exists
         os.makedirs(model_path, exist_ok=True)
         
         logger.info(f"Using device: {self.device}")
     
-    def load_model(self, model_file: str = "simple_ai_detection_model.pth") -> bool:
-        """Load trained model from file"""
+    def load_model(self, model_file: str = None) -> bool:
+        """Load trained model from file
+        
+        Without a file name the registry's active version is loaded if one is
+        set, otherwise DEFAULT_MODEL_FILE.
+        """
+        if model_file is None:
+            active = self.registry.active_version()
+            if active is not None:
+                try:
+                    self.model = self._load_version(active)
+                    logger.info(f"✅ Registry model {active} loaded")
+                    return True
+                except Exception as e:
+                    logger.error(f"Error loading registry model {active}: {e}")
+            model_file = self.DEFAULT_MODEL_FILE
+        
         try:
             model_filepath = os.path.join(self.model_path, model_file)
             
@@ -143,22 +282,11 @@ class ModelManager:
                     self.model = AIDetectionCNN(pretrained=True)
                     self.model.to(self.device)
                     self.model.eval()
+                    self._apply_memory_format()
                     logger.info("✅ Using pretrained ResNet50 model as fallback")
                     return False
             
-            # Load model state
-            checkpoint = torch.load(model_filepath, map_location=self.device)
-            
-            # Initialize model
-            self.model = AIDetectionCNN(
-                num_classes=checkpoint.get('num_classes', 3),
-                pretrained=False
-            )
-            
-            # Load weights
-            self.model.load_state_dict(checkpoint['model_state_dict'])
-            self.model.to(self.device)
-            self.model.eval()
+            self.model = self._load_checkpoint(model_filepath)
             
             logger.info(f"✅ Real trained model loaded successfully from {model_filepath}")
             return True
@@ -169,11 +297,209 @@ class ModelManager:
             self.model = AIDetectionCNN(pretrained=True)
             self.model.to(self.device)
             self.model.eval()
+            self._apply_memory_format()
             logger.info("✅ Using pretrained ResNet50 model as fallback")
             return False
     
+    def _load_checkpoint(self, path: str) -> DetectionModel:
+        """Build, load and prepare a model from a checkpoint without serving it"""
+        checkpoint = torch.load(path, map_location=self.device)
+        
+        # Initialize model (ResNet50, pruned ResNet50 or a distilled SimpleAIDetectionCNN student)
+        model = build_model(
+            checkpoint_architecture(checkpoint),
+            num_classes=checkpoint.get('num_classes', 3),
+            channel_config=checkpoint.get('channel_config')
+        )
+        model.class_names = checkpoint.get('class_names', model.class_names)
+        
+        # Load weights
+        model.load_state_dict(checkpoint['model_state_dict'])
+        model.to(self.device)
+        model.eval()
+        self._apply_memory_format(model)
+        return model
+    
+    def _load_version(self, version: str) -> DetectionModel:
+        if not self.registry.verify(version):
+            raise ValueError(f"Registry checkpoint for {version} is missing or fails its hash check")
+        model = self._load_checkpoint(self.registry.checkpoint_path(version))
+        model.registry_version = version
+        return model
+    
+    def _warm_up(self, model: DetectionModel):
+        """Run a few forwards so kernels and allocator pools are ready before serving"""
+        data = precision_modes.prepare_input(
+            torch.zeros(1, 3, *self.preprocessor.image_size, device=self.device), self.channels_last
+        )
+        with torch.inference_mode(), precision_modes.autocast(self.precision, self.device):
+            for _ in range(self.WARMUP_ITERATIONS):
+                model(data)
+    
+    def activate_version(self, version: str, persist: bool = True) -> Dict[str, Any]:
+        """
+        Hot-swap the serving model to a registry version
+        The new model is loaded and warmed up off the serving path, then the
+        serving reference is replaced in one assignment. Requests that already
+        picked up the old model finish on it. With persist the version is
+        also made active in the registry, which the other workers and pods
+        follow through sync_active_version.
+        """
+        if self.registry.get(version) is None:
+            raise KeyError(f"Unknown model version {version}")
+        if not self.swap_lock.acquire(blocking=False):
+            raise RuntimeError("Another model swap is in progress")
+        try:
+            started = time.time()
+            self.swap_status = {'state': 'loading', 'version': version}
+            model = self._load_version(version)
+            self.swap_status = {'state': 'warming_up', 'version': version}
+            self._warm_up(model)
+            
+            previous = getattr(self.model, 'registry_version', None)
+            self.model = model
+            if persist:
+                self.registry.set_active(version)
+            self.swap_status = {
+                'state': 'active', 'version': version, 'previous_version': previous,
+                'swap_seconds': time.time() - started
+            }
+            logger.info(f"✅ Serving model swapped {previous} -> {version}")
+            return self.swap_status
+        except Exception as e:
+            self.swap_status = {'state': 'failed', 'version': version, 'error': str(e)}
+            logger.error(f"Model swap to {version} failed: {e}")
+            raise
+        finally:
+            self.swap_lock.release()
+    
+    def sync_active_version(self) -> Optional[Dict[str, Any]]:
+        """
+        Swap to the registry's active version if another process changed it
+        Returns the swap status when a swap happened. A failed swap is not
+        retried until the registry index changes again.
+        """
+        stamp = self.registry.index_stamp()
+        if stamp is None or stamp == self._registry_stamp:
+            return None
+        active = self.registry.active_version()
+        if active is None or active == getattr(self.model, 'registry_version', None):
+            self._registry_stamp = stamp
+            return None
+        if self.swap_lock.locked():
+            return None  # A local swap is running; look again on the next poll
+        self._registry_stamp = stamp
+        logger.info(f"Registry active version changed to {active}, following it")
+        try:
+            return self.activate_version(active, persist=False)
+        except Exception:
+            return None  # Recorded in swap_status
+    
+    def watch_registry(self, interval: float) -> threading.Thread:
+        """Poll the registry every `interval` seconds in a daemon thread"""
+        self.stop_watching_registry()
+        stop = threading.Event()
+        
+        def poll():
+            while not stop.wait(interval):
+                try:
+                    self.sync_active_version()
+                except Exception as e:
+                    logger.error(f"Registry poll failed: {e}")
+        
+        self._watch_stop = stop
+        thread = threading.Thread(target=poll, name="registry-watch", daemon=True)
+        thread.start()
+        return thread
+    
+    def stop_watching_registry(self):
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
+    
+    @property
+    def precision_mode(self) -> str:
+        return precision_modes.mode_name(self.precision, self.channels_last)
+    
+    @property
+    def model_version(self) -> str:
+        """Version of the current serving model"""
+        return self.version_of(self.model)
+    
+    def version_of(self, model: nn.Module) -> str:
+        """Registry version of a model (or MODEL_VERSION), plus any non-default precision mode"""
+        version = getattr(model, 'registry_version', None) or self.MODEL_VERSION
+        if self.precision_mode == "fp32":
+            return version
+        return f"{version}+{self.precision_mode}"
+    
+    def configure_precision(self, precision: str = "fp32", channels_last: bool = False,
+                            parity_loader=None) -> Dict[str, Any]:
+        """
+        Select the inference precision mode
+        With parity_loader (e.g. the test split) accuracy is compared with fp32
+        first and the manager stays on fp32 if the mode loses too much.
+        """
+        precision_modes.validate_precision(precision)
+        if precision == "bf16" and self.device.type == "cpu" and not precision_modes.bf16_supported():
+            logger.warning("CPU has no native bf16 kernels; bf16 inference will be emulated and slow")
+        if self.model is None:
+            self.load_model()
+        
+        report = None
+        if parity_loader is not None and (precision != "fp32" or channels_last):
+            report = precision_modes.parity_check(
+                self.model, parity_loader, precision, channels_last, self.device
+            )
+            if not report['passed']:
+                logger.warning(f"Precision mode {report['mode']} failed the parity check, staying on fp32")
+                precision, channels_last = "fp32", False
+        
+        self.precision = precision
+        self.channels_last = channels_last
+        self.parity_report = report
+        self._apply_memory_format()
+        if self.fast_stage is not None:
+            # The cascade's first stage serves in the same mode
+            self.fast_stage.precision, self.fast_stage.channels_last = precision, channels_last
+            self.fast_stage._apply_memory_format()
+        logger.info(f"Inference precision mode: {self.precision_mode}")
+        return report or {'mode': self.precision_mode}
+    
+    def enable_cascade(self) -> bool:
+        """
+        Serve through the calibrated two-stage cascade in cascade.json
+        This manager holds the full model; a second manager holds the fast one.
+        """
+        from ml.cascade import load_cascade_config
+        
+        config = load_cascade_config(self.model_path)
+        if config is None:
+            logger.warning("No cascade.json found; run python -m ml.cascade to calibrate")
+            return False
+        
+        fast_stage = ModelManager(self.model_path)
+        if not fast_stage.load_model(config['fast_model']) or not self.load_model(config['full_model']):
+            logger.error("Cascade models could not be loaded, serving a single model")
+            return False
+        fast_stage.precision, fast_stage.channels_last = self.precision, self.channels_last
+        fast_stage._apply_memory_format()
+        
+        self.fast_stage = fast_stage
+        self.cascade_config = config
+        logger.info(f"✅ Cascade enabled: {config['fast_model']} -> {config['full_model']} "
+                    f"(threshold {config['threshold']:.3f})")
+        return True
+    
+    def _apply_memory_format(self, model: nn.Module = None):
+        model = model if model is not None else self.model
+        module = precision_modes.conv_module(model) if model is not None else None
+        if module is not None:
+            module.to(memory_format=torch.channels_last if self.channels_last else torch.contiguous_format)
+    
     def save_model(self, model: nn.Module, optimizer, epoch: int, 
-                   loss: float, accuracy: float, model_file: str = "ai_detection_model.pth"):
+                   loss: float, accuracy: float, model_file: str = "ai_detection_model.pth",
+                   extra: Dict[str, Any] = None):
         """Save trained model to file"""
         try:
             model_filepath = os.path.join(self.model_path, model_file)
@@ -185,45 +511,169 @@ class ModelManager:
                 'loss': loss,
                 'accuracy': accuracy,
                 'num_classes': model.num_classes,
-                'class_names': model.class_names
+                'class_names': model.class_names,
+                'architecture': model.architecture
             }
+            if getattr(model, 'channel_config', None):
+                checkpoint['channel_config'] = model.channel_config  # Pruned bottleneck widths
+            if extra:
+                checkpoint.update(extra)
             
-            torch.save(checkpoint, model_filepath)
+            atomic_save(checkpoint, model_filepath)
             logger.info(f"Model saved to {model_filepath}")
             
         except Exception as e:
             logger.error(f"Error saving model: {e}")
     
-    def predict_image(self, image_tensor: torch.Tensor) -> Dict[str, Any]:
-        """Predict on a single image tensor - OPTIMIZED for speed"""
+    def predict_image(self, image_tensor: torch.Tensor,
+                      metadata_suspicion: float = None) -> Dict[str, Any]:
+        """Predict on a single image tensor - OPTIMIZED for speed
+        
+        In cascade mode the fast model answers unless it is unsure or an
+        "authentic" call contradicts a high metadata suspicion score; the
+        result's 'cascade' entry records which stage decided.
+        """
+        if self.fast_stage is not None:
+            return self._predict_cascade(image_tensor, metadata_suspicion)
+        return self._predict_single(image_tensor)
+    
+    def _predict_cascade(self, image_tensor: torch.Tensor,
+                         metadata_suspicion: float = None) -> Dict[str, Any]:
+        threshold = self.cascade_config['threshold']
+        disagreement_score = self.cascade_config.get('metadata_disagreement_score', 0.5)
+        
+        fast_result = self.fast_stage._predict_single(image_tensor)
+        if fast_result['prediction'] == 'error' or fast_result['confidence'] < threshold:
+            reason = 'low_confidence'
+        elif (fast_result['prediction'] == 'authentic' and metadata_suspicion is not None
+              and metadata_suspicion >= disagreement_score):
+            reason = 'metadata_disagreement'
+        else:
+            fast_result['cascade'] = {
+                'stage': 'fast', 'reason': 'confident',
+                'fast_confidence': fast_result['confidence'], 'threshold': threshold
+            }
+            return fast_result
+        
+        result = self._predict_single(image_tensor)
+        result['cascade'] = {
+            'stage': 'full', 'reason': reason,
+            'fast_confidence': fast_result['confidence'], 'threshold': threshold
+        }
+        return result
+    
+    def predict_tta(self, image, latency_budget_ms: float) -> Dict[str, Any]:
+        """Predict from a batch of crop/flip views of a PIL image in one forward pass
+        
+        The view count is the most the serving model's measured throughput fits
+        into latency_budget_ms; probabilities are averaged over the views. The
+        cascade is bypassed: every view goes through the full model.
+        """
+        from ml import tta
+        
         if self.model is None:
             self.load_model()
+        model = self.model
+        
+        try:
+            model.eval()
+            latency = tta.latency_model(model, self)
+            num_views = latency.views_for(latency_budget_ms)
+            views, names = tta.tta_views(image, self.preprocessor, num_views)
+            views = precision_modes.prepare_input(views.to(self.device), self.channels_last)
+            
+            started = time.perf_counter()
+            with torch.inference_mode(), precision_modes.autocast(self.precision, self.device):
+                view_probabilities = model.predict_proba(views)
+            forward_seconds = time.perf_counter() - started
+            latency.update(num_views, forward_seconds)
+            
+            probabilities = view_probabilities.mean(dim=0)
+            predicted = torch.argmax(probabilities).item()
+            return {
+                'prediction': model.class_names[predicted],
+                'confidence': probabilities[predicted].item(),
+                'probabilities': {
+                    name: prob.item() for name, prob in zip(model.class_names, probabilities)
+                },
+                'model_version': self.version_of(model),
+                'tta': {
+                    'views': num_views,
+                    'latency_budget_ms': latency_budget_ms,
+                    'predicted_ms': latency.predict_ms(num_views),
+                    'forward_ms': forward_seconds * 1000.0,
+                    **tta.summarize_views(view_probabilities, names, model.class_names)
+                }
+            }
+            
+        except Exception as e:
+            logger.error(f"Error during TTA prediction: {e}")
+            return {
+                'prediction': 'error',
+                'confidence': 0.0,
+                'probabilities': {},
+                'model_version': self.version_of(model)
+            }
+    
+    def predict_batch(self, batch: torch.Tensor) -> List[Dict[str, Any]]:
+        """Predict on a (N, C, H, W) batch in one forward pass, e.g. image tiles"""
+        if self.model is None:
+            self.load_model()
+        model = self.model
+        
+        try:
+            model.eval()
+            batch = precision_modes.prepare_input(batch.to(self.device), self.channels_last)
+            with torch.inference_mode(), precision_modes.autocast(self.precision, self.device):
+                results = model.predict(batch)
+            for result in results:
+                result['model_version'] = self.version_of(model)
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error during batch prediction: {e}")
+            return [{
+                'prediction': 'error',
+                'confidence': 0.0,
+                'probabilities': {},
+                'model_version': self.version_of(model)
+            } for _ in range(len(batch))]
+    
+    def _predict_single(self, image_tensor: torch.Tensor) -> Dict[str, Any]:
+        if self.model is None:
+            self.load_model()
+        # One read of the serving reference: a concurrent hot swap cannot
+        # change the model (or its version) halfway through this request
+        model = self.model
         
         try:
             # Ensure model is in eval mode
-            self.model.eval()
+            model.eval()
             
             # Add batch dimension if needed
             if len(image_tensor.shape) == 3:
                 image_tensor = image_tensor.unsqueeze(0)
             
             # Move to device
-            image_tensor = image_tensor.to(self.device)
+            image_tensor = precision_modes.prepare_input(image_tensor.to(self.device), self.channels_last)
             
             # Get prediction with optimized inference
             with torch.no_grad():
                 # Use torch.inference_mode for better performance
-                with torch.inference_mode():
-                    results = self.model.predict(image_tensor)
+                with torch.inference_mode(), precision_modes.autocast(self.precision, self.device):
+                    results = model.predict(image_tensor)
             
-            return results[0]  # Return first (and only) result
+            result = results[0]  # Return first (and only) result
+            result['model_version'] = self.version_of(model)
+            return result
             
         except Exception as e:
             logger.error(f"Error during prediction: {e}")
             return {
                 'prediction': 'error',
                 'confidence': 0.0,
-                'probabilities': {}
+                'probabilities': {},
+                'model_version': self.version_of(model)
             }
 
 # Global model manager instance
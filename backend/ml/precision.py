@@ -0,0 +1,122 @@
+"""
+Reduced-precision and memory-format modes for CPU training and inference
+bf16 runs matmuls/convolutions under torch.autocast; channels_last stores the
+convolutional part of a model (ResNet50 backbone or SimpleAIDetectionCNN
+features) in NHWC layout, which oneDNN convolutions prefer on modern Xeons.
+"""
+import time
+import logging
+from contextlib import nullcontext
+from typing import Dict, Optional
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "bf16")
+PARITY_TOLERANCE = 0.01  # Largest accepted test accuracy drop against fp32
+
+def validate_precision(precision: str) -> str:
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+    return precision
+
+def mode_name(precision: str, channels_last: bool) -> str:
+    """Short tag such as 'fp32', 'bf16' or 'bf16-cl'"""
+    return precision + ("-cl" if channels_last else "")
+
+def bf16_supported() -> bool:
+    """Whether this CPU has native bf16 kernels (AVX512-BF16 / AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def autocast(precision: str, device: torch.device):
+    """Autocast context for the precision (no-op for fp32)"""
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return nullcontext()
+
+def conv_module(model: nn.Module) -> Optional[nn.Module]:
+    """The convolutional part of a model that benefits from channels_last"""
+    for name in ("backbone", "features"):
+        module = getattr(model, name, None)
+        if isinstance(module, nn.Module):
+            return module
+    return None
+
+def apply_channels_last(model: nn.Module) -> nn.Module:
+    module = conv_module(model)
+    if module is None:
+        logger.warning(f"{type(model).__name__} has no convolutional block for channels_last")
+    else:
+        module.to(memory_format=torch.channels_last)
+    return model
+
+def prepare_input(tensor: torch.Tensor, channels_last: bool) -> torch.Tensor:
+    if channels_last and tensor.dim() == 4:
+        return tensor.contiguous(memory_format=torch.channels_last)
+    return tensor
+
+def evaluate_predictions(model: nn.Module, loader: DataLoader, precision: str,
+                         channels_last: bool, device: torch.device) -> tuple:
+    """Predicted and true labels for every sample in loader under a mode"""
+    model.eval()
+    predictions, targets = [], []
+    with torch.inference_mode(), autocast(precision, device):
+        for data, target in loader:
+            data = prepare_input(data.to(device), channels_last)
+            predictions.append(model(data).float().argmax(dim=1).cpu())
+            targets.append(target)
+    if not predictions:
+        return torch.zeros(0, dtype=torch.long), torch.zeros(0, dtype=torch.long)
+    return torch.cat(predictions), torch.cat(targets)
+
+def parity_check(model: nn.Module, loader: DataLoader, precision: str, channels_last: bool,
+                 device: torch.device, tolerance: float = PARITY_TOLERANCE) -> Dict[str, float]:
+    """
+    Compare accuracy under a mode with fp32 on the same data
+    The model is left in the requested memory format.
+    """
+    module = conv_module(model)
+    if module is not None:
+        module.to(memory_format=torch.contiguous_format)
+    reference, targets = evaluate_predictions(model, loader, "fp32", False, device)
+    if channels_last:
+        apply_channels_last(model)
+    candidate, _ = evaluate_predictions(model, loader, precision, channels_last, device)
+
+    total = max(len(targets), 1)
+    fp32_accuracy = (reference == targets).sum().item() / total
+    mode_accuracy = (candidate == targets).sum().item() / total
+    report = {
+        'mode': mode_name(precision, channels_last),
+        'fp32_accuracy': fp32_accuracy,
+        'mode_accuracy': mode_accuracy,
+        'accuracy_delta': mode_accuracy - fp32_accuracy,
+        'prediction_agreement': (reference == candidate).sum().item() / total,
+        'passed': fp32_accuracy - mode_accuracy <= tolerance
+    }
+    logger.info(f"Precision parity {report['mode']}: fp32 {fp32_accuracy:.4f} vs "
+                f"{mode_accuracy:.4f}, agreement {report['prediction_agreement']:.4f}")
+    return report
+
+def benchmark_throughput(model: nn.Module, precision: str, channels_last: bool,
+                         device: torch.device, batch_size: int = 32, iterations: int = 10,
+                         warmup: int = 2, image_size: tuple = (224, 224)) -> float:
+    """Inference images/sec on random input under a mode"""
+    model.eval()
+    module = conv_module(model)
+    if module is not None:
+        module.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+    data = prepare_input(torch.randn(batch_size, 3, *image_size, device=device), channels_last)
+    with torch.inference_mode(), autocast(precision, device):
+        for _ in range(warmup):
+            model(data)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(data)
+        elapsed = time.perf_counter() - start
+    return batch_size * iterations / elapsed
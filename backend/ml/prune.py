@@ -0,0 +1,228 @@
+"""
+Structured channel pruning for the ResNet50 backbone
+Each Bottleneck block's inner width (conv1 output / conv2 input and output)
+is reduced by dropping the least important channels and rebuilding the
+convolutions as smaller dense layers. Residual widths are unchanged, so
+blocks can be pruned independently and CPU latency drops with FLOPs.
+
+Usage: python -m ml.prune --dataset <name> --base ai_detection_model_<name>.pth --sparsities 0.25 0.5
+"""
+import os
+import copy
+import json
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from torchvision.models.resnet import Bottleneck
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("magnitude", "taylor")
+CHANNEL_MULTIPLE = 8  # Keep widths friendly to vectorized CPU kernels
+PRUNED_ARCHITECTURE = "resnet50-pruned"
+
+def bottlenecks(model: nn.Module) -> Dict[str, Bottleneck]:
+    return {name: module for name, module in model.backbone.named_modules()
+            if isinstance(module, Bottleneck)}
+
+def channel_config(model: nn.Module) -> Dict[str, List[int]]:
+    """Inner widths (conv1 out, conv2 out) of every bottleneck"""
+    return {name: [block.conv1.out_channels, block.conv2.out_channels]
+            for name, block in bottlenecks(model).items()}
+
+def _conv(conv: nn.Conv2d, in_idx: torch.Tensor, out_idx: torch.Tensor) -> nn.Conv2d:
+    new = nn.Conv2d(len(in_idx), len(out_idx), conv.kernel_size, stride=conv.stride,
+                    padding=conv.padding, dilation=conv.dilation, bias=conv.bias is not None)
+    with torch.no_grad():
+        new.weight.copy_(conv.weight[out_idx][:, in_idx])
+        if conv.bias is not None:
+            new.bias.copy_(conv.bias[out_idx])
+    return new.to(conv.weight.device)
+
+def _bn(bn: nn.BatchNorm2d, idx: torch.Tensor) -> nn.BatchNorm2d:
+    new = nn.BatchNorm2d(len(idx), eps=bn.eps, momentum=bn.momentum)
+    with torch.no_grad():
+        new.weight.copy_(bn.weight[idx])
+        new.bias.copy_(bn.bias[idx])
+        new.running_mean.copy_(bn.running_mean[idx])
+        new.running_var.copy_(bn.running_var[idx])
+        new.num_batches_tracked.copy_(bn.num_batches_tracked)
+    return new.to(bn.weight.device)
+
+def prune_bottleneck(block: Bottleneck, keep1: torch.Tensor, keep2: torch.Tensor):
+    """Rebuild a bottleneck keeping the given inner channels (rebuilt layers are trainable)"""
+    all_in = torch.arange(block.conv1.in_channels)
+    all_out = torch.arange(block.conv3.out_channels)
+    block.conv1 = _conv(block.conv1, all_in, keep1)
+    block.bn1 = _bn(block.bn1, keep1)
+    block.conv2 = _conv(block.conv2, keep1, keep2)
+    block.bn2 = _bn(block.bn2, keep2)
+    block.conv3 = _conv(block.conv3, keep2, all_out)
+
+def apply_channel_config(model: nn.Module, config: Dict[str, List[int]]) -> nn.Module:
+    """Reshape an unpruned model to a saved channel config (weights are loaded afterwards)"""
+    blocks = bottlenecks(model)
+    for name, (width1, width2) in config.items():
+        prune_bottleneck(blocks[name], torch.arange(width1), torch.arange(width2))
+    model.architecture = PRUNED_ARCHITECTURE
+    model.channel_config = config
+    return model
+
+def magnitude_importance(model: nn.Module) -> Dict[str, Tuple[torch.Tensor, torch.Tensor]]:
+    """L1 norm of each output filter of conv1 and conv2"""
+    return {
+        name: (block.conv1.weight.detach().abs().sum(dim=(1, 2, 3)),
+               block.conv2.weight.detach().abs().sum(dim=(1, 2, 3)))
+        for name, block in bottlenecks(model).items()
+    }
+
+def taylor_importance(model: nn.Module, loader: DataLoader, device: torch.device,
+                      batches: int = 10) -> Dict[str, Tuple[torch.Tensor, torch.Tensor]]:
+    """First-order Taylor estimate |activation * gradient| per channel of bn1/bn2"""
+    scores: Dict[str, List[torch.Tensor]] = {}
+    handles = []
+    
+    def track(key, index):
+        def hook(module, inputs, output):
+            def grad_hook(grad):
+                score = (output.detach() * grad).mean(dim=(2, 3)).abs().sum(dim=0)
+                scores[key][index] += score
+            output.register_hook(grad_hook)
+        return hook
+    
+    for name, block in bottlenecks(model).items():
+        scores[name] = [torch.zeros(block.bn1.num_features, device=device),
+                        torch.zeros(block.bn2.num_features, device=device)]
+        handles.append(block.bn1.register_forward_hook(track(name, 0)))
+        handles.append(block.bn2.register_forward_hook(track(name, 1)))
+    
+    criterion = nn.CrossEntropyLoss()
+    model.eval()  # Keep BN statistics fixed while scoring
+    try:
+        for batch_idx, (data, target) in enumerate(loader):
+            if batch_idx >= batches:
+                break
+            # Input gradients make activations in frozen blocks differentiable too
+            data = data.to(device).requires_grad_(True)
+            model.zero_grad()
+            criterion(model(data), target.to(device)).backward()
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.zero_grad()
+    return {name: (s1, s2) for name, (s1, s2) in scores.items()}
+
+def _keep(importance: torch.Tensor, sparsity: float) -> torch.Tensor:
+    width = len(importance)
+    keep = int(round(width * (1 - sparsity) / CHANNEL_MULTIPLE)) * CHANNEL_MULTIPLE
+    keep = min(width, max(CHANNEL_MULTIPLE, keep))
+    return torch.sort(torch.topk(importance, keep).indices)[0].cpu()
+
+def prune_model(model: nn.Module, sparsity: float, method: str = "magnitude",
+                loader: Optional[DataLoader] = None, device: torch.device = torch.device("cpu")) -> nn.Module:
+    """Dense copy of model with each bottleneck's inner width reduced by `sparsity`"""
+    if method not in METHODS:
+        raise ValueError(f"Unknown importance method '{method}', expected one of {METHODS}")
+    pruned = copy.deepcopy(model)
+    if method == "taylor":
+        if loader is None:
+            raise ValueError("Taylor importance needs a data loader")
+        importance = taylor_importance(pruned, loader, device)
+    else:
+        importance = magnitude_importance(pruned)
+    
+    blocks = bottlenecks(pruned)
+    for name, (score1, score2) in importance.items():
+        prune_bottleneck(blocks[name], _keep(score1, sparsity), _keep(score2, sparsity))
+    pruned.architecture = PRUNED_ARCHITECTURE
+    pruned.channel_config = channel_config(pruned)
+    return pruned
+
+def count_parameters(model: nn.Module) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+def pareto_front(points: List[Dict]) -> List[Dict]:
+    """Mark points not beaten on both test accuracy and latency"""
+    for point in points:
+        point['pareto_optimal'] = not any(
+            other is not point
+            and other['test_accuracy'] >= point['test_accuracy']
+            and other['latency_ms'] <= point['latency_ms']
+            and (other['test_accuracy'] > point['test_accuracy'] or other['latency_ms'] < point['latency_ms'])
+            for other in points
+        )
+    return points
+
+def run_pipeline(dataset_path: str, dataset_name: str, base_file: str, sparsities: List[float],
+                 method: str = "magnitude", finetune_epochs: int = 3,
+                 model_path: str = "ml/models") -> List[Dict]:
+    """Prune the base checkpoint at each sparsity, fine-tune with Trainer and report"""
+    from ml.model import ModelManager
+    from ml.precision import benchmark_throughput
+    from ml.train import Trainer
+    
+    manager = ModelManager(model_path)
+    if not manager.load_model(base_file) or manager.model.architecture != "resnet50":
+        raise ValueError(f"Base checkpoint {base_file} is not a trained AIDetectionCNN")
+    base = manager.model
+    
+    trainer = Trainer(dataset_path, model_path)
+    trainer.num_epochs = finetune_epochs
+    trainer.patience = finetune_epochs
+    train_loader, _, test_loader = trainer.prepare_datasets()
+    
+    def latency_ms(model):
+        return 1000.0 / benchmark_throughput(model, "fp32", False, trainer.device, batch_size=1, iterations=20)
+    
+    def test_accuracy(model):
+        return trainer.validate(model, test_loader, nn.CrossEntropyLoss(), reduce=False)[1]
+    
+    points = [{
+        'sparsity': 0.0, 'model_file': base_file, 'parameters': count_parameters(base),
+        'latency_ms': latency_ms(base), 'test_accuracy': test_accuracy(base)
+    }]
+    for sparsity in sorted(sparsities):
+        logger.info(f"Pruning {base_file} at sparsity {sparsity:.2f} ({method})")
+        pruned = prune_model(base, sparsity, method, loader=train_loader, device=trainer.device)
+        model_file = f"ai_detection_model_{dataset_name}_pruned{int(sparsity * 100)}.pth"
+        pruned_accuracy = test_accuracy(pruned)
+        results = trainer.train_model(dataset_name, model=pruned, model_file=model_file)
+        points.append({
+            'sparsity': sparsity,
+            'model_file': model_file,
+            'parameters': count_parameters(pruned),
+            'latency_ms': latency_ms(pruned),
+            'accuracy_before_finetune': pruned_accuracy,
+            'test_accuracy': results['test_accuracy']
+        })
+    
+    report = pareto_front(points)
+    report_path = os.path.join(model_path, f"pruning_report_{dataset_name}.json")
+    with open(report_path, "w") as f:
+        json.dump({'base_model': base_file, 'method': method, 'points': report}, f, indent=2)
+    for point in report:
+        logger.info(f"sparsity {point['sparsity']:.2f}: acc {point['test_accuracy']:.4f}, "
+                    f"{point['latency_ms']:.1f} ms, {point['parameters'] / 1e6:.1f}M params"
+                    f"{' (pareto)' if point['pareto_optimal'] else ''}")
+    return report
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Structured pruning of the ResNet50 detector')
+    parser.add_argument('--dataset', type=str, required=True, help='Dataset name')
+    parser.add_argument('--base', type=str, required=True, help='Trained checkpoint in ml/models')
+    parser.add_argument('--sparsities', type=float, nargs='+', default=[0.25, 0.5, 0.75],
+                        help='Fractions of bottleneck channels to remove')
+    parser.add_argument('--method', choices=METHODS, default='magnitude', help='Channel importance')
+    parser.add_argument('--finetune-epochs', type=int, default=3, help='Fine-tune epochs per level')
+    args = parser.parse_args()
+    
+    from ml.train import settings
+    run_pipeline(os.path.join(settings.DATASET_PATH, args.dataset), args.dataset, args.base,
+                 args.sparsities, args.method, args.finetune_epochs)
+
+if __name__ == "__main__":
+    main()
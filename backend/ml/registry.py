@@ -0,0 +1,166 @@
+"""
+Model registry: versioned checkpoints with metadata
+Layout under ml/models/registry:
+    registry.json        - {"active": version, "versions": {version: metadata}}
+    <version>.pth        - immutable checkpoint copy
+
+Usage:
+    python -m ml.registry register ml/models/ai_detection_model_x.pth --notes "..."
+    python -m ml.registry list
+    python -m ml.registry activate v3
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import torch
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_DIR = "registry"
+INDEX_FILE = "registry.json"
+
+def file_sha256(path: str) -> str:
+    hash_sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+class ModelRegistry:
+    """Directory-backed registry of versioned model checkpoints"""
+    
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self._lock = threading.Lock()
+    
+    def _read(self) -> Dict[str, Any]:
+        if not os.path.exists(self.index_path):
+            return {"active": None, "versions": {}}
+        with open(self.index_path) as f:
+            return json.load(f)
+    
+    def _write(self, index: Dict[str, Any]):
+        """Atomic rewrite so readers never see a partial index"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+    
+    def checkpoint_path(self, version: str) -> str:
+        return os.path.join(self.root, f"{version}.pth")
+    
+    def list_versions(self) -> List[Dict[str, Any]]:
+        index = self._read()
+        return [
+            {**meta, "version": version, "active": version == index["active"]}
+            for version, meta in index["versions"].items()
+        ]
+    
+    def get(self, version: str) -> Optional[Dict[str, Any]]:
+        meta = self._read()["versions"].get(version)
+        return {**meta, "version": version} if meta else None
+    
+    def active_version(self) -> Optional[str]:
+        return self._read()["active"]
+    
+    def index_stamp(self) -> Optional[Tuple[int, int]]:
+        """
+        Cheap change marker for the index (None if there is none yet)
+        Every write replaces the file, so the inode changes even where
+        mtimes are too coarse to tell two writes apart.
+        """
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+    
+    def register(self, checkpoint_file: str, version: str = None,
+                 metrics: Dict[str, float] = None, notes: str = "") -> Dict[str, Any]:
+        """Copy a checkpoint into the registry and record its metadata"""
+        from ml.model import checkpoint_architecture
+        
+        checkpoint = torch.load(checkpoint_file, map_location="cpu")
+        with self._lock:
+            index = self._read()
+            version = version or f"v{len(index['versions']) + 1}"
+            if version in index["versions"]:
+                raise ValueError(f"Model version {version} already exists")
+            
+            os.makedirs(self.root, exist_ok=True)
+            target = self.checkpoint_path(version)
+            tmp_path = target + ".tmp"
+            shutil.copyfile(checkpoint_file, tmp_path)
+            os.replace(tmp_path, target)
+            
+            recorded_metrics = {
+                key: checkpoint[key] for key in ("accuracy", "loss", "epoch") if key in checkpoint
+            }
+            recorded_metrics.update(metrics or {})
+            meta = {
+                "file": os.path.basename(target),
+                "source": os.path.abspath(checkpoint_file),
+                "sha256": file_sha256(target),
+                "architecture": checkpoint_architecture(checkpoint),
+                "num_classes": checkpoint.get("num_classes", 3),
+                "class_names": checkpoint.get("class_names"),
+                "metrics": recorded_metrics,
+                "notes": notes,
+                "registered_at": datetime.utcnow().isoformat()
+            }
+            index["versions"][version] = meta
+            self._write(index)
+        
+        logger.info(f"Registered model {version} ({meta['architecture']}, sha256 {meta['sha256'][:12]})")
+        return {**meta, "version": version}
+    
+    def verify(self, version: str) -> bool:
+        """Whether the stored checkpoint still matches its recorded hash"""
+        meta = self.get(version)
+        path = self.checkpoint_path(version)
+        return bool(meta) and os.path.exists(path) and file_sha256(path) == meta["sha256"]
+    
+    def set_active(self, version: str):
+        with self._lock:
+            index = self._read()
+            if version not in index["versions"]:
+                raise KeyError(f"Unknown model version {version}")
+            index["active"] = version
+            self._write(index)
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Manage the model registry')
+    parser.add_argument('--models', type=str, default='ml/models', help='Model directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    register = commands.add_parser('register', help='Register a checkpoint')
+    register.add_argument('checkpoint', type=str)
+    register.add_argument('--version', type=str)
+    register.add_argument('--metrics', type=str, help='JSON object of extra metrics')
+    register.add_argument('--notes', type=str, default='')
+    commands.add_parser('list', help='List versions')
+    activate = commands.add_parser('activate', help='Mark a version active for the next start')
+    activate.add_argument('version', type=str)
+    args = parser.parse_args()
+    
+    registry = ModelRegistry(os.path.join(args.models, REGISTRY_DIR))
+    if args.command == 'register':
+        metrics = json.loads(args.metrics) if args.metrics else None
+        print(json.dumps(registry.register(args.checkpoint, args.version, metrics, args.notes), indent=2))
+    elif args.command == 'list':
+        print(json.dumps(registry.list_versions(), indent=2))
+    else:
+        registry.set_active(args.version)
+        print(f"Active version: {args.version} (running servers switch on their next registry poll)")
+
+if __name__ == "__main__":
+    main()
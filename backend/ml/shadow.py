@@ -0,0 +1,219 @@
+"""
+Shadow and canary evaluation of a candidate registry version on live traffic
+Shadow: a sampled fraction of requests is also run through the other model
+in a background worker after the response has been computed; only the
+served result is returned.
+Canary: a stable percentage of users (hashed user id) is served by the
+candidate, with the live model as the shadow for sampled requests.
+"""
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+import numpy as np
+import torch
+
+from ml.model import ModelManager, model_manager
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 1000  # Latencies kept per model for percentiles
+ROLES = ("live", "candidate")
+
+class _ModelStats:
+    def __init__(self):
+        self.version = None
+        self.served = 0
+        self.shadowed = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+    
+    def summary(self) -> Dict[str, Any]:
+        latencies = np.array(self.latencies) * 1000.0
+        return {
+            'version': self.version,
+            'served': self.served,
+            'shadowed': self.shadowed,
+            'errors': self.errors,
+            'latency_ms': {
+                'mean': float(latencies.mean()),
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95))
+            } if len(latencies) else None
+        }
+
+class ShadowEvaluator:
+    """Routes predictions between the live manager and a candidate registry version"""
+    
+    def __init__(self, live: ModelManager):
+        self.live = live
+        self.candidate: Optional[ModelManager] = None
+        self.sample_rate = 0.0
+        self.canary_percent = 0.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_pending = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._reset_stats()
+    
+    def _reset_stats(self):
+        self.stats = {role: _ModelStats() for role in ROLES}
+        self.comparisons = 0
+        self.agreements = 0
+        self.confidence_delta_sum = 0.0
+        self.abs_confidence_delta_sum = 0.0
+        self.disagreements = Counter()
+        self.dropped = 0
+        self.started_at = None
+    
+    @property
+    def mode(self) -> str:
+        if self.candidate is None:
+            return "off"
+        return "canary" if self.canary_percent > 0 else "shadow"
+    
+    def start(self, version: str, sample_rate: float = 0.1, canary_percent: float = 0.0,
+              workers: int = 1, max_pending: int = 8) -> Dict[str, Any]:
+        """
+        Load and warm up a registry version as the candidate
+        `workers` and `max_pending` bound the CPU the shadow path can take:
+        sampled requests arriving while the backlog is full are dropped.
+        """
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        if not 0.0 <= canary_percent <= 100.0:
+            raise ValueError("canary_percent must be between 0 and 100")
+        if self.live.registry.get(version) is None:
+            raise KeyError(f"Unknown model version {version}")
+        
+        candidate = ModelManager(self.live.model_path)
+        candidate.precision, candidate.channels_last = self.live.precision, self.live.channels_last
+        candidate.model = candidate._load_version(version)
+        candidate._warm_up(candidate.model)
+        
+        self.stop()
+        with self._lock:
+            self._reset_stats()
+            self.started_at = time.time()
+            self.sample_rate = sample_rate
+            self.canary_percent = canary_percent
+            self._max_pending = max_pending
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shadow")
+            self.candidate = candidate
+        logger.info(f"✅ {self.mode.capitalize()} evaluation of {version} started "
+                    f"(sample rate {sample_rate:.2f}, canary {canary_percent:.1f}%)")
+        return self.summary()
+    
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.candidate = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def in_canary(self, user_id: Optional[str]) -> bool:
+        """Stable per-user bucket so a user sees one model for the whole canary"""
+        candidate = self.candidate
+        if candidate is None or user_id is None or self.canary_percent <= 0:
+            return False
+        key = f"{candidate.model.registry_version}:{user_id}".encode()
+        bucket = int(hashlib.sha256(key).hexdigest()[:8], 16) % 10000 / 100.0
+        return bucket < self.canary_percent
+    
+    def predict_image(self, image_tensor: torch.Tensor, user_id: Optional[str] = None,
+                      metadata_suspicion: float = None) -> Dict[str, Any]:
+        """Serve a prediction and sample it for comparison; result['served_by'] names the role"""
+        candidate = self.candidate
+        if candidate is None:
+            return self.live.predict_image(image_tensor, metadata_suspicion=metadata_suspicion)
+        
+        served_role = "candidate" if self.in_canary(user_id) else "live"
+        served, other = (candidate, self.live) if served_role == "candidate" else (self.live, candidate)
+        started = time.perf_counter()
+        result = served.predict_image(image_tensor, metadata_suspicion=metadata_suspicion)
+        self._record(served_role, result, time.perf_counter() - started, shadow=False)
+        result['served_by'] = served_role
+        
+        if random.random() < self.sample_rate:
+            self._submit(other, "live" if served_role == "candidate" else "candidate",
+                         image_tensor, metadata_suspicion, dict(result))
+        return result
+    
+    def _submit(self, manager: ModelManager, role: str, image_tensor: torch.Tensor,
+                metadata_suspicion: Optional[float], served_result: Dict[str, Any]):
+        with self._lock:
+            executor = self._executor
+            if executor is None or self._pending >= self._max_pending:
+                self.dropped += 1
+                return
+            self._pending += 1
+        future = executor.submit(self._run_shadow, manager, role, image_tensor, metadata_suspicion, served_result)
+        future.add_done_callback(self._release)  # Also runs for futures cancelled by stop()
+    
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+    
+    def _run_shadow(self, manager: ModelManager, role: str, image_tensor: torch.Tensor,
+                    metadata_suspicion: Optional[float], served_result: Dict[str, Any]):
+        try:
+            started = time.perf_counter()
+            result = manager.predict_image(image_tensor, metadata_suspicion=metadata_suspicion)
+            self._record(role, result, time.perf_counter() - started, shadow=True)
+            if role == "candidate":
+                self._compare(served_result, result)
+            else:
+                self._compare(result, served_result)
+        except Exception as e:
+            logger.error(f"Shadow prediction failed: {e}")
+    
+    def _record(self, role: str, result: Dict[str, Any], latency: float, shadow: bool):
+        with self._lock:
+            stats = self.stats[role]
+            stats.version = result.get('model_version', stats.version)
+            stats.latencies.append(latency)
+            if shadow:
+                stats.shadowed += 1
+            else:
+                stats.served += 1
+            if result['prediction'] == 'error':
+                stats.errors += 1
+    
+    def _compare(self, live_result: Dict[str, Any], candidate_result: Dict[str, Any]):
+        if 'error' in (live_result['prediction'], candidate_result['prediction']):
+            return
+        delta = candidate_result['confidence'] - live_result['confidence']
+        with self._lock:
+            self.comparisons += 1
+            self.confidence_delta_sum += delta
+            self.abs_confidence_delta_sum += abs(delta)
+            if live_result['prediction'] == candidate_result['prediction']:
+                self.agreements += 1
+            else:
+                self.disagreements[f"{live_result['prediction']}->{candidate_result['prediction']}"] += 1
+    
+    def summary(self) -> Dict[str, Any]:
+        """Agreement, confidence deltas (candidate minus live) and latency per model"""
+        with self._lock:
+            comparisons = self.comparisons
+            return {
+                'mode': self.mode,
+                'sample_rate': self.sample_rate,
+                'canary_percent': self.canary_percent,
+                'started_at': self.started_at,
+                'models': {role: stats.summary() for role, stats in self.stats.items()},
+                'comparisons': comparisons,
+                'agreement_rate': self.agreements / comparisons if comparisons else None,
+                'mean_confidence_delta': self.confidence_delta_sum / comparisons if comparisons else None,
+                'mean_abs_confidence_delta': self.abs_confidence_delta_sum / comparisons if comparisons else None,
+                'disagreements': dict(self.disagreements),
+                'pending': self._pending,
+                'dropped': self.dropped
+            }
+
+# Global evaluator wrapping the serving model manager
+shadow_evaluator = ShadowEvaluator(model_manager)
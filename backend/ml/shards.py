@@ -0,0 +1,213 @@
+"""
+Packed shard format for training data
+Encoded images are concatenated into large sequential shard files with an
+offset index, so training reads a few big memory-mapped files instead of
+opening one small file per sample
+"""
+import io
+import os
+import json
+import mmap
+import random
+import hashlib
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+from PIL import Image
+
+from ml import dataset_store
+from ml.distributed import get_rank, get_world_size, shared_seed
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR = "shards"
+SHARD_META_FILE = "shards.json"
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+DEFAULT_SHUFFLE_BUFFER = 1024
+
+def shard_dir(dataset_path: str) -> str:
+    return os.path.join(dataset_path, SHARD_DIR)
+
+def manifest_fingerprint(dataset_path: str) -> Optional[str]:
+    """Hash of the dataset manifest the shards were packed from"""
+    try:
+        with open(dataset_store.manifest_path(dataset_path), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def has_shards(dataset_path: str) -> bool:
+    """
+    Whether packed shards exist and match the current manifest
+    Re-uploading a dataset rewrites its manifest but not shards/, so shards
+    packed from another manifest are stale and ignored until repacked.
+    """
+    meta_path = os.path.join(shard_dir(dataset_path), SHARD_META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        packed_from = json.load(f).get("manifest")
+    if packed_from is None or packed_from != manifest_fingerprint(dataset_path):
+        logger.warning(f"Ignoring stale shards in {shard_dir(dataset_path)}: the manifest changed "
+                       f"since they were packed (repack with --pack-shards)")
+        return False
+    return True
+
+def pack_dataset(dataset_path: str, shard_bytes: int = DEFAULT_SHARD_BYTES) -> Dict:
+    """
+    Pack every split of a dataset into shard files
+    Layout: shards/<split>-NNNNN.bin (payload) + <split>-NNNNN.idx.npy (offset, length, label)
+    """
+    manifest = dataset_store.load_or_import(dataset_path)
+    class_to_idx = manifest.class_to_idx
+    out_dir = shard_dir(dataset_path)
+    os.makedirs(out_dir, exist_ok=True)
+    # Shards of a previous pack are invalid from here on
+    for stale in os.listdir(out_dir):
+        os.remove(os.path.join(out_dir, stale))
+    
+    meta = {"classes": manifest.classes, "manifest": manifest_fingerprint(dataset_path), "splits": {}}
+    splits = [s for s in dataset_store.SPLITS if manifest.select(s)] or [None]
+    
+    for split in splits:
+        prefix = split or "all"
+        shards: List[Dict] = []
+        index: List[Tuple[int, int, int]] = []
+        out = None
+        offset = 0
+        
+        def close_shard():
+            if out is None:
+                return
+            out.close()
+            np.save(os.path.join(out_dir, f"{name}.idx.npy"), np.asarray(index, dtype=np.int64))
+            shards.append({"name": name, "samples": len(index), "bytes": offset})
+        
+        for path, label in manifest.select(split):
+            with open(path, "rb") as f:
+                data = f.read()
+            if out is None or offset + len(data) > shard_bytes:
+                close_shard()
+                name = f"{prefix}-{len(shards):05d}"
+                out = open(os.path.join(out_dir, f"{name}.bin"), "wb")
+                index, offset = [], 0
+            out.write(data)
+            index.append((offset, len(data), class_to_idx[label]))
+            offset += len(data)
+        close_shard()
+        
+        meta["splits"][prefix] = shards
+        logger.info(f"Packed {sum(s['samples'] for s in shards)} {prefix} samples into {len(shards)} shards")
+    
+    with open(os.path.join(out_dir, SHARD_META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+class _ShardReader:
+    """Lazily memory-maps shard payloads (one mapping per process)"""
+    
+    def __init__(self, dataset_path: str, split: Optional[str]):
+        self.dir = shard_dir(dataset_path)
+        with open(os.path.join(self.dir, SHARD_META_FILE)) as f:
+            meta = json.load(f)
+        self.classes = meta["classes"]
+        self.class_to_idx = {cls: idx for idx, cls in enumerate(self.classes)}
+        self.shards = meta["splits"][split or "all"]
+        self.indexes = [
+            np.load(os.path.join(self.dir, f"{s['name']}.idx.npy")) for s in self.shards
+        ]
+        self._maps: Dict[int, mmap.mmap] = {}
+    
+    def payload(self, shard: int) -> mmap.mmap:
+        if shard not in self._maps:
+            with open(os.path.join(self.dir, f"{self.shards[shard]['name']}.bin"), "rb") as f:
+                self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[shard]
+    
+    def sample(self, shard: int, row: int) -> Tuple[bytes, int]:
+        offset, length, label = self.indexes[shard][row]
+        return self.payload(shard)[offset:offset + length], int(label)
+    
+    def __getstate__(self):
+        # mmap objects cannot be pickled into DataLoader workers
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+def _decode(data: bytes, transform):
+    try:
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+    except Exception as e:
+        logger.error(f"Error decoding sharded image: {e}")
+        image = Image.new('RGB', (224, 224), (0, 0, 0))
+    return transform(image) if transform else image
+
+class ShardedImageDataset(Dataset):
+    """Random-access dataset over shards (validation/test)"""
+    
+    def __init__(self, dataset_path: str, transform=None, split: str = None):
+        self.reader = _ShardReader(dataset_path, split)
+        self.transform = transform
+        self.class_to_idx = self.reader.class_to_idx
+        self.locations = [
+            (shard, row)
+            for shard, index in enumerate(self.reader.indexes)
+            for row in range(len(index))
+        ]
+    
+    def __len__(self):
+        return len(self.locations)
+    
+    def __getitem__(self, idx):
+        data, label = self.reader.sample(*self.locations[idx])
+        return _decode(data, self.transform), label
+
+class ShardShuffleDataset(IterableDataset):
+    """
+    Streaming dataset for training
+    Shards are visited in random order and read sequentially; samples pass
+    through a shuffle buffer. Distributed ranks, then DataLoader workers within
+    a rank, each take a disjoint subset of shards.
+    """
+    
+    def __init__(self, dataset_path: str, transform=None, split: str = None,
+                 buffer_size: int = DEFAULT_SHUFFLE_BUFFER, seed: int = None):
+        self.reader = _ShardReader(dataset_path, split)
+        self.transform = transform
+        self.buffer_size = buffer_size
+        # Every rank and worker must derive the same shard order
+        self.seed = seed if seed is not None else shared_seed()
+        self.epoch = 0
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+        self.class_to_idx = self.reader.class_to_idx
+    
+    def __len__(self):
+        return sum(len(index) for index in self.reader.indexes) // self.world_size
+    
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+    
+    def __iter__(self) -> Iterator:
+        seed = self.seed
+        rng = random.Random(seed + self.epoch)
+        shard_order = list(range(len(self.reader.shards)))
+        rng.shuffle(shard_order)
+        shard_order = shard_order[self.rank::self.world_size]
+        
+        worker = get_worker_info()
+        if worker is not None:
+            shard_order = shard_order[worker.id::worker.num_workers]
+            rng = random.Random(seed + self.epoch * 1000 + self.rank * 100 + worker.id)
+        
+        buffer = []
+        for shard in shard_order:
+            for row in range(len(self.reader.indexes[shard])):
+                buffer.append(self.reader.sample(shard, row))
+                if len(buffer) >= self.buffer_size:
+                    data, label = buffer.pop(rng.randrange(len(buffer)))
+                    yield _decode(data, self.transform), label
+        rng.shuffle(buffer)
+        for data, label in buffer:
+            yield _decode(data, self.transform), label
@@ -0,0 +1,155 @@
+"""
+Preprocessed-tensor cache for validation and test epochs
+The deterministic part of the validation transform (resize + center crop) is
+applied once per dataset and the uint8 crops are stored in a memory-mapped
+array. Later epochs only convert to float and normalize.
+"""
+import os
+import glob
+import json
+import hashlib
+import logging
+from typing import Optional, Tuple
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader, Dataset
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "tensor_cache"
+
+def split_transform(transform) -> Optional[Tuple[transforms.Compose, Optional[transforms.Normalize]]]:
+    """
+    Split a Compose into (PIL pre-processing, Normalize) around ToTensor
+    Returns None if the transform cannot be cached (random ops or no ToTensor)
+    """
+    if not isinstance(transform, transforms.Compose):
+        return None
+    steps = transform.transforms
+    to_tensor = next((i for i, t in enumerate(steps) if isinstance(t, transforms.ToTensor)), None)
+    if to_tensor is None:
+        return None
+    pre = steps[:to_tensor]
+    post = steps[to_tensor + 1:]
+    random_ops = (transforms.RandomCrop, transforms.RandomHorizontalFlip,
+                  transforms.RandomRotation, transforms.ColorJitter, transforms.RandomResizedCrop)
+    if any(isinstance(t, random_ops) for t in pre):
+        return None
+    if len(post) > 1 or (post and not isinstance(post[0], transforms.Normalize)):
+        return None
+    return transforms.Compose(pre), (post[0] if post else None)
+
+def dataset_fingerprint(dataset) -> str:
+    """Hash of the samples a dataset will produce"""
+    hash_sha256 = hashlib.sha256()
+    if hasattr(dataset, "samples"):
+        for path, label in dataset.samples:
+            try:
+                stat = os.stat(path)
+                hash_sha256.update(f"{path}|{label}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+            except OSError:
+                hash_sha256.update(f"{path}|{label}|missing\n".encode())
+    elif hasattr(dataset, "reader"):
+        hash_sha256.update(json.dumps(dataset.reader.shards, sort_keys=True).encode())
+        for index in dataset.reader.indexes:
+            hash_sha256.update(index.tobytes())
+    else:
+        raise ValueError(f"Cannot fingerprint dataset of type {type(dataset).__name__}")
+    return hash_sha256.hexdigest()
+
+class _PreTransformView(Dataset):
+    """Yields uint8 CHW crops of a dataset using only the PIL pre-processing"""
+    
+    def __init__(self, dataset, pre):
+        self.dataset = dataset
+        self.pre = pre
+    
+    def __len__(self):
+        return len(self.dataset)
+    
+    def __getitem__(self, idx):
+        original = self.dataset.transform
+        self.dataset.transform = None
+        try:
+            image, label = self.dataset[idx]
+        finally:
+            self.dataset.transform = original
+        array = np.asarray(self.pre(image), dtype=np.uint8)
+        return torch.from_numpy(array.transpose(2, 0, 1).copy()), label
+
+class CachedTensorDataset(Dataset):
+    """Reads preprocessed crops from a memory-mapped uint8 cache"""
+    
+    def __init__(self, images_path: str, labels_path: str, normalize: Optional[transforms.Normalize],
+                 class_to_idx: dict):
+        self.images = np.load(images_path, mmap_mode="r")
+        self.labels = np.load(labels_path)
+        self.class_to_idx = class_to_idx
+        if normalize is not None:
+            self.mean = torch.tensor(normalize.mean).view(3, 1, 1)
+            self.std = torch.tensor(normalize.std).view(3, 1, 1)
+        else:
+            self.mean, self.std = None, None
+    
+    def __len__(self):
+        return len(self.labels)
+    
+    def __getitem__(self, idx):
+        image = torch.from_numpy(np.array(self.images[idx])).float().div_(255.0)
+        if self.mean is not None:
+            image = image.sub_(self.mean).div_(self.std)
+        return image, int(self.labels[idx])
+
+def cached_dataset(dataset, cache_root: str, split: str, num_workers: int = 4) -> Dataset:
+    """
+    Return a CachedTensorDataset for a deterministic-transform dataset
+    The cache is keyed by dataset fingerprint and transform; stale caches for
+    the split are removed. Falls back to the original dataset if uncacheable.
+    """
+    parts = split_transform(dataset.transform)
+    if parts is None:
+        logger.info(f"Transform for {split} is not cacheable, using on-the-fly decoding")
+        return dataset
+    pre, normalize = parts
+    
+    key = hashlib.sha256(
+        f"{dataset_fingerprint(dataset)}|{repr(dataset.transform)}".encode()
+    ).hexdigest()[:16]
+    cache_dir = os.path.join(cache_root, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    images_path = os.path.join(cache_dir, f"{split}-{key}.u8.npy")
+    labels_path = os.path.join(cache_dir, f"{split}-{key}.labels.npy")
+    
+    if not (os.path.exists(images_path) and os.path.exists(labels_path)):
+        for stale in glob.glob(os.path.join(cache_dir, f"{split}-*.npy")):
+            os.remove(stale)
+        _build_cache(dataset, pre, images_path, labels_path, num_workers)
+    
+    return CachedTensorDataset(images_path, labels_path, normalize, dataset.class_to_idx)
+
+def _build_cache(dataset, pre, images_path: str, labels_path: str, num_workers: int):
+    """Decode every sample once into a uint8 memmap (written atomically)"""
+    view = _PreTransformView(dataset, pre)
+    sample, _ = view[0] if len(view) else (torch.zeros(3, 224, 224, dtype=torch.uint8), 0)
+    shape = (len(view),) + tuple(sample.shape)
+    
+    tmp_images = images_path + ".tmp"
+    images = np.lib.format.open_memmap(tmp_images, mode="w+", dtype=np.uint8, shape=shape)
+    labels = np.zeros(len(view), dtype=np.int64)
+    
+    loader = DataLoader(view, batch_size=64, shuffle=False, num_workers=num_workers)
+    offset = 0
+    for batch, batch_labels in loader:
+        images[offset:offset + len(batch)] = batch.numpy()
+        labels[offset:offset + len(batch)] = batch_labels.numpy()
+        offset += len(batch)
+    images.flush()
+    del images
+    
+    os.replace(tmp_images, images_path)
+    tmp_labels = labels_path + ".tmp"
+    with open(tmp_labels, "wb") as f:
+        np.save(f, labels)
+    os.replace(tmp_labels, labels_path)
+    logger.info(f"Built tensor cache {images_path} with {shape[0]} samples")
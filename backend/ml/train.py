@@ -4,13 +4,17 @@ Supports training from extracted archive datasets
 """
 import os
 import logging
+import time
 import argparse
+from contextlib import nullcontext
 from datetime import datetime
 from typing import Dict, Tuple
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader, Dataset
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
 from torchvision import datasets
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support, confusion_matrix
 import matplotlib.pyplot as plt
@@ -19,6 +23,13 @@ from PIL import Image
 import numpy as np
 
 from ml.model import AIDetectionCNN, ImagePreprocessor, ModelManager
+from ml import dataset_store
+from ml.shards import has_shards, pack_dataset, ShardedImageDataset, ShardShuffleDataset
+from ml.tensor_cache import cached_dataset, CachedTensorDataset
+from ml.feature_cache import cached_features, train_head
+from ml.checkpoint import TrainingCheckpointer
+from ml import distributed
+from ml import precision as precision_modes
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -35,15 +46,37 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class CustomImageDataset(Dataset):
-    """Custom dataset for loading images from extracted archives"""
+    """Custom dataset for loading images from extracted archives
     
-    def __init__(self, dataset_path: str, transform=None):
+    Reads through the dataset manifest when one exists (optionally restricted
+    to a split), otherwise from a dataset/category/images directory tree.
+    """
+    
+    def __init__(self, dataset_path: str, transform=None, split: str = None):
         self.dataset_path = dataset_path
         self.transform = transform
+        self.split = split
         self.samples = []
         self.class_to_idx = {}
         
-        self._load_samples()
+        if dataset_store.has_manifest(dataset_path):
+            self._load_manifest_samples()
+        else:
+            self._load_samples()
+    
+    def _load_manifest_samples(self):
+        """Load samples referenced by the dataset manifest"""
+        manifest = dataset_store.DatasetManifest.load(self.dataset_path)
+        # Class indices come from the whole dataset so every split agrees
+        self.class_to_idx = manifest.class_to_idx
+        self.samples = [
+            (path, self.class_to_idx[label])
+            for path, label in manifest.select(self.split)
+        ]
+        
+        logger.info(f"Loaded {len(self.samples)} {self.split or 'all'} samples "
+                    f"from manifest with {len(self.class_to_idx)} classes")
+        logger.info(f"Classes: {list(self.class_to_idx.keys())}")
     
     def _load_samples(self):
         """Load all image samples and create class mapping"""
@@ -94,6 +127,12 @@ class Trainer:
         self.learning_rate = 0.001
         self.num_epochs = 50
         self.patience = 10  # Early stopping patience
+        self.cache_eval_tensors = True  # Decode val/test images once into a memmap cache
+        self.checkpoint_every = 1  # Full resumable checkpoint every N epochs
+        self.resume = False
+        self.precision = "fp32"  # "bf16" trains under CPU autocast
+        self.channels_last = False  # NHWC layout for the ResNet50 backbone
+        self.train_throughput = []  # Samples/sec per epoch
         
         logger.info(f"Training on device: {self.device}")
     
@@ -101,102 +140,153 @@ class Trainer:
         """Prepare train, validation, and test datasets"""
         
         # Create datasets
-        train_dataset = CustomImageDataset(
-            os.path.join(self.dataset_path, 'train'),
-            transform=self.preprocessor.get_train_transform()
-        )
-        
-        val_dataset = CustomImageDataset(
-            os.path.join(self.dataset_path, 'val'),
-            transform=self.preprocessor.get_val_transform()
-        )
-        
-        test_dataset = CustomImageDataset(
-            os.path.join(self.dataset_path, 'test'),
-            transform=self.preprocessor.get_val_transform()
-        )
-        
-        # Create data loaders
+        train_dataset = self._make_dataset('train', self.preprocessor.get_train_transform())
+        val_dataset = self._make_dataset('val', self.preprocessor.get_val_transform())
+        test_dataset = self._make_dataset('test', self.preprocessor.get_val_transform())
+        
+        if self.cache_eval_tensors:
+            # Rank 0 builds the caches; the other ranks then open the finished files
+            if not distributed.is_main_process():
+                distributed.barrier()
+            val_dataset = cached_dataset(val_dataset, self.dataset_path, 'val')
+            test_dataset = cached_dataset(test_dataset, self.dataset_path, 'test')
+            if distributed.is_main_process():
+                distributed.barrier()
+        
+        # Distributed: each rank trains on its own partition and validates on a slice;
+        # the test set stays whole because only rank 0 evaluates it
+        train_sampler = None
+        if distributed.is_distributed():
+            if not isinstance(train_dataset, ShardShuffleDataset):
+                train_sampler = DistributedSampler(train_dataset, shuffle=True)
+            val_dataset = distributed.eval_shard(val_dataset)
+        
+        # Create data loaders (shard streams shuffle internally)
         train_loader = DataLoader(
             train_dataset, 
             batch_size=self.batch_size, 
-            shuffle=True, 
+            shuffle=train_sampler is None and not isinstance(train_dataset, ShardShuffleDataset), 
+            sampler=train_sampler,
             num_workers=4
         )
         
+        # Cached tensors are memory reads; worker processes would only add IPC cost
         val_loader = DataLoader(
             val_dataset, 
             batch_size=self.batch_size, 
             shuffle=False, 
-            num_workers=4
+            num_workers=0 if isinstance(getattr(val_dataset, 'dataset', val_dataset), CachedTensorDataset) else 4
         )
         
         test_loader = DataLoader(
             test_dataset, 
             batch_size=self.batch_size, 
             shuffle=False, 
-            num_workers=4
+            num_workers=0 if isinstance(test_dataset, CachedTensorDataset) else 4
         )
         
         return train_loader, val_loader, test_loader
     
+    def _make_dataset(self, split: str, transform) -> Dataset:
+        """Dataset for one split, from shards, the manifest or a legacy split directory"""
+        if has_shards(self.dataset_path):
+            if split == 'train':
+                return ShardShuffleDataset(self.dataset_path, transform=transform, split=split)
+            return ShardedImageDataset(self.dataset_path, transform=transform, split=split)
+        if dataset_store.has_manifest(self.dataset_path):
+            return CustomImageDataset(self.dataset_path, transform=transform, split=split)
+        return CustomImageDataset(os.path.join(self.dataset_path, split), transform=transform)
+    
     def train_epoch(self, model: nn.Module, train_loader: DataLoader, 
                    optimizer: optim.Optimizer, criterion: nn.Module) -> float:
         """Train for one epoch"""
         model.train()
         total_loss = 0.0
+        num_batches = 0
+        num_samples = 0
+        start = time.time()
+        
+        # DDP all-reduces gradients in backward(); join() keeps ranks with
+        # fewer batches from blocking the others
+        with model.join() if isinstance(model, DistributedDataParallel) else nullcontext():
+            for batch_idx, (data, target) in enumerate(train_loader):
+                data, target = data.to(self.device), target.to(self.device)
+                data = precision_modes.prepare_input(data, self.channels_last)
+                
+                optimizer.zero_grad()
+                with precision_modes.autocast(self.precision, self.device):
+                    output = model(data)
+                loss = criterion(output.float(), target)
+                loss.backward()
+                optimizer.step()
+                
+                total_loss += loss.item()
+                num_batches += 1
+                num_samples += target.size(0)
+                
+                if batch_idx % 100 == 0 and distributed.is_main_process():
+                    logger.info(f'Batch {batch_idx}/{len(train_loader)}, Loss: {loss.item():.6f}')
         
-        for batch_idx, (data, target) in enumerate(train_loader):
-            data, target = data.to(self.device), target.to(self.device)
-            
-            optimizer.zero_grad()
-            output = model(data)
-            loss = criterion(output, target)
-            loss.backward()
-            optimizer.step()
-            
-            total_loss += loss.item()
-            
-            if batch_idx % 100 == 0:
-                logger.info(f'Batch {batch_idx}/{len(train_loader)}, Loss: {loss.item():.6f}')
-        
-        return total_loss / len(train_loader)
+        elapsed = time.time() - start
+        total_loss, num_batches, num_samples = distributed.all_reduce_sum(
+            [total_loss, num_batches, num_samples]
+        )
+        self.train_throughput.append(num_samples / max(elapsed, 1e-9))
+        return total_loss / max(num_batches, 1)
     
     def validate(self, model: nn.Module, val_loader: DataLoader, 
-                criterion: nn.Module) -> Tuple[float, float]:
-        """Validate the model"""
+                criterion: nn.Module, reduce: bool = True) -> Tuple[float, float]:
+        """Validate the model (summed over ranks unless reduce=False)"""
         model.eval()
         total_loss = 0.0
-        all_predictions = []
-        all_targets = []
+        num_batches = 0
+        correct = 0
+        total = 0
         
         with torch.no_grad():
             for data, target in val_loader:
                 data, target = data.to(self.device), target.to(self.device)
-                output = model(data)
+                data = precision_modes.prepare_input(data, self.channels_last)
+                with precision_modes.autocast(self.precision, self.device):
+                    output = model(data).float()
                 loss = criterion(output, target)
                 total_loss += loss.item()
+                num_batches += 1
                 
                 pred = output.argmax(dim=1)
-                all_predictions.extend(pred.cpu().numpy())
-                all_targets.extend(target.cpu().numpy())
+                correct += (pred == target).sum().item()
+                total += target.size(0)
         
-        avg_loss = total_loss / len(val_loader)
-        accuracy = accuracy_score(all_targets, all_predictions)
+        if reduce:
+            total_loss, num_batches, correct, total = distributed.all_reduce_sum(
+                [total_loss, num_batches, correct, total]
+            )
+        avg_loss = total_loss / max(num_batches, 1)
+        accuracy = correct / max(total, 1)
         
         return avg_loss, accuracy
     
-    def train_model(self, dataset_name: str) -> Dict[str, float]:
-        """Main training loop"""
+    def train_model(self, dataset_name: str, model: nn.Module = None,
+                    model_file: str = None) -> Dict[str, float]:
+        """Main training loop
+        
+        Pass `model` to fine-tune an existing network (e.g. a pruned one) instead
+        of starting from ImageNet weights; `model_file` overrides the save name.
+        """
         logger.info(f"Starting training for dataset: {dataset_name}")
+        model_file = model_file or f"ai_detection_model_{dataset_name}.pth"
         
         # Prepare datasets
         train_loader, val_loader, test_loader = self.prepare_datasets()
         
         # Initialize model
-        num_classes = len(train_loader.dataset.class_to_idx)
-        model = AIDetectionCNN(num_classes=num_classes, pretrained=True)
+        if model is None:
+            num_classes = len(train_loader.dataset.class_to_idx)
+            model = AIDetectionCNN(num_classes=num_classes, pretrained=True)
         model.to(self.device)
+        if self.channels_last:
+            precision_modes.apply_channels_last(model)
+        is_main = distributed.is_main_process()
         
         # Loss and optimizer
         criterion = nn.CrossEntropyLoss()
@@ -209,14 +299,40 @@ class Trainer:
         train_losses = []
         val_losses = []
         val_accuracies = []
+        start_epoch = 0
         
-        for epoch in range(self.num_epochs):
+        checkpointer = TrainingCheckpointer(
+            os.path.join(self.model_save_path, "checkpoints"), os.path.splitext(model_file)[0],
+            self.checkpoint_every
+        )
+        if self.resume and checkpointer.exists():
+            tracking = checkpointer.load(model, optimizer, scheduler, self.device)
+            best_val_accuracy = tracking['best_val_accuracy']
+            patience_counter = tracking['patience_counter']
+            train_losses = tracking['train_losses']
+            val_losses = tracking['val_losses']
+            val_accuracies = tracking['val_accuracies']
+            start_epoch = tracking['start_epoch']
+            if patience_counter >= self.patience:
+                # Run had already stopped early; go straight to evaluation
+                start_epoch = self.num_epochs
+        elif self.resume:
+            logger.warning(f"No checkpoint at {checkpointer.path}, starting from scratch")
+        
+        # Wrap after any resume; DDP broadcasts rank 0's weights to every rank
+        train_module = DistributedDataParallel(model) if distributed.is_distributed() else model
+        
+        for epoch in range(start_epoch, self.num_epochs):
             logger.info(f"Epoch {epoch+1}/{self.num_epochs}")
+            if isinstance(train_loader.dataset, ShardShuffleDataset):
+                train_loader.dataset.set_epoch(epoch)
+            if isinstance(train_loader.sampler, DistributedSampler):
+                train_loader.sampler.set_epoch(epoch)
             
             # Train
-            train_loss = self.train_epoch(model, train_loader, optimizer, criterion)
+            train_loss = self.train_epoch(train_module, train_loader, optimizer, criterion)
             
-            # Validate
+            # Validate (metrics are identical on every rank, so early stopping agrees)
             val_loss, val_accuracy = self.validate(model, val_loader, criterion)
             
             # Update scheduler
@@ -235,22 +351,39 @@ class Trainer:
                 patience_counter = 0
                 
                 # Save model
-                model_manager = ModelManager(self.model_save_path)
-                model_manager.save_model(
-                    model, optimizer, epoch, val_loss, val_accuracy,
-                    f"ai_detection_model_{dataset_name}.pth"
-                )
-                logger.info(f"New best model saved with accuracy: {val_accuracy:.4f}")
+                if is_main:
+                    model_manager = ModelManager(self.model_save_path)
+                    model_manager.save_model(
+                        model, optimizer, epoch, val_loss, val_accuracy, model_file
+                    )
+                    logger.info(f"New best model saved with accuracy: {val_accuracy:.4f}")
             else:
                 patience_counter += 1
             
+            # Periodic full checkpoint for --resume
+            if is_main:
+                checkpointer.save(epoch, model, optimizer, scheduler, {
+                    'best_val_accuracy': best_val_accuracy,
+                    'patience_counter': patience_counter,
+                    'train_losses': train_losses,
+                    'val_losses': val_losses,
+                    'val_accuracies': val_accuracies
+                })
+            
             # Early stopping
             if patience_counter >= self.patience:
                 logger.info(f"Early stopping at epoch {epoch+1}")
                 break
         
+        if not is_main:
+            return {
+                'best_val_accuracy': best_val_accuracy,
+                'final_train_loss': train_losses[-1] if train_losses else 0.0,
+                'final_val_loss': val_losses[-1] if val_losses else 0.0
+            }
+        
         # Final evaluation on test set
-        test_loss, test_accuracy = self.validate(model, test_loader, criterion)
+        test_loss, test_accuracy = self.validate(model, test_loader, criterion, reduce=False)
         logger.info(f"Final Test Accuracy: {test_accuracy:.4f}")
         
         # Generate training plots
@@ -259,12 +392,80 @@ class Trainer:
         # Generate evaluation report
         evaluation_report = self._evaluate_model(model, test_loader)
         
+        # Reduced-precision runs must match fp32 accuracy on the test split
+        precision_report = {'precision_mode': precision_modes.mode_name(self.precision, self.channels_last)}
+        if self.precision != "fp32" or self.channels_last:
+            parity = precision_modes.parity_check(
+                model, test_loader, self.precision, self.channels_last, self.device
+            )
+            if not parity['passed']:
+                logger.warning(f"Precision mode {parity['mode']} lost accuracy against fp32: {parity}")
+            precision_report.update({f"parity_{k}": v for k, v in parity.items() if k != 'mode'})
+        if self.train_throughput:
+            precision_report['train_samples_per_sec'] = sum(self.train_throughput) / len(self.train_throughput)
+        
         return {
             'best_val_accuracy': best_val_accuracy,
             'test_accuracy': test_accuracy,
             'final_train_loss': train_losses[-1],
             'final_val_loss': val_losses[-1],
-            **evaluation_report
+            **checkpointer.summary(),
+            **evaluation_report,
+            **precision_report
+        }
+    
+    def train_head_model(self, dataset_name: str, augment_views: int = 0) -> Dict[str, float]:
+        """
+        Train only the classifier head on cached backbone embeddings
+        augment_views=0 embeds each training image once with the val transform;
+        N > 0 embeds N augmented views with the train transform
+        """
+        logger.info(f"Starting head-only training for dataset: {dataset_name}")
+        
+        if augment_views > 0:
+            train_dataset = self._make_dataset('train', self.preprocessor.get_train_transform())
+        else:
+            train_dataset = self._make_dataset('train', self.preprocessor.get_val_transform())
+        val_dataset = self._make_dataset('val', self.preprocessor.get_val_transform())
+        test_dataset = self._make_dataset('test', self.preprocessor.get_val_transform())
+        
+        num_classes = len(train_dataset.class_to_idx)
+        model = AIDetectionCNN(num_classes=num_classes, pretrained=True)
+        model.to(self.device)
+        
+        feature_args = dict(batch_size=self.batch_size, device=self.device)
+        train_features = cached_features(model, train_dataset, self.dataset_path, 'train',
+                                         views=max(augment_views, 1), **feature_args)
+        val_features = cached_features(model, val_dataset, self.dataset_path, 'val', **feature_args)
+        test_features = cached_features(model, test_dataset, self.dataset_path, 'test', **feature_args)
+        
+        best_val_accuracy, head_state = train_head(
+            model, train_features, val_features,
+            epochs=self.num_epochs, learning_rate=self.learning_rate, patience=self.patience
+        )
+        model.classifier.load_state_dict(head_state)
+        
+        # Test accuracy straight from the cached embeddings
+        model.eval()
+        correct = 0
+        with torch.no_grad():
+            for data, target in DataLoader(test_features, batch_size=256):
+                output = model.classifier(data.to(self.device))
+                correct += (output.argmax(dim=1).cpu() == target).sum().item()
+        test_accuracy = correct / max(len(test_features), 1)
+        logger.info(f"Head-only Test Accuracy: {test_accuracy:.4f}")
+        
+        # Full model checkpoint so ModelManager can load it like any other
+        optimizer = optim.Adam(model.classifier.parameters(), lr=self.learning_rate)
+        model_manager = ModelManager(self.model_save_path)
+        model_manager.save_model(
+            model, optimizer, self.num_epochs, 0.0, best_val_accuracy,
+            f"ai_detection_model_{dataset_name}.pth"
+        )
+        
+        return {
+            'best_val_accuracy': best_val_accuracy,
+            'test_accuracy': test_accuracy
         }
     
     def _plot_training_history(self, train_losses, val_losses, val_accuracies, dataset_name):
@@ -329,60 +530,12 @@ class Trainer:
         }
 
 def split_dataset(dataset_path: str, train_ratio: float = 0.8, val_ratio: float = 0.1):
-    """Split dataset into train/val/test sets"""
-    import shutil
-    import random
+    """Split dataset into train/val/test sets
     
-    # Create split directories
-    split_dirs = ['train', 'val', 'test']
-    for split_dir in split_dirs:
-        os.makedirs(os.path.join(dataset_path, split_dir), exist_ok=True)
-    
-    # Get all categories
-    categories = [d for d in os.listdir(dataset_path) 
-                 if os.path.isdir(os.path.join(dataset_path, d)) and d not in split_dirs]
-    
-    for category in categories:
-        category_path = os.path.join(dataset_path, category)
-        images = [f for f in os.listdir(category_path) if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
-        
-        # Shuffle images
-        random.shuffle(images)
-        
-        # Calculate split sizes
-        total = len(images)
-        train_size = int(total * train_ratio)
-        val_size = int(total * val_ratio)
-        
-        # Split images
-        train_images = images[:train_size]
-        val_images = images[train_size:train_size + val_size]
-        test_images = images[train_size + val_size:]
-        
-        # Create category directories in splits
-        for split_dir in split_dirs:
-            os.makedirs(os.path.join(dataset_path, split_dir, category), exist_ok=True)
-        
-        # Move images to respective splits
-        for img in train_images:
-            shutil.copy2(
-                os.path.join(category_path, img),
-                os.path.join(dataset_path, 'train', category, img)
-            )
-        
-        for img in val_images:
-            shutil.copy2(
-                os.path.join(category_path, img),
-                os.path.join(dataset_path, 'val', category, img)
-            )
-        
-        for img in test_images:
-            shutil.copy2(
-                os.path.join(category_path, img),
-                os.path.join(dataset_path, 'test', category, img)
-            )
-        
-        logger.info(f"Split {category}: {len(train_images)} train, {len(val_images)} val, {len(test_images)} test")
+    Splits are recorded in the dataset manifest; no image files are copied.
+    Legacy directory datasets are imported into the blob store first.
+    """
+    return dataset_store.split_dataset(dataset_path, train_ratio, val_ratio)
 
 def main():
     parser = argparse.ArgumentParser(description='Train AI Detection Model')
@@ -391,8 +544,31 @@ def main():
     parser.add_argument('--epochs', type=int, default=50, help='Number of epochs')
     parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
     parser.add_argument('--lr', type=float, default=0.001, help='Learning rate')
+    parser.add_argument('--pack-shards', action='store_true',
+                        help='Pack the dataset into sequential shard files before training')
+    parser.add_argument('--no-eval-cache', action='store_true',
+                        help='Decode val/test images every epoch instead of caching tensors')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the last full checkpoint of this dataset')
+    parser.add_argument('--checkpoint-every', type=int, default=1,
+                        help='Write a full resumable checkpoint every N epochs')
+    parser.add_argument('--head-only', action='store_true',
+                        help='Train only the classifier head on cached backbone embeddings')
+    parser.add_argument('--augment-views', type=int, default=0,
+                        help='Augmented views per training image for --head-only (0 = none)')
+    parser.add_argument('--precision', choices=precision_modes.PRECISIONS, default='fp32',
+                        help='Training precision (bf16 uses CPU autocast)')
+    parser.add_argument('--channels-last', action='store_true',
+                        help='Use the channels_last memory format for the backbone')
+    parser.add_argument('--nproc-per-node', type=int, default=1,
+                        help='Data-parallel training processes on this machine (gloo); '
+                             'set NNODES/NODE_RANK/MASTER_ADDR/MASTER_PORT for several machines')
     
     args = parser.parse_args()
+    if args.head_only and distributed.launch_requested(args.nproc_per_node):
+        parser.error("--head-only trains in a single process")
+    if 'RANK' in os.environ and (args.archive or args.pack_shards):
+        parser.error("prepare the dataset before starting under torchrun")
     
     # Extract archive if provided
     if args.archive:
@@ -413,17 +589,36 @@ def main():
     else:
         dataset_path = os.path.join(settings.DATASET_PATH, args.dataset)
     
+    if args.pack_shards:
+        pack_dataset(dataset_path)
+    
+    if distributed.launch_requested(args.nproc_per_node):
+        distributed.launch(run_training, args.nproc_per_node, (args, dataset_path))
+    else:
+        run_training(args, dataset_path)
+
+def run_training(args, dataset_path: str):
+    """Train in this process (one rank of a distributed run when a group is initialized)"""
     # Initialize trainer
     trainer = Trainer(dataset_path)
     trainer.num_epochs = args.epochs
     trainer.batch_size = args.batch_size
     trainer.learning_rate = args.lr
+    trainer.cache_eval_tensors = not args.no_eval_cache
+    trainer.resume = args.resume
+    trainer.checkpoint_every = args.checkpoint_every
+    trainer.precision = args.precision
+    trainer.channels_last = args.channels_last
     
     # Train model
-    results = trainer.train_model(args.dataset)
+    if args.head_only:
+        results = trainer.train_head_model(args.dataset, args.augment_views)
+    else:
+        results = trainer.train_model(args.dataset)
     
-    logger.info("Training completed!")
-    logger.info(f"Results: {results}")
+    if distributed.is_main_process():
+        logger.info("Training completed!")
+        logger.info(f"Results: {results}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Batched test-time augmentation (TTA)
+Multi-crop and flip views of one image are stacked into a single batch, so
+a TTA prediction is one forward pass. The number of views is chosen per
+request from a latency budget using a per-model cost fit
+(forward time ~ overhead + per_view * views).
+"""
+import time
+import logging
+from typing import Dict, List, Tuple
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from ml import precision as precision_modes
+
+logger = logging.getLogger(__name__)
+
+# Most informative first: a 1-view request is the standard center crop
+VIEWS = (
+    "center", "center_flip",
+    "top_left", "top_right", "bottom_left", "bottom_right",
+    "top_left_flip", "top_right_flip", "bottom_left_flip", "bottom_right_flip"
+)
+MAX_VIEWS = len(VIEWS)
+EMA_WEIGHT = 0.2  # Weight of each observed forward in the per-view cost estimate
+
+def _offset(name: str, full: Tuple[int, int], crop: Tuple[int, int]) -> Tuple[int, int]:
+    (height, width), (crop_h, crop_w) = full, crop
+    if name.startswith("center"):
+        return (height - crop_h) // 2, (width - crop_w) // 2
+    top = 0 if name.startswith("top") else height - crop_h
+    left = 0 if "left" in name else width - crop_w
+    return top, left
+
+def tta_views(image: Image.Image, preprocessor, num_views: int) -> Tuple[torch.Tensor, List[str]]:
+    """First `num_views` views as a (num_views, 3, H, W) batch; the image is resized and normalized once"""
+    base = preprocessor.get_tta_transform()(image)
+    crop_h, crop_w = preprocessor.image_size
+    names = list(VIEWS[:max(1, min(num_views, MAX_VIEWS))])
+    views = []
+    for name in names:
+        top, left = _offset(name, tuple(base.shape[1:]), (crop_h, crop_w))
+        view = base[:, top:top + crop_h, left:left + crop_w]
+        views.append(torch.flip(view, dims=[2]) if name.endswith("flip") else view)
+    return torch.stack(views), names
+
+class ViewLatencyModel:
+    """Linear forward-latency model for one serving model and precision mode"""
+    
+    def __init__(self, mode: str, overhead: float, per_view: float):
+        self.mode = mode
+        self.overhead = overhead
+        self.per_view = per_view
+    
+    @classmethod
+    def calibrate(cls, model: nn.Module, manager, repeats: int = 3) -> "ViewLatencyModel":
+        """Time a 1-view and a MAX_VIEWS batch (after a warm-up pass) and fit the two points"""
+        def timed(batch_size):
+            data = precision_modes.prepare_input(
+                torch.zeros(batch_size, 3, *manager.preprocessor.image_size, device=manager.device),
+                manager.channels_last
+            )
+            with torch.inference_mode(), precision_modes.autocast(manager.precision, manager.device):
+                model(data)
+                started = time.perf_counter()
+                for _ in range(repeats):
+                    model(data)
+            return (time.perf_counter() - started) / repeats
+        
+        single, full = timed(1), timed(MAX_VIEWS)
+        per_view = max(full - single, 0.0) / (MAX_VIEWS - 1)
+        overhead = max(single - per_view, 0.0)
+        logger.info(f"TTA latency fit ({manager.precision_mode}): "
+                    f"{overhead * 1000:.1f} ms + {per_view * 1000:.1f} ms/view")
+        return cls(manager.precision_mode, overhead, per_view)
+    
+    def predict_ms(self, num_views: int) -> float:
+        return (self.overhead + self.per_view * num_views) * 1000.0
+    
+    def views_for(self, budget_ms: float) -> int:
+        """Most views whose predicted forward time fits the budget (at least one)"""
+        if self.per_view <= 0:
+            return MAX_VIEWS
+        # The epsilon keeps an exact fit (e.g. 0.02 / 0.005 = 3.9999...) from losing a view
+        views = int((budget_ms / 1000.0 - self.overhead) / self.per_view + 1e-9)
+        return max(1, min(MAX_VIEWS, views))
+    
+    def update(self, num_views: int, seconds: float):
+        """Track drift (load, thermal, co-tenants) from observed forwards"""
+        observed = max(seconds - self.overhead, 0.0) / num_views
+        self.per_view = (1 - EMA_WEIGHT) * self.per_view + EMA_WEIGHT * observed
+
+def latency_model(model: nn.Module, manager) -> ViewLatencyModel:
+    """The model's cost fit, calibrated on first use and again after a precision change"""
+    fitted = getattr(model, 'tta_latency', None)
+    if fitted is None or fitted.mode != manager.precision_mode:
+        fitted = ViewLatencyModel.calibrate(model, manager)
+        model.tta_latency = fitted  # Travels with the model across hot swaps
+    return fitted
+
+def summarize_views(probabilities: torch.Tensor, names: List[str], class_names: List[str]) -> Dict[str, object]:
+    """Per-view predictions and how many agree with the averaged prediction"""
+    view_predictions = torch.argmax(probabilities, dim=1)
+    final = torch.argmax(probabilities.mean(dim=0))
+    return {
+        'view_predictions': {name: class_names[idx] for name, idx in zip(names, view_predictions.tolist())},
+        'view_agreement': (view_predictions == final).float().mean().item()
+    }
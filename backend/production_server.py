@@ -2,7 +2,7 @@
 """
 Production AI server with real trained model, MongoDB, and OSINT analysis
 """
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -19,8 +19,11 @@ from dotenv import load_dotenv
 load_dotenv('.env.production')
 
 # Import our services
+from app.core.config import settings
 from app.core.database import connect_to_mongo, close_mongo_connection, get_database
 from app.services.image_analysis import image_analysis_service
+from app.services.upload_retention import upload_store, retention_sweeper
+from app.utils.file_handler import file_handler
 from app.models.analysis import ImageAnalysisResult
 from app.models.user import User
 import logging
@@ -51,6 +54,8 @@ app.add_middleware(
 # Create uploads directory
 os.makedirs("uploads", exist_ok=True)
 
+UPLOAD_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+
 # Database dependency
 async def get_db():
     return get_database()
@@ -66,6 +71,9 @@ async def startup_event():
         logger.warning(f"⚠️ Database connection failed, continuing without database: {e}")
         # Continue without database - app will use fallback mode
     
+    # Expired and over-watermark uploads are deleted in the background
+    retention_sweeper.start()
+    
     # Initialize AI model - CRITICAL for free scanning
     try:
         from app.services.image_analysis import image_analysis_service
@@ -88,6 +96,7 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    await retention_sweeper.stop()
     try:
         await close_mongo_connection()
     except:
@@ -217,26 +226,23 @@ async def upload_file(image: UploadFile = File(...)):
     """Upload file endpoint - FREE, no authentication required"""
     
     # Validate file type
-    allowed_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
     file_ext = os.path.splitext(image.filename)[1].lower()
     
-    if file_ext not in allowed_extensions:
-        raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {allowed_extensions}")
+    if file_ext not in UPLOAD_IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {UPLOAD_IMAGE_EXTENSIONS}")
     
     # Generate unique filename
     file_id = str(uuid.uuid4())
     unique_filename = f"{file_id}{file_ext}"
     
-    # Save file
-    file_path = os.path.join("uploads", unique_filename)
-    with open(file_path, "wb") as buffer:
-        content = await image.read()
-        buffer.write(content)
+    # Stream into upload storage with the free-tier TTL
+    with upload_store.writer(unique_filename, plan="free") as writer:
+        size, _ = await file_handler.copy_to_storage(image, writer)
     
     return {
         "filename": unique_filename,
         "original_name": image.filename,
-        "size": len(content),
+        "size": size,
         "mimetype": image.content_type,
         "upload_id": file_id
     }
@@ -246,10 +252,10 @@ async def upload_file(image: UploadFile = File(...)):
 async def analyze_image_free(filename: str = Form(...), original_name: str = Form(...), db=Depends(get_db)):
     """FAST FREE AI Analysis - Optimized for speed, no authentication required"""
     
-    file_path = os.path.join("uploads", filename)
+    file_path = upload_store.resolve(filename)
     
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="File not found or expired")
     
     print(f"🚀 FAST FREE Analysis starting: {original_name}")
     start_time = time.time()
@@ -262,50 +268,10 @@ async def analyze_image_free(filename: str = Form(...), original_name: str = For
         analysis_id = str(uuid.uuid4())
         
         # Create streamlined result for speed
-        result = {
-            "analysis_id": analysis_id,
-            "prediction": analysis_result.prediction,
-            "confidence_score": analysis_result.confidence_score,
-            "processing_time": processing_time,
-            "plan": "free",
-            "metadata": {
-                "ai_probabilities": analysis_result.metadata.get('ml_probabilities', {}),
-                "model_status": "optimized",
-                "model_version": analysis_result.model_version,
-                "performance": analysis_result.metadata.get('performance_breakdown', {})
-            },
-            "osint_analysis": {
-                "metadata_analysis": {
-                    "has_exif": len(analysis_result.metadata.get('exif_anomalies', {})) > 0,
-                    "suspicion_score": analysis_result.metadata.get('metadata_suspicion_score', 0.0)
-                },
-                "quality_analysis": analysis_result.metadata.get('quality_metrics', {}),
-                "authenticity_indicators": _generate_fast_authenticity_indicators(analysis_result)
-            },
-            "status": "completed",
-            "message": f"Fast analysis completed in {processing_time:.2f}s! Upgrade for detailed reports."
-        }
+        result = _fast_analysis_result(analysis_id, analysis_result, processing_time)
         
         # Optional: Save to database if available (async to not slow down response)
-        if db is not None:
-            try:
-                analysis_doc = {
-                    "_id": analysis_id,
-                    "user_id": "anonymous_fast",
-                    "original_filename": original_name,
-                    "filename": filename,
-                    "prediction": analysis_result.prediction,
-                    "confidence_score": analysis_result.confidence_score,
-                    "processing_time": processing_time,
-                    "created_at": datetime.utcnow(),
-                    "plan": "free_fast"
-                }
-                
-                # Use background task to save without blocking response
-                asyncio.create_task(save_analysis_async(db, analysis_doc))
-                
-            except Exception as e:
-                logger.error(f"❌ Error queuing database save: {e}")
+        _queue_fast_analysis_save(db, analysis_id, analysis_result, processing_time, original_name, filename)
         
         print(f"✅ FAST FREE Analysis complete: {analysis_result.prediction} ({analysis_result.confidence_score:.3f}) in {processing_time:.3f}s")
         
@@ -316,6 +282,91 @@ async def analyze_image_free(filename: str = Form(...), original_name: str = For
         logger.error(f"❌ Error in FAST analysis: {e}")
         raise HTTPException(status_code=500, detail=f"Fast analysis failed: {str(e)}")
 
+# Upload + FAST FREE analysis in one round trip - NO LOGIN REQUIRED
+@app.post("/api/analysis/upload-and-analyze")
+async def upload_and_analyze(background_tasks: BackgroundTasks, image: UploadFile = File(...), db=Depends(get_db)):
+    """Analyze an upload straight from the request buffer; it is stored after the response, if retained"""
+    
+    file_ext = os.path.splitext(image.filename)[1].lower()
+    if file_ext not in UPLOAD_IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {UPLOAD_IMAGE_EXTENSIONS}")
+    
+    start_time = time.time()
+    try:
+        # Hash the spooled body chunk by chunk, then decode from the same buffer
+        size, file_hash = await file_handler.hash_upload(image)
+        analysis_result = image_analysis_service.analyze_image(image.file, image.filename)
+        
+        processing_time = time.time() - start_time
+        analysis_id = str(uuid.uuid4())
+        result = _fast_analysis_result(analysis_id, analysis_result, processing_time)
+        
+        # Store the upload only if the plan retains it, after the response is sent
+        unique_filename = None
+        if upload_store.retains("free"):
+            unique_filename = f"{uuid.uuid4()}{file_ext}"
+            background_tasks.add_task(upload_store.save_stream, unique_filename, image.file, "free")
+        
+        result.update({"filename": unique_filename, "original_name": image.filename, "size": size, "file_hash": file_hash})
+        _queue_fast_analysis_save(db, analysis_id, analysis_result, processing_time, image.filename, unique_filename,
+                                  file_hash=file_hash)
+        return result
+        
+    except Exception as e:
+        logger.error(f"❌ Error in upload-and-analyze: {e}")
+        raise HTTPException(status_code=500, detail=f"Fast analysis failed: {str(e)}")
+
+def _fast_analysis_result(analysis_id: str, analysis_result: ImageAnalysisResult, processing_time: float) -> dict:
+    """Streamlined FAST FREE analysis response"""
+    return {
+        "analysis_id": analysis_id,
+        "prediction": analysis_result.prediction,
+        "confidence_score": analysis_result.confidence_score,
+        "processing_time": processing_time,
+        "plan": "free",
+        "metadata": {
+            "ai_probabilities": analysis_result.metadata.get('ml_probabilities', {}),
+            "model_status": "optimized",
+            "model_version": analysis_result.model_version,
+            "performance": analysis_result.metadata.get('performance_breakdown', {})
+        },
+        "osint_analysis": {
+            "metadata_analysis": {
+                "has_exif": len(analysis_result.metadata.get('exif_anomalies', {})) > 0,
+                "suspicion_score": analysis_result.metadata.get('metadata_suspicion_score', 0.0)
+            },
+            "quality_analysis": analysis_result.metadata.get('quality_metrics', {}),
+            "authenticity_indicators": _generate_fast_authenticity_indicators(analysis_result)
+        },
+        "status": "completed",
+        "message": f"Fast analysis completed in {processing_time:.2f}s! Upgrade for detailed reports."
+    }
+
+def _queue_fast_analysis_save(db, analysis_id: str, analysis_result: ImageAnalysisResult, processing_time: float,
+                              original_name: str, filename: Optional[str], **extra):
+    """Save a FAST FREE analysis in the background when the database is available"""
+    if db is None:
+        return
+    try:
+        analysis_doc = {
+            "_id": analysis_id,
+            "user_id": "anonymous_fast",
+            "original_filename": original_name,
+            "filename": filename,
+            "prediction": analysis_result.prediction,
+            "confidence_score": analysis_result.confidence_score,
+            "processing_time": processing_time,
+            "created_at": datetime.utcnow(),
+            "plan": "free_fast",
+            **extra
+        }
+        
+        # Use background task to save without blocking response
+        asyncio.create_task(save_analysis_async(db, analysis_doc))
+        
+    except Exception as e:
+        logger.error(f"❌ Error queuing database save: {e}")
+
 async def save_analysis_async(db, analysis_doc):
     """Save analysis to database asynchronously"""
     try:
@@ -412,6 +463,8 @@ async def analyze_image_premium(
     filename: str = Form(...), 
     original_name: str = Form(...),
     authorization: str = Form(...),  # JWT token required
+    tta: bool = Form(False),  # Batched test-time augmentation
+    tta_budget_ms: Optional[float] = Form(None),  # Defaults to TTA_LATENCY_BUDGET_MS
     db=Depends(get_db)
 ):
     """PREMIUM AI Analysis - Authentication required for advanced features"""
@@ -420,17 +473,21 @@ async def analyze_image_premium(
     if not authorization or authorization == "null":
         raise HTTPException(status_code=401, detail="Premium analysis requires authentication")
     
-    file_path = os.path.join("uploads", filename)
+    file_path = upload_store.resolve(filename)
     
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="File not found or expired")
+    upload_store.retain(filename, "premium")  # Premium results keep their image longer
     
     print(f"🔍 PREMIUM Analysis: {original_name}")
     start_time = time.time()
     
     try:
         # Use real AI analysis service with enhanced features
-        analysis_result = image_analysis_service.analyze_image(file_path, original_name)
+        analysis_result = image_analysis_service.analyze_image(
+            file_path, original_name,
+            tta_budget_ms=(tta_budget_ms or settings.TTA_LATENCY_BUDGET_MS) if tta else None
+        )
         
         processing_time = time.time() - start_time
         analysis_id = str(uuid.uuid4())
@@ -448,7 +505,8 @@ async def analyze_image_premium(
                 "quality_metrics": analysis_result.metadata.get('quality_metrics', {}),
                 "metadata_suspicion_score": analysis_result.metadata.get('metadata_suspicion_score', 0.0),
                 "model_status": "loaded",
-                "model_version": analysis_result.model_version
+                "model_version": analysis_result.model_version,
+                "tta": analysis_result.metadata.get('tta')
             },
             "exif_data": analysis_result.metadata.get('exif_data', {}),
             "osint_analysis": {
@@ -612,12 +670,16 @@ async def get_analysis_by_id(analysis_id: str, db=Depends(get_db)):
         if db is not None:
             doc = await db.image_analyses.find_one({"_id": analysis_id})
             if doc:
+                # The upload may have expired or been evicted since the analysis
+                file_size = upload_store.size(doc.get("filename"))
+                
                 # Convert database document to frontend format
                 return {
                     "_id": str(doc["_id"]),
                     "original_filename": doc["original_filename"],
-                    "image_url": f"/uploads/{doc['filename']}",
-                    "file_size": os.path.getsize(doc["file_path"]) if os.path.exists(doc["file_path"]) else 0,
+                    "image_url": upload_store.url(doc.get("filename")) if file_size is not None else None,
+                    "file_size": file_size or 0,
+                    "file_available": file_size is not None,
                     "created_at": doc["created_at"].isoformat(),
                     "processing_time": doc["processing_time"] * 1000,  # Convert to ms
                     "final_verdict": {
@@ -5,83 +5,54 @@ Simplified training script for AI detection model
 import os
 import sys
 import logging
-import random
-import shutil
 from datetime import datetime
 from typing import Dict, Tuple
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader, Dataset
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
 from torchvision import transforms
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 import matplotlib.pyplot as plt
 from PIL import Image
 import numpy as np
 
+from ml import dataset_store
+from ml import distributed
+from ml.model import SimpleAIDetectionCNN
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Simple CNN Model
-class SimpleAIDetectionCNN(nn.Module):
-    """Simplified CNN for AI detection"""
-    
-    def __init__(self, num_classes=3):
-        super(SimpleAIDetectionCNN, self).__init__()
-        
-        self.features = nn.Sequential(
-            # First conv block
-            nn.Conv2d(3, 32, kernel_size=3, padding=1),
-            nn.ReLU(inplace=True),
-            nn.MaxPool2d(kernel_size=2, stride=2),
-            
-            # Second conv block
-            nn.Conv2d(32, 64, kernel_size=3, padding=1),
-            nn.ReLU(inplace=True),
-            nn.MaxPool2d(kernel_size=2, stride=2),
-            
-            # Third conv block
-            nn.Conv2d(64, 128, kernel_size=3, padding=1),
-            nn.ReLU(inplace=True),
-            nn.MaxPool2d(kernel_size=2, stride=2),
-            
-            # Fourth conv block
-            nn.Conv2d(128, 256, kernel_size=3, padding=1),
-            nn.ReLU(inplace=True),
-            nn.MaxPool2d(kernel_size=2, stride=2),
-        )
-        
-        self.classifier = nn.Sequential(
-            nn.Dropout(0.5),
-            nn.Linear(256 * 14 * 14, 512),
-            nn.ReLU(inplace=True),
-            nn.Dropout(0.3),
-            nn.Linear(512, 128),
-            nn.ReLU(inplace=True),
-            nn.Linear(128, num_classes)
-        )
-        
-        self.num_classes = num_classes
-        self.class_names = ["authentic", "ai_generated", "manipulated"]
-    
-    def forward(self, x):
-        x = self.features(x)
-        x = x.view(x.size(0), -1)
-        x = self.classifier(x)
-        return x
-
 # Dataset class
 class SimpleImageDataset(Dataset):
     """Simple dataset for loading images"""
     
-    def __init__(self, dataset_path: str, transform=None):
+    def __init__(self, dataset_path: str, transform=None, split: str = None):
         self.dataset_path = dataset_path
         self.transform = transform
+        self.split = split
         self.samples = []
         self.class_to_idx = {}
         
-        self._load_samples()
+        if dataset_store.has_manifest(dataset_path):
+            self._load_manifest_samples()
+        else:
+            self._load_samples()
+    
+    def _load_manifest_samples(self):
+        """Load samples referenced by the dataset manifest"""
+        manifest = dataset_store.DatasetManifest.load(self.dataset_path)
+        self.class_to_idx = manifest.class_to_idx
+        self.samples = [
+            (path, self.class_to_idx[label])
+            for path, label in manifest.select(self.split)
+        ]
+        
+        logger.info(f"Loaded {len(self.samples)} {self.split or 'all'} samples from manifest")
     
     def _load_samples(self):
         """Load all image samples"""
@@ -118,59 +89,8 @@ class SimpleImageDataset(Dataset):
             return Image.new('RGB', (224, 224), (0, 0, 0)), label
 
 def split_dataset(dataset_path: str, train_ratio: float = 0.7, val_ratio: float = 0.2):
-    """Split dataset into train/val/test sets"""
-    
-    # Create split directories
-    split_dirs = ['train', 'val', 'test']
-    for split_dir in split_dirs:
-        os.makedirs(os.path.join(dataset_path, split_dir), exist_ok=True)
-    
-    # Get all categories
-    categories = [d for d in os.listdir(dataset_path) 
-                 if os.path.isdir(os.path.join(dataset_path, d)) and d not in split_dirs]
-    
-    for category in categories:
-        category_path = os.path.join(dataset_path, category)
-        images = [f for f in os.listdir(category_path) 
-                 if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
-        
-        # Shuffle images
-        random.shuffle(images)
-        
-        # Calculate split sizes
-        total = len(images)
-        train_size = int(total * train_ratio)
-        val_size = int(total * val_ratio)
-        
-        # Split images
-        train_images = images[:train_size]
-        val_images = images[train_size:train_size + val_size]
-        test_images = images[train_size + val_size:]
-        
-        # Create category directories in splits
-        for split_dir in split_dirs:
-            os.makedirs(os.path.join(dataset_path, split_dir, category), exist_ok=True)
-        
-        # Copy images to respective splits
-        for img in train_images:
-            shutil.copy2(
-                os.path.join(category_path, img),
-                os.path.join(dataset_path, 'train', category, img)
-            )
-        
-        for img in val_images:
-            shutil.copy2(
-                os.path.join(category_path, img),
-                os.path.join(dataset_path, 'val', category, img)
-            )
-        
-        for img in test_images:
-            shutil.copy2(
-                os.path.join(category_path, img),
-                os.path.join(dataset_path, 'test', category, img)
-            )
-        
-        logger.info(f"Split {category}: {len(train_images)} train, {len(val_images)} val, {len(test_images)} test")
+    """Split dataset into train/val/test sets (manifest only, no file copies)"""
+    return dataset_store.split_dataset(dataset_path, train_ratio, val_ratio)
 
 def train_model():
     """Main training function"""
@@ -202,28 +122,37 @@ def train_model():
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
     ])
     
-    # Split dataset
-    print("✂️ Splitting dataset...")
-    split_dataset(dataset_path)
+    is_main = distributed.is_main_process()
+    
+    # Split dataset (rank 0 writes the manifest, the others wait for it)
+    if is_main:
+        print("✂️ Splitting dataset...")
+        split_dataset(dataset_path)
+    distributed.barrier()
     
     # Create datasets
     train_dataset = SimpleImageDataset(
-        os.path.join(dataset_path, 'train'),
+        dataset_path,
+        split='train',
         transform=train_transform
     )
     
     val_dataset = SimpleImageDataset(
-        os.path.join(dataset_path, 'val'),
+        dataset_path,
+        split='val',
         transform=val_transform
     )
     
     test_dataset = SimpleImageDataset(
-        os.path.join(dataset_path, 'test'),
+        dataset_path,
+        split='test',
         transform=val_transform
     )
     
     # Create data loaders
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+    train_sampler = DistributedSampler(train_dataset) if distributed.is_distributed() else None
+    train_loader = DataLoader(train_dataset, batch_size=batch_size,
+                              shuffle=train_sampler is None, sampler=train_sampler)
     val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
     test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
     
@@ -236,6 +165,9 @@ def train_model():
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
     
+    # Gradients are all-reduced across ranks in backward()
+    train_module = DistributedDataParallel(model) if distributed.is_distributed() else model
+    
     # Training loop
     best_val_accuracy = 0.0
     train_losses = []
@@ -245,21 +177,25 @@ def train_model():
     
     for epoch in range(num_epochs):
         # Training phase
-        model.train()
+        train_module.train()
         total_loss = 0.0
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         
         for batch_idx, (data, target) in enumerate(train_loader):
             data, target = data.to(device), target.to(device)
             
             optimizer.zero_grad()
-            output = model(data)
+            output = train_module(data)
             loss = criterion(output, target)
             loss.backward()
             optimizer.step()
             
             total_loss += loss.item()
         
-        avg_train_loss = total_loss / len(train_loader)
+        # DistributedSampler pads so every rank runs the same number of batches
+        total_loss, num_batches = distributed.all_reduce_sum([total_loss, len(train_loader)])
+        avg_train_loss = total_loss / num_batches
         train_losses.append(avg_train_loss)
         
         # Validation phase
@@ -278,18 +214,25 @@ def train_model():
         val_accuracy = accuracy_score(val_targets, val_predictions)
         val_accuracies.append(val_accuracy)
         
-        print(f"Epoch {epoch+1}/{num_epochs}: Train Loss: {avg_train_loss:.4f}, Val Acc: {val_accuracy:.4f}")
+        if is_main:
+            print(f"Epoch {epoch+1}/{num_epochs}: Train Loss: {avg_train_loss:.4f}, Val Acc: {val_accuracy:.4f}")
         
-        # Save best model
+        # Save best model (every rank validates the full set, so all agree)
         if val_accuracy > best_val_accuracy:
             best_val_accuracy = val_accuracy
-            torch.save({
-                'epoch': epoch,
-                'model_state_dict': model.state_dict(),
-                'optimizer_state_dict': optimizer.state_dict(),
-                'val_accuracy': val_accuracy,
-                'class_names': model.class_names
-            }, 'ml/models/simple_ai_detection_model.pth')
+            if is_main:
+                torch.save({
+                    'epoch': epoch,
+                    'model_state_dict': model.state_dict(),
+                    'optimizer_state_dict': optimizer.state_dict(),
+                    'val_accuracy': val_accuracy,
+                    'num_classes': model.num_classes,
+                    'class_names': model.class_names,
+                    'architecture': model.architecture
+                }, 'ml/models/simple_ai_detection_model.pth')
+    
+    if not is_main:
+        return {'best_val_accuracy': best_val_accuracy}
     
     # Test evaluation
     model.eval()
@@ -352,7 +295,12 @@ def train_model():
 
 if __name__ == "__main__":
     try:
-        results = train_model()
+        # NPROC_PER_NODE > 1 (or NNODES/torchrun env) trains data-parallel with gloo
+        nproc_per_node = int(os.environ.get("NPROC_PER_NODE", "1"))
+        if distributed.launch_requested(nproc_per_node):
+            distributed.launch(train_model, nproc_per_node)
+        else:
+            results = train_model()
         print("\n✅ AI model training completed successfully!")
     except Exception as e:
         print(f"\n❌ Training failed: {e}")
@@ -0,0 +1,189 @@
+"""
+Tests for archive extraction and its resource guards
+"""
+import io
+import os
+import zipfile
+import pytest
+from PIL import Image
+
+from app.core.config import settings
+from app.services.archive_extractor import archive_extractor, ArchiveLimitError
+
+def _png_bytes(color='red'):
+    img_bytes = io.BytesIO()
+    Image.new('RGB', (16, 16), color=color).save(img_bytes, format='PNG')
+    return img_bytes.getvalue()
+
+def _make_zip(path, members, compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def dataset_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATASET_PATH", str(tmp_path / "datasets"))
+    monkeypatch.setattr(settings, "ARCHIVE_VALIDATION_WORKERS", 1)
+    return tmp_path / "datasets"
+
+def test_extract_only_valid_images(tmp_path, dataset_dir):
+    """Non-images, invalid images and root-level files are never written"""
+    archive = _make_zip(tmp_path / "data.zip", {
+        "real/a.png": _png_bytes(),
+        "real/broken.png": b"not an image",
+        "fake/b.png": _png_bytes('blue'),
+        "fake/readme.txt": b"text",
+        "root.png": _png_bytes(),
+    })
+    progress = []
+
+    success, extract_path, counts = archive_extractor.extract_archive(
+        archive, "sample", progress_callback=progress.append
+    )
+
+    assert success
+    assert counts == {"real": 1, "fake": 1}
+    assert os.listdir(extract_path) == ["manifest.json"]
+    structure = archive_extractor.get_dataset_structure(extract_path)
+    assert sorted(structure) == ["fake", "real"]
+    assert all(os.path.exists(p) for paths in structure.values() for p in paths)
+    assert progress[-1]["accepted"] == 2
+    assert progress[-1]["rejected"] == 1
+
+def test_path_traversal_rejected(tmp_path, dataset_dir):
+    """Traversing member paths abort extraction and leave nothing behind"""
+    archive = _make_zip(tmp_path / "evil.zip", {
+        "real/a.png": _png_bytes(),
+        "../escape/b.png": _png_bytes(),
+    })
+
+    with pytest.raises(ArchiveLimitError) as exc_info:
+        archive_extractor.extract_archive(archive, "evil")
+
+    assert exc_info.value.code == "unsafe_path"
+    assert not os.path.exists(dataset_dir / "evil")
+    assert [files for _, _, files in os.walk(dataset_dir / "blobs") if files] == []
+
+def test_aborted_import_keeps_blobs_of_saved_manifests(tmp_path, dataset_dir, monkeypatch):
+    """An aborted import removes the blobs it created unless a saved manifest references them"""
+    from ml.dataset_store import BlobStore, DatasetManifest
+    members = {f"real/{i}.png": _png_bytes((i * 40, 0, 0)) for i in range(5)}
+    members["../escape/b.png"] = _png_bytes()
+    archive = _make_zip(tmp_path / "evil.zip", members)
+    shared = []
+    put_bytes = BlobStore.put_bytes
+
+    def put_and_share(self, data):
+        # A concurrent import of the same content completes against the first new blob
+        digest, created = put_bytes(self, data)
+        if created and not shared:
+            shared.append(digest)
+            other = DatasetManifest("other", self.root)
+            other.add(digest, "real")
+            other.save(str(dataset_dir / "other"))
+        return digest, created
+    monkeypatch.setattr(BlobStore, "put_bytes", put_and_share)
+
+    with pytest.raises(ArchiveLimitError):
+        archive_extractor.extract_archive(archive, "evil")
+
+    store = BlobStore(str(dataset_dir / "blobs"))
+    assert archive_extractor.get_dataset_structure(str(dataset_dir / "other"))["real"] == [store.path(shared[0])]
+    assert [files for _, _, files in os.walk(dataset_dir / "blobs") if files] == [[shared[0]]]
+
+def test_compression_ratio_limit(tmp_path, dataset_dir):
+    """Highly compressible members are treated as zip bombs"""
+    archive = _make_zip(tmp_path / "bomb.zip", {
+        "real/a.png": b"\0" * (10 * 1024 * 1024),
+    }, compression=zipfile.ZIP_DEFLATED)
+
+    with pytest.raises(ArchiveLimitError) as exc_info:
+        archive_extractor.extract_archive(archive, "bomb")
+
+    assert exc_info.value.code == "compression_ratio_exceeded"
+    assert not os.path.exists(dataset_dir / "bomb")
+
+def test_member_count_limit(tmp_path, dataset_dir, monkeypatch):
+    """Archives with too many entries are rejected"""
+    monkeypatch.setattr(settings, "ARCHIVE_MAX_MEMBERS", 2)
+    archive = _make_zip(tmp_path / "many.zip", {
+        f"real/{i}.png": _png_bytes() for i in range(5)
+    })
+
+    with pytest.raises(ArchiveLimitError) as exc_info:
+        archive_extractor.extract_archive(archive, "many")
+
+    assert exc_info.value.code == "too_many_members"
+
+def _make_7z(path, members):
+    import py7zr
+    with py7zr.SevenZipFile(path, 'w') as z:
+        for name, data in members.items():
+            z.writestr(data, name)
+    return str(path)
+
+def _make_tar(path, members):
+    import tarfile
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return str(path)
+
+@pytest.mark.parametrize("make, iterate", [
+    (lambda p, m: _make_zip(p / "a.zip", m), archive_extractor._iter_zip),
+    (lambda p, m: _make_tar(p / "a.tar.gz", m), archive_extractor._iter_tar),
+    (lambda p, m: _make_7z(p / "a.7z", m), archive_extractor._iter_7z),
+])
+def test_iterators_yield_only_accepted_members(tmp_path, dataset_dir, make, iterate):
+    """Members are filtered on their headers before any content is read"""
+    os.makedirs(dataset_dir, exist_ok=True)
+    members = {f"real/{i}.png": _png_bytes() for i in range(3)}
+    members["real/notes.txt"] = b"text"
+    archive = make(tmp_path, members)
+    seen = []
+
+    def accept(name, size, compressed_size):
+        seen.append(name)
+        return name.endswith(".png")
+
+    yielded = dict(iterate(archive, accept))
+
+    assert sorted(seen) == sorted(members)
+    assert yielded == {name: data for name, data in members.items() if name.endswith(".png")}
+
+def test_7z_is_decompressed_in_one_pass(tmp_path, dataset_dir, monkeypatch):
+    """Solid 7z archives are not restarted for every batch of members"""
+    import py7zr
+    os.makedirs(dataset_dir, exist_ok=True)
+    calls = []
+    extract = py7zr.SevenZipFile.extract
+    monkeypatch.setattr(py7zr.SevenZipFile, "reset", lambda self: calls.append("reset"))
+    monkeypatch.setattr(py7zr.SevenZipFile, "extract",
+                        lambda self, *args, **kwargs: calls.append("extract") or extract(self, *args, **kwargs))
+    archive = _make_7z(tmp_path / "solid.7z", {f"real/{i}.png": _png_bytes() for i in range(20)})
+
+    assert len(list(archive_extractor._iter_7z(archive, lambda *_: True))) == 20
+    assert calls == ["extract"]
+    assert os.listdir(dataset_dir) == []  # Scratch directory removed
+
+def test_validation_in_process_pool(tmp_path, dataset_dir, monkeypatch):
+    """Members validated by several worker processes are all accounted for"""
+    monkeypatch.setattr(settings, "ARCHIVE_VALIDATION_WORKERS", 2)
+    members = {f"real/{i}.png": _png_bytes((i, 0, 0)) for i in range(12)}
+    members.update({f"fake/{i}.png": b"corrupt" for i in range(5)})
+    archive = _make_zip(tmp_path / "pool.zip", members)
+    progress = []
+
+    success, _, counts = archive_extractor.extract_archive(archive, "pool", progress_callback=progress.append)
+
+    assert success and counts == {"real": 12}
+    assert progress[-1]["processed"] == 17 and progress[-1]["rejected"] == 5
+
+def test_accept_member_returns_bool():
+    assert archive_extractor._accept_member("root.png", 10) is False
+    assert archive_extractor._accept_member("real/notes.txt", 10) is False
+    assert archive_extractor._accept_member("real/a.png", 0) is False
+    assert archive_extractor._accept_member("real/a.png", 10) is True
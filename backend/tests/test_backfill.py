@@ -0,0 +1,138 @@
+"""
+Tests for the re-scoring backfill over stored analyses
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from bson import ObjectId
+from app.services.backfill import AnalysisBackfill, BackfillCheckpoint, OpsThrottle, document_view
+from app.services.metadata_rules import metadata_rules
+
+class _BulkResult:
+    def __init__(self, count):
+        self.modified_count = count
+
+class _Collection:
+    """In-memory image_analyses supporting the _id range queries the backfill issues"""
+    
+    def __init__(self, docs):
+        self.docs = {doc['_id']: doc for doc in docs}
+        self.writes = []
+    
+    def find(self, query, projection, sort, batch_size):
+        kind = str if query['_id']['$type'] == 'string' else ObjectId
+        ids = sorted(doc_id for doc_id in self.docs if isinstance(doc_id, kind))
+        if '$gt' in query['_id']:
+            ids = [doc_id for doc_id in ids if doc_id > query['_id']['$gt']]
+        return _Cursor([self.docs[doc_id] for doc_id in ids])
+    
+    def bulk_write(self, operations, ordered):
+        self.writes.append(len(operations))
+        for operation in operations:
+            doc = self.docs[operation._filter['_id']]
+            for path, value in operation._doc['$set'].items():
+                target = doc
+                *parents, leaf = path.split('.')
+                for name in parents:
+                    target = target.setdefault(name, {})
+                target[leaf] = value
+        return _BulkResult(len(operations))
+
+class _Cursor(list):
+    def close(self):
+        pass
+
+def _docs():
+    stored = [{
+        '_id': ObjectId(),
+        'result': {'prediction': 'authentic', 'confidence_score': 0.6, 'model_version': 'old',
+                   'metadata': {'original_confidence': 0.6, 'quality_metrics': {'sharpness': 1500, 'noise_level': 5}}},
+        'exif_data': {'format': 'PNG', 'size': [1024, 1024], 'Software': 'Midjourney'},
+        'stored_filename': 'gone.png'
+    } for _ in range(5)]
+    production = [{'_id': f"id-{index}", 'prediction': 'authentic', 'confidence_score': 0.7,
+                   'model_version': 'old', 'filename': 'missing.jpg',
+                   'metadata': {'exif_anomalies': {'missing_exif': True}}} for index in range(3)]
+    return stored + production
+
+def test_document_view_handles_both_shapes():
+    nested, flat = _docs()[0], _docs()[-1]
+
+    assert document_view(nested)['prefix'] == 'result.'
+    assert document_view(nested)['upload'] == 'gone.png'
+    assert document_view(flat)['prefix'] == ''
+    assert document_view(flat)['upload'] == 'missing.jpg'
+
+def test_rules_rescoring_is_resumable(tmp_path):
+    collection = _Collection(_docs())
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    def run(limit=None):
+        backfill = AnalysisBackfill(collection, BackfillCheckpoint(checkpoint_path), OpsThrottle(0), batch_size=2)
+        return backfill.run(limit=limit)
+
+    first = run(limit=2)
+    assert not first['done'] and first['read'] == 2
+    second = run()
+
+    assert second['done']
+    assert second['read'] == 8  # Nothing read twice across the resume
+    assert second['missing_files'] == 8 and second['from_stored'] == 8
+    for doc in collection.docs.values():
+        verdict = doc.get('result', doc)
+        assert verdict['metadata']['metadata_rules_version'] == metadata_rules.version
+        assert verdict['metadata']['backfill']['source'] == 'stored'
+    generated = next(doc for doc in collection.docs.values() if 'result' in doc)
+    assert generated['result']['metadata']['metadata_suspicion_score'] == 1.0
+    assert generated['result']['confidence_score'] == pytest.approx(0.6 * 0.8 + 0.2)
+
+def test_throttle_spaces_operations(monkeypatch):
+    slept = []
+    monkeypatch.setattr("app.services.backfill.time.sleep", slept.append)
+    throttle = OpsThrottle(100)
+
+    throttle.acquire(100)
+    throttle.acquire(50)
+
+    assert slept and slept[-1] == pytest.approx(0.5, abs=0.05)
+
+def test_dry_run_leaves_checkpoint_and_documents_untouched(tmp_path):
+    collection = _Collection(_docs())
+    checkpoint_path = tmp_path / "checkpoint.json"
+
+    report = AnalysisBackfill(collection, BackfillCheckpoint(str(checkpoint_path)), OpsThrottle(0),
+                              batch_size=2, dry_run=True).run()
+
+    assert report['done'] and report['read'] == 8 and report['from_stored'] == 8
+    assert collection.writes == []
+    assert not checkpoint_path.exists()
+    # A real run afterwards starts from the beginning
+    real = AnalysisBackfill(collection, BackfillCheckpoint(str(checkpoint_path)), OpsThrottle(0), batch_size=2).run()
+    assert real['read'] == 8 and sum(collection.writes) == 8
+
+def test_retained_uploads_are_reclassified_in_batches(tmp_path, monkeypatch):
+    from PIL import Image
+    from app.core.config import settings
+    from app.services import backfill
+    from ml.model import model_manager
+    path = tmp_path / "kept.png"
+    Image.new('RGB', (64, 48), 'red').save(path)
+    monkeypatch.setattr(backfill.upload_store, "resolve", lambda name: str(path) if name else None)
+    monkeypatch.setattr(settings, "BATCH_SIZE", 2)
+    forwards = []
+    predict_batch = model_manager.predict_batch
+    monkeypatch.setattr(model_manager, "predict_batch", lambda batch: forwards.append(len(batch)) or predict_batch(batch))
+    collection = _Collection(_docs()[:3])
+
+    report = AnalysisBackfill(collection, BackfillCheckpoint(str(tmp_path / "checkpoint.json")), OpsThrottle(0),
+                              batch_size=3).run()
+
+    assert report['from_file'] == 3 and report['failed'] == 0
+    assert forwards == [2, 1]  # One forward pass per BATCH_SIZE retained images
+    for doc in collection.docs.values():
+        result = doc['result']
+        assert result['metadata']['backfill']['source'] == 'file'
+        assert result['model_version'] == model_manager.model_version
+        assert set(result['metadata']['ml_probabilities']) == {'authentic', 'ai_generated', 'manipulated'}
+        assert tuple(doc['exif_data']['size']) == (64, 48)
@@ -0,0 +1,78 @@
+"""
+Tests for two-stage cascade inference
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import json
+import numpy as np
+from ml.cascade import calibrate_threshold, config_path
+from ml.model import ModelManager, SimpleAIDetectionCNN
+
+def test_threshold_is_lowest_meeting_target():
+    """Only the unsure, wrong first-stage sample needs escalating"""
+    confidence = np.array([0.99, 0.95, 0.60, 0.90])
+    fast = np.array([0, 1, 0, 2])
+    full = np.array([0, 1, 2, 2])
+    targets = np.array([0, 1, 2, 2])
+
+    result = calibrate_threshold(confidence, fast, full, targets, target_accuracy=1.0)
+
+    assert result['threshold'] == pytest.approx(0.90)
+    assert result['accuracy'] == 1.0
+    assert result['escalation_rate'] == 0.25
+
+class _Stage:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def _predict_single(self, image_tensor):
+        self.calls += 1
+        return dict(self.result)
+
+def _cascade(fast_result, full_result):
+    manager = ModelManager.__new__(ModelManager)
+    manager.fast_stage = _Stage(fast_result)
+    manager.cascade_config = {'threshold': 0.8, 'metadata_disagreement_score': 0.5}
+    full = _Stage(full_result)
+    manager._predict_single = full._predict_single
+    return manager, full
+
+def test_confident_fast_stage_decides():
+    manager, full = _cascade({'prediction': 'ai_generated', 'confidence': 0.9},
+                             {'prediction': 'authentic', 'confidence': 0.7})
+
+    result = manager.predict_image(None, metadata_suspicion=0.1)
+
+    assert result['cascade']['stage'] == 'fast'
+    assert full.calls == 0
+
+def test_metadata_disagreement_escalates():
+    manager, full = _cascade({'prediction': 'authentic', 'confidence': 0.95},
+                             {'prediction': 'ai_generated', 'confidence': 0.7})
+
+    result = manager.predict_image(None, metadata_suspicion=0.7)
+
+    assert result['prediction'] == 'ai_generated'
+    assert result['cascade'] == {'stage': 'full', 'reason': 'metadata_disagreement',
+                                 'fast_confidence': 0.95, 'threshold': 0.8}
+
+def test_precision_mode_applies_to_the_fast_stage(tmp_path):
+    """Configuring precision after enabling the cascade also switches the first stage"""
+    manager = ModelManager(str(tmp_path))
+    for name in ("fast.pth", "full.pth"):
+        model = SimpleAIDetectionCNN(num_classes=3)
+        manager.save_model(model, torch.optim.Adam(model.parameters()), 0, 0.0, 0.9, name)
+    with open(config_path(str(tmp_path)), "w") as f:
+        json.dump({'fast_model': 'fast.pth', 'full_model': 'full.pth', 'threshold': 0.8,
+                   'metadata_disagreement_score': 0.5}, f)
+
+    assert manager.enable_cascade()
+    manager.configure_precision("bf16", channels_last=True)
+
+    fast = manager.fast_stage
+    assert (fast.precision, fast.channels_last) == ("bf16", True)
+    assert fast.model.features[0].weight.is_contiguous(memory_format=torch.channels_last)
+    assert manager.predict_image(torch.randn(3, 224, 224))['cascade']['stage'] in ('fast', 'full')
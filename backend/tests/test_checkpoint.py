@@ -0,0 +1,107 @@
+"""
+Tests for resumable full training checkpoints
+"""
+import os
+import random
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import torch.nn as nn
+from ml.checkpoint import TrainingCheckpointer, atomic_save
+
+class _Model(nn.Module):
+    num_classes = 3
+    class_names = ["authentic", "ai_generated", "manipulated"]
+
+    def __init__(self):
+        super().__init__()
+        self.net = nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Dropout(0.2), nn.Linear(16, 3))
+
+    def forward(self, x):
+        return self.net(x)
+
+class _Killed(Exception):
+    pass
+
+DATA = torch.randn(32, 8, generator=torch.Generator().manual_seed(1))
+TARGETS = torch.randint(0, 3, (32,), generator=torch.Generator().manual_seed(2))
+
+def _train(checkpointer, epochs, resume=False, kill_after=None):
+    """The train_model loop in miniature: every RNG feeds into the weights"""
+    torch.manual_seed(0)
+    np.random.seed(0)
+    random.seed(0)
+    model = _Model()
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=1)
+    tracking = {'losses': []}
+    start_epoch = 0
+    if resume:
+        tracking = checkpointer.load(model, optimizer, scheduler, torch.device("cpu"))
+        start_epoch = tracking.pop('start_epoch')
+
+    for epoch in range(start_epoch, epochs):
+        model.train()
+        noise = float(np.random.rand()) * random.random()
+        for batch in torch.randperm(len(DATA)).split(8):
+            optimizer.zero_grad()
+            loss = nn.functional.cross_entropy(model(DATA[batch] + noise), TARGETS[batch])
+            loss.backward()
+            optimizer.step()
+        # A rising loss after epoch 1 makes the plateau scheduler act
+        scheduler.step(loss.item() + (epoch if epoch > 1 else 0))
+        tracking['losses'].append(loss.item())
+        checkpointer.save(epoch, model, optimizer, scheduler, tracking)
+        if epoch == kill_after:
+            raise _Killed()
+    return model, optimizer, scheduler, tracking
+
+def test_resume_after_kill_matches_an_uninterrupted_run(tmp_path):
+    """Epoch, optimizer, scheduler and RNG state all survive a kill and --resume"""
+    reference = _train(TrainingCheckpointer(str(tmp_path / "a"), "run"), epochs=6)
+    reference_draws = (torch.rand(3), np.random.rand(), random.random())
+
+    checkpointer = TrainingCheckpointer(str(tmp_path / "b"), "run")
+    with pytest.raises(_Killed):
+        _train(checkpointer, epochs=6, kill_after=2)
+    assert torch.load(checkpointer.path, weights_only=False)['epoch'] == 2
+
+    # Fresh process state: different RNG seeds, new model and optimizer
+    torch.manual_seed(123)
+    np.random.seed(123)
+    random.seed(123)
+    model, optimizer, scheduler, tracking = _train(checkpointer, epochs=6, resume=True)
+    resumed_draws = (torch.rand(3), np.random.rand(), random.random())
+
+    ref_model, ref_optimizer, ref_scheduler, ref_tracking = reference
+    assert tracking['losses'] == ref_tracking['losses'] and len(tracking['losses']) == 6
+    for name, tensor in ref_model.state_dict().items():
+        assert torch.equal(model.state_dict()[name], tensor), name
+    for param, state in ref_optimizer.state_dict()['state'].items():
+        assert torch.equal(optimizer.state_dict()['state'][param]['exp_avg'], state['exp_avg'])
+        assert optimizer.state_dict()['state'][param]['step'] == state['step']
+    assert scheduler.state_dict() == ref_scheduler.state_dict()
+    assert optimizer.param_groups[0]['lr'] == ref_optimizer.param_groups[0]['lr'] < 0.01
+    assert torch.equal(resumed_draws[0], reference_draws[0])
+    assert resumed_draws[1:] == reference_draws[1:]
+
+def test_interrupted_atomic_save_keeps_the_previous_checkpoint(tmp_path, monkeypatch):
+    """A write that dies half way never replaces the last good file"""
+    path = str(tmp_path / "checkpoints" / "run_last.pth")
+    atomic_save({'epoch': 1, 'weights': torch.ones(4)}, path)
+    save = torch.save
+
+    def interrupted(obj, f, *args, **kwargs):
+        f.write(b"PK\x03\x04 partial")
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(torch, "save", interrupted)
+
+    with pytest.raises(KeyboardInterrupt):
+        atomic_save({'epoch': 2, 'weights': torch.zeros(4)}, path)
+
+    monkeypatch.setattr(torch, "save", save)
+    checkpoint = torch.load(path)
+    assert checkpoint['epoch'] == 1 and torch.equal(checkpoint['weights'], torch.ones(4))
+    assert os.listdir(tmp_path / "checkpoints") == ["run_last.pth"]
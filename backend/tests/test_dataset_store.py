@@ -0,0 +1,49 @@
+"""
+Tests for content-addressed dataset storage
+"""
+import os
+from ml import dataset_store
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def test_blob_store_deduplicates(tmp_path):
+    """Identical content is stored once"""
+    store = dataset_store.BlobStore(str(tmp_path / "blobs"))
+
+    digest_a, created_a = store.put_bytes(b"image-bytes")
+    digest_b, created_b = store.put_bytes(b"image-bytes")
+
+    assert digest_a == digest_b
+    assert created_a and not created_b
+    assert open(store.path(digest_a), "rb").read() == b"image-bytes"
+
+def test_split_is_metadata_only(tmp_path):
+    """Splitting assigns manifest splits without creating split directories"""
+    dataset_path = str(tmp_path / "datasets" / "sample")
+    for i in range(10):
+        _write(os.path.join(dataset_path, "real", f"{i}.jpg"), f"real-{i}".encode())
+        _write(os.path.join(dataset_path, "fake", f"{i}.jpg"), f"fake-{i}".encode())
+
+    manifest = dataset_store.split_dataset(dataset_path, train_ratio=0.6, val_ratio=0.2, seed=0)
+
+    assert not any(os.path.exists(os.path.join(dataset_path, s)) for s in dataset_store.SPLITS)
+    reloaded = dataset_store.DatasetManifest.load(dataset_path)
+    assert len(reloaded.samples) == 20
+    assert len(reloaded.select("train")) == 12
+    assert len(reloaded.select("val")) == 4
+    assert len(reloaded.select("test")) == 4
+    assert reloaded.class_to_idx == {"fake": 0, "real": 1}
+    assert all(os.path.exists(path) for path, _ in manifest.select())
+
+def test_datasets_share_blobs(tmp_path):
+    """The same image in two datasets is stored once"""
+    for name in ("first", "second"):
+        _write(str(tmp_path / "datasets" / name / "real" / "same.jpg"), b"shared")
+        dataset_store.import_directory(str(tmp_path / "datasets" / name))
+
+    blob_files = [f for _, _, files in os.walk(tmp_path / "datasets" / "blobs") for f in files]
+    assert len(blob_files) == 1
+    assert len(dataset_store.referenced_hashes(str(tmp_path / "datasets"))) == 1
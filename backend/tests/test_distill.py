@@ -0,0 +1,33 @@
+"""
+Tests for knowledge distillation into SimpleAIDetectionCNN
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from ml.distill import distillation_loss
+from ml.model import ModelManager, SimpleAIDetectionCNN
+
+def test_loss_is_cross_entropy_without_soft_term():
+    """alpha=0 reduces to the hard-label loss"""
+    torch.manual_seed(0)
+    student = torch.randn(4, 3)
+    teacher = torch.randn(4, 3)
+    targets = torch.tensor([0, 1, 2, 0])
+
+    loss = distillation_loss(student, teacher, targets, temperature=4.0, alpha=0.0)
+
+    assert torch.isclose(loss, torch.nn.functional.cross_entropy(student, targets))
+    assert distillation_loss(teacher, teacher, targets, 4.0, 1.0).item() == pytest.approx(0.0, abs=1e-5)  # float32 KL noise, scaled by T^2
+
+def test_model_manager_loads_student_checkpoint(tmp_path):
+    """A distilled student is loaded as SimpleAIDetectionCNN"""
+    student = SimpleAIDetectionCNN(num_classes=3)
+    manager = ModelManager(str(tmp_path))
+    manager.save_model(student, torch.optim.Adam(student.parameters()), 0, 0.0, 0.9,
+                       "distilled_sample.pth")
+
+    assert manager.load_model("distilled_sample.pth")
+    assert isinstance(manager.model, SimpleAIDetectionCNN)
+    result = manager.predict_image(torch.randn(3, 224, 224))
+    assert result['prediction'] in student.class_names
@@ -0,0 +1,77 @@
+"""
+Tests for Error Level Analysis
+"""
+import cv2
+import numpy as np
+from app.services.ela import ela_windows, error_level_analysis
+
+def _jpeg(image, quality):
+    _, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+def _image():
+    noise = (np.random.RandomState(0).rand(60, 80, 3) * 255).astype(np.uint8)
+    return cv2.resize(noise, (640, 480), interpolation=cv2.INTER_CUBIC)
+
+def test_pasted_region_stands_out():
+    original = _jpeg(_image(), 90)
+    spliced = original.copy()
+    spliced[128:256, 256:384] = cv2.GaussianBlur(_image(), (3, 3), 0)[128:256, 256:384]
+
+    clean, _ = error_level_analysis(original)
+    tampered, _ = error_level_analysis(spliced)
+
+    assert tampered['ela_block_cv'] > clean['ela_block_cv']
+    assert tampered['ela_outlier_block_fraction'] > clean['ela_outlier_block_fraction']
+
+def test_statistics_match_direct_computation():
+    image = _jpeg(_image(), 75)
+
+    features, seconds = error_level_analysis(image, heatmap=True)
+
+    error = cv2.absdiff(image, _jpeg(image, 90)).max(axis=2)
+    assert abs(features['ela_mean'] - error.mean()) < 1e-6
+    assert abs(features['ela_std'] - error.std()) < 1e-6
+    assert features['ela_max'] == error.max()
+    assert np.array(features['heatmap']).shape == (48, 64)
+    assert seconds > 0
+
+def test_splice_with_different_jpeg_quality_is_detected_in_windows():
+    noise = (np.random.RandomState(0).rand(192, 256, 3) * 255).astype(np.uint8)
+    source = cv2.resize(noise, (2048, 1536), interpolation=cv2.INTER_CUBIC)
+    original = _jpeg(source, 60)
+    spliced = original.copy()
+    spliced[512:1024, 768:1280] = source[512:1024, 768:1280]  # Pasted without the q60 history
+
+    def analyzed(image):
+        _, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        features, _ = error_level_analysis(cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE))
+        return features
+
+    clean, tampered = analyzed(original), analyzed(spliced)
+
+    assert tampered['windows'] == clean['windows'] > 0
+    assert tampered['ela_block_cv'] > 2 * clean['ela_block_cv']
+    assert tampered['ela_outlier_block_fraction'] > 2 * clean['ela_outlier_block_fraction']
+
+def test_windows_bound_pixels():
+    image = np.zeros((3000, 4000), dtype=np.uint8)
+
+    mosaic, windows = ela_windows(image, 1024 * 1024)
+    assert windows > 1
+    assert mosaic.size <= 1024 * 1024
+
+    strip, windows = ela_windows(np.zeros((100, 50000), dtype=np.uint8), 1024 * 1024)
+    assert windows == 1 and strip.size <= 1024 * 1024
+
+    small = np.zeros((480, 640), dtype=np.uint8)
+    whole, windows = ela_windows(small, 1024 * 1024)
+    assert windows == 0 and whole is small
+
+def test_heatmap_only_for_whole_images():
+    image = _jpeg(_image(), 75)
+
+    features, _ = error_level_analysis(image, heatmap=True, max_pixels=640 * 480 // 4)
+
+    assert features['windows'] > 0
+    assert 'heatmap' not in features
@@ -0,0 +1,73 @@
+"""
+Tests for cached frozen-backbone features and head-only training
+"""
+import os
+from functools import partial
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import torchvision.transforms as transforms
+from PIL import Image
+from ml import dataset_store, feature_cache
+from ml.feature_cache import CACHE_DIR, cached_features
+from ml.model import AIDetectionCNN, ModelManager
+from ml.train import CustomImageDataset, Trainer
+
+def _make_dataset(dataset_path, per_class=4):
+    for label, color in (("fake", (200, 30, 30)), ("real", (30, 30, 200))):
+        os.makedirs(os.path.join(dataset_path, label), exist_ok=True)
+        for i in range(per_class):
+            Image.new("RGB", (40, 40), color=(color[0], 10 * i, color[2])).save(
+                os.path.join(dataset_path, label, f"{i}.png"))
+
+def test_cached_features_are_reused_until_the_backbone_changes(tmp_path, monkeypatch):
+    """Embeddings are extracted once per dataset and backbone"""
+    dataset_path = str(tmp_path / "sample")
+    _make_dataset(dataset_path)
+    dataset = CustomImageDataset(dataset_path, transform=transforms.Compose([
+        transforms.Resize(32), transforms.ToTensor()
+    ]))
+    torch.manual_seed(0)
+    model = AIDetectionCNN(num_classes=2, pretrained=False)
+    extractions = []
+    extract = feature_cache._extract
+    monkeypatch.setattr(feature_cache, "_extract", lambda *args: extractions.append(1) or extract(*args))
+    args = dict(batch_size=4, num_workers=0)
+
+    first = cached_features(model, dataset, str(tmp_path), "train", **args)
+    again = cached_features(model, dataset, str(tmp_path), "train", **args)
+
+    assert len(extractions) == 1
+    assert len(first) == len(dataset) and first.features.shape == (len(dataset), 2048)
+    assert torch.equal(again[3][0], first[3][0]) and again[3][1] == dataset[3][1]
+    files = set(os.listdir(tmp_path / CACHE_DIR))
+
+    with torch.no_grad():
+        model.backbone.conv1.weight.add_(0.1)
+    changed = cached_features(model, dataset, str(tmp_path), "train", **args)
+
+    assert len(extractions) == 2
+    assert not set(os.listdir(tmp_path / CACHE_DIR)) & files
+    assert not torch.equal(changed[3][0], first[3][0])
+
+def test_head_only_training_saves_a_loadable_checkpoint(tmp_path, monkeypatch):
+    """train_head_model writes a full checkpoint that ModelManager serves"""
+    dataset_path = str(tmp_path / "datasets" / "sample")
+    _make_dataset(dataset_path)
+    dataset_store.split_dataset(dataset_path, train_ratio=0.5, val_ratio=0.25, seed=0)
+    monkeypatch.setattr("ml.train.AIDetectionCNN", partial(AIDetectionCNN, pretrained=False))
+    trainer = Trainer(dataset_path, model_save_path=str(tmp_path / "models"))
+    trainer.num_epochs = 2
+    trainer.batch_size = 4
+    monkeypatch.setattr(feature_cache, "DataLoader", partial(feature_cache.DataLoader, num_workers=0))
+
+    results = trainer.train_head_model("sample")
+
+    assert 0.0 <= results["best_val_accuracy"] <= 1.0 and 0.0 <= results["test_accuracy"] <= 1.0
+    assert len(os.listdir(tmp_path / "datasets" / "sample" / CACHE_DIR)) == 6
+    manager = ModelManager(str(tmp_path / "models"))
+    assert manager.load_model("ai_detection_model_sample.pth")
+    assert isinstance(manager.model, AIDetectionCNN) and manager.model.num_classes == 2
+    result = manager.predict_image(torch.randn(3, 224, 224))
+    assert result["prediction"] in manager.model.class_names
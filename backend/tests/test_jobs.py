@@ -0,0 +1,192 @@
+"""
+Tests for background jobs and their server-sent progress events
+"""
+import io
+import json
+import asyncio
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+import fitz
+import pytest
+from bson import ObjectId
+from httpx import AsyncClient
+from PIL import Image
+from app.main import app
+from app.api.auth import get_current_user
+from app.models.user import User
+from app.services.jobs import job_manager
+from app.services.storage import LocalStorage
+from app.services.upload_retention import UploadStore
+
+class _Collection:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=ObjectId())
+
+class _Database:
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        return self.collections.setdefault(name, _Collection())
+
+def _user(name: str) -> User:
+    return User(
+        username=name, email=f"{name}@example.com", plan="premium",
+        created_at=datetime.utcnow(), updated_at=datetime.utcnow()
+    )
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    database = _Database()
+    monkeypatch.setattr("app.api.jobs.get_database", lambda: database)
+    monkeypatch.setattr("app.api.analysis.get_database", lambda: database)
+    store = UploadStore(LocalStorage(str(tmp_path / "uploads")), str(tmp_path / "index.sqlite3"))
+    monkeypatch.setattr("app.api.analysis.upload_store", store)
+    user = _user("tester")
+    app.dependency_overrides[get_current_user] = lambda: user
+    database.store = store
+    yield database
+    app.dependency_overrides.clear()
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        data = [line[len("data: "):] for line in block.splitlines() if line.startswith("data: ")]
+        if data:
+            events.append(json.loads(data[0]))
+    return events
+
+def jpeg_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color=(30, 120, 200)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+@pytest.mark.asyncio
+async def test_image_job_streams_analysis_stages(db):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        started = await ac.post("/api/jobs/image", files={"file": ("photo.jpg", jpeg_bytes(), "image/jpeg")})
+        assert started.status_code == 202
+        job_id = started.json()["job_id"]
+
+        response = await ac.get(f"/api/jobs/{job_id}/events")
+        snapshot = (await ac.get(f"/api/jobs/{job_id}")).json()
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [event["stage"] for event in events] == [
+        "upload_received", "exif", "metadata", "quality", "forensic", "ela",
+        "preprocess", "inference", "persisted", "completed"
+    ]
+    assert [event["id"] for event in events] == list(range(1, len(events) + 1))
+    assert events[-1]["result"]["analysis_id"] == events[-2]["analysis_id"]
+    assert snapshot["status"] == "completed" and len(db.image_analyses.docs) == 1
+
+@pytest.mark.asyncio
+async def test_image_job_persists_like_the_synchronous_endpoint(db):
+    content = jpeg_bytes()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        job_id = (await ac.post("/api/jobs/image", files={"file": ("photo.jpg", content, "image/jpeg")})).json()["job_id"]
+        await ac.get(f"/api/jobs/{job_id}/events")
+        synchronous = await ac.post("/api/analyze/image", files={"file": ("photo.jpg", content, "image/jpeg")})
+
+    assert synchronous.status_code == 200
+    job_record, sync_record = db.image_analyses.docs
+    assert set(job_record) == set(sync_record)
+    # The upload is retained through upload_store instead of being deleted
+    with open(db.store.resolve(job_record["stored_filename"]), "rb") as f:
+        assert f.read() == content
+    assert [log["endpoint"] for log in db.api_logs.docs] == ["/api/jobs/image", "/analyze/image"]
+    assert db.api_logs.docs[0]["file_size"] == len(content)
+
+@pytest.mark.asyncio
+async def test_pdf_job_reports_each_page_and_resumes_after_last_event_id(db):
+    document = fitz.open()
+    for text in ("first page", "second page"):
+        document.new_page().insert_text((72, 72), text)
+    pdf = document.tobytes()
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        job_id = (await ac.post("/api/jobs/pdf", files={"file": ("doc.pdf", pdf, "application/pdf")})).json()["job_id"]
+        events = parse_sse((await ac.get(f"/api/jobs/{job_id}/events")).text)
+        resumed = parse_sse((await ac.get(f"/api/jobs/{job_id}/events", headers={"Last-Event-ID": "2"})).text)
+
+    pages = [(event["page"], event["pages"]) for event in events if event["stage"] == "page"]
+    assert pages == [(1, 2), (2, 2)]
+    assert events[-1]["stage"] == "completed" and events[-1]["result"]["page_count"] == 2
+    assert resumed == events[2:]
+    assert len(db.pdf_analyses.docs) == 1 and db.api_logs.docs[0]["endpoint"] == "/api/jobs/pdf"
+
+@pytest.mark.asyncio
+async def test_client_disconnect_does_not_cancel_the_job():
+    release = threading.Event()
+
+    async def work(job):
+        job.emit("inference", seconds=0.0)
+        await job_manager.run_blocking(release.wait, 5)
+        return {"prediction": "authentic"}
+
+    job = job_manager.submit("image", work)
+    job.emit("upload_received", size=1)
+
+    # Drive the SSE endpoint as an ASGI client that goes away after the first event
+    disconnected = asyncio.Event()
+    requested = []
+    sent = []
+
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body" and message.get("body"):
+            disconnected.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": f"/api/jobs/{job.id}/events", "raw_path": f"/api/jobs/{job.id}/events".encode(),
+        "query_string": b"", "root_path": "", "headers": [(b"host", b"test")],
+        "client": ("test", 1), "server": ("test", 80)
+    }
+    await asyncio.wait_for(app(scope, receive, send), timeout=5)
+    assert not job.done and not job._subscribers
+
+    release.set()
+    await asyncio.wait_for(job_manager.wait(), timeout=5)
+
+    assert job.status == "completed" and job.result == {"prediction": "authentic"}
+    assert [event["stage"] for event in job.events] == ["upload_received", "inference", "completed"]
+
+@pytest.mark.asyncio
+async def test_job_snapshot_is_only_visible_to_its_owner(db):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        job_id = (await ac.post("/api/jobs/image", files={"file": ("photo.jpg", jpeg_bytes(), "image/jpeg")})).json()["job_id"]
+        await ac.get(f"/api/jobs/{job_id}/events")
+        owner = await ac.get(f"/api/jobs/{job_id}")
+
+        other = _user("someone-else")
+        app.dependency_overrides[get_current_user] = lambda: other
+        foreign = await ac.get(f"/api/jobs/{job_id}")
+        events = await ac.get(f"/api/jobs/{job_id}/events")  # The id alone grants the event stream
+
+        app.dependency_overrides.clear()
+        anonymous = await ac.get(f"/api/jobs/{job_id}")
+
+    assert owner.status_code == 200 and owner.json()["status"] == "completed"
+    assert foreign.status_code == 404
+    assert events.status_code == 200 and parse_sse(events.text)[-1]["stage"] == "completed"
+    assert anonymous.status_code in (401, 403)
+
+@pytest.mark.asyncio
+async def test_unknown_job_is_404():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/jobs/missing/events")
+    assert response.status_code == 404
@@ -0,0 +1,101 @@
+"""
+Tests for the header-only metadata reader
+"""
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+from app.services.metadata_reader import read_image_metadata
+from benchmark_metadata import c2pa_segment
+
+def _image(size=(64, 48)):
+    return Image.fromarray(np.random.RandomState(0).randint(0, 255, (size[1], size[0], 3), dtype=np.uint8))
+
+def test_jpeg_exif_and_xmp(tmp_path):
+    exif = Image.Exif()
+    exif[0x010F], exif[0x0131] = "Canon", "Adobe Photoshop 25.0"
+    exif.get_ifd(0x8769)[0x9003] = "2024:01:01 10:00:00"
+    xmp = b'<rdf:Description xmp:CreatorTool="Midjourney"><dc:format>image/jpeg</dc:format></rdf:Description>'
+    path = str(tmp_path / "photo.jpg")
+    _image().save(path, exif=exif, xmp=xmp)
+
+    metadata = read_image_metadata(path)
+
+    assert (metadata.format, metadata.size, metadata.mode) == ("JPEG", (64, 48), "RGB")
+    assert metadata.exif['Make'] == "Canon"
+    assert metadata.exif['DateTimeOriginal'] == "2024:01:01 10:00:00"  # From the Exif sub-IFD
+    assert metadata.xmp == {'xmp:CreatorTool': "Midjourney", 'dc:format': "image/jpeg"}
+
+def test_png_generation_parameters(tmp_path):
+    info = PngImagePlugin.PngInfo()
+    info.add_text("parameters", "a cat\nSteps: 20, Sampler: Euler a")
+    info.add_itxt("Comment", "créé", zip=True)
+    path = str(tmp_path / "generated.png")
+    _image().convert("RGBA").save(path, pnginfo=info)
+
+    metadata = read_image_metadata(path)
+
+    assert metadata.mode == "RGBA" and metadata.has_transparency
+    assert metadata.generation_parameters.startswith("a cat")
+    assert metadata.text_chunks['Comment'] == "créé"
+
+def test_jpeg_c2pa_manifest(tmp_path):
+    path = tmp_path / "firefly.jpg"
+    _image().save(path)
+    data = path.read_bytes()
+    path.write_bytes(data[:2] + c2pa_segment("Adobe Firefly/1.0") + data[2:])
+
+    c2pa = read_image_metadata(str(path)).c2pa
+
+    assert c2pa.present and c2pa.ai_generated
+    assert c2pa.claim_generator == "Adobe Firefly/1.0"
+
+def test_header_above_pillow_pixel_limit(tmp_path):
+    from PIL import TiffImagePlugin
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=b"II")
+    for tag, value in {256: 20000, 257: 20000, 258: (8, 8, 8), 259: 1, 262: 2,
+                       273: 0, 277: 3, 278: 20000, 279: 20000 * 20000 * 3}.items():
+        ifd[tag] = value
+    path = tmp_path / "scan.tif"
+    path.write_bytes(b"II*\x00\x08\x00\x00\x00" + ifd.tobytes(8))
+
+    metadata = read_image_metadata(str(path))
+
+    assert (metadata.format, metadata.size) == ("TIFF", (20000, 20000))
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(str(path))  # The process-wide check is left in force
+
+def test_compressed_text_bomb_is_inflated_only_up_to_the_cap(tmp_path):
+    import struct, zlib
+    from app.services import metadata_reader
+    compressor = zlib.compressobj(9)
+    payload = b"".join(compressor.compress(b"\0" * (1024 * 1024)) for _ in range(200)) + compressor.flush()
+    chunk = b"parameters\0\0" + payload
+    path = tmp_path / "bomb.png"
+    _image().save(path)
+    data = path.read_bytes()
+    ztxt = struct.pack(">L", len(chunk)) + b"zTXt" + chunk + struct.pack(">L", zlib.crc32(b"zTXt" + chunk))
+    path.write_bytes(data[:33] + ztxt + data[33:])  # After the IHDR chunk
+    assert path.stat().st_size < 256 * 1024  # 200 MiB of text once inflated
+
+    metadata = read_image_metadata(str(path))
+
+    assert len(metadata.generation_parameters) == metadata_reader.MAX_GENERATION_CHARS
+    assert len(metadata.text_chunks['parameters']) == metadata_reader.MAX_TEXT_CHARS
+    assert metadata.size == (64, 48)
+
+def test_malformed_segment_keeps_fields_of_the_others(tmp_path):
+    import struct
+    exif = Image.Exif()
+    exif[0x010F] = "Canon"
+    path = tmp_path / "photo.jpg"
+    _image().save(path, exif=exif, xmp=b'<rdf:Description xmp:CreatorTool="Midjourney"/>')
+    # Photoshop resource whose Pascal name runs past the end of the segment
+    iptc = b"Photoshop 3.0\x00" + b"8BIM\x04\x04\xff" + b"\x00" * 5
+    data = path.read_bytes()
+    path.write_bytes(data[:2] + b"\xff\xed" + struct.pack(">H", len(iptc) + 2) + iptc + data[2:])
+
+    metadata = read_image_metadata(str(path))
+
+    assert metadata.exif['Make'] == "Canon"
+    assert metadata.xmp == {'xmp:CreatorTool': "Midjourney"}
+    assert metadata.size == (64, 48)
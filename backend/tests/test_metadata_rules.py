@@ -0,0 +1,107 @@
+"""
+Tests for the metadata rules engine
+"""
+import json
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.models.analysis import C2PAManifest, ImageMetadata
+from app.services.metadata_rules import MetadataRules, RulesConfigError
+
+@pytest.fixture(scope="module")
+def rules():
+    return MetadataRules.load(settings.METADATA_RULES_PATH)
+
+CAMERA = {'Make': "Canon", 'Model': "EOS R5", 'DateTimeOriginal': "2024:01:01 10:00:00"}
+PHOTO = dict(width=4032, height=3024)
+# Weights of the detection that was hard-coded in image_analysis before the rules file
+LEGACY_WEIGHTS = {
+    'missing_exif': 0.3, 'missing_camera_info': 0.2, 'suspicious_software': 0.4,
+    'missing_timestamp': 0.1, 'unusual_dimensions': 0.2, 'ai_provenance': 0.5
+}
+
+@pytest.mark.parametrize("fields, flagged", [
+    (dict(exif=CAMERA, **PHOTO), set()),
+    (dict(**PHOTO), {'missing_exif', 'missing_camera_info', 'missing_timestamp'}),
+    (dict(exif={'Orientation': 1}, **PHOTO), {'missing_camera_info', 'missing_timestamp'}),
+    *[(dict(exif=CAMERA, width=side, height=side), {'unusual_dimensions'}) for side in (256, 512, 768, 1024)],
+    *[(dict(exif={**CAMERA, 'Software': name}, **PHOTO), {'suspicious_software'})
+      for name in ("Adobe Photoshop 25.0", "GIMP 2.10", "Midjourney", "DALLE", "Stable Diffusion")],
+    (dict(exif=CAMERA, xmp={'xmp:CreatorTool': "Stable Diffusion web UI"}, **PHOTO), {'suspicious_software'}),
+    (dict(exif=CAMERA, generation_parameters="a cat\nSteps: 20", **PHOTO), {'ai_provenance'}),
+    (dict(exif=CAMERA, c2pa=C2PAManifest(present=True, ai_generated=True), **PHOTO), {'ai_provenance'}),
+    (dict(exif=CAMERA, xmp={'Iptc4xmpExt:DigitalSourceType':
+                            "http://cv.iptc.org/newscodes/digitalsourcetype/compositeWithTrainedAlgorithmicMedia"},
+          **PHOTO), {'ai_provenance'}),
+])
+def test_legacy_detection_cases_are_unchanged(rules, fields, flagged):
+    anomalies = rules.detect(ImageMetadata(**fields).as_exif_dict())
+
+    assert {name for name, hit in anomalies.items() if hit} == flagged
+    assert rules.score(anomalies, None) == pytest.approx(min(sum(LEGACY_WEIGHTS[name] for name in flagged), 1.0))
+
+def test_detection_added_by_rules_file(rules):
+    """Flagged by the rules file only: stored and live scores of such images shift"""
+    assert rules.generator_sized((4096, 2304))  # 16:9 on the 64 px latent grid
+    assert rules.generator_sized((832, 1216))  # SDXL bucket
+    assert rules.match_software({'Software': "Adobe Firefly"}) == ("firefly", "generator")
+    assert rules.match_software({'ProcessingSoftware': "ComfyUI"}) == ("comfyui", "generator")
+
+def test_detect(rules):
+    camera = {'Make': "Canon", 'DateTimeOriginal': "2024:01:01 10:00:00", 'size': (4032, 3024), 'format': "JPEG"}
+    assert not any(rules.detect(camera).values())
+
+    generated = {
+        'Software': "Adobe Photoshop 25.0", 'size': [832, 1216], 'format': "PNG",
+        'XMP': {'Iptc4xmpExt:DigitalSourceType': "http://cv.iptc.org/newscodes/digitalsourcetype/trainedAlgorithmicMedia"}
+    }
+    assert rules.detect(generated) == {
+        'missing_camera_info': True,
+        'suspicious_software': True,
+        'missing_timestamp': True,
+        'unusual_dimensions': True,
+        'missing_exif': False,
+        'ai_provenance': True
+    }
+    assert rules.match_software({'XMP': {'xmp:CreatorTool': "DALL-E 3"}}) == ("dall-e", "generator")
+    assert rules.generator_sized((1280, 1280))  # 1:1 on the 64 px latent grid
+    assert not rules.generator_sized((1920, 1080))
+    assert rules.detect({'format': "PNG", 'size': (10, 10)})['missing_exif']
+
+def test_batch_matches_single(rules):
+    exif_records = [
+        {'format': "PNG", 'size': (512, 512), 'GenerationParameters': {'parameters': "a cat"}},
+        {'Make': "Nikon", 'DateTime': "2024:01:01 10:00:00", 'size': (6000, 4000)},
+        {'Software': "GIMP 2.10", 'size': (800, 600)}
+    ]
+    quality_records = [{'sharpness': 1500.0, 'noise_level': 5.0}, None, {'sharpness': 10.0, 'noise_level': 40.0}]
+
+    anomalies, scores = rules.score_batch(exif_records, quality_records)
+
+    expected = [rules.score(rules.detect(exif), quality) for exif, quality in zip(exif_records, quality_records)]
+    assert np.allclose(scores, expected)
+    assert scores[0] == 1.0  # Capped at max_score
+    assert scores[1] == 0.0
+    assert anomalies[2]['suspicious_software']
+    with pytest.raises(ValueError):
+        rules.score_batch(exif_records, quality_records[:1])
+
+def test_versioned_weights(tmp_path, rules):
+    with open(settings.METADATA_RULES_PATH) as f:
+        config = json.load(f)
+    config['version'] = "test"
+    config['weights']['suspicious_software'] = 0.9
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(config))
+
+    custom = MetadataRules.load(str(path))
+    record = {'Make': "Canon", 'DateTime': "x", 'Software': "Midjourney"}
+
+    assert custom.version == "test"
+    assert custom.score(custom.detect(record), None) == pytest.approx(0.9)
+    assert rules.score(rules.detect(record), None) == pytest.approx(0.4)
+
+    del config['weights']
+    path.write_text(json.dumps(config))
+    with pytest.raises(RulesConfigError):
+        MetadataRules.load(str(path))
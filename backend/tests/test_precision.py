@@ -0,0 +1,30 @@
+"""
+Tests for CPU precision modes
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from torch.utils.data import DataLoader, TensorDataset
+from ml import precision as precision_modes
+from ml.model import SimpleAIDetectionCNN
+
+def _loader():
+    data = torch.randn(6, 3, 224, 224)
+    return DataLoader(TensorDataset(data, torch.tensor([0, 1, 2, 0, 1, 2])), batch_size=3)
+
+def test_mode_name_and_validation():
+    assert precision_modes.mode_name("bf16", True) == "bf16-cl"
+    assert precision_modes.mode_name("fp32", False) == "fp32"
+    with pytest.raises(ValueError):
+        precision_modes.validate_precision("fp16")
+
+def test_channels_last_parity_matches_fp32():
+    """Memory format alone must not change predictions"""
+    torch.manual_seed(0)
+    model = SimpleAIDetectionCNN()
+    report = precision_modes.parity_check(model, _loader(), "fp32", True, torch.device("cpu"))
+
+    assert report['passed']
+    assert report['prediction_agreement'] == 1.0
+    assert model.features[0].weight.is_contiguous(memory_format=torch.channels_last)
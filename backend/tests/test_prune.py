@@ -0,0 +1,34 @@
+"""
+Tests for structured channel pruning
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from ml.model import AIDetectionCNN, ModelManager
+from ml.prune import prune_model, count_parameters, pareto_front
+
+def test_pruned_model_is_smaller_dense_and_reloadable(tmp_path):
+    """Pruned checkpoints reload through ModelManager with identical outputs"""
+    torch.manual_seed(0)
+    model = AIDetectionCNN(pretrained=False).eval()
+    pruned = prune_model(model, 0.5).eval()
+
+    assert count_parameters(pruned) < count_parameters(model)
+    assert pruned.backbone.layer1[0].conv1.out_channels == 32
+
+    manager = ModelManager(str(tmp_path))
+    manager.save_model(pruned, torch.optim.Adam(pruned.parameters()), 0, 0.0, 0.5, "pruned.pth")
+    assert manager.load_model("pruned.pth")
+
+    data = torch.randn(1, 3, 64, 64)
+    with torch.no_grad():
+        assert torch.allclose(manager.model(data), pruned(data), atol=1e-5)
+
+def test_pareto_front():
+    points = [
+        {'test_accuracy': 0.90, 'latency_ms': 40.0},
+        {'test_accuracy': 0.88, 'latency_ms': 20.0},
+        {'test_accuracy': 0.85, 'latency_ms': 25.0},
+    ]
+    assert [p['pareto_optimal'] for p in pareto_front(points)] == [True, True, False]
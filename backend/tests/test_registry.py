@@ -0,0 +1,83 @@
+"""
+Tests for the model registry and hot swap
+"""
+import time
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from ml.model import ModelManager, SimpleAIDetectionCNN
+
+def _save(manager, name):
+    model = SimpleAIDetectionCNN()
+    manager.save_model(model, torch.optim.Adam(model.parameters()), 0, 0.1, 0.8, name)
+    return f"{manager.model_path}/{name}"
+
+def test_register_activate_and_stamp_version(tmp_path):
+    """A hot swap changes the version stamped on new predictions"""
+    manager = ModelManager(str(tmp_path))
+    first = manager.registry.register(_save(manager, "a.pth"))
+    second = manager.registry.register(_save(manager, "b.pth"), metrics={"val_f1": 0.7})
+
+    assert (first['version'], second['version']) == ("v1", "v2")
+    assert second['architecture'] == "simple"
+    assert second['metrics'] == {"accuracy": 0.8, "loss": 0.1, "epoch": 0, "val_f1": 0.7}
+
+    manager.activate_version("v1")
+    assert manager.predict_image(torch.randn(3, 224, 224))['model_version'] == "v1"
+
+    status = manager.activate_version("v2")
+    assert status['previous_version'] == "v1"
+    assert manager.predict_image(torch.randn(3, 224, 224))['model_version'] == "v2"
+
+    # A fresh process serves the active version
+    restarted = ModelManager(str(tmp_path))
+    assert restarted.load_model()
+    assert restarted.model_version == "v2"
+
+def test_tampered_checkpoint_is_rejected(tmp_path):
+    manager = ModelManager(str(tmp_path))
+    manager.registry.register(_save(manager, "a.pth"))
+    with open(manager.registry.checkpoint_path("v1"), "ab") as f:
+        f.write(b"corrupt")
+
+    with pytest.raises(ValueError):
+        manager.activate_version("v1")
+    assert manager.swap_status['state'] == "failed"
+
+def test_other_workers_follow_an_activation(tmp_path):
+    """A swap in one process is picked up by every manager sharing the registry"""
+    worker_a = ModelManager(str(tmp_path))
+    worker_a.registry.register(_save(worker_a, "a.pth"))
+    worker_a.registry.register(_save(worker_a, "b.pth"))
+    worker_a.activate_version("v1")
+
+    worker_b = ModelManager(str(tmp_path))
+    assert worker_b.load_model() and worker_b.model_version == "v1"
+    assert worker_b.sync_active_version() is None
+
+    worker_a.activate_version("v2")
+    status = worker_b.sync_active_version()
+
+    assert status['state'] == "active" and status['previous_version'] == "v1"
+    assert worker_b.predict_image(torch.randn(3, 224, 224))['model_version'] == "v2"
+    assert worker_b.sync_active_version() is None
+    assert worker_a.sync_active_version() is None  # Its own write is already served
+
+def test_registry_watch_swaps_in_the_background(tmp_path):
+    """The poll thread follows the registry CLI's `activate` without a restart"""
+    worker = ModelManager(str(tmp_path))
+    worker.registry.register(_save(worker, "a.pth"))
+    worker.registry.register(_save(worker, "b.pth"))
+    worker.activate_version("v1")
+    worker.watch_registry(0.05)
+    try:
+        worker.registry.set_active("v2")
+        deadline = time.time() + 10
+        while worker.model_version != "v2" and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        worker.stop_watching_registry()
+
+    assert worker.model_version == "v2"
+    assert worker.registry.active_version() == "v2"
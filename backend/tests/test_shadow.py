@@ -0,0 +1,63 @@
+"""
+Tests for shadow and canary evaluation
+"""
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+torch = pytest.importorskip("torch")
+
+from ml.shadow import ShadowEvaluator
+
+class _Manager:
+    def __init__(self, version, prediction, confidence):
+        self.result = {'prediction': prediction, 'confidence': confidence, 'model_version': version}
+        self.model = type("Model", (), {"registry_version": version})()
+        self.calls = 0
+
+    def predict_image(self, image_tensor, metadata_suspicion=None):
+        self.calls += 1
+        return dict(self.result)
+
+def _evaluator(sample_rate=1.0, canary_percent=0.0):
+    evaluator = ShadowEvaluator(_Manager("v1", "authentic", 0.9))
+    evaluator.candidate = _Manager("v2", "ai_generated", 0.7)
+    evaluator.sample_rate = sample_rate
+    evaluator.canary_percent = canary_percent
+    evaluator._max_pending = 8
+    evaluator._executor = ThreadPoolExecutor(max_workers=1)
+    return evaluator
+
+def test_shadow_records_agreement_delta_and_latency():
+    evaluator = _evaluator()
+
+    result = evaluator.predict_image(None, user_id="user")
+    evaluator._executor.shutdown(wait=True)
+    report = evaluator.summary()
+
+    assert result['model_version'] == "v1" and result['served_by'] == "live"
+    assert report['mode'] == "shadow"
+    assert report['comparisons'] == 1
+    assert report['agreement_rate'] == 0.0
+    assert report['mean_confidence_delta'] == pytest.approx(-0.2)
+    assert report['disagreements'] == {"authentic->ai_generated": 1}
+    assert report['models']['live']['served'] == 1
+    assert report['models']['candidate']['shadowed'] == 1
+    assert report['models']['candidate']['latency_ms'] is not None
+
+def test_full_backlog_drops_samples():
+    evaluator = _evaluator()
+    evaluator._max_pending = 0
+
+    evaluator.predict_image(None)
+
+    assert evaluator.summary()['dropped'] == 1
+    assert evaluator.candidate.calls == 0
+
+def test_canary_buckets_are_stable_per_user():
+    evaluator = _evaluator(sample_rate=0.0, canary_percent=30.0)
+
+    served = [evaluator.predict_image(None, user_id=f"user{i}")['served_by'] for i in range(200)]
+
+    assert 0.15 < served.count("candidate") / len(served) < 0.45
+    assert all(evaluator.in_canary(f"user{i}") == (role == "candidate") for i, role in enumerate(served))
+    assert not evaluator.in_canary(None)
@@ -0,0 +1,68 @@
+"""
+Tests for the packed shard format and its invalidation
+"""
+import io
+import os
+from PIL import Image
+from ml import dataset_store
+from ml.shards import SHARD_DIR, has_shards, pack_dataset, ShardedImageDataset, ShardShuffleDataset
+
+def _png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _make_dataset(dataset_path, per_class=6, offset=0):
+    for label, channel in (("fake", 0), ("real", 1)):
+        os.makedirs(os.path.join(dataset_path, label), exist_ok=True)
+        for i in range(per_class):
+            color = [0, 0, 0]
+            color[channel] = 10 * (i + offset) + 1
+            with open(os.path.join(dataset_path, label, f"{i}.png"), "wb") as f:
+                f.write(_png(tuple(color)))
+    return dataset_store.split_dataset(dataset_path, train_ratio=0.5, val_ratio=0.25, seed=0)
+
+def test_pack_and_read_round_trip(tmp_path):
+    """Shards return every sample of a split with its label, across shard boundaries"""
+    dataset_path = str(tmp_path / "datasets" / "sample")
+    manifest = _make_dataset(dataset_path)
+
+    pack_dataset(dataset_path, shard_bytes=100)
+
+    assert has_shards(dataset_path)
+    for split in dataset_store.SPLITS:
+        expected = sorted((open(path, "rb").read(), manifest.class_to_idx[label])
+                          for path, label in manifest.select(split))
+        dataset = ShardedImageDataset(dataset_path, split=split)
+        assert sorted((bytes(dataset.reader.sample(*loc)[0]), dataset.reader.sample(*loc)[1])
+                      for loc in dataset.locations) == expected
+        assert len(dataset.reader.shards) > 1 or len(expected) <= 1
+
+    train = ShardShuffleDataset(dataset_path, split="train", buffer_size=2, seed=0)
+    images = list(train)
+    assert len(images) == len(manifest.select("train"))
+    assert sorted(label for _, label in images) == sorted(
+        manifest.class_to_idx[label] for _, label in manifest.select("train"))
+    assert all(image.size == (8, 8) for image, _ in images)
+
+def test_shards_of_a_replaced_manifest_are_ignored(tmp_path):
+    """Re-uploading a dataset under the same name invalidates its shards until repacked"""
+    dataset_path = str(tmp_path / "datasets" / "sample")
+    _make_dataset(dataset_path)
+    pack_dataset(dataset_path, shard_bytes=100)
+    old_files = set(os.listdir(os.path.join(dataset_path, SHARD_DIR)))
+
+    # Same name, different content: the manifest is rewritten, shards/ is not
+    os.remove(dataset_store.manifest_path(dataset_path))
+    manifest = _make_dataset(dataset_path, per_class=2, offset=7)
+
+    assert not has_shards(dataset_path)
+
+    pack_dataset(dataset_path)
+    assert has_shards(dataset_path)
+    assert len(ShardedImageDataset(dataset_path, split="train")) == len(manifest.select("train"))
+    # Shard files of the old pack beyond the new ones are gone
+    new_files = set(os.listdir(os.path.join(dataset_path, SHARD_DIR)))
+    assert len(old_files) > len(new_files)
+    assert new_files == {"shards.json"} | {f"{split}-00000.{ext}" for split in dataset_store.SPLITS
+                                           for ext in ("bin", "idx.npy")}
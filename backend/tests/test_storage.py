@@ -0,0 +1,154 @@
+"""
+Tests for the local and S3 storage backends, read-through cache and their consumers
+"""
+import os
+import pytest
+import boto3
+from moto import mock_aws
+from app.services.storage import MB, MIN_PART_SIZE, LocalStorage, ReadThroughCache, S3Storage, StorageBackend
+from app.services.upload_retention import ObjectUploadStore, UploadStore, create_upload_store
+from ml.dataset_store import BlobStore
+
+BUCKET = "uploads-test"
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+def make_s3(client, tmp_path, name="pod", max_bytes=100 * MB):
+    cache = ReadThroughCache(str(tmp_path / name / "cache"), max_bytes)
+    return S3Storage(BUCKET, "uploads/", cache, client=client, part_size=MIN_PART_SIZE)
+
+def test_s3_streams_large_objects_as_multipart(s3_client, tmp_path):
+    storage = make_s3(s3_client, tmp_path)
+    payload = os.urandom(12 * MB)
+
+    with storage.writer("big.bin") as writer:
+        for start in range(0, len(payload), MB):
+            writer.write(payload[start:start + MB])
+
+    # Two full 5MB parts and the 2MB remainder
+    assert len(writer.parts) == 3
+    assert s3_client.head_object(Bucket=BUCKET, Key="uploads/big.bin")['ContentLength'] == len(payload)
+    assert storage.read_range("big.bin", 6 * MB, 10) == payload[6 * MB:6 * MB + 10]
+    with open(storage.local_path("big.bin"), "rb") as f:
+        assert f.read() == payload
+
+def test_s3_small_objects_are_a_single_put(s3_client, tmp_path):
+    storage = make_s3(s3_client, tmp_path)
+
+    storage.put_bytes("a/b/small.jpg", b"abc")
+
+    assert storage.size("a/b/small.jpg") == 3 and storage.size("missing.jpg") is None
+    assert list(storage.list("a/")) == ["a/b/small.jpg"]
+    assert "small.jpg" in storage.url("a/b/small.jpg")
+
+def test_failed_s3_write_aborts_the_multipart_upload(s3_client, tmp_path):
+    storage = make_s3(s3_client, tmp_path)
+
+    with pytest.raises(RuntimeError):
+        with storage.writer("broken.bin") as writer:
+            writer.write(os.urandom(6 * MB))
+            raise RuntimeError("client went away")
+
+    assert not storage.exists("broken.bin")
+    assert not s3_client.list_multipart_uploads(Bucket=BUCKET).get('Uploads')
+
+def test_read_through_cache_hits_and_evicts(s3_client, tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.storage.CACHE_MIN_AGE_SECONDS", -1)
+    storage = make_s3(s3_client, tmp_path, max_bytes=2 * MB)
+    for name in ("a", "b", "c"):
+        storage.put_bytes(name, os.urandom(MB))
+
+    first = storage.local_path("a")
+    assert storage.local_path("a") == first
+    assert (storage.cache.hits, storage.cache.misses) == (1, 1)
+
+    storage.local_path("b")
+    os.utime(first, (0, 0))  # "a" is now the least recently used entry
+    storage.local_path("c")
+
+    assert not os.path.exists(first)
+    assert storage.cache.size <= 2 * MB
+    assert storage.local_path("missing") is None
+
+def test_uploads_are_shared_between_pods_through_s3(s3_client, tmp_path):
+    pod_a = create_upload_store(make_s3(s3_client, tmp_path, "a"), str(tmp_path / "a.sqlite3"))
+    pod_b = create_upload_store(make_s3(s3_client, tmp_path, "b"), str(tmp_path / "b.sqlite3"))
+    assert isinstance(pod_a, ObjectUploadStore)
+
+    with pod_a.writer("shared.jpg") as writer:
+        writer.write(b"jpeg bytes")
+
+    path = pod_b.resolve("shared.jpg")
+    with open(path, "rb") as f:
+        assert f.read() == b"jpeg bytes"
+    assert pod_b.size("shared.jpg") == 10
+    assert pod_b.bytes_over_watermark() == 0  # Object storage is not bounded by local disk
+
+    # Retention lives on the object, so any pod can extend it
+    key = "uploads/" + pod_a.key("shared.jpg")
+    assert pod_b.retain("shared.jpg", "premium")
+    assert not pod_a.retain("shared.jpg", "free")
+    assert not pod_a.retain("missing.jpg", "premium")
+    tags = s3_client.get_object_tagging(Bucket=BUCKET, Key=key)['TagSet']
+    assert tags == [{'Key': 'retention', 'Value': 'premium'}]
+    assert pod_a.sweep_expired(now=10 ** 12) == (0, 0)  # S3 lifecycle rules do the sweeping
+
+def test_s3_retention_is_bucket_lifecycle_rules(s3_client, tmp_path):
+    s3_client.put_bucket_lifecycle_configuration(Bucket=BUCKET, LifecycleConfiguration={'Rules': [
+        {'ID': 'other-tool', 'Filter': {'Prefix': 'logs/'}, 'Status': 'Enabled', 'Expiration': {'Days': 7}}
+    ]})
+
+    store = ObjectUploadStore(make_s3(s3_client, tmp_path))
+    ObjectUploadStore(make_s3(s3_client, tmp_path, "other"))  # Every pod installs the same rules
+
+    rules = {rule['ID']: rule for rule in s3_client.get_bucket_lifecycle_configuration(Bucket=BUCKET)['Rules']}
+    assert set(rules) == {'other-tool', 'uploads/retention-free', 'uploads/retention-premium',
+                          'uploads/retention-pro', 'uploads/retention-untagged'}
+    assert rules['uploads/retention-free']['Expiration'] == {'Days': 1}
+    assert rules['uploads/retention-premium']['Filter']['And']['Tags'] == [{'Key': 'retention', 'Value': 'premium'}]
+    assert rules['uploads/retention-untagged']['Expiration'] == {'Days': 90}
+    assert store.stats() == {'lifecycle_days': {'free': 1, 'premium': 30, 'pro': 90}}
+
+def test_sqlite_index_refuses_object_storage(s3_client, tmp_path):
+    with pytest.raises(ValueError):
+        UploadStore(make_s3(s3_client, tmp_path), str(tmp_path / "index.sqlite3"))
+
+def test_backends_must_implement_the_interface():
+    class Incomplete(StorageBackend):
+        def writer(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_local_writer_is_atomic(tmp_path):
+    storage = LocalStorage(str(tmp_path / "root"))
+    storage.put_bytes("x/y/done.bin", b"0123456789")
+
+    with pytest.raises(RuntimeError):
+        with storage.writer("x/y/partial.bin") as writer:
+            writer.write(b"data")
+            raise RuntimeError
+
+    assert list(storage.list()) == ["x/y/done.bin"]
+    assert storage.read_range("x/y/done.bin", 2, 3) == b"234"
+    assert storage.url("x/y/done.bin") is None
+
+def test_blob_store_on_s3(s3_client, tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"), make_s3(s3_client, tmp_path))
+
+    digest, created = store.put_bytes(b"image")
+    assert created and store.put_bytes(b"image") == (digest, False)
+    with open(store.path(digest), "rb") as f:
+        assert f.read() == b"image"
+
+    assert store.garbage_collect(referenced=[]) == 1
+    assert not store.exists(digest)
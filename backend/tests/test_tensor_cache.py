@@ -0,0 +1,62 @@
+"""
+Tests for the preprocessed-tensor cache
+"""
+import os
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import torchvision.transforms as transforms
+from PIL import Image
+from ml.tensor_cache import CACHE_DIR, CachedTensorDataset, cached_dataset
+from ml.train import CustomImageDataset
+
+TRANSFORM = transforms.Compose([
+    transforms.Resize(40),
+    transforms.CenterCrop(32),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+])
+
+def _make_dataset(dataset_path):
+    for label in ("fake", "real"):
+        os.makedirs(os.path.join(dataset_path, label), exist_ok=True)
+        for i in range(4):
+            color = (40 * i, 200 if label == "real" else 20, 90)
+            Image.new("RGB", (48 + 8 * i, 64), color=color).save(os.path.join(dataset_path, label, f"{i}.png"))
+    return CustomImageDataset(dataset_path, transform=TRANSFORM)
+
+def test_cached_tensors_match_uncached(tmp_path):
+    """Cached crops normalize to the same tensors as on-the-fly decoding"""
+    dataset = _make_dataset(str(tmp_path / "val"))
+
+    cached = cached_dataset(dataset, str(tmp_path), "val", num_workers=0)
+
+    assert isinstance(cached, CachedTensorDataset)
+    assert len(cached) == len(dataset) and cached.class_to_idx == dataset.class_to_idx
+    for i in range(len(dataset)):
+        expected, label = dataset[i]
+        image, cached_label = cached[i]
+        assert cached_label == label
+        assert torch.allclose(image, expected, atol=1e-6)
+    assert not [f for f in os.listdir(tmp_path / CACHE_DIR) if f.endswith(".tmp")]
+
+def test_cache_is_rebuilt_when_the_dataset_changes(tmp_path):
+    """A fingerprint mismatch replaces the split's cache instead of serving stale crops"""
+    dataset = _make_dataset(str(tmp_path / "val"))
+    first = cached_dataset(dataset, str(tmp_path), "val", num_workers=0)
+    old_files = set(os.listdir(tmp_path / CACHE_DIR))
+
+    # Reused while nothing changed
+    again = cached_dataset(dataset, str(tmp_path), "val", num_workers=0)
+    assert set(os.listdir(tmp_path / CACHE_DIR)) == old_files
+    assert torch.equal(again[0][0], first[0][0])
+
+    path, _ = dataset.samples[0]
+    Image.new("RGB", (64, 64), color=(255, 255, 255)).save(path)
+    rebuilt = cached_dataset(dataset, str(tmp_path), "val", num_workers=0)
+
+    new_files = set(os.listdir(tmp_path / CACHE_DIR))
+    assert len(new_files) == 2 and not new_files & old_files
+    assert torch.allclose(rebuilt[0][0], dataset[0][0], atol=1e-6)
+    assert not torch.equal(rebuilt[0][0], first[0][0])
@@ -0,0 +1,80 @@
+"""
+Tests for tiled, bounded-memory analysis of large images
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import numpy as np
+from PIL import Image
+from app.services.tiled_analysis import TiledAnalyzer, MemoryCeilingError, tile_boxes
+
+def _save(tmp_path, name, size):
+    path = tmp_path / name
+    Image.fromarray(np.random.RandomState(0).randint(0, 255, (size[1], size[0], 3), dtype=np.uint8)).save(path)
+    return str(path)
+
+def test_tile_grid_covers_image_with_full_size_edge_tiles():
+    boxes = tile_boxes(1100, 600, 512)
+
+    assert len(boxes) == 6
+    assert (588, 88, 1100, 600) in boxes
+    assert all(right - left == 512 and bottom - top == 512 for left, top, right, bottom in boxes)
+
+def _analyzer(ceiling_bytes):
+    analyzer = TiledAnalyzer()
+    analyzer.tile_size, analyzer.batch_size = 64, 2
+    analyzer.memory_ceiling = analyzer._batch_bytes() + ceiling_bytes
+    return analyzer
+
+def test_jpeg_is_decoded_at_reduced_scale_under_ceiling(tmp_path):
+    path = _save(tmp_path, "large.jpg", (1024, 512))
+
+    image, scale = _analyzer(1024 * 512).open_bounded(path)
+
+    assert scale == 2.0
+    assert image.size == (512, 256)
+
+def test_undecodable_within_ceiling_is_rejected(tmp_path):
+    path = _save(tmp_path, "large.png", (1024, 512))
+
+    with pytest.raises(MemoryCeilingError) as error:
+        _analyzer(1024 * 512).open_bounded(path)
+    assert error.value.code == "memory_ceiling_exceeded"
+
+def _png_header(width, height):
+    """A PNG whose header declares width x height; its pixel data is never read"""
+    import struct, zlib
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+
+def test_image_above_pillow_pixel_limit_hits_memory_ceiling_not_bomb_check(tmp_path):
+    path = tmp_path / "scan.png"
+    path.write_bytes(_png_header(20000, 20000))
+    assert 20000 * 20000 > 2 * Image.MAX_IMAGE_PIXELS
+
+    with pytest.raises(MemoryCeilingError) as error:
+        _analyzer(1024 * 512).open_bounded(str(path))
+    assert error.value.details['width'] == 20000
+    assert Image.MAX_IMAGE_PIXELS is not None
+
+def test_striped_tiff_over_ceiling_is_decoded_band_by_band(tmp_path):
+    path = str(tmp_path / "scan.tif")
+    pixels = np.random.RandomState(0).randint(0, 255, (1000, 300, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, compression="tiff_deflate")
+    analyzer = _analyzer(400 * 1000)
+    assert 300 * 1000 * 4 > 400 * 1000  # A full decode does not fit
+
+    image, scale = analyzer.open_bounded(path)
+    try:
+        batches = list(analyzer._tile_batches(image))
+    finally:
+        image.close()
+
+    assert scale == 1.0
+    tiles = [(box, crop) for boxes, crops in batches for box, crop in zip(boxes, crops)]
+    assert [box for box, _ in tiles] == tile_boxes(300, 1000, 64)
+    for (left, top, right, bottom), crop in tiles:
+        assert np.array_equal(np.asarray(crop), pixels[top:bottom, left:right])
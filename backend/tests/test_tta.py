@@ -0,0 +1,40 @@
+"""
+Tests for batched test-time augmentation
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from PIL import Image
+import numpy as np
+from ml.model import ImagePreprocessor, ModelManager, SimpleAIDetectionCNN
+from ml.tta import tta_views, ViewLatencyModel, MAX_VIEWS
+
+def _image():
+    return Image.fromarray(np.random.RandomState(0).randint(0, 255, (300, 400, 3), dtype=np.uint8))
+
+def test_views_match_standard_preprocessing():
+    preprocessor = ImagePreprocessor()
+    views, names = tta_views(_image(), preprocessor, 4)
+
+    assert views.shape == (4, 3, 224, 224)
+    assert names == ["center", "center_flip", "top_left", "top_right"]
+    assert torch.allclose(views[0], preprocessor.get_val_transform()(_image()), atol=1e-6)
+    assert torch.equal(views[1], torch.flip(views[0], dims=[2]))
+
+def test_view_count_fits_budget():
+    latency = ViewLatencyModel("fp32", overhead=0.010, per_view=0.005)
+
+    assert latency.views_for(30) == 4
+    assert latency.views_for(5) == 1
+    assert latency.views_for(1000) == MAX_VIEWS
+
+def test_predict_tta_single_forward(tmp_path):
+    manager = ModelManager(str(tmp_path))
+    manager.model = SimpleAIDetectionCNN().eval()
+
+    result = manager.predict_tta(_image(), latency_budget_ms=10000)
+
+    assert result['tta']['views'] == MAX_VIEWS
+    assert sum(result['probabilities'].values()) == pytest.approx(1.0, abs=1e-4)
+    assert len(result['tta']['view_predictions']) == MAX_VIEWS
@@ -0,0 +1,60 @@
+"""
+Tests for the single round trip upload-and-analyze endpoint
+"""
+import io
+import hashlib
+import pytest
+from httpx import AsyncClient
+from PIL import Image
+from app.core.config import settings
+from app.services.storage import LocalStorage
+from app.services.upload_retention import UploadStore
+import production_server  # After settings: it loads .env.production into the environment
+
+def jpeg_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color=(200, 30, 30)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = UploadStore(LocalStorage(str(tmp_path / "uploads")), str(tmp_path / "index.sqlite3"))
+    monkeypatch.setattr(production_server, "upload_store", store)
+    return store
+
+@pytest.mark.asyncio
+async def test_upload_is_analyzed_in_one_request_and_retained_after(store):
+    content = jpeg_bytes()
+    async with AsyncClient(app=production_server.app, base_url="http://test") as ac:
+        response = await ac.post("/api/analysis/upload-and-analyze", files={"image": ("photo.jpg", content, "image/jpeg")})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "completed" and result["prediction"] != "error"
+    assert result["size"] == len(content)
+    assert result["file_hash"] == hashlib.sha256(content).hexdigest()
+    # Stored from the request buffer once the response was sent
+    with open(store.resolve(result["filename"]), "rb") as f:
+        assert f.read() == content
+
+@pytest.mark.asyncio
+async def test_upload_is_not_stored_without_retention(store, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_TTL_HOURS", {"free": 0})
+    async with AsyncClient(app=production_server.app, base_url="http://test") as ac:
+        response = await ac.post("/api/analysis/upload-and-analyze", files={"image": ("photo.jpg", jpeg_bytes(), "image/jpeg")})
+
+    assert response.status_code == 200
+    assert response.json()["filename"] is None
+    assert list(store.backend.list()) == []
+
+@pytest.mark.asyncio
+async def test_two_step_flow_still_works(store):
+    content = jpeg_bytes()
+    async with AsyncClient(app=production_server.app, base_url="http://test") as ac:
+        upload = (await ac.post("/api/upload", files={"image": ("photo.jpg", content, "image/jpeg")})).json()
+        response = await ac.post("/api/analysis/analyze", data={
+            "filename": upload["filename"], "original_name": upload["original_name"]
+        })
+
+    assert upload["size"] == len(content)
+    assert response.status_code == 200 and response.json()["status"] == "completed"
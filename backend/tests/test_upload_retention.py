@@ -0,0 +1,89 @@
+"""
+Tests for sharded upload storage, TTL sweeping and watermark eviction
+"""
+import os
+import time
+from collections import namedtuple
+import pytest
+from app.core.config import settings
+from app.services.storage import LocalStorage
+from app.services.upload_retention import UploadStore
+
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(LocalStorage(str(tmp_path / "uploads"), url_prefix="/uploads"), str(tmp_path / "index.sqlite3"))
+
+def test_uploads_are_sharded_and_resolved(store):
+    key = store.save("abc.jpg", b"x" * 10)
+    path = store.backend.path(key)
+
+    assert len(key.split("/")) == 3 and key.endswith("/abc.jpg")
+    assert store.resolve("abc.jpg") == path and os.path.isfile(path)
+    assert store.resolve("../abc.jpg") == path  # Names never leave UPLOAD_DIR
+    assert store.url("abc.jpg") == "/uploads/" + key
+    assert store.size("abc.jpg") == 10
+    assert store.resolve("missing.jpg") is None and store.url("missing.jpg") is None
+
+def test_expired_uploads_are_swept_per_plan(store, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_SWEEP_BATCH", 2)
+    for index in range(5):
+        store.save(f"free-{index}.jpg", b"x" * 10, plan="free")
+    store.save("premium.jpg", b"x" * 10, plan="premium")
+    store.save("upgraded.jpg", b"x" * 10, plan="free")
+    assert store.retain("upgraded.jpg", "premium")
+    assert not store.retain("upgraded.jpg", "free") and not store.retain("missing.jpg", "premium")
+    os.remove(store.resolve("free-0.jpg"))  # Already gone files are dropped from the index too
+
+    deleted, freed = store.sweep_expired(now=time.time() + 48 * 3600)
+
+    assert deleted == 5 and freed == 40
+    assert store.resolve("free-1.jpg") is None
+    assert store.resolve("premium.jpg") and store.resolve("upgraded.jpg")
+    assert store.stats()['plans'] == {'premium': {'uploads': 2, 'bytes': 20}}
+
+def test_watermark_eviction_spares_recent_uploads(store):
+    for index in range(4):
+        store.save(f"{index}.jpg", b"x" * 100, plan="premium" if index == 0 else "free")
+
+    assert store.evict(150) == (0, 0)  # All younger than UPLOAD_EVICTION_MIN_AGE_SECONDS
+
+    evicted, freed = store.evict(150, now=time.time() + settings.UPLOAD_EVICTION_MIN_AGE_SECONDS + 1)
+
+    # Closest to expiry first: two free uploads go, the premium one survives
+    assert (evicted, freed) == (2, 200)
+    assert store.resolve("0.jpg") and store.resolve("3.jpg")
+    assert store.resolve("1.jpg") is None and store.resolve("2.jpg") is None
+
+def test_sweep_evicts_above_high_watermark(store, monkeypatch):
+    for index in range(3):
+        store.save(f"{index}.jpg", b"x" * 100)
+    monkeypatch.setattr(settings, "UPLOAD_EVICTION_MIN_AGE_SECONDS", -60)
+    monkeypatch.setattr("app.services.upload_retention.shutil.disk_usage", lambda root: DiskUsage(1000, 950, 50))
+
+    result = store.sweep()
+
+    # 95% used > 90% high watermark: free down to the 80% low watermark (150 bytes)
+    assert result['expired'] == 0 and result['evicted'] == 2
+
+def test_streamed_upload_is_only_indexed_once_committed(store):
+    with pytest.raises(RuntimeError):
+        with store.writer("partial.jpg") as writer:
+            writer.write(b"x" * 10)
+            raise RuntimeError("client went away")
+
+    assert store.resolve("partial.jpg") is None
+    assert store.stats()['plans'] == {}
+    assert list(store.backend.list()) == []
+
+def test_legacy_flat_uploads_are_adopted_once(store):
+    root = store.backend.root
+    with open(os.path.join(root, "legacy.jpg"), "wb") as f:
+        f.write(b"x" * 10)
+
+    assert store.adopt_legacy() == 1
+    assert store.adopt_legacy() == 0
+    assert store.resolve("legacy.jpg") == os.path.join(root, "legacy.jpg")
+    assert store.url("legacy.jpg") == "/uploads/legacy.jpg"
+    assert store.sweep_expired(now=time.time() + 48 * 3600) == (1, 10)